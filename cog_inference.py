@@ -4,7 +4,8 @@ import torch
 from diffusers import CogVideoXImageToVideoPipeline
 
 from svg.models.cog.utils import seed_everything
-from svg.models.cog.inference import replace_cog_attention, sample_image
+from svg.models.cog.inference import generate_video, replace_cog_attention, sample_image
+from svg.teacache import TeaCache, TeaCacheRecorder, load_teacache_coefficients
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="A script that sets a random seed.")
@@ -23,6 +24,20 @@ if __name__ == "__main__":
         default=0.25,
         help="The sparsity of the striped attention pattern. Accepts one or two float values. Only effective for fast_sample_mse"
     )
+    parser.add_argument("--pattern_reprofile_interval", type=int, default=1, help="Re-run sample_mse every N timesteps and reuse the decision in between. 1 profiles every step")
+    parser.add_argument("--pattern_drift_threshold", type=float, default=None, help="Re-profile early when the sampled query norms drift by more than this relative amount")
+    parser.add_argument("--pattern_table", type=str, default=None, help="Static mode: load the spatial / temporal decisions from a calibrated .npz table instead of profiling online")
+    parser.add_argument("--sparse_backend", type=str, default="flex", choices=["flex", "index_mapped", "sdpa", "cpu"], help="Block-sparse attention backend, index_mapped gathers the token-major rows of the temporal heads inside the attention kernel")
+    parser.add_argument("--calibrate_pattern_table", type=str, default=None, help="Record the online decisions on the calibration prompts into this .npz table")
+    parser.add_argument("--calibration_prompts", type=str, default=None, help="Text file with one calibration prompt per line, all generated from --image_path. Defaults to --prompt")
+    parser.add_argument("--num_timestep_buckets", type=int, default=10, help="Number of timestep buckets of the calibrated table")
+    parser.add_argument("--head_width_table", type=str, default=None, help="Load the calibrated temporal band width of every (layer, head) from this .npz table instead of one --sparsity width")
+    parser.add_argument("--flop_report", action="store_true", help="Print the attention FLOPs of every layer and the density relative to dense attention")
+    parser.add_argument("--teacache_thresh", type=float, default=None, help="Enable TeaCache: skip the steps whose accumulated rescaled input change stays under this threshold. Requires --pattern SVG")
+    parser.add_argument("--teacache_coefficients", type=str, default=None, help="TeaCache rescale polynomial: a model name of svg.teacache.TEACACHE_COEFFICIENTS or a --calibrate_teacache .npz file")
+    parser.add_argument("--teacache_sync_interval", type=int, default=1, help="Read the TeaCache distances on the host once every N steps and extrapolate the decisions in between. 1 is exact")
+    parser.add_argument("--calibrate_teacache", type=str, default=None, help="Run every step and add the TeaCache (input change, output change) pairs of this run to this .npz file. Requires --pattern SVG")
+    parser.add_argument("--output_type", type=str, default="video", choices=["video", "latent"], help="latent skips the VAE and saves the float16 latents next to --output_path, to be decoded by decode_latents.py workers")
     parser.add_argument(
         "--output_path",
         type=str,
@@ -31,6 +46,10 @@ if __name__ == "__main__":
     )
 
     args = parser.parse_args()
+    if (args.teacache_thresh is not None or args.calibrate_teacache is not None) and args.pattern != "SVG":
+        parser.error("TeaCache hooks into the sparse forward, use --pattern SVG")
+    if args.teacache_thresh is not None and args.calibrate_teacache is None and args.teacache_coefficients is None:
+        parser.error("--teacache_thresh needs --teacache_coefficients, fitted on a --calibrate_teacache run")
 
     seed_everything(args.seed)
 
@@ -47,15 +66,54 @@ if __name__ == "__main__":
     pipe.vae.enable_tiling()
     pipe.vae.enable_slicing()
 
+    pattern_cache = None
     if args.pattern == "SVG":
-        replace_cog_attention(
+        pattern_cache = replace_cog_attention(
             pipe,
             args.version,
             args.num_sampled_rows,
             args.sparsity,
             args.first_layers_fp,
-            args.first_times_fp
+            args.first_times_fp,
+            args.pattern_reprofile_interval,
+            args.pattern_drift_threshold,
+            args.pattern_table,
+            args.sparse_backend,
+            args.head_width_table,
+            args.flop_report
         )
+
+    if args.pattern == "SVG" and args.calibrate_pattern_table is not None:
+        from diffusers.utils import load_image
+        from svg.models.cog.attention import CogVideoX_SparseAttn_Processor2_0
+        from svg.sparse import calibrate_pattern_table
+
+        if args.calibration_prompts is None:
+            calibration_prompts = [args.prompt]
+        else:
+            with open(args.calibration_prompts) as f:
+                calibration_prompts = [line.strip() for line in f if line.strip()]
+
+        image = load_image(args.image_path)
+        def run_prompt(prompt):
+            generate_video(pipe, image, prompt, args.version, args.num_step, output_type="latent")
+
+        pattern_cache = calibrate_pattern_table(
+            CogVideoX_SparseAttn_Processor2_0, run_prompt, calibration_prompts, args.num_timestep_buckets, args.calibrate_pattern_table
+        )
+        print(f"Pattern table saved to {args.calibrate_pattern_table}")
+        # The video below is generated in static mode with the table just calibrated
+        CogVideoX_SparseAttn_Processor2_0.pattern_cache = pattern_cache
+
+    teacache = None
+    if args.calibrate_teacache is not None:
+        teacache = TeaCacheRecorder(args.num_step, calls_per_step=1)
+    elif args.teacache_thresh is not None:
+        teacache = TeaCache(
+            args.teacache_thresh, load_teacache_coefficients(args.teacache_coefficients), args.num_step,
+            calls_per_step=1, sync_interval=args.teacache_sync_interval
+        )
+    pipe.transformer.teacache = teacache
     
     sample_image(
         pipe,
@@ -64,5 +122,17 @@ if __name__ == "__main__":
         args.output_path,
         args.seed,
         args.version,
-        args.num_step
-    )
\ No newline at end of file
+        args.num_step,
+        latent_metadata={"model": "cog", "vae": model_id, "vae_dtype": "bf16"} if args.output_type == "latent" else None
+    )
+
+    if pattern_cache is not None:
+        print(pattern_cache.summary())
+    if args.calibrate_teacache is not None:
+        teacache.save(args.calibrate_teacache)
+        print(f"TeaCache calibration pairs saved to {args.calibrate_teacache}")
+    elif teacache is not None:
+        print(teacache.summary())
+    if args.pattern == "SVG" and args.flop_report:
+        from svg.models.cog.attention import CogVideoX_SparseAttn_Processor2_0
+        print(CogVideoX_SparseAttn_Processor2_0.flop_counter.report())
\ No newline at end of file
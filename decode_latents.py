@@ -0,0 +1,119 @@
+"""Decode worker of the latents saved by ``--output-type latent`` (hyvideo_inference.py) or ``--output_type latent``
+(wan_t2v_inference.py, wan_i2v_inference.py, cog_inference.py) runs.
+
+Start as many workers as needed, on any hosts that see ``--latent_dir`` and ``--output_dir``: they lease the
+latent files from a shared job queue and write one video per sample. Decoding the same latents into another
+``--output_dir`` with other tiling settings does not need the denoising again.
+"""
+
+import argparse
+import os
+
+import torch
+
+from svg.latent_store import run_decode_worker
+from svg.models.hyvideo.constants import PRECISION_TO_TYPE
+from svg.models.hyvideo.utils.job_queue import SQLiteJobQueue, default_worker_name
+
+
+def to_video(video):
+    return (video / 2 + 0.5).clamp(0, 1).cpu().float()
+
+
+def hunyuan_decoder(args, metadata, device):
+    from svg.models.hyvideo.vae import load_vae
+    from svg.models.hyvideo.diffusion.pipelines.pipeline_hunyuan_video import unscale_latents
+
+    # Latents saved before the path was recorded fall back to the default path of the VAE type
+    vae = load_vae(metadata["vae"], metadata["vae_dtype"], vae_path=metadata.get("vae_path"), device=device)[0]
+    vae.tile_batch_size = args.tile_batch_size
+    if args.tiling:
+        vae.enable_tiling()
+    if args.streaming:
+        vae.enable_streaming_decode(args.stream_chunk_size)
+
+    @torch.no_grad()
+    def decode(latents, metadata):
+        latents = unscale_latents(vae, latents.to(device, vae.dtype))
+        if vae.use_streaming_decode:
+            # Encoded chunk by chunk as the VAE decodes them
+            for video in vae.stream_decode(latents):
+                yield to_video(video)
+        else:
+            yield to_video(vae.decode(latents).sample)
+
+    return decode
+
+
+def wan_decoder(args, metadata, device):
+    from diffusers import AutoencoderKLWan
+
+    vae = AutoencoderKLWan.from_pretrained(metadata["vae"], subfolder="vae", torch_dtype=PRECISION_TO_TYPE[metadata["vae_dtype"]]).to(device)
+    if args.tiling:
+        vae.enable_tiling()
+    shape = (1, vae.config.z_dim, 1, 1, 1)
+    latents_mean = torch.tensor(vae.config.latents_mean).view(shape).to(device, vae.dtype)
+    latents_std = torch.tensor(vae.config.latents_std).view(shape).to(device, vae.dtype)
+
+    @torch.no_grad()
+    def decode(latents, metadata):
+        # The denormalization of WanPipeline
+        latents = latents.to(device, vae.dtype) * latents_std + latents_mean
+        yield to_video(vae.decode(latents).sample)
+
+    return decode
+
+
+def cog_decoder(args, metadata, device):
+    from diffusers import AutoencoderKLCogVideoX
+
+    vae = AutoencoderKLCogVideoX.from_pretrained(metadata["vae"], subfolder="vae", torch_dtype=PRECISION_TO_TYPE[metadata["vae_dtype"]]).to(device)
+    if args.tiling:
+        vae.enable_tiling()
+
+    @torch.no_grad()
+    def decode(latents, metadata):
+        # The padding frames of CogVideoX 1.5 are dropped, (b, t, c, h, w) -> (b, c, t, h, w) like CogVideoX pipelines
+        latents = latents[:, metadata["padding_frames"]:].to(device, vae.dtype).permute(0, 2, 1, 3, 4)
+        yield to_video(vae.decode(latents / vae.config.scaling_factor).sample)
+
+    return decode
+
+
+DECODERS = {"hunyuan": hunyuan_decoder, "wan": wan_decoder, "cog": cog_decoder}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decode the latent files of a directory into videos")
+    parser.add_argument("--latent_dir", type=str, required=True, help="Directory of the *.latents.safetensors files")
+    parser.add_argument("--output_dir", type=str, required=True, help="Directory of the videos")
+    parser.add_argument("--job_queue", type=str, default=None, help="SQLite file shared by the workers of --output_dir. Defaults to --output_dir/decode_queue.sqlite")
+    parser.add_argument("--lease_seconds", type=float, default=600, help="A latent file whose worker did not renew its lease for this long (dead worker) is decoded again")
+    parser.add_argument("--poll_interval", type=float, default=30, help="Seconds between two looks at the queue or at --latent_dir")
+    parser.add_argument("--watch", type=float, default=None, help="Keep decoding the latent files that come while the denoising runs, until none came for this many seconds")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu", help="Device of the VAE")
+    parser.add_argument("--tiling", action="store_true", help="Decode in overlapping spatial and temporal tiles, with less device memory")
+    parser.add_argument("--tile_batch_size", type=int, default=1, help="HunyuanVideo: same-shape VAE tiles decoded in one decoder call")
+    parser.add_argument("--streaming", action="store_true", help="HunyuanVideo: decode in time chunks that carry the causal state of the VAE, and encode them as they come")
+    parser.add_argument("--stream_chunk_size", type=int, default=4, help="HunyuanVideo: latent frames decoded together with --streaming")
+    args = parser.parse_args()
+
+    job_queue = args.job_queue or os.path.join(args.output_dir, "decode_queue.sqlite")
+    queue = SQLiteJobQueue(job_queue, args.lease_seconds)
+    worker = default_worker_name(int(os.environ.get("RANK", 0)))
+
+    # A directory can mix models, every VAE is loaded once
+    decoders = {}
+
+    def decoder_for(metadata):
+        key = (metadata["model"], metadata["vae"], metadata.get("vae_path"), metadata["vae_dtype"])
+        if key not in decoders:
+            print(f"{worker} loading the {metadata['model']} VAE {metadata['vae']}")
+            decoders[key] = DECODERS[metadata["model"]](args, metadata, args.device)
+        return decoders[key]
+
+    num_done = run_decode_worker(
+        args.latent_dir, args.output_dir, decoder_for, queue, worker, watch=args.watch, poll_interval=args.poll_interval
+    )
+    print(f"{worker} done after {num_done} latent files")
+    queue.close()
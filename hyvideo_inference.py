@@ -1,11 +1,8 @@
-import glob
 import os
 import time
 import math
-import json
 from pathlib import Path
 from loguru import logger
-from datetime import datetime
 import pandas as pd
 
 import torch
@@ -13,6 +10,13 @@ import torchvision
 from svg.models.hyvideo.utils.file_utils import save_videos_grid
 from svg.models.hyvideo.config import parse_args
 from svg.models.hyvideo.inference import HunyuanVideoSampler
+from svg.models.hyvideo.utils.task_journal import TaskJournal, compact_journals, load_completed_tasks
+from svg.teacache import TeaCache, TeaCacheRecorder, load_teacache_coefficients
+from svg.block_cache import BlockResidualCache
+from svg.block_streaming import stream_transformer_blocks
+from svg.stage_pipeline import Stage, StageLock, StagePipeline
+from svg.latent_store import latent_path, save_latents
+from svg.models.hyvideo.constants import PRECISION_TO_TYPE
 import gc
 
 import torch.distributed as dist
@@ -48,6 +52,7 @@ class InferenceTask:
         # mkdir if not exists
         os.makedirs(self.args.output_path, exist_ok=True)
         os.makedirs(self.args.output_path + "/checkpoint", exist_ok=True)
+        self.journal = None
 
     def set_prompts(self, prompts):
         self.prompts = prompts
@@ -74,32 +79,23 @@ class InferenceTask:
     def update_task(self, prompt, loop_idx, is_done):
         self.task_list[prompt][loop_idx] = is_done
 
-    def save_task_list_checkpoint(self):
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")    
-        save_path = self.args.output_path + f"/checkpoint/task_list_{timestamp}_{self.rank}.json"
-        with open(save_path, "w") as f:
-            json.dump(self.task_list, f)
-    
+    def save_task_progress(self, prompt, loop_idx):
+        # Opened on the first completed task, after the journals of the previous runs are compacted
+        if self.journal is None:
+            self.journal = TaskJournal(self.args.output_path + "/checkpoint", self.rank)
+        self.journal.append(prompt, loop_idx)
+
+    def close_journal(self):
+        if self.journal is not None:
+            self.journal.close()
+
     def load_task_list_checkpoint(self):
         self.valid_prompts = []
-        max_world_size = 16
-        for rank in range(max_world_size):
-            # find the latest checkpoint    
-            save_path = self.args.output_path + f"/checkpoint/task_list_*_{rank}.json"
-            files = glob.glob(save_path)
-            if len(files) == 0:
-                continue
-            save_path = max(files, key=os.path.getctime)
-            print(f"rank {self.rank} load task list from {save_path}")
-            current_task_list = {}
-            with open(save_path, "r") as f:
-                current_task_list = json.load(f)
-            # count the number of tasks
-            for prompt in current_task_list:
-                for loop_idx in current_task_list[prompt]:
-                    if current_task_list[prompt][loop_idx] == True:
-                        loop_idx = int(loop_idx)
-                        self.task_list[prompt][loop_idx] = True
+        # Journals of every rank of every previous run, whatever their world size
+        completed = load_completed_tasks(self.args.output_path + "/checkpoint")
+        for prompt, loop_idx in completed:
+            if prompt in self.task_list and loop_idx in self.task_list[prompt]:
+                self.task_list[prompt][loop_idx] = True
         task_num = 0
         total_task_num = 0
         for prompt in self.task_list:
@@ -113,18 +109,64 @@ class InferenceTask:
         print(f"Total task num at rank {self.rank}: {total_task_num}, Task num: {task_num}")
 
 
-    def inference(self,inference_func):
+    def inference_from_queue(self, stages):
+        from svg.models.hyvideo.utils.job_queue import SQLiteJobQueue, default_worker_name, run_worker
+
+        queue = SQLiteJobQueue(self.args.job_queue, self.args.lease_seconds)
+        # Every rank adds the tasks, the ones already in the queue keep their state
+        queue.add_tasks([
+            (prompt, loop_idx) for prompt in self.valid_prompts for loop_idx, is_done in self.task_list[prompt].items() if not is_done
+        ])
+        worker = default_worker_name(self.rank)
+        pipeline = self.stage_pipeline(stages)
+
+        def task_func(prompts, loop_idxs):
+            # The queue marks the tasks done when task_func returns, so a leased batch goes through every stage first
+            pipeline.run([self.new_job(prompts, loop_idxs)])
+            print(f"{queue.counts()} at rank {self.rank}")
+
+        task_num = run_worker(queue, worker, task_func, batch_size=self.args.batch_size)
+        print(f"Rank {self.rank} done after {task_num} tasks")
+        print(pipeline.summary())
+        queue.close()
+
+    def inference(self, stages):
+        try:
+            if self.args.job_queue is not None:
+                self.inference_from_queue(stages)
+            else:
+                self.inference_from_shard(stages)
+        finally:
+            self.close_journal()
+
+    def inference_from_shard(self, stages):
         task_list = self.get_task(self.rank)
-        task_num = len(task_list)
-        for prompt, loop_idxs in task_list.items():
-            for loop_idx in loop_idxs:
-                if task_list[prompt][loop_idx] == False:   
-                    print(f"Inference: {prompt} {loop_idx}")
-                    inference_func(self.args, prompt, loop_idx)
-                    self.update_task(prompt, loop_idx, True)
-                    self.save_task_list_checkpoint()
-                    print(f"Inference done: {prompt} {loop_idx},{task_num} left at rank {self.rank}")
-            task_num -= 1
+        tasks = [(prompt, loop_idx) for prompt, loop_idxs in task_list.items() for loop_idx in loop_idxs if loop_idxs[loop_idx] == False]
+        self.tasks_left = len(tasks)
+        # The --batch-size prompts are denoised together, the stages of consecutive batches overlap
+        pipeline = self.stage_pipeline(stages)
+        pipeline.run(
+            self.new_job(*[list(column) for column in zip(*tasks[start:start + self.args.batch_size])])
+            for start in range(0, len(tasks), self.args.batch_size)
+        )
+        print(pipeline.summary())
+
+    def new_job(self, prompts, loop_idxs):
+        print(f"Inference: {list(zip(prompts, loop_idxs))}")
+        return {"prompts": prompts, "loop_idxs": loop_idxs}
+
+    def stage_pipeline(self, stages):
+        # A task is only journaled once its videos are written, so that a resumed run redoes the lost ones
+        return StagePipeline(stages + [Stage("journal", self.record_job)])
+
+    def record_job(self, job):
+        for prompt, loop_idx in zip(job["prompts"], job["loop_idxs"]):
+            self.update_task(prompt, loop_idx, True)
+            self.save_task_progress(prompt, loop_idx)
+            print(f"Inference done: {prompt} {loop_idx}")
+        if self.args.job_queue is None:
+            self.tasks_left -= len(job["prompts"])
+            print(f"{self.tasks_left} tasks left at rank {self.rank}")
 
 
     
@@ -150,6 +192,10 @@ def inference(args, rank, world_size):
         print(f"rank {rank} barrier")
         dist.barrier()
         print(f"rank {rank} barrier done")
+        if rank == 0:
+            # No rank appends to its journal before the second barrier
+            print(f"Compacted {compact_journals(args.output_path + '/checkpoint')} completed tasks")
+        dist.barrier()
     
     models_root_path = Path(args.model_base)
     if not models_root_path.exists():
@@ -158,10 +204,25 @@ def inference(args, rank, world_size):
     # Load models
     hunyuan_video_sampler = HunyuanVideoSampler.from_pretrained(models_root_path, args=args,device="cpu")
     pipe = hunyuan_video_sampler.pipeline
-    hunyuan_video_sampler.model.enable_teacache = args.tea_cache
-    hunyuan_video_sampler.model.rel_l1_thresh = 0.15
-    hunyuan_video_sampler.model.num_steps =args.infer_steps 
-    hunyuan_video_sampler.model.cnt = 0
+    if args.calibrate_teacache is not None:
+        hunyuan_video_sampler.model.teacache = TeaCacheRecorder(args.infer_steps)
+    elif args.tea_cache:
+        hunyuan_video_sampler.model.teacache = TeaCache(
+            args.teacache_thresh,
+            load_teacache_coefficients(args.teacache_coefficients),
+            args.infer_steps,
+            sync_interval=args.teacache_sync_interval,
+        )
+    if args.block_cache_thresh is not None:
+        transformer = hunyuan_video_sampler.model
+        transformer.block_cache = BlockResidualCache(
+            args.block_cache_thresh,
+            len(transformer.double_blocks) + len(transformer.single_blocks),
+            args.infer_steps,
+            group_size=args.block_cache_group_size,
+            sync_interval=args.teacache_sync_interval,
+            max_cached_bytes=None if args.block_cache_max_gb is None else int(args.block_cache_max_gb * 1024 ** 3),
+        )
 
     print("offload")
     from mmgp import offload
@@ -175,7 +236,18 @@ def inference(args, rank, world_size):
 
     split_linear_modules_map = get_linear_split_map()
     offload.split_linear_modules(pipe.transformer, split_linear_modules_map )
-    offload.profile(pipe,profile_no=4,quantizeTransformer=False,**kwargs,verboseLevel=0)
+    if args.stream_blocks:
+        # mmgp only manages the other models, the transformer blocks are streamed with prefetch
+        modules = {name: module for name, module in pipe.components.items() if isinstance(module, torch.nn.Module) and name != "transformer"}
+        offload.profile(modules,profile_no=4,quantizeTransformer=False,**kwargs,verboseLevel=0)
+        stream_transformer_blocks(
+            pipe.transformer,
+            "cuda",
+            prefetch_depth=args.stream_prefetch_depth,
+            max_resident_bytes=None if args.stream_max_gb is None else int(args.stream_max_gb * 1024 ** 3),
+        )
+    else:
+        offload.profile(pipe,profile_no=4,quantizeTransformer=False,**kwargs,verboseLevel=0)
     
     # Get the updated args
     args = hunyuan_video_sampler.args
@@ -188,22 +260,8 @@ def inference(args, rank, world_size):
         block.sparse_args = args
     transformer.sparse_args = args
 
-    # if args.pattern == "SVG":
-    #     # We need to get the prompt len in advance, since HunyuanVideo handle the attention mask in a special way
-    #     prompt_mask = hunyuan_video_sampler.get_prompt_mask(
-    #         prompt=args.prompt, 
-    #         height=args.video_size[0],
-    #         width=args.video_size[1],
-    #         video_length=args.video_length,
-    #         negative_prompt=args.neg_prompt,
-    #         infer_steps=args.infer_steps,
-    #         guidance_scale=args.cfg_scale,
-    #         num_videos_per_prompt=args.num_videos,
-    #         embedded_guidance_scale=args.embedded_cfg_scale
-    #     )
-    #     prompt_len = prompt_mask.sum()
-
     # print(f"Memory: {torch.cuda.memory_allocated() // 1024 ** 2} / {torch.cuda.max_memory_allocated() // 1024 ** 2} MB before Inference")
+    # Initial guess: Hunyuan_SparseAttn reads the number of valid text tokens of every batch from its text mask
     prompt_len = 255
 
     cfg_size, num_head, head_dim, dtype, device = 1, 24, 128, torch.bfloat16, "cuda"
@@ -218,60 +276,28 @@ def inference(args, rank, world_size):
         
     if args.pattern == "SVG":
         print("build sparse attention")
-        masks = ["spatial", "temporal"]
-
-        def get_attention_mask(mask_name):
-
-            context_length = 256
-            num_frame = args.video_length // 4 + 1
-            frame_size = 3600
-            attention_mask = torch.zeros((context_length + num_frame * frame_size, context_length + num_frame * frame_size), device="cpu")
-
-            # TODO: fix hard coded mask
-            if mask_name == "spatial":
-                pixel_attn_mask = torch.zeros_like(attention_mask[:-context_length, :-context_length], dtype=torch.bool, device="cpu")
-                block_size, block_thres = 128, frame_size * 1.5
-                num_block = math.ceil(num_frame * frame_size / block_size)
-                for i in range(num_block):
-                    for j in range(num_block):
-                        if abs(i - j) < block_thres // block_size:
-                            pixel_attn_mask[i * block_size : (i + 1) * block_size, j * block_size : (j + 1) * block_size] = 1
-                attention_mask[:-context_length, :-context_length] = pixel_attn_mask
-
-                attention_mask[-context_length:, :] = 1
-                attention_mask[:, -context_length:] = 1
-                # attention_mask = torch.load(f"/data/home/xihaocheng/andy_develop/tmp_data/hunyuanvideo/I2VSparse/sparseattn/v5/mask_tensor/mask_spatial.pt", map_location="cpu")
-
-            else:
-                pixel_attn_mask = torch.zeros_like(attention_mask[:-context_length, :-context_length], dtype=torch.bool, device="cpu")
-
-                block_size, block_thres = 128, frame_size * 1.5
-                num_block = math.ceil(num_frame * frame_size / block_size)
-                for i in range(num_block):
-                    for j in range(num_block):
-                        if abs(i - j) < block_thres // block_size:
-                            pixel_attn_mask[i * block_size : (i + 1) * block_size, j * block_size : (j + 1) * block_size] = 1
-
-                pixel_attn_mask = pixel_attn_mask.reshape(frame_size, num_frame, frame_size, num_frame).permute(1, 0, 3, 2).reshape(frame_size * num_frame, frame_size * num_frame)
-                attention_mask[:-context_length, :-context_length] = pixel_attn_mask
-
-                attention_mask[-context_length:, :] = 1
-                attention_mask[:, -context_length:] = 1
-                # attention_mask = torch.load(f"/data/home/xihaocheng/andy_develop/tmp_data/hunyuanvideo/I2VSparse/sparseattn/v5/mask_tensor/mask_temporal.pt", map_location="cpu")
-            attention_mask = attention_mask[:args.sample_mse_max_row].cuda()
-            return attention_mask
-
-
         from svg.models.hyvideo.modules.attenion import Hunyuan_SparseAttn, prepare_flexattention
         from svg.models.hyvideo.modules.custom_models import replace_sparse_forward
+        from svg.sparse import (
+            get_profiling_masks, AttentionFlopCounter, HeadWidthRecorder, HeadWidthTable, PatternDecisionCache, PatternRecorder,
+            PatternTable, SparseAttentionGeometry
+        )
 
         AttnModule = Hunyuan_SparseAttn
         AttnModule.num_sampled_rows = args.num_sampled_rows
-        AttnModule.num_frame = num_frame
-        AttnModule.sample_mse_max_row = args.sample_mse_max_row
-        AttnModule.attention_masks = [get_attention_mask(mask_name) for mask_name in masks]
+        AttnModule.geometry = SparseAttentionGeometry.hunyuan(context_length, prompt_len, num_frame, frame_size, temporal_width)
+        AttnModule.attention_masks = get_profiling_masks("hunyuan", context_length, num_frame, frame_size, device=device)
         AttnModule.first_layers_fp = args.first_layers_fp
         AttnModule.first_times_fp = args.first_times_fp
+        if args.calibrate_pattern_table is not None:
+            AttnModule.pattern_cache = PatternRecorder(args.num_timestep_buckets)
+        elif args.pattern_table is not None:
+            # Static mode: the spatial / temporal decisions are looked up, sample_mse is never run
+            AttnModule.pattern_cache = PatternTable.load(args.pattern_table)
+        elif args.pattern_reprofile_interval > 1 or args.pattern_drift_threshold is not None:
+            AttnModule.pattern_cache = PatternDecisionCache(
+                args.pattern_reprofile_interval, args.pattern_drift_threshold, args.num_sampled_rows
+            )
 
         block_mask = prepare_flexattention(
                 cfg_size, num_head, head_dim, dtype, device, 
@@ -279,14 +305,30 @@ def inference(args, rank, world_size):
                 diag_width=spatial_width, multiplier=temporal_width
             )
         AttnModule.block_mask = block_mask
+        AttnModule.backend = args.sparse_backend
+        if args.calibrate_head_widths is not None:
+            AttnModule.head_widths = HeadWidthRecorder(num_sampled_rows=args.num_sampled_rows)
+        elif args.head_width_table is not None:
+            # Calibrated band width per (layer, head) instead of the uniform --sparsity width
+            AttnModule.head_widths = HeadWidthTable.load(args.head_width_table)
+        if args.flop_report:
+            AttnModule.flop_counter = AttentionFlopCounter()
         replace_sparse_forward()
 
 
     torch.cuda.empty_cache()
 
-    def inference_func(args,prompt, loop_idx):
+    # mmgp swaps the text encoders, the DiT and the VAE in and out of the GPU: the GPU stages take turns, the
+    # video of a batch is encoded and written while the next one is denoised
+    gpu_lock = StageLock()
+
+    def encode_prompts(job):
+        hunyuan_video_sampler.encode_prompts(job["prompts"], args.neg_prompt)
+        return job
+
+    def denoise(job):
         outputs = hunyuan_video_sampler.predict(
-            prompt=prompt, 
+            prompt=job["prompts"], 
             height=args.video_size[0],
             width=args.video_size[1],
             video_length=args.video_length,
@@ -295,18 +337,91 @@ def inference(args, rank, world_size):
             guidance_scale=args.cfg_scale,
             num_videos_per_prompt=args.num_videos,
             flow_shift=args.flow_shift,
-            batch_size=args.batch_size,
-            embedded_guidance_scale=args.embedded_cfg_scale
+            embedded_guidance_scale=args.embedded_cfg_scale,
+            output_type="latent",
         )
-        samples = outputs['samples']
-        save_path_i = f"{save_path}/{prompt[:180]}-{loop_idx}.mp4"
-        # Save samples
-        for i, sample in enumerate(samples):
-            sample = sample.unsqueeze(0)
-            save_videos_grid(sample, save_path_i, fps=24)
-            logger.info(f'Sample save to: {save_path}')
-
-    inference_task.inference(inference_func)
+        job["latents"] = outputs["samples_per_prompt"]
+        if args.pattern == "SVG" and isinstance(Hunyuan_SparseAttn.pattern_cache, (PatternDecisionCache, PatternTable)):
+            logger.info(Hunyuan_SparseAttn.pattern_cache.summary())
+        if pipe.prompt_embedding_cache is not None:
+            logger.info(pipe.prompt_embedding_cache.summary())
+        if args.tea_cache and args.calibrate_teacache is None:
+            logger.info(hunyuan_video_sampler.model.teacache.summary())
+        if args.block_cache_thresh is not None:
+            logger.info(hunyuan_video_sampler.model.block_cache.summary())
+        if args.stream_blocks:
+            logger.info(hunyuan_video_sampler.model.block_streamer.summary())
+        return job
+
+    def decode(job):
+        job["samples"] = [hunyuan_video_sampler.decode(latents) for latents in job.pop("latents")]
+        return job
+
+    def write(job):
+        for prompt, loop_idx, samples in zip(job["prompts"], job["loop_idxs"], job.pop("samples")):
+            save_path_i = f"{save_path}/{prompt[:180]}-{loop_idx}.mp4"
+            # Save samples
+            for i, sample in enumerate(samples):
+                sample = sample.unsqueeze(0)
+                save_videos_grid(sample, save_path_i, fps=24)
+                logger.info(f'Sample save to: {save_path_i}')
+        return job
+
+    def write_latents(job):
+        # Decoded later and elsewhere by decode_latents.py, the VAE never runs here
+        for prompt, loop_idx, latents in zip(job["prompts"], job["loop_idxs"], job.pop("latents")):
+            path = latent_path(save_path, f"{prompt[:180]}-{loop_idx}")
+            metadata = {
+                "model": "hunyuan",
+                "vae": args.vae,
+                "vae_path": hunyuan_video_sampler.vae_kwargs["vae_path"],
+                "vae_dtype": args.vae_precision,
+                "fps": 24,
+                "prompt": prompt,
+                "loop_idx": loop_idx,
+                "seed": args.seed,
+                "video_size": args.video_size,
+                "video_length": args.video_length,
+            }
+            save_latents(path, latents, metadata, dtype=PRECISION_TO_TYPE[args.latent_dtype])
+            logger.info(f'Latents save to: {path}')
+        return job
+
+    if args.output_type == "latent":
+        stages = [Stage("write", write_latents)]
+    else:
+        stages = [Stage("decode", decode, lock=gpu_lock), Stage("write", write)]
+    inference_task.inference([
+        Stage("text", encode_prompts, lock=gpu_lock),
+        Stage("denoise", denoise, lock=gpu_lock),
+    ] + stages)
+    if args.pattern == "SVG" and args.calibrate_pattern_table is not None:
+        table_path = args.calibrate_pattern_table
+        if world_size > 1:
+            # Merge with `python -m svg.sparse.pattern_table merge`
+            table_path = table_path.replace(".npz", "") + f"_rank{rank}.npz"
+        Hunyuan_SparseAttn.pattern_cache.to_table().save(table_path)
+        logger.info(f"Pattern table saved to {table_path}")
+
+    if args.pattern == "SVG" and args.calibrate_head_widths is not None:
+        table_path = args.calibrate_head_widths
+        if world_size > 1:
+            table_path = table_path.replace(".npz", "") + f"_rank{rank}.npz"
+        head_widths = Hunyuan_SparseAttn.head_widths.to_table(args.head_width_budget)
+        head_widths.save(table_path)
+        logger.info(f"Head width table saved to {table_path}")
+        logger.info(head_widths.summary())
+
+    if args.pattern == "SVG" and args.flop_report:
+        logger.info("Attention FLOPs\n" + Hunyuan_SparseAttn.flop_counter.report())
+
+    if args.calibrate_teacache is not None:
+        pairs_path = args.calibrate_teacache
+        if world_size > 1:
+            # Fit on all the ranks with `python -m svg.teacache`
+            pairs_path = pairs_path.replace(".npz", "") + f"_rank{rank}.npz"
+        hunyuan_video_sampler.model.teacache.save(pairs_path)
+        logger.info(f"TeaCache calibration pairs saved to {pairs_path}")
 
 
 
@@ -0,0 +1,130 @@
+"""Block-level residual cache: the TeaCache decision taken per group of consecutive transformer blocks.
+
+Every step, each group compares its input with the input it got at the previous step. While the accumulated
+relative L1 change stays under ``threshold``, the group reuses the residual (output - input) of the last step
+it was computed instead of running its blocks. ``group_size=1`` decides per block, ``group_size=num_blocks``
+is the step-level TeaCache on the raw hidden states.
+
+Each residual is as large as the hidden states, so the residuals of all the groups are kept within
+``max_cached_bytes``. Over the budget, the residual of the group whose accumulated change is the closest to
+the threshold (the next one to be recomputed anyway) is dropped, and that group runs at its next step.
+"""
+
+import math
+from collections import OrderedDict
+
+from .teacache import TeaCache, TeaCacheBranch
+
+
+class BlockResidualCache(TeaCache):
+    """Per-group residual cache attached to a transformer as ``transformer.block_cache``.
+
+    For every group of blocks, the forward calls ``should_compute(group_idx, hidden_states)`` with the input of
+    the group. When it returns False, the forward replaces the group by ``apply_residuals(*hidden_states)``,
+    otherwise it runs the blocks and calls ``store_residuals(inputs, outputs)``.
+
+    Args:
+        threshold (float): Accumulated relative input change under which a group is skipped. 0 never skips.
+        num_blocks (int): Number of blocks of the transformer.
+        num_steps (int): Denoising steps per generation. The first and last ones are always computed.
+        group_size (int): Consecutive blocks that share one decision and one residual.
+        calls_per_step (int): Transformer calls per step, e.g. 2 for separate cond / uncond passes.
+        sync_interval (int): The host reads the distances of a group once every ``sync_interval`` steps.
+        max_cached_bytes (int): Budget of the cached residuals, None for no limit.
+        input_stride (int): The input change is measured on every ``input_stride``-th token only, so that
+            the previous inputs kept for the decision are ``input_stride`` times smaller than a residual.
+        coefficients (list of float): Rescale polynomial of the input change, the identity by default.
+    """
+
+    def __init__(
+        self,
+        threshold,
+        num_blocks,
+        num_steps,
+        group_size=1,
+        calls_per_step=1,
+        sync_interval=1,
+        max_cached_bytes=None,
+        input_stride=4,
+        coefficients=(1.0, 0.0),
+    ):
+        self.num_blocks = num_blocks
+        self.group_size = group_size
+        self.num_groups = math.ceil(num_blocks / group_size)
+        self.max_cached_bytes = max_cached_bytes
+        self.input_stride = input_stride
+
+        self.group_computed = [0] * self.num_groups
+        self.group_skipped = [0] * self.num_groups
+        self.evictions = 0
+        self.peak_cached_bytes = 0
+        super().__init__(threshold, coefficients, num_steps, calls_per_step, sync_interval)
+
+    def reset(self):
+        self.num_calls = 0
+        self.branches = [[TeaCacheBranch() for _ in range(self.num_groups)] for _ in range(self.calls_per_step)]
+        self.branch = self.branches[0][0]
+        self.step, self.branch_idx, self.key = 0, 0, None
+        # (branch_idx, group_idx) -> bytes of the cached residuals
+        self.cached = OrderedDict()
+        self.cached_bytes = 0
+
+    def group_blocks(self, group_idx):
+        """Indices of the blocks of a group."""
+        return range(group_idx * self.group_size, min((group_idx + 1) * self.group_size, self.num_blocks))
+
+    def should_compute(self, group_idx, hidden_states):
+        """Whether the blocks of ``group_idx`` must run for this call. ``hidden_states`` is the input of the group."""
+        if group_idx == 0:
+            if self.num_calls == self.num_steps * self.calls_per_step:
+                self.reset()
+            self.step, self.branch_idx = divmod(self.num_calls, self.calls_per_step)
+            self.num_calls += 1
+        self.key = (self.branch_idx, group_idx)
+        branch = self.branch = self.branches[self.branch_idx][group_idx]
+
+        # The blocks update the hidden states in place, the decision keeps its own copy
+        signature = hidden_states[:, ::self.input_stride].clone()
+        computed = self.decide_step(branch, self.step, signature)
+
+        if computed:
+            self.computed += 1
+            self.group_computed[group_idx] += 1
+        else:
+            self.skipped += 1
+            self.group_skipped[group_idx] += 1
+            self.generation_skipped += 1
+        if group_idx == self.num_groups - 1 and self.num_calls == self.num_steps * self.calls_per_step:
+            self.skipped_per_generation.append(self.generation_skipped)
+            self.generation_skipped = 0
+        return computed
+
+    def store_residuals(self, inputs, outputs):
+        if self.key in self.cached:
+            self.cached_bytes -= self.cached.pop(self.key)
+        super().store_residuals(inputs, outputs)
+        self.cached[self.key] = sum(residual.numel() * residual.element_size() for residual in self.branch.residuals)
+        self.cached_bytes += self.cached[self.key]
+        self.evict()
+        self.peak_cached_bytes = max(self.peak_cached_bytes, self.cached_bytes)
+
+    def evict(self):
+        if self.max_cached_bytes is None:
+            return
+        while self.cached_bytes > self.max_cached_bytes and self.cached:
+            # Closest to the threshold first, then the most recently stored one
+            order = {key: i for i, key in enumerate(self.cached)}
+            victim = max(self.cached, key=lambda key: (self.branches[key[0]][key[1]].estimate, order[key]))
+            self.cached_bytes -= self.cached.pop(victim)
+            self.branches[victim[0]][victim[1]].residuals = None
+            self.evictions += 1
+
+    def summary(self):
+        rates = " ".join(
+            f"{skipped / max(computed + skipped, 1) * 100:.0f}%" for computed, skipped in zip(self.group_computed, self.group_skipped)
+        )
+        return (
+            f"Block cache: {self.skipped} / {self.computed + self.skipped} group calls skipped ({self.skip_rate() * 100:.1f}%), "
+            f"per group of {self.group_size} blocks: {rates}. {self.syncs} host syncs, {self.evictions} evictions, "
+            f"peak {self.peak_cached_bytes / 1024 ** 3:.2f} GB of residuals"
+        )
@@ -0,0 +1,175 @@
+"""Block weight streaming: the transformer blocks live in pinned host memory and are copied to the device ahead of use.
+
+The weights of every block are packed into one pinned host buffer, so that loading a block is a single
+host-to-device copy. The copies are issued on a side stream: while block ``i`` computes, the next
+``prefetch_depth`` blocks are already on their way, within ``max_resident_bytes`` of device memory. A block is
+released as soon as it falls out of the look-ahead window, the device buffer going back to the caching
+allocator once the compute stream is done with it.
+
+The window wraps around the last block, so the first blocks of the next step are copied during the last
+blocks of the current one. Blocks skipped by a residual cache are simply released when the window moves on.
+
+``simulate=True`` runs on the CPU without streams and records the copy / compute / release schedule in
+``BlockStreamer.schedule``.
+"""
+
+import torch
+
+
+# Offsets of the tensors in the packed buffers, so that every view is aligned for its dtype
+BUFFER_ALIGNMENT = 64
+
+
+class BlockStreamer:
+    """Streams the weights of ``blocks``, run in that order every step, to ``device``.
+
+    Args:
+        blocks (list of nn.Module): Blocks in execution order.
+        device (torch.device): Device the blocks compute on.
+        prefetch_depth (int): Blocks copied ahead of the one computing.
+        max_resident_bytes (int): Budget of the blocks on the device, None for no limit. The computing block
+            is always loaded, the look-ahead stops at the first block that does not fit.
+        simulate (bool): Copy synchronously on the CPU and record the schedule.
+    """
+
+    def __init__(self, blocks, device, prefetch_depth=1, max_resident_bytes=None, simulate=False):
+        self.blocks = list(blocks)
+        self.device = torch.device(device)
+        self.prefetch_depth = prefetch_depth
+        self.max_resident_bytes = max_resident_bytes
+        self.simulate = simulate
+        self.use_streams = not simulate and self.device.type == "cuda"
+
+        self.copy_stream = torch.cuda.Stream(self.device) if self.use_streams else None
+        self.host_buffers, self.tensors = zip(*(self.pack(block) for block in self.blocks))
+        self.nbytes = [host_buffer.numel() for host_buffer in self.host_buffers]
+        # block_idx -> (device buffer, copy done event)
+        self.resident = {}
+        self.resident_bytes = 0
+        self.peak_resident_bytes = 0
+
+        self.loads = 0
+        self.stalls = 0
+        self.copied_bytes = 0
+        self.schedule = []
+
+        self.hooks = []
+        for block_idx, block in enumerate(self.blocks):
+            self.hooks.append(block.register_forward_pre_hook(lambda module, args, block_idx=block_idx: self.compute(block_idx)))
+            # Parts of a block can be called outside of its forward, e.g. the first modulation of TeaCache
+            for module in block.modules():
+                if module is not block:
+                    self.hooks.append(module.register_forward_pre_hook(lambda module, args, block_idx=block_idx: self.fetch(block_idx)))
+
+    def pack(self, block):
+        """Move the parameters and buffers of a block into one (pinned) host buffer, and its (tensor, offset) pairs."""
+        tensors, seen, offset = [], set(), 0
+        for tensor in list(block.parameters()) + list(block.buffers()):
+            if id(tensor) in seen:
+                continue
+            seen.add(id(tensor))
+            tensors.append((tensor, offset))
+            offset += -(-tensor.numel() * tensor.element_size() // BUFFER_ALIGNMENT) * BUFFER_ALIGNMENT
+
+        host_buffer = torch.empty(offset, dtype=torch.uint8, pin_memory=self.use_streams)
+        for tensor, offset in tensors:
+            view = self.view(host_buffer, tensor, offset)
+            view.copy_(tensor.data)
+            tensor.data = view
+        return host_buffer, tensors
+
+    @staticmethod
+    def view(buffer, tensor, offset):
+        return buffer[offset:offset + tensor.numel() * tensor.element_size()].view(tensor.dtype).view(tensor.shape)
+
+    def load(self, block_idx):
+        host_buffer = self.host_buffers[block_idx]
+        if self.use_streams:
+            with torch.cuda.stream(self.copy_stream):
+                device_buffer = torch.empty_like(host_buffer, device=self.device)
+                device_buffer.copy_(host_buffer, non_blocking=True)
+                event = torch.cuda.Event()
+                event.record(self.copy_stream)
+        else:
+            device_buffer, event = host_buffer.to(self.device, copy=True), None
+        for tensor, offset in self.tensors[block_idx]:
+            tensor.data = self.view(device_buffer, tensor, offset)
+
+        self.resident[block_idx] = (device_buffer, event)
+        self.resident_bytes += self.nbytes[block_idx]
+        self.peak_resident_bytes = max(self.peak_resident_bytes, self.resident_bytes)
+        self.loads += 1
+        self.copied_bytes += self.nbytes[block_idx]
+        if self.simulate:
+            self.schedule.append(("copy", block_idx))
+
+    def release(self, block_idx):
+        device_buffer, _ = self.resident.pop(block_idx)
+        for tensor, offset in self.tensors[block_idx]:
+            tensor.data = self.view(self.host_buffers[block_idx], tensor, offset)
+        if self.use_streams:
+            # Allocated on the copy stream, the buffer is only reused once the queued compute is done with it
+            device_buffer.record_stream(torch.cuda.current_stream(self.device))
+        self.resident_bytes -= self.nbytes[block_idx]
+        if self.simulate:
+            self.schedule.append(("release", block_idx))
+
+    def fetch(self, block_idx):
+        """Make sure ``block_idx`` is on the device and ready for the compute stream."""
+        if block_idx not in self.resident:
+            # Not prefetched: the compute stream waits for the whole copy
+            self.stalls += 1
+            self.load(block_idx)
+        _, event = self.resident[block_idx]
+        if event is not None:
+            torch.cuda.current_stream(self.device).wait_event(event)
+
+    def window(self, block_idx):
+        """The computing block and the next ones that fit in the budget."""
+        window, window_bytes = [block_idx], self.nbytes[block_idx]
+        for offset in range(1, min(self.prefetch_depth, len(self.blocks) - 1) + 1):
+            next_idx = (block_idx + offset) % len(self.blocks)
+            if self.max_resident_bytes is not None and window_bytes + self.nbytes[next_idx] > self.max_resident_bytes:
+                break
+            window.append(next_idx)
+            window_bytes += self.nbytes[next_idx]
+        return window
+
+    def compute(self, block_idx):
+        """Forward pre-hook of a block: release what is behind, load it and copy the next blocks ahead."""
+        window = self.window(block_idx)
+        for resident_idx in list(self.resident):
+            if resident_idx not in window:
+                self.release(resident_idx)
+        self.fetch(block_idx)
+        for next_idx in window[1:]:
+            if next_idx not in self.resident:
+                self.load(next_idx)
+        if self.simulate:
+            # The kernels of the block are queued after the copies of the next blocks
+            self.schedule.append(("compute", block_idx))
+
+    def remove(self):
+        """Unhook the blocks and leave their weights on the host."""
+        for hook in self.hooks:
+            hook.remove()
+        self.hooks = []
+        for block_idx in list(self.resident):
+            self.release(block_idx)
+
+    def summary(self):
+        return (
+            f"Block streaming: {self.loads} block loads ({self.copied_bytes / 1024 ** 3:.1f} GB), "
+            f"{self.stalls} not prefetched, peak {self.peak_resident_bytes / 1024 ** 3:.2f} GB of blocks on the device"
+        )
+
+
+def stream_transformer_blocks(transformer, device, prefetch_depth=1, max_resident_bytes=None, simulate=False):
+    """Keep everything but the double / single stream blocks of a HYVideoDiffusionTransformer on ``device``
+    and stream the blocks. The streamer is attached as ``transformer.block_streamer``."""
+    for name, module in transformer.named_children():
+        if name not in ("double_blocks", "single_blocks"):
+            module.to(device)
+    blocks = list(transformer.double_blocks) + list(transformer.single_blocks)
+    transformer.block_streamer = BlockStreamer(blocks, device, prefetch_depth, max_resident_bytes, simulate)
+    return transformer.block_streamer
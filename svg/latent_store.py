@@ -0,0 +1,113 @@
+"""Latents of the denoising stage saved for a separate decode service (``decode_latents.py``).
+
+A latent file ``{name}.latents.safetensors`` holds the ``output_type="latent"`` samples of one (prompt, loop) in
+float16 and a JSON metadata header: the ``model`` ("hunyuan", "wan" or "cog"), the ``vae`` and ``vae_dtype`` to
+decode them with (for HunyuanVideo also the resolved ``vae_path``, the ``vae`` being only its type), the ``fps`` of
+the video, and the prompt, seed, etc. of the run. The files are written under a
+temporary name and renamed, so a worker scanning the directory never reads a partial file.
+
+The decode workers share a ``SQLiteJobQueue`` next to the videos they write, whose tasks are the names of the
+latent files (their loop_idx is always 0). Any number of them, on any host, can decode a directory, and decoding
+it again into another directory, e.g. with other tiling settings, does not need the denoising again.
+"""
+
+import json
+import os
+import time
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+
+LATENT_SUFFIX = ".latents.safetensors"
+
+
+def latent_path(directory, name):
+    return os.path.join(directory, name + LATENT_SUFFIX)
+
+
+def list_latents(directory):
+    """The names of the latent files of ``directory``, sorted."""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(entry[:-len(LATENT_SUFFIX)] for entry in os.listdir(directory) if entry.endswith(LATENT_SUFFIX))
+
+
+def save_latents(path, latents, metadata, dtype=torch.float16):
+    """Save ``latents`` (num_samples, ...) as ``dtype`` with the JSON-serializable ``metadata``, which needs a ``model``."""
+    if "model" not in metadata:
+        raise ValueError("The latent metadata needs the model that decodes them")
+    stored = latents.detach().to("cpu", dtype).contiguous()
+    if not torch.isfinite(stored).all():
+        raise ValueError(f"The latents do not fit in {dtype}, save them with a wider dtype")
+    header = {key: json.dumps(value, ensure_ascii=False) for key, value in metadata.items()}
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    save_file({"latents": stored}, tmp_path, metadata=header)
+    os.replace(tmp_path, path)
+
+
+def load_latents(path):
+    """The (latents, metadata) of a latent file, the latents in their stored dtype."""
+    with safe_open(path, framework="pt") as f:
+        metadata = {key: json.loads(value) for key, value in f.metadata().items()}
+        latents = f.get_tensor("latents")
+    return latents, metadata
+
+
+def video_paths(output_dir, name, num_samples):
+    """``{name}.mp4``, or ``{name}-{i}.mp4`` for each of several samples."""
+    if num_samples == 1:
+        return [os.path.join(output_dir, f"{name}.mp4")]
+    return [os.path.join(output_dir, f"{name}-{i}.mp4") for i in range(num_samples)]
+
+
+def decode_latent_file(path, output_dir, decoder_for):
+    """Decode the samples of a latent file one by one and write their videos to ``output_dir``.
+
+    ``decoder_for(metadata)`` returns the decode function of the model, ``decode(latents, metadata)``, which turns
+    the latents of one sample into consecutive [0, 1] float (1, c, t, h, w) chunks of frames on the host.
+    """
+    from svg.models.hyvideo.utils.file_utils import save_video_stream
+
+    latents, metadata = load_latents(path)
+    decode = decoder_for(metadata)
+    name = os.path.basename(path)[:-len(LATENT_SUFFIX)]
+    paths = video_paths(output_dir, name, latents.shape[0])
+    for sample_latents, video_path in zip(latents.split(1), paths):
+        # Renamed once complete, a video that exists is a video that was fully written
+        tmp_path = f"{video_path[:-len('.mp4')]}.{os.getpid()}.tmp.mp4"
+        save_video_stream(decode(sample_latents, metadata), tmp_path, fps=metadata["fps"])
+        os.replace(tmp_path, video_path)
+    return paths
+
+
+def run_decode_worker(latent_dir, output_dir, decoder_for, queue, worker, watch=None, poll_interval=30, sleep=time.sleep, clock=time.monotonic):
+    """Decode the latent files of ``latent_dir`` that ``queue`` leases to ``worker`` until all are decoded.
+
+    With ``watch`` (seconds), the directory is scanned for new latent files every ``poll_interval`` seconds, e.g.
+    while the denoising runs, and the worker returns once no new file came for ``watch`` seconds.
+    Returns the number of files this worker decoded.
+    """
+    from svg.models.hyvideo.utils.job_queue import run_worker
+
+    def task_func(names, loop_idxs):
+        for name in names:
+            paths = decode_latent_file(latent_path(latent_dir, name), output_dir, decoder_for)
+            print(f"{worker} decoded {name} to {', '.join(paths)}")
+
+    num_done = 0
+    known = set()
+    last_new = clock()
+    while True:
+        names = [name for name in list_latents(latent_dir) if name not in known]
+        if names:
+            # Every worker adds the files it sees, the ones already in the queue keep their state
+            queue.add_tasks([(name, 0) for name in names])
+            known.update(names)
+            last_new = clock()
+        num_done += run_worker(queue, worker, task_func, poll_interval=poll_interval, sleep=sleep)
+        if watch is None or clock() - last_new >= watch:
+            return num_done
+        sleep(poll_interval)
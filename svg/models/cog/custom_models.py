@@ -122,7 +122,20 @@ class CogVideoXTransformer3DModel_Sparse(CogVideoXTransformer3DModel):
         hidden_states = hidden_states[:, text_seq_length:]
 
         # 3. Transformer blocks
-        for i, block in enumerate(self.transformer_blocks):
+        teacache = getattr(self, "teacache", None)
+        should_calc = True
+        if teacache is not None:
+            # Modulated video tokens of the first block's attention
+            modulated_inp = self.transformer_blocks[0].norm1(hidden_states, encoder_hidden_states, emb)[0]
+            should_calc = teacache.should_compute(modulated_inp)
+            ori_hidden_states, ori_encoder_hidden_states = hidden_states, encoder_hidden_states
+
+        if not should_calc:
+            hidden_states, encoder_hidden_states = teacache.apply_residuals(hidden_states, encoder_hidden_states)
+            blocks = []
+        else:
+            blocks = self.transformer_blocks
+        for i, block in enumerate(blocks):
             if torch.is_grad_enabled() and self.gradient_checkpointing:
 
                 def create_custom_forward(module):
@@ -148,6 +161,8 @@ class CogVideoXTransformer3DModel_Sparse(CogVideoXTransformer3DModel):
                     image_rotary_emb=image_rotary_emb,
                     timestep=timestep
                 )
+        if teacache is not None and should_calc:
+            teacache.store_residuals((ori_hidden_states, ori_encoder_hidden_states), (hidden_states, encoder_hidden_states))
 
         if not self.config.use_rotary_positional_embeddings:
             # CogVideoX-2B
@@ -1,3 +1,5 @@
+import os
+
 import torch
 import torch.nn.functional as F
 
@@ -5,33 +7,61 @@ from diffusers.models.attention_processor import Attention
 from diffusers.utils import export_to_video, load_image
 
 from .attention import CogVideoX_SparseAttn_Processor2_0, prepare_flexattention
-from .utils import sparsity_to_width, get_attention_mask
+from .utils import sparsity_to_width
+from svg.sparse import get_profiling_masks, AttentionFlopCounter, HeadWidthTable, PatternDecisionCache, PatternTable, SparseAttentionGeometry
 from .custom_models import replace_sparse_forward
+from svg.latent_store import LATENT_SUFFIX, save_latents
+
+
+def generate_video(pipe, image, prompt, version, num_step=50, output_type="pil"):
+    """Run the pipeline with the sampling settings of ``version``, returns the frames and the number of frames."""
+    if version == "v1":
+        num_frames = 49
+        video = pipe(
+            image=image, prompt=prompt, guidance_scale=6, use_dynamic_cfg=True, num_inference_steps=num_step,
+            output_type=output_type
+        ).frames
+    elif version == "v1.5":
+        num_frames = 81
+        video = pipe(
+            image=image, prompt=prompt, num_videos_per_prompt=1, num_inference_steps=num_step, num_frames=num_frames, guidance_scale=6,
+            height=768, width=1360, output_type=output_type
+        ).frames
+    else:
+        raise ValueError(f"Unsupported version: {version}")
+    return video, num_frames
 
 
-def sample_image(pipe, prompt, image_path, output_path, seed, version, num_step=50):
+def sample_image(pipe, prompt, image_path, output_path, seed, version, num_step=50, latent_metadata=None):
+    """Generate the video of ``prompt`` and ``image_path`` into ``output_path``. With ``latent_metadata``, the latents
+    are saved next to it with that metadata instead, to be decoded by decode_latents.py workers."""
     print("\n" * 5)
     print(f"Prompt: {prompt}")
 
     image = load_image(image_path)
     print(f"Image Is Ready. Seed is {seed}")
 
-    if version == "v1":
-        video = pipe(
-            image=image, prompt=prompt, guidance_scale=6, use_dynamic_cfg=True, num_inference_steps=num_step
-        ).frames[0]
-    elif version == "v1.5":
-        video = pipe(
-            image=image, prompt=prompt, num_videos_per_prompt=1, num_inference_steps=num_step, num_frames=81, guidance_scale=6,
-            height=768, width=1360
-        ).frames[0]
+    output_type = "pil" if latent_metadata is None else "latent"
+    video, num_frames = generate_video(pipe, image, prompt, version, num_step, output_type)
 
-    export_to_video(video, output_path, fps=8)
+    if latent_metadata is None:
+        export_to_video(video[0], output_path, fps=8)
+        return
 
+    # CogVideoX 1.5 pads the latent frames to a multiple of the temporal patch size, the decode drops the first ones
+    latent_frames = (num_frames - 1) // pipe.vae_scale_factor_temporal + 1
+    patch_size_t = pipe.transformer.config.patch_size_t
+    padding_frames = 0 if patch_size_t is None else -latent_frames % patch_size_t
+    latent_file = os.path.splitext(output_path)[0] + LATENT_SUFFIX
+    metadata = dict(latent_metadata, fps=8, prompt=prompt, seed=seed, padding_frames=padding_frames)
+    save_latents(latent_file, video, metadata)
+    print(f"Latents saved to {latent_file}")
 
-def replace_cog_attention(pipe, version, num_sampled_rows, sparsity, first_layers_fp, first_times_fp):
 
-    masks = ["spatial", "temporal"]
+def replace_cog_attention(
+    pipe, version, num_sampled_rows, sparsity, first_layers_fp, first_times_fp, reprofile_interval=1, drift_threshold=None,
+    pattern_table=None, sparse_backend="flex", head_width_table=None, flop_report=False
+):
 
     # For FlexAttention
     if version == "v1":
@@ -49,21 +79,30 @@ def replace_cog_attention(pipe, version, num_sampled_rows, sparsity, first_layer
 
     AttnModule = CogVideoX_SparseAttn_Processor2_0
     AttnModule.num_sampled_rows = num_sampled_rows
-    AttnModule.attention_masks = [get_attention_mask(mask_name, context_length, num_frame, frame_size) for mask_name in masks]
+    AttnModule.attention_masks = get_profiling_masks("cog", context_length, num_frame, frame_size, device="cuda")
     AttnModule.version = version
     AttnModule.first_layers_fp = first_layers_fp
     AttnModule.first_times_fp = first_times_fp
+    if pattern_table is not None:
+        # Static mode: the spatial / temporal decisions are looked up, sample_mse is never run
+        AttnModule.pattern_cache = PatternTable.load(pattern_table)
+    elif reprofile_interval > 1 or drift_threshold is not None:
+        AttnModule.pattern_cache = PatternDecisionCache(reprofile_interval, drift_threshold, num_sampled_rows)
 
     multiplier = diag_width = sparsity_to_width(sparsity, context_length, num_frame, frame_size)
 
-    AttnModule.context_length = context_length
-    AttnModule.num_frame = num_frame
-    AttnModule.frame_size = frame_size
+    AttnModule.geometry = SparseAttentionGeometry.cog(context_length, num_frame, frame_size, multiplier)
     
     # NOTE: ??? Prepare placement will strongly decrease PSNR
     # prepare_placement(2, 48, 64, dtype, "cuda", context_length, num_frame, frame_size)
     block_mask = prepare_flexattention(2, 48, 64, dtype, "cuda", context_length, num_frame, frame_size, diag_width, multiplier)
     AttnModule.block_mask = block_mask
+    AttnModule.backend = sparse_backend
+    if head_width_table is not None:
+        # Calibrated band width per (layer, head) instead of the uniform --sparsity width
+        AttnModule.head_widths = HeadWidthTable.load(head_width_table)
+    if flop_report:
+        AttnModule.flop_counter = AttentionFlopCounter()
     
     replace_sparse_forward()
     
@@ -77,3 +116,5 @@ def replace_cog_attention(pipe, version, num_sampled_rows, sparsity, first_layer
             layer_idx = m.processor.layer_idx
             m.set_processor(AttnModule(layer_idx))
             m.processor.num_layers = num_layers
+
+    return AttnModule.pattern_cache
@@ -79,6 +79,25 @@ def add_extra_models_args(parser: argparse.ArgumentParser):
         help="Enable tiling for the VAE model to save GPU memory.",
     )
     group.set_defaults(vae_tiling=True)
+    group.add_argument(
+        "--vae-streaming",
+        action="store_true",
+        help="Decode the video in time chunks that carry the causal state of the VAE to the next chunk, instead of "
+        "overlapping temporal tiles. Every latent frame is decoded once.",
+    )
+    group.add_argument(
+        "--vae-stream-chunk-size",
+        type=int,
+        default=4,
+        help="Latent frames decoded together with --vae-streaming.",
+    )
+    group.add_argument(
+        "--vae-tile-batch-size",
+        type=int,
+        default=1,
+        help="Number of same-shape VAE tiles decoded in one decoder call, faster but with the activations of as "
+        "many tiles.",
+    )
 
     group.add_argument(
         "--text-encoder",
@@ -247,11 +266,95 @@ def add_inference_args(parser: argparse.ArgumentParser):
         default="",
         help="a txt file contains multiple prompts",
     )
+    group.add_argument(
+        "--job-queue",
+        type=str,
+        default=None,
+        help="SQLite file on the shared filesystem. The ranks pull (prompt, loop) tasks from it instead of a static prompt shard",
+    )
+    group.add_argument(
+        "--lease-seconds",
+        type=float,
+        default=600,
+        help="A task of the job queue that is not renewed for this long (dead rank) is re-issued",
+    )
+    group.add_argument(
+        "--prompt-cache",
+        action="store_true",
+        help="Cache the LLM and CLIP embeddings of every prompt and of the negative prompt across loops",
+    )
+    group.add_argument(
+        "--prompt-cache-dir",
+        type=str,
+        default=None,
+        help="Also keep the prompt embeddings in this directory, so that reruns skip the text encoders. Implies --prompt-cache",
+    )
     group.add_argument(
         "--tea-cache",
         action="store_true",
         help="Use tea cache for inference",
     )
+    group.add_argument(
+        "--teacache-thresh",
+        type=float,
+        default=0.15,
+        help="Accumulated rescaled input change under which TeaCache skips a step. Higher skips more steps",
+    )
+    group.add_argument(
+        "--teacache-coefficients",
+        type=str,
+        default="hunyuan",
+        help="TeaCache rescale polynomial: a model name of svg.teacache.TEACACHE_COEFFICIENTS or a --calibrate-teacache .npz file",
+    )
+    group.add_argument(
+        "--teacache-sync-interval",
+        type=int,
+        default=1,
+        help="Read the TeaCache and block cache distances on the host once every N steps and extrapolate the decisions in between. 1 is exact",
+    )
+    group.add_argument(
+        "--calibrate-teacache",
+        type=str,
+        default=None,
+        help="Run every step and record the TeaCache (input change, output change) pairs into this .npz file (one file per rank when distributed)",
+    )
+    group.add_argument(
+        "--block-cache-thresh",
+        type=float,
+        default=None,
+        help="Enable the block-level residual cache: a group of blocks reuses its last residual while its accumulated "
+        "relative input change stays under this threshold. Can be combined with --tea-cache",
+    )
+    group.add_argument(
+        "--block-cache-group-size",
+        type=int,
+        default=5,
+        help="Consecutive blocks (double stream, then single stream) that share one block cache decision and residual",
+    )
+    group.add_argument(
+        "--block-cache-max-gb",
+        type=float,
+        default=None,
+        help="Memory budget of the cached block residuals, in GB. Over it, the residuals closest to being recomputed are dropped",
+    )
+    group.add_argument(
+        "--stream-blocks",
+        action="store_true",
+        help="Stream the transformer blocks from pinned host memory, copying the next blocks while the current one "
+        "computes, instead of the mmgp offload of the transformer",
+    )
+    group.add_argument(
+        "--stream-prefetch-depth",
+        type=int,
+        default=2,
+        help="Blocks copied to the device ahead of the computing one with --stream-blocks",
+    )
+    group.add_argument(
+        "--stream-max-gb",
+        type=float,
+        default=None,
+        help="Device memory budget of the streamed blocks, in GB. The look-ahead stops at the first block that does not fit",
+    )
     group.add_argument(
         "--dit-weight",
         type=str,
@@ -286,7 +389,7 @@ def add_inference_args(parser: argparse.ArgumentParser):
         "--batch-size",
         type=int,
         default=1,
-        help="Batch size for inference and evaluation.",
+        help="Number of prompts generated together in one batched denoising loop.",
     )
     group.add_argument(
         "--infer-steps",
@@ -311,6 +414,21 @@ def add_inference_args(parser: argparse.ArgumentParser):
         default="",
         help="Suffix for the directory of saved samples.",
     )
+    group.add_argument(
+        "--output-type",
+        type=str,
+        default="video",
+        choices=["video", "latent"],
+        help="video decodes and writes the videos. latent skips the VAE and saves the latents in --output_path "
+        "instead, to be decoded by decode_latents.py workers.",
+    )
+    group.add_argument(
+        "--latent-dtype",
+        type=str,
+        default="fp16",
+        choices=PRECISIONS,
+        help="Precision of the latents saved with --output-type latent.",
+    )
     group.add_argument(
         "--name-suffix",
         type=str,
@@ -454,10 +572,64 @@ def add_sparsity_args(parser: argparse.ArgumentParser):
         help="The number of sampled rows"
     )
     group.add_argument(
-        "--sample_mse_max_row", 
+        "--pattern_reprofile_interval", 
+        type=int, 
+        default=1, 
+        help="Re-run sample_mse every N timesteps and reuse the decision in between. 1 profiles every step"
+    )
+    group.add_argument(
+        "--pattern_drift_threshold", 
+        type=float, 
+        default=None, 
+        help="Re-profile early when the sampled query norms drift by more than this relative amount"
+    )
+    group.add_argument(
+        "--pattern_table", 
+        type=str, 
+        default=None, 
+        help="Static mode: load the spatial / temporal decisions from a calibrated .npz table instead of profiling online"
+    )
+    group.add_argument(
+        "--calibrate_pattern_table", 
+        type=str, 
+        default=None, 
+        help="Record the online decisions on the prompt set into this .npz table (one file per rank when distributed)"
+    )
+    group.add_argument(
+        "--num_timestep_buckets", 
         type=int, 
-        default=10000, 
-        help="Since some attention masks are really large, need to restrict the maximum size (the row we are going to sample on)."
+        default=10, 
+        help="Number of timestep buckets of the calibrated table"
+    )
+    group.add_argument(
+        "--sparse_backend", 
+        type=str, 
+        default="flex", 
+        choices=["flex", "index_mapped", "sdpa", "cpu"], 
+        help="Block-sparse attention backend, index_mapped gathers the token-major rows of the temporal heads inside the attention kernel"
+    )
+    group.add_argument(
+        "--head_width_table", 
+        type=str, 
+        default=None, 
+        help="Load the calibrated temporal band width of every (layer, head) from this .npz table instead of one --sparsity width"
+    )
+    group.add_argument(
+        "--calibrate_head_widths", 
+        type=str, 
+        default=None, 
+        help="Allocate a band width per (layer, head) on the prompt set and save the .npz table (one file per rank when distributed)"
+    )
+    group.add_argument(
+        "--head_width_budget", 
+        type=float, 
+        default=1.0, 
+        help="Attention blocks of the calibrated widths relative to the uniform --sparsity width"
+    )
+    group.add_argument(
+        "--flop_report", 
+        action="store_true", 
+        help="Log the attention FLOPs of every layer and the density relative to dense attention"
     )
     parser.add_argument(
         "--sparsity",
@@ -46,7 +46,7 @@ from diffusers.utils import BaseOutput
 
 from ...constants import PRECISION_TO_TYPE
 from ...vae.autoencoder_kl_causal_3d import AutoencoderKLCausal3D
-from ...text_encoder import TextEncoder
+from ...text_encoder import TextEncoder, TextEncoderModelOutput
 from ...modules import HYVideoDiffusionTransformer
 
 logger = logging.get_logger(__name__)  # pylint: disable=invalid-name
@@ -137,6 +137,13 @@ def retrieve_timesteps(
     return timesteps, num_inference_steps
 
 
+def unscale_latents(vae, latents):
+    """The ``output_type="latent"`` latents of the pipeline, in the latent space of ``vae`` (the input of its decode)."""
+    if hasattr(vae.config, "shift_factor") and vae.config.shift_factor:
+        return latents / vae.config.scaling_factor + vae.config.shift_factor
+    return latents / vae.config.scaling_factor
+
+
 @dataclass
 class HunyuanVideoPipelineOutput(BaseOutput):
     videos: Union[torch.Tensor, np.ndarray]
@@ -187,6 +194,8 @@ class HunyuanVideoPipeline(DiffusionPipeline):
         self._progress_bar_config.update(progress_bar_config)
 
         self.args = args
+        # PromptEmbeddingCache consulted before running the text encoders, if any
+        self.prompt_embedding_cache = None
         # ==========================================================================================
 
         if (
@@ -311,14 +320,19 @@ class HunyuanVideoPipeline(DiffusionPipeline):
             if isinstance(self, TextualInversionLoaderMixin):
                 prompt = self.maybe_convert_prompt(prompt, text_encoder.tokenizer)
 
-            text_inputs = text_encoder.text2tokens(prompt, data_type=data_type)
-
-            if clip_skip is None:
+            if clip_skip is None and self.prompt_embedding_cache is not None:
+                prompt_embeds, attention_mask = self.prompt_embedding_cache.encode(
+                    text_encoder, [prompt] if isinstance(prompt, str) else prompt, data_type=data_type, device=device
+                )
+                prompt_outputs = TextEncoderModelOutput(prompt_embeds, attention_mask)
+            elif clip_skip is None:
+                text_inputs = text_encoder.text2tokens(prompt, data_type=data_type)
                 prompt_outputs = text_encoder.encode(
                     text_inputs, data_type=data_type, device=device
                 )
                 prompt_embeds = prompt_outputs.hidden_state
             else:
+                text_inputs = text_encoder.text2tokens(prompt, data_type=data_type)
                 prompt_outputs = text_encoder.encode(
                     text_inputs,
                     output_hidden_states=True,
@@ -396,11 +410,17 @@ class HunyuanVideoPipeline(DiffusionPipeline):
                 )
 
             # max_length = prompt_embeds.shape[1]
-            uncond_input = text_encoder.text2tokens(uncond_tokens, data_type=data_type)
+            if self.prompt_embedding_cache is not None:
+                # The negative prompt is constant across the prompts of a run, so it is encoded once
+                negative_prompt_outputs = TextEncoderModelOutput(*self.prompt_embedding_cache.encode(
+                    text_encoder, uncond_tokens, data_type=data_type, device=device
+                ))
+            else:
+                uncond_input = text_encoder.text2tokens(uncond_tokens, data_type=data_type)
 
-            negative_prompt_outputs = text_encoder.encode(
-                uncond_input, data_type=data_type, device=device
-            )
+                negative_prompt_outputs = text_encoder.encode(
+                    uncond_input, data_type=data_type, device=device
+                )
             negative_prompt_embeds = negative_prompt_outputs.hidden_state
 
             negative_attention_mask = negative_prompt_outputs.attention_mask
@@ -749,7 +769,7 @@ class HunyuanVideoPipeline(DiffusionPipeline):
         # device = torch.device(f"cuda:{dist.get_rank()}") if dist.is_initialized() else self._execution_device
         # local_rank = int(os.environ["LOCAL_RANK"])
         local_rank = os.environ["LOCAL_RANK"] if "LOCAL_RANK" in os.environ else 0
-        device = torch.device(f"cuda:{local_rank}")
+        device = torch.device(f"cuda:{local_rank}") if torch.cuda.is_available() else torch.device("cpu")
 
 
         # 3. Encode input prompt
@@ -793,16 +813,7 @@ class HunyuanVideoPipeline(DiffusionPipeline):
                 f"Only support latents with shape (b, c, h, w) or (b, c, f, h, w), but got {latents.shape}."
             )
 
-        if (
-            hasattr(self.vae.config, "shift_factor")
-            and self.vae.config.shift_factor
-        ):
-            latents = (
-                latents / self.vae.config.scaling_factor
-                + self.vae.config.shift_factor
-            )
-        else:
-            latents = latents / self.vae.config.scaling_factor
+        latents = unscale_latents(self.vae, latents)
 
         with torch.autocast(
             device_type="cuda", dtype=vae_dtype, enabled=vae_autocast_enabled
@@ -823,6 +834,44 @@ class HunyuanVideoPipeline(DiffusionPipeline):
         return image
 
 
+    @torch.no_grad()
+    def decode_video(self, latents, enable_tiling=False, generator=None):
+        """Decode the ``output_type="latent"`` output of the pipeline into the [0, 1] float32 video on the host."""
+        if getattr(self.vae, "use_streaming_decode", False) and len(latents.shape) == 5:
+            # Only a chunk of frames at a time on the device
+            return torch.cat(list(self.decode_video_chunks(latents, enable_tiling=enable_tiling)), dim=2)
+
+        vae_dtype = PRECISION_TO_TYPE[self.args.vae_precision]
+        vae_autocast_enabled = (
+            vae_dtype != torch.float32
+        ) and not self.args.disable_autocast
+        image = self.haocheng_decode_latents(latents, vae_dtype, vae_autocast_enabled, enable_tiling, generator)
+
+        image = (image / 2 + 0.5).clamp(0, 1)
+        # we always cast to float32 as this does not cause significant overhead and is compatible with bfloa16
+        return image.cpu().float()
+
+    @torch.no_grad()
+    def decode_video_chunks(self, latents, enable_tiling=False):
+        """Stream the decode of ``output_type="latent"`` video latents: yield the [0, 1] float32 frames on the host as the
+        VAE decodes them, ``vae.stream_chunk_size`` latent frames at a time."""
+        vae_dtype = PRECISION_TO_TYPE[self.args.vae_precision]
+        vae_autocast_enabled = (
+            vae_dtype != torch.float32
+        ) and not self.args.disable_autocast
+        latents = unscale_latents(self.vae, latents)
+        if enable_tiling:
+            self.vae.enable_tiling()
+
+        chunks = self.vae.stream_decode(latents)
+        while True:
+            # The autocast only around the decode, not around the caller of the generator
+            with torch.autocast(device_type="cuda", dtype=vae_dtype, enabled=vae_autocast_enabled):
+                image = next(chunks, None)
+            if image is None:
+                return
+            yield (image / 2 + 0.5).clamp(0, 1).cpu().float()
+
     @torch.no_grad()
     @replace_example_docstring(EXAMPLE_DOC_STRING)
     def __call__(
@@ -1001,7 +1050,7 @@ class HunyuanVideoPipeline(DiffusionPipeline):
 
         # device = torch.device(f"cuda:{dist.get_rank()}") if dist.is_initialized() else self._execution_device
         local_rank = os.environ["LOCAL_RANK"] if "LOCAL_RANK" in os.environ else 0
-        device = torch.device(f"cuda:{local_rank}")
+        device = torch.device(f"cuda:{local_rank}") if torch.cuda.is_available() else torch.device("cpu")
 
         # 3. Encode input prompt
         lora_scale = (
@@ -1154,7 +1203,7 @@ class HunyuanVideoPipeline(DiffusionPipeline):
 
                 # predict the noise residual
                 with torch.autocast(
-                    device_type="cuda", dtype=target_dtype, enabled=autocast_enabled
+                    device_type=device.type, dtype=target_dtype, enabled=autocast_enabled
                 ):
                     noise_pred = self.transformer(  # For an input image (129, 192, 336) (1, 256, 256)
                         latent_model_input,  # [2, 16, 33, 24, 42]
@@ -1224,14 +1273,11 @@ class HunyuanVideoPipeline(DiffusionPipeline):
                 #     save_videos_grid(image, f"visualization_result/{prompt[0][:15]}/step_{i}.mp4", fps=24)
 
         if not output_type == "latent":
-            image = self.haocheng_decode_latents(latents, vae_dtype, vae_autocast_enabled, enable_tiling, generator)
+            image = self.decode_video(latents, enable_tiling=enable_tiling, generator=generator)
         else:
+            # Decoded later with decode_video
             image = latents
 
-        image = (image / 2 + 0.5).clamp(0, 1)
-        # we always cast to float32 as this does not cause significant overhead and is compatible with bfloa16
-        image = image.cpu().float()
-
         # Offload all models
         self.maybe_free_model_hooks()
 
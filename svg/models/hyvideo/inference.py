@@ -13,9 +13,11 @@ from .constants import PROMPT_TEMPLATE, NEGATIVE_PROMPT, PRECISION_TO_TYPE
 from .vae import load_vae
 from .modules import load_model
 from .text_encoder import TextEncoder
+from .text_encoder.embedding_cache import PromptEmbeddingCache
 from .utils.data_utils import align_to
-from .modules.posemb_layers import get_nd_rotary_pos_embed
+from .modules.posemb_layers import get_cached_nd_rotary_pos_embed
 from .modules.fp8_optimization import convert_fp8_linear
+from .utils.checkpoint import checkpoint_variant, load_checkpoint, load_model_checkpoint, resolve_checkpoint
 from .diffusion.schedulers import FlowMatchDiscreteScheduler
 from .diffusion.pipelines import HunyuanVideoPipeline
 
@@ -140,6 +142,13 @@ class Inference(object):
         self.logger = logger
         self.parallel_args = parallel_args
 
+    @property
+    def execution_device(self):
+        """The device the pipeline runs on, ``cuda:LOCAL_RANK`` whatever device the models were loaded on."""
+        if torch.cuda.is_available():
+            return torch.device(f"cuda:{os.environ.get('LOCAL_RANK', 0)}")
+        return torch.device("cpu")
+
     @classmethod
     def from_pretrained(cls, pretrained_model_path, args, device=None, **kwargs):
         """
@@ -198,18 +207,22 @@ class Inference(object):
             factor_kwargs=factor_kwargs,
         )
         if args.use_fp8:
-            args.dit_weight = args.dit_weight.replace('.pt', '_fp8.pt')
+            args.dit_weight = checkpoint_variant(args.dit_weight, "_fp8")
             convert_fp8_linear(model, args.dit_weight, original_dtype=PRECISION_TO_TYPE[args.precision])
 
         # ============================= Build extra models ========================
         # VAE
-        vae, _, s_ratio, t_ratio = load_vae(
+        vae, vae_path, s_ratio, t_ratio = load_vae(
             args.vae,
             args.vae_precision,
             logger=logger,
             device=device if not args.use_cpu_offload else "cpu",
         )
-        vae_kwargs = {"s_ratio": s_ratio, "t_ratio": t_ratio}
+        vae.tile_batch_size = args.vae_tile_batch_size
+        if args.vae_streaming:
+            vae.enable_streaming_decode(args.vae_stream_chunk_size)
+        # The directory the VAE came from, recorded with the saved latents for the decode workers
+        vae_kwargs = {"s_ratio": s_ratio, "t_ratio": t_ratio, "vae_path": os.path.abspath(vae_path)}
 
         # Text encoder
         if args.prompt_template_video is not None:
@@ -261,10 +274,14 @@ class Inference(object):
                 device=device if not args.use_cpu_offload else "cpu",
             )
 
-        from mmgp import offload
         # model = Inference.load_state_dict(args, model, pretrained_model_path)
         print("load model...")
-        offload.load_model_data(model,args.dit_weight)
+        if resolve_checkpoint(args.dit_weight).endswith(".safetensors"):
+            # Memory-mapped, the workers of the node share the page cache of the weights
+            load_model_checkpoint(model, args.dit_weight)
+        else:
+            from mmgp import offload
+            offload.load_model_data(model,args.dit_weight)
         model.eval()
 
         return cls(
@@ -342,7 +359,7 @@ class Inference(object):
         if not model_path.exists():
             raise ValueError(f"model_path not exists: {model_path}")
         logger.info(f"Loading torch model {model_path}...")
-        state_dict = torch.load(model_path, map_location=lambda storage, loc: storage)
+        state_dict = load_checkpoint(model_path)
 
         if bare_model == "unknown" and ("ema" in state_dict or "module" in state_dict):
             bare_model = False
@@ -408,6 +425,9 @@ class HunyuanVideoSampler(Inference):
             device=self.device,
         )
 
+        if getattr(args, "prompt_cache", False) or getattr(args, "prompt_cache_dir", None) is not None:
+            self.pipeline.prompt_embedding_cache = PromptEmbeddingCache(cache_dir=args.prompt_cache_dir)
+
         self.default_negative_prompt = NEGATIVE_PROMPT
         if self.parallel_args['ulysses_degree'] > 1 or self.parallel_args['ring_degree'] > 1:
             parallelize_transformer(self.pipeline)
@@ -489,12 +509,15 @@ class HunyuanVideoSampler(Inference):
         assert (
             sum(rope_dim_list) == head_dim
         ), "sum(rope_dim_list) should equal to head_dim of attention layer"
-        freqs_cos, freqs_sin = get_nd_rotary_pos_embed(
+        # Built once per geometry and kept on the device the transformer runs on, not on self.device, which
+        # is the host when the models are loaded there for offloading
+        freqs_cos, freqs_sin = get_cached_nd_rotary_pos_embed(
             rope_dim_list,
             rope_sizes,
             theta=self.args.rope_theta,
-            use_real=True,
             theta_rescale_factor=1,
+            device=self.execution_device,
+            dtype=torch.float32,
         )
         return freqs_cos, freqs_sin
 
@@ -598,13 +621,17 @@ class HunyuanVideoSampler(Inference):
         embedded_guidance_scale=None,
         batch_size=1,
         num_videos_per_prompt=1,
+        output_type="pil",
         **kwargs,
     ):
         """
         Predict the image/video from the given text.
 
+        A list of prompts is generated in one batched denoising loop, they share the size and the video length.
+
         Args:
             prompt (str or List[str]): The input text.
+            batch_size (int): Ignored, the batch size is the number of prompts.
             kwargs:
                 height (int): The height of the output video. Default is 192.
                 width (int): The width of the output video. Default is 336.
@@ -614,9 +641,18 @@ class HunyuanVideoSampler(Inference):
                 guidance_scale (float): The guidance scale for the generation. Default is 6.0.
                 num_images_per_prompt (int): The number of images per prompt. Default is 1.
                 infer_steps (int): The number of inference steps. Default is 100.
+                output_type (str): "latent" returns the latents, decoded later with ``decode``. Default is "pil".
         """
         out_dict = dict()
 
+        if isinstance(prompt, str):
+            prompt = [prompt]
+        if not isinstance(prompt, (list, tuple)) or not all(isinstance(p, str) for p in prompt):
+            raise TypeError(f"`prompt` must be a string or a list of strings, but got {type(prompt)}")
+        batch_size = len(prompt)
+        if batch_size > 1 and (self.parallel_args['ulysses_degree'] > 1 or self.parallel_args['ring_degree'] > 1):
+            raise ValueError("Batched prompts are not supported with sequence parallelism")
+
         # ========================================================================
         # Arguments: seed
         # ========================================================================
@@ -679,9 +715,7 @@ class HunyuanVideoSampler(Inference):
         # ========================================================================
         # Arguments: prompt, new_prompt, negative_prompt
         # ========================================================================
-        if not isinstance(prompt, str):
-            raise TypeError(f"`prompt` must be a string, but got {type(prompt)}")
-        prompt = [prompt.strip()]
+        prompt = [p.strip() for p in prompt]
 
         # negative prompt
         if negative_prompt is None or negative_prompt == "":
@@ -690,7 +724,7 @@ class HunyuanVideoSampler(Inference):
             raise TypeError(
                 f"`negative_prompt` must be a string, but got {type(negative_prompt)}"
             )
-        negative_prompt = [negative_prompt.strip()]
+        negative_prompt = [negative_prompt.strip()] * batch_size
 
         # ========================================================================
         # Scheduler
@@ -742,7 +776,7 @@ class HunyuanVideoSampler(Inference):
             negative_prompt=negative_prompt,
             num_videos_per_prompt=num_videos_per_prompt,
             generator=generator,
-            output_type="pil",
+            output_type=output_type,
             freqs_cis=(freqs_cos, freqs_sin),
             n_tokens=n_tokens,
             embedded_guidance_scale=embedded_guidance_scale,
@@ -751,10 +785,36 @@ class HunyuanVideoSampler(Inference):
             vae_ver=self.args.vae,
             enable_tiling=self.args.vae_tiling,
         )[0]
+        # [batch_size * num_videos_per_prompt, C, T, H, W], prompt major
         out_dict["samples"] = samples
         out_dict["prompts"] = prompt
+        out_dict["samples_per_prompt"] = [
+            samples[i * num_videos_per_prompt:(i + 1) * num_videos_per_prompt] for i in range(batch_size)
+        ]
 
         gen_time = time.time() - start_time
         logger.info(f"Success, time: {gen_time}")
 
         return out_dict
+
+    @torch.no_grad()
+    def encode_prompts(self, prompt, negative_prompt=None, data_type="video"):
+        """Encode the prompts of a later ``predict`` into the prompt embedding cache of the pipeline, if it has one."""
+        cache = self.pipeline.prompt_embedding_cache
+        if cache is None:
+            return
+        if isinstance(prompt, str):
+            prompt = [prompt]
+        if negative_prompt is None or negative_prompt == "":
+            negative_prompt = self.default_negative_prompt
+        # The texts predict passes to the pipeline, on the device the pipeline encodes on
+        texts = [p.strip() for p in prompt] + [negative_prompt.strip()]
+        device = self.execution_device
+        for text_encoder in (self.text_encoder, self.text_encoder_2):
+            if text_encoder is not None:
+                cache.encode(text_encoder, texts, data_type=data_type, device=device)
+
+    @torch.no_grad()
+    def decode(self, latents):
+        """The [0, 1] float32 videos of the ``output_type="latent"`` samples of ``predict``."""
+        return self.pipeline.decode_video(latents, enable_tiling=self.args.vae_tiling)
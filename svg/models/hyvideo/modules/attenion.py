@@ -2,13 +2,11 @@ import math
 
 import torch
 import torch.nn.functional as F
-from torch.nn.attention.flex_attention import flex_attention
 
-from flash_attn.flash_attn_interface import flash_attn_varlen_func
-
-
-from .utils import create_block_mask_cached, generate_temporal_head_mask_mod
-from .placement import hunyuan_sparse_head_placement, hunyuan_hidden_states_placement, ref_hunyuan_sparse_head_placement, ref_hunyuan_hidden_states_placement 
+from .utils import generate_temporal_head_mask_mod
+from svg.sparse import backends
+from svg.sparse.core import SparseAttentionProcessor
+from svg.sparse.geometry import SparseAttentionGeometry
 
 try:
     import flash_attn
@@ -49,11 +47,6 @@ except ImportError:
     sageattn = None
     print("SageAttention is not installed")
 
-flex_attention = torch.compile(flex_attention, dynamic=False)
-torch._dynamo.config.cache_size_limit = 192 * 3
-torch._dynamo.config.accumulated_cache_size_limit = 192 * 3
-
-
 MEMORY_LAYOUT = {
     "flash": (
         lambda x: x.view(x.shape[0] * x.shape[1], *x.shape[2:]),
@@ -77,84 +70,43 @@ MEMORY_LAYOUT = {
     ),
 }
 
-class Hunyuan_SparseAttn:
-    num_sampled_rows = 32
-    attention_masks = None
-
-    context_length = 256
-    num_frame = 33 
-    frame_size = 3600
-
-    first_layers_fp = 0
-    first_times_fp = 0
+class Hunyuan_SparseAttn(SparseAttentionProcessor):
+    # The settings are class attributes, shared by the double and single stream blocks through hunyuan_sparse_attn
 
-    sample_mse_max_row = 10000
-    block_mask = None
-    
+    cu_seqlens = None # cu_seqlens the geometry was last checked against
 
     def __init__(self):  
         if not hasattr(F, "scaled_dot_product_attention"):
             raise ImportError("Hunyuan_SparseAttn requires PyTorch 2.0, please upgrade PyTorch.")
 
-    @classmethod
-    def sample_mse(self, query, key, value):
-        assert len(self.attention_masks) == 2
-
-        cfg, num_heads, seq_len, dim = query.size()
-        num_sampled_rows = min(self.num_sampled_rows, seq_len)
-        sampled_rows = torch.randint(low=0, high=self.sample_mse_max_row, size=(num_sampled_rows,))
-        sampled_q = query[:, :, sampled_rows, :]
-        sampled_qk_scores = torch.matmul(sampled_q, key.transpose(-2, -1)) / (dim**0.5)
-    
-        sampled_attn_weights = F.softmax(sampled_qk_scores, dim=-1)
-        sampled_golden_hidden_states = torch.matmul(sampled_attn_weights, value)  # (1, seq_len, dim)
-
-        sampled_mses = torch.zeros(len(self.attention_masks), cfg, num_heads, device=query.device, dtype=query.dtype)
-
-        # Only have Tri-diagonal and Striped
-        for mask_idx, attn_mask in enumerate(self.attention_masks):
-            sampled_attention_mask = attn_mask[sampled_rows, :]
-            sampled_attention_scores = sampled_qk_scores.masked_fill(sampled_attention_mask == 0, float('-inf'))
-            sampled_attn_weights = F.softmax(sampled_attention_scores, dim=-1)
-            sampled_hidden_states = torch.matmul(sampled_attn_weights, value)
-            mse = torch.mean((sampled_hidden_states - sampled_golden_hidden_states) ** 2, dim=(2, 3))
-            sampled_mses[mask_idx] = mse
-
-        return sampled_mses
-
-    @classmethod
-    def sparse_flex_attention(self, query, key, value, block_mask):
-        return flex_attention(query, key, value, block_mask=block_mask)
-
-    @classmethod
-    def sparse_head_placement(self, query, key, value, query_out, key_out, value_out, best_mask_idx, context_length, num_frame, frame_size):
-        
-        query_out, key_out, value_out = ref_hunyuan_sparse_head_placement(query, key, value, best_mask_idx, context_length, num_frame, frame_size)
-
-        return query_out, key_out, value_out
-
-    @classmethod
-    def fast_sparse_head_placement(self, query, key, value, query_out, key_out, value_out, best_mask_idx, context_length, num_frame, frame_size):
-
-        hunyuan_sparse_head_placement(query, key, value, query_out, key_out, value_out, best_mask_idx, context_length, num_frame, frame_size)
-
-        return query_out, key_out, value_out
-
-    @classmethod
-    def hidden_states_placement(self, \
-        hidden_states, output_hidden_states, \
-        best_mask_idx, context_length, num_frame, frame_size
-    ):
-        ref_hunyuan_hidden_states_placement(hidden_states, output_hidden_states, best_mask_idx, context_length, num_frame, frame_size)
-
-    @classmethod
-    def fast_hidden_states_placement(self, \
-        hidden_states, output_hidden_states, \
-        best_mask_idx, context_length, num_frame, frame_size
-    ):
-        hunyuan_hidden_states_placement(hidden_states, output_hidden_states, best_mask_idx, context_length, num_frame, frame_size)
+    def update_prompt_length(self, query, cu_seqlens):
+        """Rebuild the geometry and the BlockMask for the number of valid text tokens of the batch, read from ``cu_seqlens``.
+
+        ``get_cu_seqlens`` returns the same tensor at every step of a batch, so the lengths are read on the host once per batch.
+        The BlockMask is shared by the samples of a batch, so they must all have the same prompt length.
+        """
+        cls = type(self)
+        if cu_seqlens is cls.cu_seqlens:
+            return
+        geometry = cls.geometry
+        prompt_lengths = set((cu_seqlens[1::2] - cu_seqlens[:-1:2] - geometry.pixel_length).tolist())
+        if len(prompt_lengths) > 1:
+            raise ValueError(
+                f"Sparse attention needs the prompts of a batch to have the same number of text tokens, got {sorted(prompt_lengths)}. "
+                "Use --batch-size 1"
+            )
+        prompt_length = prompt_lengths.pop()
+        if prompt_length != geometry.prompt_length:
+            cfg_size, num_head, _, head_dim = query.shape
+            cls.block_mask = prepare_flexattention(
+                cfg_size, num_head, head_dim, query.dtype, query.device, geometry.context_length, prompt_length,
+                geometry.num_frame, geometry.frame_size, diag_width=geometry.multiplier, multiplier=geometry.multiplier
+            )
+            cls.geometry = SparseAttentionGeometry.hunyuan(
+                geometry.context_length, prompt_length, geometry.num_frame, geometry.frame_size, geometry.multiplier
+            )
+        cls.cu_seqlens = cu_seqlens
 
-    @classmethod
     def attention_core_logic(
         self,
         query: torch.Tensor,
@@ -167,33 +119,25 @@ class Hunyuan_SparseAttn:
         max_seqlen_q,
         max_seqlen_kv,
     ):
-        cfg, num_heads, seq_len, dim = query.size()
-        
-        context_length, num_frame, frame_size = self.context_length, self.num_frame, self.frame_size
-
-        assert seq_len == context_length + num_frame * frame_size, \
-            f"Query Shape: {seq_len} is not equivalent to {context_length} + {num_frame} * {frame_size}"
-
-        sampled_mses = self.sample_mse(query, key, value)
-        best_mask_idx = torch.argmin(sampled_mses, dim=0)
-
-
-        output_hidden_states = torch.zeros_like(query)
-
-        query_out, key_out, value_out = torch.zeros_like(query), torch.zeros_like(key), torch.zeros_like(value)
+        self.update_prompt_length(query, cu_seqlens_q)
+        return self.sparse_attention(query, key, value, timestep, layer_idx)
 
-        query_out, key_out, value_out = self.fast_sparse_head_placement(query, key, value, query_out, key_out, value_out, best_mask_idx, context_length, num_frame, frame_size)
 
-        hidden_states = self.sparse_flex_attention(query_out, key_out, value_out, block_mask=self.block_mask)
+hunyuan_sparse_attn = Hunyuan_SparseAttn()
 
-        self.fast_hidden_states_placement(hidden_states, output_hidden_states, best_mask_idx, context_length, num_frame, frame_size)
 
-        return output_hidden_states.reshape(cfg, num_heads, seq_len, dim)
+# (text_mask, text_mask._version, img_len, cu_seqlens) of the last masks. The mask is the same tensor at every
+# step of a generation, holding it keeps its storage from being reused by another mask
+_cu_seqlens_cache = []
+CU_SEQLENS_CACHE_SIZE = 4
 
 
 def get_cu_seqlens(text_mask, img_len):
     """Calculate cu_seqlens_q, cu_seqlens_kv using text_mask and img_len
 
+    Every sample is a segment of its image and real text tokens followed by a segment of its text padding.
+    The result is memoized per text_mask tensor, so the denoising steps do not recompute it.
+
     Args:
         text_mask (torch.Tensor): the mask of text
         img_len (int): the length of image
@@ -201,20 +145,33 @@ def get_cu_seqlens(text_mask, img_len):
     Returns:
         torch.Tensor: the calculated cu_seqlens for flash attention
     """
-    batch_size = text_mask.shape[0]
-    text_len = text_mask.sum(dim=1)
-    max_len = text_mask.shape[1] + img_len
+    for mask, version, cached_img_len, cu_seqlens in _cu_seqlens_cache:
+        if mask is text_mask and version == text_mask._version and cached_img_len == img_len:
+            return cu_seqlens
 
-    cu_seqlens = torch.zeros([2 * batch_size + 1], dtype=torch.int32, device="cuda")
+    max_len = text_mask.shape[1] + img_len
+    valid_len = text_mask.sum(dim=1, dtype=torch.int32) + img_len
+    # Interleaved [valid_0, pad_0, valid_1, pad_1, ...] lengths, all on the device of text_mask
+    seqlens = torch.stack([valid_len, max_len - valid_len], dim=1).flatten()
+    cu_seqlens = F.pad(seqlens.cumsum(0, dtype=torch.int32), (1, 0))
+
+    _cu_seqlens_cache.append((text_mask, text_mask._version, img_len, cu_seqlens))
+    if len(_cu_seqlens_cache) > CU_SEQLENS_CACHE_SIZE:
+        _cu_seqlens_cache.pop(0)
+    return cu_seqlens
 
-    for i in range(batch_size):
-        s = text_len[i] + img_len
-        s1 = i * max_len + s
-        s2 = (i + 1) * max_len
-        cu_seqlens[2 * i + 1] = s1
-        cu_seqlens[2 * i + 2] = s2
 
-    return cu_seqlens
+def varlen_sdpa(q, k, v, cu_seqlens_q, cu_seqlens_kv):
+    """``flash_attn_varlen_func`` on the [(b x s), a, d] Q / K / V with SDPA, when flash-attn is not installed (e.g. on CPU)."""
+    out = torch.empty_like(q)
+    # One host sync per call, this path is for validation only
+    bounds_q, bounds_kv = cu_seqlens_q.tolist(), cu_seqlens_kv.tolist()
+    for q_start, q_end, kv_start, kv_end in zip(bounds_q[:-1], bounds_q[1:], bounds_kv[:-1], bounds_kv[1:]):
+        if q_end == q_start:
+            continue
+        q_i, k_i, v_i = [x[start:end].transpose(0, 1) for x, start, end in ((q, q_start, q_end), (k, kv_start, kv_end), (v, kv_start, kv_end))]
+        out[q_start:q_end] = F.scaled_dot_product_attention(q_i, k_i, v_i).transpose(0, 1)
+    return out
 
 
 def attention(
@@ -257,19 +214,19 @@ def attention(
     """
 
     # Some Preprocess
+    if torch.is_tensor(timestep):
+        # The samples of a batch share the denoising timestep
+        timestep = timestep.reshape(-1)[0]
     if mode == "sparse":
         assert torch.allclose(cu_seqlens_q, cu_seqlens_kv)
         assert cu_seqlens_kv is not None
                 
         # Determine if we use Full Attention to calculate  # TODO  
-        full_attention_flag = False
-        if layer_idx < 42 * Hunyuan_SparseAttn.first_layers_fp:
-            full_attention_flag = True
-        if timestep > 1000 * (1 - Hunyuan_SparseAttn.first_times_fp):
-            full_attention_flag = True
+        full_attention_flag = hunyuan_sparse_attn.use_full_attention(layer_idx, timestep, 42)
 
         if full_attention_flag:    
             mode = "flash"
+            hunyuan_sparse_attn.count_flops(layer_idx, q.transpose(1, 2))
         else:
             mode = "sparse"
 
@@ -285,7 +242,7 @@ def attention(
             q, k, v, attn_mask=attn_mask, dropout_p=drop_rate, is_causal=causal
         )
     elif mode == "sparse":
-        x = Hunyuan_SparseAttn.attention_core_logic(
+        x = hunyuan_sparse_attn.attention_core_logic(
             q, k, v, timestep, layer_idx,
             cu_seqlens_q,
             cu_seqlens_kv,
@@ -297,15 +254,18 @@ def attention(
         del q, k , v
         x = sageattn_wrapper(qkv_list, cu_seqlens_q)
     elif mode == "flash":
-        x = flash_attn_varlen_func(
-            q,
-            k,
-            v,
-            cu_seqlens_q,
-            cu_seqlens_kv,
-            max_seqlen_q,
-            max_seqlen_kv,
-        )
+        if flash_attn_varlen_func is None:
+            x = varlen_sdpa(q, k, v, cu_seqlens_q, cu_seqlens_kv)
+        else:
+            x = flash_attn_varlen_func(
+                q,
+                k,
+                v,
+                cu_seqlens_q,
+                cu_seqlens_kv,
+                max_seqlen_q,
+                max_seqlen_kv,
+            )
         # x with shape [(bxs), a, d]
         x = x.view(
             batch_size, max_seqlen_q, x.shape[-2], x.shape[-1]
@@ -409,12 +369,6 @@ def prepare_flexattention(cfg_size, num_head, head_dim, dtype, device, context_l
     diag_width=1, multiplier=2
 ):
     assert diag_width == multiplier
-    seq_len = context_length + num_frame * frame_size
-    query, key, value = [torch.zeros((1, cfg_size * num_head, seq_len, head_dim), dtype=dtype, device=device) for _ in range(3)]
-
+    geometry = SparseAttentionGeometry.hunyuan(context_length, prompt_length, num_frame, frame_size, multiplier)
     mask_mod = generate_temporal_head_mask_mod(context_length, prompt_length, num_frame, frame_size, mul=multiplier)
-    block_mask = create_block_mask_cached(mask_mod, None, None, seq_len, seq_len, device=device, _compile=True)
-
-    hidden_states = flex_attention(query, key, value, block_mask=block_mask)
-
-    return block_mask
+    return backends.prepare_flexattention(geometry, mask_mod, cfg_size, num_head, head_dim, dtype, device)
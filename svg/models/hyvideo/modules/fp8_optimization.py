@@ -4,6 +4,8 @@ import torch
 import torch.nn as nn
 from torch.nn import functional as F
 
+from ..utils.checkpoint import checkpoint_variant, load_checkpoint, resolve_checkpoint
+
 def get_fp_maxval(bits=8, mantissa_bit=3, sign_bits=1):
     _bits = torch.tensor(bits)
     _mantissa_bit = torch.tensor(mantissa_bit)
@@ -83,9 +85,9 @@ def convert_fp8_linear(module, dit_weight_path, original_dtype, params_to_keep={
     setattr(module, "fp8_matmul_enabled", True)
 
     # loading fp8 mapping file
-    fp8_map_path = dit_weight_path.replace('.pt', '_map.pt')
+    fp8_map_path = resolve_checkpoint(checkpoint_variant(dit_weight_path, "_map"))
     if os.path.exists(fp8_map_path):
-        fp8_map = torch.load(fp8_map_path, map_location=lambda storage, loc: storage)
+        fp8_map = load_checkpoint(fp8_map_path)
     else:
         raise ValueError(f"Invalid fp8_map path: {fp8_map_path}.")
 
@@ -17,7 +17,6 @@ from .posemb_layers import apply_rotary_emb
 from .mlp_layers import MLP, MLPEmbedder, FinalLayer
 from .modulate_layers import ModulateDiT, modulate, modulate_ , apply_gate, apply_gate_and_accumulate_
 from .token_refiner import SingleTokenRefiner
-import numpy as np
 
 
 class MMDoubleStreamBlock(nn.Module):
@@ -652,6 +651,11 @@ class HYVideoDiffusionTransformer(ModelMixin, ConfigMixin):
             **factory_kwargs,
         )
 
+        # svg.teacache.TeaCache, skips the blocks of the steps whose input barely changed
+        self.teacache = None
+        # svg.block_cache.BlockResidualCache, skips the groups of blocks whose input barely changed
+        self.block_cache = None
+
     def enable_deterministic(self):
         for block in self.double_blocks:
             block.enable_deterministic()
@@ -722,13 +726,14 @@ class HYVideoDiffusionTransformer(ModelMixin, ConfigMixin):
 
         if hasattr(self, 'sparse_args'):
             if getattr(self.sparse_args, 'pattern', None) == "SVG":
-                freqs_cos = freqs_cos.to(x.device).to(torch.float32)
-                freqs_sin = freqs_sin.to(x.device).to(torch.float32)
+                # No-op for the tables of HunyuanVideoSampler, built in float32 on the execution device
+                freqs_cos = freqs_cos.to(device=x.device, dtype=torch.float32)
+                freqs_sin = freqs_sin.to(device=x.device, dtype=torch.float32)
         freqs_cis = (freqs_cos, freqs_sin) if freqs_cos is not None else None
             
-        if self.enable_teacache:
-            inp = img 
-            vec_ = vec 
+        teacache = getattr(self, "teacache", None)
+        should_calc = True
+        if teacache is not None:
             (
                 img_mod1_shift,
                 img_mod1_scale,
@@ -737,8 +742,8 @@ class HYVideoDiffusionTransformer(ModelMixin, ConfigMixin):
                 _ ,
                 _ ,
 
-            ) = self.double_blocks[0].img_mod(vec_).chunk(6, dim=-1)
-            normed_inp = self.double_blocks[0].img_norm1(inp)
+            ) = self.double_blocks[0].img_mod(vec).chunk(6, dim=-1)
+            normed_inp = self.double_blocks[0].img_norm1(img)
             normed_inp = normed_inp.to(torch.bfloat16)
             modulated_inp = modulate(
                 normed_inp, shift=img_mod1_shift, scale=img_mod1_scale
@@ -746,107 +751,68 @@ class HYVideoDiffusionTransformer(ModelMixin, ConfigMixin):
 
             del normed_inp, img_mod1_shift, img_mod1_scale
 
-            if self.cnt == 0 or self.cnt == self.num_steps-1:
-                should_calc = True
-                self.accumulated_rel_l1_distance = 0
-            else: 
-                coefficients = [7.33226126e+02, -4.01131952e+02,  6.75869174e+01, -3.14987800e+00, 9.61237896e-02]
-                rescale_func = np.poly1d(coefficients)
-                self.accumulated_rel_l1_distance += rescale_func(((modulated_inp-self.previous_modulated_input).abs().mean() / self.previous_modulated_input.abs().mean()).cpu().item())
-                if self.accumulated_rel_l1_distance < self.rel_l1_thresh:
-                    should_calc = False
-                else:
-                    should_calc = True
-                    self.accumulated_rel_l1_distance = 0
-            self.previous_modulated_input = modulated_inp  
-            self.cnt += 1
-            if self.cnt == self.num_steps:
-                self.cnt = 0          
-
-        if self.enable_teacache:
-            if not should_calc:
-                img += self.previous_residual
-            else:
-                ori_img = img.clone()
-                # --------------------- Pass through DiT blocks ------------------------
-                for _, block in enumerate(self.double_blocks):
-                    double_block_args = [
-                    img,
-                    txt,
-                    vec,
-                    cu_seqlens_q,
-                    cu_seqlens_kv,
-                    max_seqlen_q,
-                    max_seqlen_kv,
-                    freqs_cis,
-                    t
-                    ]
-
-                    img, txt = block(*double_block_args)
-                    double_block_args = None
-
-                # Merge txt and img to pass through single stream blocks.
-                # x = torch.cat((img, txt), 1)
-                # del img, txt
-                if len(self.single_blocks) > 0:
-                    for _, block in enumerate(self.single_blocks):
+            # No host sync here, the distance is read once every teacache.sync_interval steps
+            should_calc = teacache.should_compute(modulated_inp)
+
+        if not should_calc:
+            img = teacache.apply_residuals(img)
+        else:
+            ori_img = img.clone() if teacache is not None else None
+            # --------------------- Pass through DiT blocks ------------------------
+            # Double stream blocks, then single stream blocks, in groups of block_cache.group_size
+            blocks = list(self.double_blocks) + list(self.single_blocks)
+            block_cache = getattr(self, "block_cache", None)
+            group_size = len(blocks) if block_cache is None else block_cache.group_size
+            for group_idx, group_start in enumerate(range(0, len(blocks), group_size)):
+                if block_cache is not None:
+                    if not block_cache.should_compute(group_idx, img):
+                        img, txt = block_cache.apply_residuals(img, txt)
+                        continue
+                    # The blocks accumulate into img and txt in place
+                    group_inputs = (img.clone(), txt.clone())
+
+                for block_idx in range(group_start, min(group_start + group_size, len(blocks))):
+                    block = blocks[block_idx]
+                    if block_idx < len(self.double_blocks):
+                        double_block_args = [
+                            img,
+                            txt,
+                            vec,
+                            cu_seqlens_q,
+                            cu_seqlens_kv,
+                            max_seqlen_q,
+                            max_seqlen_kv,
+                            freqs_cis,
+                            t
+                        ]
+
+                        img, txt = block(*double_block_args)
+                    else:
+                        # Merge txt and img to pass through single stream blocks.
+                        # x = torch.cat((img, txt), 1)
                         single_block_args = [
-                        # x,
-                        img,
-                        txt,
-                        vec,
-                        txt_seq_len,
-                        cu_seqlens_q,
-                        cu_seqlens_kv,
-                        max_seqlen_q,
-                        max_seqlen_kv,
-                        (freqs_cos, freqs_sin),
-                        t
+                            # x,
+                            img,
+                            txt,
+                            vec,
+                            txt_seq_len,
+                            cu_seqlens_q,
+                            cu_seqlens_kv,
+                            max_seqlen_q,
+                            max_seqlen_kv,
+                            (freqs_cos, freqs_sin),
+                            t
                         ]
 
                         img,txt = block(*single_block_args)
-                        single_block_args = None
-                # img = x[:, :img_seq_len, ...]
-                self.previous_residual = img - ori_img
-        else:
-            # --------------------- Pass through DiT blocks ------------------------
-            for _, block in enumerate(self.double_blocks):
-                double_block_args = [
-                    img,
-                    txt,
-                    vec,
-                    cu_seqlens_q,
-                    cu_seqlens_kv,
-                    max_seqlen_q,
-                    max_seqlen_kv,
-                    freqs_cis,
-                    t
-                ]
 
-                img, txt = block(*double_block_args)
-
-            # Merge txt and img to pass through single stream blocks.
-            # x = torch.cat((img, txt), 1)
-            if len(self.single_blocks) > 0:
-                for _, block in enumerate(self.single_blocks):
-                    single_block_args = [
-                        # x,
-                        img,
-                        txt,
-                        vec,
-                        txt_seq_len,
-                        cu_seqlens_q,
-                        cu_seqlens_kv,
-                        max_seqlen_q,
-                        max_seqlen_kv,
-                        (freqs_cos, freqs_sin),
-                        t
-                    ]
-
-                    img,txt = block(*single_block_args)
+                if block_cache is not None:
+                    block_cache.store_residuals(group_inputs, (img, txt))
 
             # img = x[:, :img_seq_len, ...]
             del txt
+            if teacache is not None:
+                teacache.store_residuals(ori_img, img)
 
         # ---------------------------- Final layer ------------------------------
         img = self.final_layer(img, vec)  # (N, T, patch_size ** 2 * out_channels)
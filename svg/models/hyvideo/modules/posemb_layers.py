@@ -1,4 +1,5 @@
 import torch
+from collections import OrderedDict
 from typing import Union, Tuple, List
 
 
@@ -258,6 +259,56 @@ def get_nd_rotary_pos_embed(
         return emb
 
 
+# (rope_dim_list, rope_sizes, theta, theta_rescale_factor, device, dtype) -> (freqs_cos, freqs_sin), in LRU order
+_rope_table_cache = OrderedDict()
+ROPE_TABLE_CACHE_SIZE = 8
+
+
+def get_cached_nd_rotary_pos_embed(
+    rope_dim_list,
+    rope_sizes,
+    theta=10000.0,
+    theta_rescale_factor: float = 1.0,
+    device=None,
+    dtype=torch.float32,
+):
+    """
+    Real ``(freqs_cos, freqs_sin)`` tables of ``get_nd_rotary_pos_embed``, built once per geometry and kept
+    resident on ``device`` in ``dtype``.
+
+    Every predict at the same (video_length, height, width) reuses the tables, and the transformer gets
+    tensors that are already on its device, so neither the tables nor a host-to-device copy are redone
+    per step or per layer. The returned tensors are shared and must not be modified in place.
+
+    Returns:
+        freqs_cos, freqs_sin (torch.Tensor): [THW, D]
+    """
+    key = (
+        tuple(rope_dim_list),
+        tuple(rope_sizes),
+        float(theta),
+        float(theta_rescale_factor),
+        str(torch.device(device)) if device is not None else "cpu",
+        dtype,
+    )
+    if key in _rope_table_cache:
+        _rope_table_cache.move_to_end(key)
+        return _rope_table_cache[key]
+
+    freqs_cos, freqs_sin = get_nd_rotary_pos_embed(
+        rope_dim_list,
+        rope_sizes,
+        theta=theta,
+        use_real=True,
+        theta_rescale_factor=theta_rescale_factor,
+    )
+    tables = (freqs_cos.to(device=device, dtype=dtype), freqs_sin.to(device=device, dtype=dtype))
+    _rope_table_cache[key] = tables
+    if len(_rope_table_cache) > ROPE_TABLE_CACHE_SIZE:
+        _rope_table_cache.popitem(last=False)
+    return tables
+
+
 def get_1d_rotary_pos_embed(
     dim: int,
     pos: Union[torch.FloatTensor, int],
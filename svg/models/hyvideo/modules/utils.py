@@ -14,11 +14,6 @@ from torch.nn.attention.flex_attention import (
 )
 
 
-@lru_cache
-def create_block_mask_cached(score_mod, B, H, M, N, device="cuda", _compile=False):
-    block_mask = create_block_mask(score_mod, B, H, M, N, device=device, _compile=_compile)
-    return block_mask
-
 def generate_temporal_head_mask_mod(context_length: int = 226, prompt_length: int = 226, num_frames: int = 13, token_per_frame: int = 1350, mul: int = 2):
     
     def round_to_multiple(idx):
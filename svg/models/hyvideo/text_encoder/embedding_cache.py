@@ -0,0 +1,119 @@
+"""Content-addressed cache of the prompt embeddings of the LLM and CLIP text encoders.
+
+The embedding of a text only depends on the encoder and on how the text is templated, tokenized and
+cropped, so every row is keyed by (encoder id, template, crop_start, max_length, hidden_state_skip_layer,
+text). Rows are kept in an in-memory LRU and, with a ``cache_dir``, in one safetensors file per row that
+is memory-mapped back by later runs. On a full hit the text encoder is not run at all, so an offloaded
+encoder is never moved onto the device.
+"""
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+
+def text_encoder_id(text_encoder, data_type):
+    """Everything the embedding of a text depends on, besides the text."""
+    template = text_encoder.prompt_template_video if data_type == "video" else text_encoder.prompt_template
+    return dict(
+        type=text_encoder.text_encoder_type,
+        path=str(text_encoder.model_path),
+        precision=text_encoder.precision,
+        template=template["template"] if template is not None else None,
+        crop_start=template.get("crop_start", -1) if template is not None else -1,
+        max_length=text_encoder.max_length,
+        hidden_state_skip_layer=text_encoder.hidden_state_skip_layer,
+        apply_final_norm=text_encoder.apply_final_norm,
+        output_key=text_encoder.output_key,
+        use_attention_mask=text_encoder.use_attention_mask,
+    )
+
+
+def embedding_cache_key(encoder_id, text):
+    return hashlib.sha256(json.dumps(dict(encoder_id, text=text), sort_keys=True).encode()).hexdigest()
+
+
+class PromptEmbeddingCache:
+    """Two-tier (LRU in memory, safetensors on disk) cache of per-text ``(hidden_state, attention_mask)`` rows.
+
+    Args:
+        max_entries (int): Number of rows kept in memory.
+        cache_dir (str): Directory of the on-disk tier, None to only cache in memory.
+    """
+
+    def __init__(self, max_entries=256, cache_dir=None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.safetensors")
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        if self.cache_dir is None or not os.path.exists(self.path(key)):
+            return None
+        with safe_open(self.path(key), framework="pt", device="cpu") as f:
+            entry = (f.get_tensor("hidden_state"), f.get_tensor("attention_mask") if "attention_mask" in f.keys() else None)
+        self.put_memory(key, entry)
+        return entry
+
+    def put_memory(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def put(self, key, hidden_state, attention_mask):
+        entry = (hidden_state.detach().cpu().clone(), None if attention_mask is None else attention_mask.detach().cpu().clone())
+        self.put_memory(key, entry)
+        if self.cache_dir is not None:
+            tensors = {"hidden_state": entry[0].contiguous()}
+            if entry[1] is not None:
+                tensors["attention_mask"] = entry[1].contiguous()
+            # Write to a private file first so that concurrent ranks never read a partial row
+            tmp_path = f"{self.path(key)}.{os.getpid()}.tmp"
+            save_file(tensors, tmp_path)
+            os.replace(tmp_path, self.path(key))
+        return entry
+
+    def encode(self, text_encoder, texts, data_type="image", device=None):
+        """``text_encoder.encode(text_encoder.text2tokens(texts))`` of the list ``texts``, as ``(hidden_state, attention_mask)``.
+
+        Only the texts that miss the cache are tokenized and encoded, in one batch.
+        """
+        encoder_id = text_encoder_id(text_encoder, data_type)
+        keys = [embedding_cache_key(encoder_id, text) for text in texts]
+        entries = [self.get(key) for key in keys]
+
+        # A text repeated in the batch, like the negative prompt of batched prompts, is encoded once
+        misses = list(dict.fromkeys(keys[i] for i, entry in enumerate(entries) if entry is None))
+        self.hits += len(texts) - len(misses)
+        self.misses += len(misses)
+        if misses:
+            miss_texts = [texts[keys.index(key)] for key in misses]
+            batch_encoding = text_encoder.text2tokens(miss_texts, data_type=data_type)
+            outputs = text_encoder.encode(batch_encoding, data_type=data_type, device=device)
+            encoded = {}
+            for row, key in enumerate(misses):
+                attention_mask = outputs.attention_mask[row] if outputs.attention_mask is not None else None
+                encoded[key] = self.put(key, outputs.hidden_state[row], attention_mask)
+            entries = [encoded[key] if entry is None else entry for key, entry in zip(keys, entries)]
+
+        hidden_state = torch.stack([entry[0] for entry in entries]).to(device)
+        attention_mask = None if entries[0][1] is None else torch.stack([entry[1] for entry in entries]).to(device)
+        return hidden_state, attention_mask
+
+    def summary(self):
+        return f"Prompt embedding cache: {self.hits} hits, {self.misses} misses, {len(self.entries)} rows in memory"
@@ -0,0 +1,172 @@
+"""Memory-mapped safetensors checkpoints.
+
+A ``.safetensors`` checkpoint is mapped copy-on-write and its tensors are views of the mapping, so nothing is
+read before a tensor is touched, and the workers of a node share the page cache of the file instead of each
+unpickling its own copy of the weights. ``load_checkpoint`` falls back to ``torch.load`` for the ``.pt``
+formats, and prefers a ``.safetensors`` conversion next to the ``.pt`` file when there is one.
+
+Convert the existing checkpoints once with::
+
+    python -m svg.models.hyvideo.utils.checkpoint ckpts/hunyuan-video-t2v-720p/transformers/mp_rank_00_model_states.pt
+"""
+
+import json
+import mmap
+import os
+import struct
+from collections.abc import Mapping
+
+import torch
+from loguru import logger
+from safetensors.torch import save_file
+
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "F8_E4M3": torch.float8_e4m3fn,
+    "F8_E5M2": torch.float8_e5m2,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def checkpoint_variant(path, suffix):
+    """``foo.pt`` -> ``foo{suffix}.pt``, for the ``_fp8`` weights and their ``_map`` scales."""
+    root, ext = os.path.splitext(str(path))
+    return f"{root}{suffix}{ext}"
+
+
+def safetensors_path(path):
+    """The conversion of a ``.pt`` checkpoint: ``foo.pt`` -> ``foo.safetensors``."""
+    return os.path.splitext(str(path))[0] + ".safetensors"
+
+
+def resolve_checkpoint(path):
+    """``path``, or its ``.safetensors`` conversion when there is one."""
+    path = str(path)
+    if not path.endswith(".safetensors") and os.path.exists(safetensors_path(path)):
+        return safetensors_path(path)
+    return path
+
+
+class MappedSafetensors(Mapping):
+    """Read-only state dict whose tensors are created on access, as zero-copy views of the mapped file.
+
+    The mapping is copy-on-write, so the views can be written to (e.g. by ``load_state_dict(assign=True)``
+    parameters) without changing the file, and the untouched pages stay shared with the other processes.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        with open(self.path, "rb") as f:
+            header_size = struct.unpack("<Q", f.read(8))[0]
+            header = json.loads(f.read(header_size))
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        self.metadata = header.pop("__metadata__", None)
+        self.entries = header
+        self.data_offset = 8 + header_size
+        self.buffer = torch.frombuffer(self.mmap, dtype=torch.uint8)
+
+    def __getitem__(self, key):
+        entry = self.entries[key]
+        dtype = SAFETENSORS_DTYPES[entry["dtype"]]
+        start, end = entry["data_offsets"]
+        data = self.buffer[self.data_offset + start:self.data_offset + end]
+        if (self.data_offset + start) % dtype.itemsize != 0:
+            # Misaligned for a view of its dtype, only this tensor is copied
+            data = data.clone()
+        return data.view(dtype).view(entry["shape"])
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def prefix(self, prefix):
+        """The tensors of a submodule, e.g. ``prefix("double_blocks.3.")``, with the prefix removed."""
+        return {key[len(prefix):]: self[key] for key in self.entries if key.startswith(prefix)}
+
+
+def unwrap_state_dict(state_dict, load_key=None):
+    """The tensors of a ``torch.load``-ed checkpoint: under ``load_key`` (e.g. the deepspeed ``module``) or ``state_dict``."""
+    if load_key is not None and load_key in state_dict:
+        return state_dict[load_key]
+    if "state_dict" in state_dict:
+        return state_dict["state_dict"]
+    return state_dict
+
+
+def torch_load(path):
+    """``torch.load`` on the CPU, memory-mapped for the zipfile format. The checkpoints also pickle their training args."""
+    try:
+        return torch.load(path, map_location="cpu", mmap=True, weights_only=False)
+    except RuntimeError:
+        # Legacy format, which cannot be mapped
+        return torch.load(path, map_location="cpu", weights_only=False)
+
+
+def load_checkpoint(path, load_key=None):
+    """State dict of a checkpoint. A ``.safetensors`` checkpoint (or conversion of ``path``) is memory-mapped."""
+    path = resolve_checkpoint(path)
+    if path.endswith(".safetensors"):
+        return MappedSafetensors(path)
+    return unwrap_state_dict(torch_load(path), load_key)
+
+
+def load_model_checkpoint(model, path, load_key=None, strict=True):
+    """Load a checkpoint into ``model``, which can be built on the meta device.
+
+    The memory-mapped tensors are assigned to the parameters as they are, only the ones whose dtype differs
+    from the model's are copied.
+    """
+    state_dict = load_checkpoint(path, load_key)
+    dtypes = {name: tensor.dtype for name, tensor in model.state_dict(keep_vars=True).items()}
+    model.load_state_dict(state_dict, strict=strict, assign=True)
+    for name, tensor in model.state_dict(keep_vars=True).items():
+        if name in dtypes and tensor.dtype != dtypes[name]:
+            tensor.data = tensor.data.to(dtypes[name])
+    return model
+
+
+def convert_to_safetensors(path, output_path=None, load_key=None):
+    """Convert a ``.pt`` checkpoint to ``.safetensors``, next to it by default. Non-tensor entries are dropped."""
+    output_path = output_path or safetensors_path(path)
+    state_dict = unwrap_state_dict(torch_load(path), load_key)
+    tensors, storages = {}, set()
+    for key, value in state_dict.items():
+        if not torch.is_tensor(value):
+            logger.warning(f"Dropping the non-tensor entry {key} of {path}")
+            continue
+        value = value.contiguous()
+        # safetensors does not store shared storages
+        storage = value.untyped_storage().data_ptr()
+        tensors[key] = value.clone() if storage in storages else value
+        storages.add(storage)
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    save_file(tensors, tmp_path)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert .pt checkpoints (DiT, VAE, fp8 scales) to memory-mapped .safetensors")
+    parser.add_argument("inputs", type=str, nargs="+", help=".pt checkpoints, each converted next to itself")
+    parser.add_argument("--load-key", type=str, default="module", help="Key of the weights in deepspeed checkpoints")
+    args = parser.parse_args()
+
+    for path in args.inputs:
+        logger.info(f"Converted {path} to {convert_to_safetensors(path, load_key=args.load_key)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from einops import rearrange
 
@@ -44,27 +46,76 @@ def safe_file(path):
     path.parent.mkdir(exist_ok=True, parents=True)
     return path
 
-def save_videos_grid(videos: torch.Tensor, path: str, rescale=False, n_rows=1, fps=24):
+def video_grid_frames(videos: torch.Tensor, rescale=False, n_rows=1, chunk_size=4):
+    """Yield the uint8 (h, w, c) grid frames of a video tensor, converted ``chunk_size`` frames at a time.
+
+    Args:
+        videos (torch.Tensor): [b, c, t, h, w] video tensor in [0, 1], or [-1, 1] with ``rescale``.
+        rescale (bool, optional): rescale the video tensor from [-1, 1] to [0, 1]. Defaults to False.
+        n_rows (int, optional): Defaults to 1.
+        chunk_size (int, optional): frames converted to uint8 together. Defaults to 4.
+    """
+    # The grid padding is 0 before the rescale
+    pad_value = 127 if rescale else 0
+    for start in range(0, videos.shape[2], chunk_size):
+        x = videos[:, :, start:start + chunk_size]
+        if rescale:
+            x = (x + 1.0) / 2.0  # -1,1 -> 0,1
+        # One float temporary per chunk
+        x = torch.clamp(x, 0, 1).mul_(255).to(torch.uint8)
+        for frame in rearrange(x, "b c t h w -> t b c h w"):
+            frame = torchvision.utils.make_grid(frame, nrow=n_rows, pad_value=pad_value)
+            yield np.ascontiguousarray(frame.permute(1, 2, 0).squeeze(-1).numpy())
+
+
+def save_videos_grid(videos: torch.Tensor, path: str, rescale=False, n_rows=1, fps=24, chunk_size=4):
     """save videos by video tensor
        copy from https://github.com/guoyww/AnimateDiff/blob/e92bd5671ba62c0d774a32951453e328018b7c5b/animatediff/utils/util.py#L61
 
+    The frames are converted and fed to the encoder ``chunk_size`` at a time, the whole video is never held as
+    float grids or as a list of frames.
+
     Args:
         videos (torch.Tensor): video tensor predicted by the model
         path (str): path to save video
         rescale (bool, optional): rescale the video tensor from [-1, 1] to  . Defaults to False.
         n_rows (int, optional): Defaults to 1.
         fps (int, optional): video save fps. Defaults to 8.
+        chunk_size (int, optional): frames converted to uint8 together. Defaults to 4.
     """
-    videos = rearrange(videos, "b c t h w -> t b c h w")
-    outputs = []
-    for x in videos:
-        x = torchvision.utils.make_grid(x, nrow=n_rows)
-        x = x.transpose(0, 1).transpose(1, 2).squeeze(-1)
-        if rescale:
-            x = (x + 1.0) / 2.0  # -1,1 -> 0,1
-        x = torch.clamp(x, 0, 1)
-        x = (x * 255).numpy().astype(np.uint8)
-        outputs.append(x)
+    save_video_stream([videos], path, rescale=rescale, n_rows=n_rows, fps=fps, chunk_size=chunk_size)
 
+
+def save_video_stream(chunks, path: str, rescale=False, n_rows=1, fps=24, chunk_size=4):
+    """Like ``save_videos_grid``, for a video that comes as consecutive [b, c, t, h, w] chunks of frames, e.g. from
+    a streaming VAE decode. Each chunk is encoded as soon as it comes.
+    """
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    imageio.mimsave(path, outputs, fps=fps)
+    with imageio.get_writer(path, fps=fps) as writer:
+        for videos in chunks:
+            for frame in video_grid_frames(videos, rescale=rescale, n_rows=n_rows, chunk_size=chunk_size):
+                writer.append_data(frame)
+
+
+class BackgroundVideoWriter:
+    """Runs ``save_videos_grid`` on a background thread, so that the next prompt is denoised while a video is encoded.
+
+    Args:
+        max_pending (int): videos submitted and not written yet. ``submit`` blocks beyond, so that the videos
+            waiting for the encoder never pile up in host memory.
+    """
+
+    def __init__(self, max_pending=2):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="video-writer")
+        self.slots = threading.Semaphore(max_pending)
+
+    def submit(self, videos, path, **kwargs):
+        """Queue ``save_videos_grid(videos, path, **kwargs)``. Returns its Future, whose result re-raises encoding errors."""
+        self.slots.acquire()
+        future = self.executor.submit(save_videos_grid, videos, path, **kwargs)
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def close(self):
+        """Wait for the videos still being written."""
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,243 @@
+"""Shared (prompt, loop_idx) job queue that the ranks pull leases from, instead of a static prompt shard per rank.
+
+A worker ``acquire``s the oldest task that is pending or whose lease expired, keeps the lease alive with
+``renew`` while it runs, and ``complete``s it. The tasks of a dead worker are re-issued once their lease
+expires. ``SQLiteJobQueue`` is the store shared by the ranks of a run, ``LocalJobQueue`` its in-process
+stand-in. Both take a ``clock`` so that the lease logic can be simulated.
+"""
+
+import contextlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+
+PENDING, LEASED, DONE = "pending", "leased", "done"
+
+
+def default_worker_name(rank):
+    return f"rank{rank}-{socket.gethostname()}-{os.getpid()}"
+
+
+class LocalJobQueue:
+    """In-process job queue with the same lease semantics as ``SQLiteJobQueue``.
+
+    Args:
+        lease_seconds (float): Time after which a task that was not renewed or completed is re-issued.
+        clock (callable): Current time in seconds.
+    """
+
+    def __init__(self, lease_seconds=600, clock=time.time):
+        self.lease_seconds = lease_seconds
+        self.clock = clock
+        self.lock = threading.Lock()
+        # (prompt, loop_idx) -> dict(state, worker, lease_expiry, attempts), in insertion order
+        self.tasks = {}
+
+    def add_tasks(self, tasks):
+        """Add the (prompt, loop_idx) tasks. Tasks already in the queue keep their state."""
+        with self.lock:
+            for task in tasks:
+                self.tasks.setdefault(tuple(task), dict(state=PENDING, worker=None, lease_expiry=None, attempts=0))
+
+    def acquire(self, worker):
+        """Lease the oldest pending or expired task to ``worker``. None if there is none right now."""
+        with self.lock:
+            now = self.clock()
+            for task, row in self.tasks.items():
+                if row["state"] == PENDING or (row["state"] == LEASED and row["lease_expiry"] < now):
+                    row.update(state=LEASED, worker=worker, lease_expiry=now + self.lease_seconds, attempts=row["attempts"] + 1)
+                    return task
+            return None
+
+    def renew(self, task, worker):
+        """Extend the lease of ``worker`` on ``task``. False if the lease was lost to another worker."""
+        with self.lock:
+            row = self.tasks[tuple(task)]
+            if row["state"] != LEASED or row["worker"] != worker:
+                return False
+            row["lease_expiry"] = self.clock() + self.lease_seconds
+            return True
+
+    def complete(self, task, worker):
+        """Mark ``task`` done. Returns whether ``worker`` still held the lease (the output is written either way)."""
+        with self.lock:
+            row = self.tasks[tuple(task)]
+            held = row["state"] == LEASED and row["worker"] == worker
+            row.update(state=DONE, worker=worker, lease_expiry=None)
+            return held
+
+    def release(self, task, worker):
+        """Give the lease of ``worker`` on ``task`` back, e.g. after a failure."""
+        with self.lock:
+            row = self.tasks[tuple(task)]
+            if row["state"] == LEASED and row["worker"] == worker:
+                row.update(state=PENDING, worker=None, lease_expiry=None)
+
+    def counts(self):
+        with self.lock:
+            counts = {PENDING: 0, LEASED: 0, DONE: 0}
+            for row in self.tasks.values():
+                counts[row["state"]] += 1
+            return counts
+
+    def is_finished(self):
+        return self.counts()[DONE] == len(self.tasks)
+
+
+class SQLiteJobQueue:
+    """Job queue in a SQLite file on the filesystem shared by the ranks.
+
+    Every operation is one ``BEGIN IMMEDIATE`` transaction, so concurrent workers never lease the same task.
+    The filesystem must support POSIX locks (local disks, Lustre, NFS with lockd).
+    """
+
+    def __init__(self, path, lease_seconds=600, clock=time.time, timeout=60):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.clock = clock
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        # The heartbeat thread shares the connection
+        self.lock = threading.Lock()
+        with self.transaction() as cursor:
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, prompt TEXT NOT NULL, loop_idx INTEGER NOT NULL, "
+                f"state TEXT NOT NULL DEFAULT '{PENDING}', worker TEXT, lease_expiry REAL, attempts INTEGER NOT NULL DEFAULT 0, "
+                "UNIQUE (prompt, loop_idx))"
+            )
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+
+    def add_tasks(self, tasks):
+        """Add the (prompt, loop_idx) tasks. Tasks already in the queue keep their state."""
+        with self.transaction() as cursor:
+            cursor.executemany("INSERT OR IGNORE INTO tasks (prompt, loop_idx) VALUES (?, ?)", [(p, int(i)) for p, i in tasks])
+
+    def acquire(self, worker):
+        """Lease the oldest pending or expired task to ``worker``. None if there is none right now."""
+        with self.transaction() as cursor:
+            now = self.clock()
+            row = cursor.execute(
+                "SELECT id, prompt, loop_idx FROM tasks WHERE state = ? OR (state = ? AND lease_expiry < ?) ORDER BY id LIMIT 1",
+                (PENDING, LEASED, now)
+            ).fetchone()
+            if row is None:
+                return None
+            cursor.execute(
+                "UPDATE tasks SET state = ?, worker = ?, lease_expiry = ?, attempts = attempts + 1 WHERE id = ?",
+                (LEASED, worker, now + self.lease_seconds, row[0])
+            )
+            return row[1], row[2]
+
+    def renew(self, task, worker):
+        """Extend the lease of ``worker`` on ``task``. False if the lease was lost to another worker."""
+        with self.transaction() as cursor:
+            cursor.execute(
+                "UPDATE tasks SET lease_expiry = ? WHERE prompt = ? AND loop_idx = ? AND state = ? AND worker = ?",
+                (self.clock() + self.lease_seconds, task[0], int(task[1]), LEASED, worker)
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, task, worker):
+        """Mark ``task`` done. Returns whether ``worker`` still held the lease (the output is written either way)."""
+        with self.transaction() as cursor:
+            held = cursor.execute(
+                "SELECT COUNT(*) FROM tasks WHERE prompt = ? AND loop_idx = ? AND state = ? AND worker = ?",
+                (task[0], int(task[1]), LEASED, worker)
+            ).fetchone()[0] == 1
+            cursor.execute(
+                "UPDATE tasks SET state = ?, worker = ?, lease_expiry = NULL WHERE prompt = ? AND loop_idx = ?",
+                (DONE, worker, task[0], int(task[1]))
+            )
+            return held
+
+    def release(self, task, worker):
+        """Give the lease of ``worker`` on ``task`` back, e.g. after a failure."""
+        with self.transaction() as cursor:
+            cursor.execute(
+                "UPDATE tasks SET state = ?, worker = NULL, lease_expiry = NULL WHERE prompt = ? AND loop_idx = ? AND state = ? AND worker = ?",
+                (PENDING, task[0], int(task[1]), LEASED, worker)
+            )
+
+    def counts(self):
+        with self.transaction() as cursor:
+            counts = {PENDING: 0, LEASED: 0, DONE: 0}
+            counts.update(cursor.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+            return counts
+
+    def is_finished(self):
+        counts = self.counts()
+        return counts[PENDING] == 0 and counts[LEASED] == 0
+
+    def close(self):
+        self.connection.close()
+
+
+class LeaseHeartbeat:
+    """Renews the leases of ``worker`` on ``tasks`` every ``interval`` seconds in a daemon thread while they run."""
+
+    def __init__(self, queue, tasks, worker, interval=None):
+        self.queue, self.tasks, self.worker = queue, tasks, worker
+        self.interval = queue.lease_seconds / 3 if interval is None else interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            for task in self.tasks:
+                if not self.queue.renew(task, self.worker):
+                    print(f"{self.worker} lost the lease of {task}")
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.stopped.set()
+        self.thread.join()
+
+
+def run_worker(queue, worker, task_func, batch_size=1, poll_interval=30, sleep=time.sleep):
+    """Pull up to ``batch_size`` tasks at a time from ``queue`` and run ``task_func(prompts, loop_idxs)`` until every task is done.
+
+    While the remaining tasks are leased to other workers, polls every ``poll_interval`` seconds,
+    so that the tasks of a worker that dies are picked up once their lease expires.
+    """
+    num_done = 0
+    while True:
+        tasks = []
+        while len(tasks) < batch_size:
+            task = queue.acquire(worker)
+            if task is None:
+                break
+            tasks.append(task)
+        if not tasks:
+            if queue.is_finished():
+                return num_done
+            sleep(poll_interval)
+            continue
+
+        try:
+            with LeaseHeartbeat(queue, tasks, worker):
+                task_func(*[list(column) for column in zip(*tasks)])
+        except BaseException:
+            for task in tasks:
+                queue.release(task, worker)
+            raise
+        for task in tasks:
+            queue.complete(task, worker)
+        num_done += len(tasks)
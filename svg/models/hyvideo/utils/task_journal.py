@@ -0,0 +1,116 @@
+"""Append-only journal of the completed (prompt, loop_idx) tasks of an inference run.
+
+Every rank appends one JSON line per completed task to ``journal_{rank}.jsonl`` and fsyncs in batches.
+Resuming reads all the journals of the checkpoint directory in one pass, whatever the world size of the
+previous runs, and ``compact_journals`` folds them into ``journal_base.jsonl``. The timestamped
+``task_list_*_{rank}.json`` checkpoints of older runs are still read.
+"""
+
+import glob
+import json
+import os
+import re
+import time
+
+
+BASE_JOURNAL = "journal_base.jsonl"
+
+
+class TaskJournal:
+    """Per-rank journal, fsynced every ``fsync_every`` tasks or ``fsync_interval`` seconds, whichever comes first.
+
+    A crash loses at most the tasks of the last batch, which are then generated again.
+    """
+
+    def __init__(self, checkpoint_dir, rank, fsync_every=16, fsync_interval=60.0):
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self.path = os.path.join(checkpoint_dir, f"journal_{rank}.jsonl")
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.num_unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def append(self, prompt, loop_idx):
+        self.file.write(json.dumps({"prompt": prompt, "loop_idx": int(loop_idx)}, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.num_unsynced += 1
+        if self.num_unsynced >= self.fsync_every or time.monotonic() - self.last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        if self.num_unsynced > 0:
+            os.fsync(self.file.fileno())
+            self.num_unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+
+def read_journal(path, completed):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                task = json.loads(line)
+            except json.JSONDecodeError:
+                # Last line of a rank that died while writing it
+                continue
+            completed.add((task["prompt"], task["loop_idx"]))
+
+
+def journal_paths(checkpoint_dir):
+    return sorted(glob.glob(os.path.join(checkpoint_dir, "journal_*.jsonl")))
+
+
+def legacy_checkpoint_paths(checkpoint_dir):
+    """Newest ``task_list_{timestamp}_{rank}.json`` of every rank."""
+    newest = {}
+    for path in glob.glob(os.path.join(checkpoint_dir, "task_list_*_*.json")):
+        match = re.search(r"task_list_(\d{8}_\d{6})_(\d+)\.json$", path)
+        if match is None:
+            continue
+        timestamp, rank = match.group(1), int(match.group(2))
+        if rank not in newest or timestamp > newest[rank][0]:
+            newest[rank] = (timestamp, path)
+    return [path for _, path in newest.values()]
+
+
+def load_completed_tasks(checkpoint_dir):
+    """Set of the (prompt, loop_idx) tasks completed by any rank of any previous run."""
+    completed = set()
+    for path in legacy_checkpoint_paths(checkpoint_dir):
+        with open(path, "r") as f:
+            task_list = json.load(f)
+        completed.update((prompt, int(loop_idx)) for prompt, loop_idxs in task_list.items() for loop_idx, is_done in loop_idxs.items() if is_done)
+    for path in journal_paths(checkpoint_dir):
+        read_journal(path, completed)
+    return completed
+
+
+def compact_journals(checkpoint_dir):
+    """Fold all the journals into ``journal_base.jsonl`` with one line per task. Returns the number of tasks.
+
+    Must not run while a rank appends to its journal. The base journal is replaced atomically before the
+    rank journals are removed, so a crash in between only leaves duplicates.
+    """
+    paths = journal_paths(checkpoint_dir)
+    completed = set()
+    for path in paths:
+        read_journal(path, completed)
+
+    base_path = os.path.join(checkpoint_dir, BASE_JOURNAL)
+    tmp_path = base_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for prompt, loop_idx in sorted(completed):
+            f.write(json.dumps({"prompt": prompt, "loop_idx": loop_idx}, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, base_path)
+
+    for path in paths:
+        if os.path.basename(path) != BASE_JOURNAL:
+            os.remove(path)
+    return len(completed)
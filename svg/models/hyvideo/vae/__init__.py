@@ -4,6 +4,7 @@ import torch
 
 from .autoencoder_kl_causal_3d import AutoencoderKLCausal3D
 from ..constants import VAE_PATH, PRECISION_TO_TYPE
+from ..utils.checkpoint import load_checkpoint, resolve_checkpoint
 
 def load_vae(vae_type: str="884-16c-hy",
              vae_precision: str=None,
@@ -33,10 +34,11 @@ def load_vae(vae_type: str="884-16c-hy",
     else:
         vae = AutoencoderKLCausal3D.from_config(config)
     
-    vae_ckpt = Path(vae_path) / "pytorch_model.pt"
+    # pytorch_model.safetensors when it was converted, memory-mapped
+    vae_ckpt = Path(resolve_checkpoint(Path(vae_path) / "pytorch_model.pt"))
     assert vae_ckpt.exists(), f"VAE checkpoint not found: {vae_ckpt}"
     
-    ckpt = torch.load(vae_ckpt, map_location=vae.device)
+    ckpt = load_checkpoint(vae_ckpt)
     if "state_dict" in ckpt:
         ckpt = ckpt["state_dict"]
     if any(k.startswith("vae.") for k in ckpt.keys()):
@@ -16,6 +16,7 @@
 # Modified from diffusers==0.29.2
 #
 # ==============================================================================
+import os
 from typing import Dict, Optional, Tuple, Union
 from dataclasses import dataclass
 
@@ -42,6 +43,8 @@ from diffusers.models.attention_processor import (
 from diffusers.models.modeling_outputs import AutoencoderKLOutput
 from diffusers.models.modeling_utils import ModelMixin
 from .vae import DecoderCausal3D, BaseOutput, DecoderOutput, DiagonalGaussianDistribution, EncoderCausal3D
+from .tiled_decode import TiledDecoder
+from .streaming_decode import StreamingDecoder
 
 
 @dataclass
@@ -117,6 +120,8 @@ class AutoencoderKLCausal3D(ModelMixin, ConfigMixin, FromOriginalVAEMixin):
         self.use_slicing = False
         self.use_spatial_tiling = False
         self.use_temporal_tiling = False
+        self.use_streaming_decode = False
+        self.stream_chunk_size = 4
 
         # only relevant if vae tiling is enabled
         self.tile_sample_min_tsize = sample_tsize
@@ -130,6 +135,9 @@ class AutoencoderKLCausal3D(ModelMixin, ConfigMixin, FromOriginalVAEMixin):
         )
         self.tile_latent_min_size = int(sample_size / (2 ** (len(self.config.block_out_channels) - 1)))
         self.tile_overlap_factor = 0.25
+        # Same-shape tiles decoded in one decoder call, and the threads decoding them when the VAE runs on the CPU
+        self.tile_batch_size = 1
+        self.tile_num_workers = min(4, os.cpu_count() or 1)
 
     def _set_gradient_checkpointing(self, module, value=False):
         if isinstance(module, (EncoderCausal3D, DecoderCausal3D)):
@@ -164,6 +172,17 @@ class AutoencoderKLCausal3D(ModelMixin, ConfigMixin, FromOriginalVAEMixin):
         self.disable_spatial_tiling()
         self.disable_temporal_tiling()
 
+    def enable_streaming_decode(self, chunk_size: int = 4):
+        r"""
+        Decode videos in time chunks of `chunk_size` latent frames, every causal layer carrying its state to the next
+        chunk, instead of the overlapping temporal tiles. Spatial tiling still applies within the chunks.
+        """
+        self.use_streaming_decode = True
+        self.stream_chunk_size = chunk_size
+
+    def disable_streaming_decode(self):
+        self.use_streaming_decode = False
+
     def enable_slicing(self):
         r"""
         Enable sliced VAE decoding. When this option is enabled, the VAE will split the input tensor in slices to
@@ -297,6 +316,12 @@ class AutoencoderKLCausal3D(ModelMixin, ConfigMixin, FromOriginalVAEMixin):
     def _decode(self, z: torch.FloatTensor, return_dict: bool = True) -> Union[DecoderOutput, torch.FloatTensor]:
         assert len(z.shape) == 5, "The input tensor should have 5 dimensions."
 
+        if self.use_streaming_decode and z.shape[2] > self.stream_chunk_size:
+            dec = torch.cat(list(self.stream_decode(z)), dim=2)
+            if not return_dict:
+                return (dec,)
+            return DecoderOutput(sample=dec)
+
         if self.use_temporal_tiling and z.shape[2] > self.tile_latent_min_tsize:
             return self.temporal_tiled_decode(z, return_dict=return_dict)
 
@@ -340,22 +365,40 @@ class AutoencoderKLCausal3D(ModelMixin, ConfigMixin, FromOriginalVAEMixin):
 
         return DecoderOutput(sample=decoded)
 
+    @staticmethod
+    def blend_weight(blend_extent: int, like: torch.Tensor) -> torch.Tensor:
+        # y / blend_extent for y < blend_extent, the weight of b in the blends
+        return (torch.arange(blend_extent, dtype=torch.float64) / blend_extent).to(like)
+
+    def stream_decode(self, z: torch.FloatTensor):
+        r"""
+        Yield the decoded frames of `z`, `stream_chunk_size` latent frames at a time. Every latent frame is decoded
+        once, see [`StreamingDecoder`].
+        """
+        return StreamingDecoder(self, chunk_size=self.stream_chunk_size).frames(z)
+
     def blend_v(self, a: torch.Tensor, b: torch.Tensor, blend_extent: int) -> torch.Tensor:
         blend_extent = min(a.shape[-2], b.shape[-2], blend_extent)
-        for y in range(blend_extent):
-            b[:, :, :, y, :] = a[:, :, :, -blend_extent + y, :] * (1 - y / blend_extent) + b[:, :, :, y, :] * (y / blend_extent)
+        if blend_extent <= 0:
+            return b
+        weight = self.blend_weight(blend_extent, b)[:, None]
+        b[:, :, :, :blend_extent, :] = a[:, :, :, -blend_extent:, :] * (1 - weight) + b[:, :, :, :blend_extent, :] * weight
         return b
 
     def blend_h(self, a: torch.Tensor, b: torch.Tensor, blend_extent: int) -> torch.Tensor:
         blend_extent = min(a.shape[-1], b.shape[-1], blend_extent)
-        for x in range(blend_extent):
-            b[:, :, :, :, x] = a[:, :, :, :, -blend_extent + x] * (1 - x / blend_extent) + b[:, :, :, :, x] * (x / blend_extent)
+        if blend_extent <= 0:
+            return b
+        weight = self.blend_weight(blend_extent, b)
+        b[:, :, :, :, :blend_extent] = a[:, :, :, :, -blend_extent:] * (1 - weight) + b[:, :, :, :, :blend_extent] * weight
         return b
 
     def blend_t(self, a: torch.Tensor, b: torch.Tensor, blend_extent: int) -> torch.Tensor:
         blend_extent = min(a.shape[-3], b.shape[-3], blend_extent)
-        for x in range(blend_extent):
-            b[:, :, x, :, :] = a[:, :, -blend_extent + x, :, :] * (1 - x / blend_extent) + b[:, :, x, :, :] * (x / blend_extent)
+        if blend_extent <= 0:
+            return b
+        weight = self.blend_weight(blend_extent, b)[:, None, None]
+        b[:, :, :blend_extent, :, :] = a[:, :, -blend_extent:, :, :] * (1 - weight) + b[:, :, :blend_extent, :, :] * weight
         return b
 
     def spatial_tiled_encode(self, x: torch.FloatTensor, return_dict: bool = True, return_moments: bool = False) -> AutoencoderKLOutput:
@@ -414,6 +457,9 @@ class AutoencoderKLCausal3D(ModelMixin, ConfigMixin, FromOriginalVAEMixin):
 
         return AutoencoderKLOutput(latent_dist=posterior)
 
+    def tiled_decoder(self) -> TiledDecoder:
+        return TiledDecoder(self, tile_batch_size=self.tile_batch_size, num_workers=self.tile_num_workers)
+
     def spatial_tiled_decode(self, z: torch.FloatTensor, return_dict: bool = True) -> Union[DecoderOutput, torch.FloatTensor]:
         r"""
         Decode a batch of images/videos using a tiled decoder.
@@ -428,35 +474,8 @@ class AutoencoderKLCausal3D(ModelMixin, ConfigMixin, FromOriginalVAEMixin):
                 If return_dict is True, a [`~models.vae.DecoderOutput`] is returned, otherwise a plain `tuple` is
                 returned.
         """
-        overlap_size = int(self.tile_latent_min_size * (1 - self.tile_overlap_factor))
-        blend_extent = int(self.tile_sample_min_size * self.tile_overlap_factor)
-        row_limit = self.tile_sample_min_size - blend_extent
-
-        # Split z into overlapping tiles and decode them separately.
-        # The tiles have an overlap to avoid seams between tiles.
-        rows = []
-        for i in range(0, z.shape[-2], overlap_size):
-            row = []
-            for j in range(0, z.shape[-1], overlap_size):
-                tile = z[:, :, :, i: i + self.tile_latent_min_size, j: j + self.tile_latent_min_size]
-                tile = self.post_quant_conv(tile)
-                decoded = self.decoder(tile)
-                row.append(decoded)
-            rows.append(row)
-        result_rows = []
-        for i, row in enumerate(rows):
-            result_row = []
-            for j, tile in enumerate(row):
-                # blend the above tile and the left tile
-                # to the current tile and add the current tile to the result row
-                if i > 0:
-                    tile = self.blend_v(rows[i - 1][j], tile, blend_extent)
-                if j > 0:
-                    tile = self.blend_h(row[j - 1], tile, blend_extent)
-                result_row.append(tile[:, :, :, :row_limit, :row_limit])
-            result_rows.append(torch.cat(result_row, dim=-1))
-
-        dec = torch.cat(result_rows, dim=-2)
+        # Batched tiles, blended row by row into the output
+        dec = self.tiled_decoder().spatial_decode(z)
         if not return_dict:
             return (dec,)
 
@@ -498,33 +517,9 @@ class AutoencoderKLCausal3D(ModelMixin, ConfigMixin, FromOriginalVAEMixin):
         return AutoencoderKLOutput(latent_dist=posterior)
 
     def temporal_tiled_decode(self, z: torch.FloatTensor, return_dict: bool = True) -> Union[DecoderOutput, torch.FloatTensor]:
-        # Split z into overlapping tiles and decode them separately.
-
-        B, C, T, H, W = z.shape
-        overlap_size = int(self.tile_latent_min_tsize * (1 - self.tile_overlap_factor))
-        blend_extent = int(self.tile_sample_min_tsize * self.tile_overlap_factor)
-        t_limit = self.tile_sample_min_tsize - blend_extent
-
-        row = []
-        for i in range(0, T, overlap_size):
-            tile = z[:, :, i: i + self.tile_latent_min_tsize + 1, :, :]
-            if self.use_spatial_tiling and (tile.shape[-1] > self.tile_latent_min_size or tile.shape[-2] > self.tile_latent_min_size):
-                decoded = self.spatial_tiled_decode(tile, return_dict=True).sample
-            else:
-                tile = self.post_quant_conv(tile)
-                decoded = self.decoder(tile)
-            if i > 0:
-                decoded = decoded[:, :, 1:, :, :]
-            row.append(decoded)
-        result_row = []
-        for i, tile in enumerate(row):
-            if i > 0:
-                tile = self.blend_t(row[i - 1], tile, blend_extent)
-                result_row.append(tile[:, :, :t_limit, :, :])
-            else:
-                result_row.append(tile[:, :, :t_limit + 1, :, :])
-
-        dec = torch.cat(result_row, dim=2)
+        # Split z into overlapping tiles and decode them separately, the chunks are blended into the output as
+        # they are decoded
+        dec = self.tiled_decoder().temporal_decode(z)
         if not return_dict:
             return (dec,)
 
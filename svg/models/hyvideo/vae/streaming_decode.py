@@ -0,0 +1,216 @@
+"""Streaming decode of AutoencoderKLCausal3D latents, ``chunk_size`` latent frames at a time.
+
+The decoder is causal in time, so instead of decoding overlapping temporal tiles from a cold start and blending
+them, the chunks carry what the causal layers need from the previous ones:
+
+* every ``CausalConv3d`` keeps the last ``kernel_size - 1`` frames of its padded input, which replace the
+  replicated first frame it pads the next chunk with,
+* the time upsamplers only treat the very first frame apart (it is not repeated in time),
+* the causal attention of the mid block keeps the keys and values of the previous frames.
+
+Every latent frame is decoded once and the frames come out chunk by chunk. With spatial tiling, every tile
+carries its own state and the tiles of a chunk are blended like ``TiledDecoder.spatial_decode``.
+
+The GroupNorms normalize over all the frames of the video, which a stream does not have yet. They use the
+statistics of the frames decoded so far (``norm_stats="running"``, so that the first chunk matches a full
+decode of its frames), of the chunk alone (``"chunk"``, like the temporal tiles), or given per-norm
+``(mean, var)`` of shape (batch, groups), e.g. recorded during a full decode, with which the stream matches it.
+"""
+
+import contextlib
+import functools
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from einops import rearrange
+
+from .tiled_decode import TiledDecoder
+from .unet_causal_3d_blocks import CausalConv3d, UNetMidBlockCausal3D, UpsampleCausal3D
+
+
+class StreamState:
+    """What the causal layers of the decoder carry from a chunk to the next, for one tile."""
+
+    def __init__(self):
+        # CausalConv3d: the last frames of its padded input
+        self.conv_frames = {}
+        # UpsampleCausal3D that had the first frame
+        self.started = set()
+        # GroupNorm: (count, mean, sum of squared deviations) per group of the frames so far
+        self.norm_moments = {}
+        # Attention: keys and values of the frames so far
+        self.attention_kv = {}
+
+
+class StreamingDecoder(TiledDecoder):
+    """Decodes the latents of ``vae`` chunk by chunk of latent frames.
+
+    Args:
+        vae (AutoencoderKLCausal3D): Its spatial tiling settings are used for the chunks.
+        chunk_size (int): Latent frames decoded together. The first chunk gives ``1 + 4 * (chunk_size - 1)`` frames
+            with the 884 VAE, the next ones ``4 * chunk_size``.
+        norm_stats (str or dict): "running", "chunk", or {GroupNorm: (mean, var)}, see the module docstring.
+    """
+
+    def __init__(self, vae, chunk_size=4, norm_stats="running"):
+        super().__init__(vae)
+        self.chunk_size = chunk_size
+        self.norm_stats = norm_stats
+        self.states = {}
+        self.state = None
+        self.tile_idx = 0
+
+    def frames(self, z):
+        """Yield the decoded frames of ``z`` (b, c, t, h, w), chunk by chunk in order."""
+        self.states = {}
+        try:
+            for start in range(0, z.shape[2], self.chunk_size):
+                chunk = z[:, :, start:start + self.chunk_size]
+                # The forwards are only replaced while a chunk decodes, not while the caller has the frames
+                with self.streaming():
+                    self.tile_idx = 0
+                    if self.vae.use_spatial_tiling and (
+                        chunk.shape[-1] > self.vae.tile_latent_min_size or chunk.shape[-2] > self.vae.tile_latent_min_size
+                    ):
+                        decoded = self.spatial_decode(chunk)
+                    else:
+                        decoded = self.decode_tiles([chunk])[0]
+                yield decoded
+        finally:
+            self.states = {}
+            self.state = None
+
+    def decode(self, z):
+        return torch.cat(list(self.frames(z)), dim=2)
+
+    def decode_tiles(self, tiles):
+        # The tiles of every chunk come in the same order, each one with the state of its predecessors
+        decoded = []
+        for tile in tiles:
+            self.state = self.states.setdefault(self.tile_idx, StreamState())
+            self.tile_idx += 1
+            decoded.append(self.vae.decoder(self.vae.post_quant_conv(tile)))
+        return decoded
+
+    @contextlib.contextmanager
+    def streaming(self):
+        replaced = []
+        for module in self.vae.decoder.modules():
+            if isinstance(module, CausalConv3d):
+                forward = self.conv_forward
+            elif isinstance(module, UpsampleCausal3D):
+                forward = self.upsample_forward
+            elif isinstance(module, nn.GroupNorm):
+                forward = self.group_norm_forward
+            elif isinstance(module, UNetMidBlockCausal3D):
+                forward = self.mid_block_forward
+            else:
+                continue
+            module.forward = functools.partial(forward, module)
+            replaced.append(module)
+        try:
+            yield
+        finally:
+            for module in replaced:
+                del module.forward
+
+    def conv_forward(self, conv, x):
+        num_frames = conv.time_causal_padding[4]
+        if num_frames == 0:
+            return conv.conv(F.pad(x, conv.time_causal_padding, mode=conv.pad_mode))
+        previous = self.state.conv_frames.get(conv)
+        if previous is None:
+            x = F.pad(x, conv.time_causal_padding, mode=conv.pad_mode)
+        else:
+            # The padding in time is the end of the previous chunk
+            x = torch.cat([previous, F.pad(x, conv.time_causal_padding[:4] + (0, 0), mode=conv.pad_mode)], dim=2)
+        self.state.conv_frames[conv] = x[:, :, -num_frames:].clone()
+        return conv.conv(x)
+
+    def upsample_forward(self, upsample, hidden_states, output_size=None, scale=1.0):
+        if upsample not in self.state.started:
+            self.state.started.add(upsample)
+            return UpsampleCausal3D.forward(upsample, hidden_states, output_size=output_size, scale=scale)
+
+        # The first frame was in a previous chunk, every frame is upsampled in time
+        dtype = hidden_states.dtype
+        if dtype == torch.bfloat16:
+            hidden_states = hidden_states.to(torch.float32)
+        hidden_states = F.interpolate(hidden_states, scale_factor=upsample.upsample_factor, mode="nearest")
+        if dtype == torch.bfloat16:
+            hidden_states = hidden_states.to(dtype)
+        if upsample.use_conv:
+            conv = upsample.conv if upsample.name == "conv" else upsample.Conv2d_0
+            hidden_states = conv(hidden_states)
+        return hidden_states
+
+    def group_norm_forward(self, norm, x):
+        batch_size = x.shape[0]
+        groups = x.reshape(batch_size, norm.num_groups, -1).float()
+        if isinstance(self.norm_stats, dict):
+            mean, var = self.norm_stats[norm]
+        else:
+            var, mean = torch.var_mean(groups, dim=-1, unbiased=False)
+            if self.norm_stats == "running":
+                mean, var = self.running_moments(norm, groups.shape[-1], mean, var)
+        groups = (groups - mean[..., None].float()) * torch.rsqrt(var[..., None].float() + norm.eps)
+        x_norm = groups.view(x.shape)
+        if norm.affine:
+            shape = (1, -1) + (1,) * (x.dim() - 2)
+            x_norm = x_norm * norm.weight.view(shape) + norm.bias.view(shape)
+        return x_norm.to(x.dtype)
+
+    def running_moments(self, norm, count, mean, var):
+        # Merged with the moments of the previous chunks (Chan et al.), in float64
+        mean, m2 = mean.double(), var.double() * count
+        if norm in self.state.norm_moments:
+            previous_count, previous_mean, previous_m2 = self.state.norm_moments[norm]
+            total = previous_count + count
+            delta = mean - previous_mean
+            mean = previous_mean + delta * (count / total)
+            m2 = previous_m2 + m2 + delta ** 2 * (previous_count * count / total)
+            count = total
+        self.state.norm_moments[norm] = (count, mean, m2)
+        return mean, m2 / count
+
+    def mid_block_forward(self, mid_block, hidden_states, temb=None):
+        hidden_states = mid_block.resnets[0](hidden_states, temb)
+        for attn, resnet in zip(mid_block.attentions, mid_block.resnets[1:]):
+            if attn is not None:
+                hidden_states = self.attention(attn, hidden_states)
+            hidden_states = resnet(hidden_states, temb)
+        return hidden_states
+
+    def attention(self, attn, hidden_states):
+        # The processor of the mid block attention, with the keys and values of the previous chunks in front
+        B, C, T, H, W = hidden_states.shape
+        residual = rearrange(hidden_states, "b c f h w -> b (f h w) c")
+        hidden_states = residual
+        if attn.group_norm is not None:
+            hidden_states = attn.group_norm(hidden_states.transpose(1, 2)).transpose(1, 2)
+
+        head_dim = attn.to_q.out_features // attn.heads
+        query, key, value = (
+            projection(hidden_states).view(B, -1, attn.heads, head_dim).transpose(1, 2)
+            for projection in (attn.to_q, attn.to_k, attn.to_v)
+        )
+        if attn in self.state.attention_kv:
+            previous_key, previous_value = self.state.attention_kv[attn]
+            key = torch.cat([previous_key, key], dim=2)
+            value = torch.cat([previous_value, value], dim=2)
+        self.state.attention_kv[attn] = (key, value)
+
+        # A frame attends to itself and to the frames before it, those of the previous chunks included
+        num_previous = key.shape[2] // (H * W) - T
+        key_frames = torch.arange(num_previous + T, device=query.device).repeat_interleave(H * W)
+        query_frames = key_frames[num_previous * H * W:]
+        attention_mask = key_frames[None, :] <= query_frames[:, None]
+
+        hidden_states = F.scaled_dot_product_attention(query, key, value, attn_mask=attention_mask)
+        hidden_states = hidden_states.transpose(1, 2).reshape(B, -1, attn.heads * head_dim).to(query.dtype)
+        hidden_states = attn.to_out[1](attn.to_out[0](hidden_states))
+        if attn.residual_connection:
+            hidden_states = hidden_states + residual
+        hidden_states = hidden_states / attn.rescale_output_factor
+        return rearrange(hidden_states, "b (f h w) c -> b c f h w", f=T, h=H, w=W)
@@ -0,0 +1,141 @@
+"""Tiled decoding of AutoencoderKLCausal3D latents.
+
+The tiles of a row that have the same shape go through the decoder together, ``tile_batch_size`` at a time, and
+on the CPU the batches of a row are spread over a thread pool. The rows are blended as they are decoded and
+copied into the preallocated output. Of the previous row of tiles (the previous temporal chunk for the temporal
+tiling) only the bottom (last) ``blend_extent`` lines the next one is blended with are kept, instead of every
+decoded tile.
+
+The tiles, the overlaps and the blending are those of the former loops of ``spatial_tiled_decode`` and
+``temporal_tiled_decode``.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+
+class TiledDecoder:
+    """Decodes the latents of ``vae`` in overlapping tiles.
+
+    Args:
+        vae (AutoencoderKLCausal3D): The tile sizes and the overlap factor are read from it.
+        tile_batch_size (int): Same-shape tiles decoded in one decoder call.
+        num_workers (int): Threads decoding the batches of a row when the latents are on the CPU, 1 decodes them
+            in the calling thread. They are never used on the GPU, where a batch already fills the device.
+    """
+
+    def __init__(self, vae, tile_batch_size=1, num_workers=1):
+        self.vae = vae
+        self.tile_batch_size = tile_batch_size
+        self.num_workers = num_workers
+
+    def decode_batch(self, tiles):
+        batch_size = tiles[0].shape[0]
+        z = torch.cat(tiles) if len(tiles) > 1 else tiles[0]
+        return self.vae.decoder(self.vae.post_quant_conv(z)).split(batch_size)
+
+    def decode_tiles(self, tiles):
+        """The decoded ``tiles``, in order."""
+        groups = {}
+        for tile_idx, tile in enumerate(tiles):
+            groups.setdefault(tuple(tile.shape), []).append(tile_idx)
+        batches = [
+            tile_idxs[start:start + self.tile_batch_size]
+            for tile_idxs in groups.values()
+            for start in range(0, len(tile_idxs), self.tile_batch_size)
+        ]
+
+        if self.num_workers > 1 and len(batches) > 1 and tiles[0].device.type == "cpu":
+            # The grad mode is thread-local, the workers decode in the one of the caller
+            grad_enabled = torch.is_grad_enabled()
+
+            def decode(tile_idxs):
+                with torch.set_grad_enabled(grad_enabled):
+                    return self.decode_batch([tiles[tile_idx] for tile_idx in tile_idxs])
+
+            with ThreadPoolExecutor(min(self.num_workers, len(batches)), thread_name_prefix="vae-tile") as pool:
+                outputs = list(pool.map(decode, batches))
+        else:
+            outputs = [self.decode_batch([tiles[tile_idx] for tile_idx in tile_idxs]) for tile_idxs in batches]
+
+        decoded = [None] * len(tiles)
+        for tile_idxs, batch_outputs in zip(batches, outputs):
+            for tile_idx, output in zip(tile_idxs, batch_outputs):
+                decoded[tile_idx] = output
+        return decoded
+
+    def spatial_decode(self, z):
+        vae = self.vae
+        overlap_size = int(vae.tile_latent_min_size * (1 - vae.tile_overlap_factor))
+        blend_extent = int(vae.tile_sample_min_size * vae.tile_overlap_factor)
+        row_limit = vae.tile_sample_min_size - blend_extent
+        ratio = vae.tile_sample_min_size // vae.tile_latent_min_size
+
+        def output_size(size):
+            # Rows (columns) are cropped to row_limit, the last ones are shorter
+            return sum(
+                min(row_limit, ratio * min(vae.tile_latent_min_size, size - start))
+                for start in range(0, size, overlap_size)
+            )
+
+        dec = None
+        # The bottom lines of the tiles of the row above
+        previous_row = None
+        y = 0
+        for i in range(0, z.shape[-2], overlap_size):
+            row = self.decode_tiles([
+                z[:, :, :, i: i + vae.tile_latent_min_size, j: j + vae.tile_latent_min_size]
+                for j in range(0, z.shape[-1], overlap_size)
+            ])
+            if dec is None:
+                dec = row[0].new_empty(*row[0].shape[:3], output_size(z.shape[-2]), output_size(z.shape[-1]))
+            x = 0
+            for j, tile in enumerate(row):
+                # blend the above tile and the left tile to the current tile, in place like the former loops
+                if previous_row is not None:
+                    tile = vae.blend_v(previous_row[j], tile, blend_extent)
+                if j > 0:
+                    tile = vae.blend_h(row[j - 1], tile, blend_extent)
+                tile = tile[:, :, :, :row_limit, :row_limit]
+                dec[:, :, :, y: y + tile.shape[-2], x: x + tile.shape[-1]] = tile
+                x += tile.shape[-1]
+            y += tile.shape[-2]
+            previous_row = [tile[:, :, :, -blend_extent:, :].clone() for tile in row]
+        return dec
+
+    def temporal_decode(self, z):
+        vae = self.vae
+        T = z.shape[2]
+        overlap_size = int(vae.tile_latent_min_tsize * (1 - vae.tile_overlap_factor))
+        blend_extent = int(vae.tile_sample_min_tsize * vae.tile_overlap_factor)
+        t_limit = vae.tile_sample_min_tsize - blend_extent
+        ratio = vae.tile_sample_min_tsize // vae.tile_latent_min_tsize
+
+        # The first chunk keeps its first frame, the others drop it
+        num_frames = sum(
+            min(t_limit + (i == 0), ratio * (min(vae.tile_latent_min_tsize + 1, T - i) - 1) + (i == 0))
+            for i in range(0, T, overlap_size)
+        )
+
+        dec = None
+        # The last frames of the previous chunk
+        previous = None
+        t = 0
+        for i in range(0, T, overlap_size):
+            tile = z[:, :, i: i + vae.tile_latent_min_tsize + 1, :, :]
+            if vae.use_spatial_tiling and (tile.shape[-1] > vae.tile_latent_min_size or tile.shape[-2] > vae.tile_latent_min_size):
+                decoded = self.spatial_decode(tile)
+            else:
+                decoded = self.decode_tiles([tile])[0]
+            if dec is None:
+                dec = decoded.new_empty(*decoded.shape[:2], num_frames, *decoded.shape[3:])
+            if i > 0:
+                decoded = vae.blend_t(previous, decoded[:, :, 1:, :, :], blend_extent)
+                chunk = decoded[:, :, :t_limit, :, :]
+            else:
+                chunk = decoded[:, :, :t_limit + 1, :, :]
+            dec[:, :, t: t + chunk.shape[2]] = chunk
+            t += chunk.shape[2]
+            previous = decoded[:, :, -blend_extent:].clone()
+        return dec
@@ -1,34 +1,58 @@
 import sys
+from collections import OrderedDict
 from typing import Optional
 
 import torch
 import torch.nn.functional as F
 from diffusers.models.attention_processor import Attention
 from diffusers.models.embeddings import apply_rotary_emb
-from torch.nn.attention.flex_attention import (
-    flex_attention,
-)
 
-from .placement import wan_sparse_head_placement, wan_hidden_states_placement, ref_wan_sparse_head_placement, ref_wan_hidden_states_placement
-from .utils import generate_temporal_head_mask_mod, create_block_mask_cached
+from .utils import generate_temporal_head_mask_mod
+from svg.sparse import backends
+from svg.sparse.core import SparseAttentionProcessor
+from svg.sparse.geometry import SparseAttentionGeometry
 
-flex_attention = torch.compile(flex_attention, dynamic=False, mode="max-autotune-no-cudagraphs")
-torch._dynamo.config.cache_size_limit = 192 * 3
-torch._dynamo.config.accumulated_cache_size_limit = 192 * 3
 
+# Tables kept per rope module, in LRU order
+ROPE_TABLE_CACHE_SIZE = 8
+
+
+def get_rope_tables(rope, hidden_states):
+    """Real float32 ``(cos, sin)`` tables, [1, 1, S, D / 2], of the complex ``rope(hidden_states)`` freqs.
+
+    The freqs only depend on the rope and the latent geometry, so they are built and converted once per
+    (num_frames, height, width) and device, and stay resident on the device of ``hidden_states``. They are
+    stored on ``rope`` itself and go away with it.
+    """
+    cache = getattr(rope, "_rope_tables", None)
+    if cache is None:
+        cache = rope._rope_tables = OrderedDict()
+    key = (tuple(hidden_states.shape[2:]), str(hidden_states.device))
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+
+    freqs = rope(hidden_states)
+    tables = (freqs.real.to(hidden_states.device, torch.float32), freqs.imag.to(hidden_states.device, torch.float32))
+    cache[key] = tables
+    if len(cache) > ROPE_TABLE_CACHE_SIZE:
+        cache.popitem(last=False)
+    return tables
 
-class WanAttn_SparseAttn_Processor2_0:
-    version = None
-    context_length = 0
-    num_frame = 0
-    frame_size = 0
 
-    first_layers_fp = 0
-    first_times_fp = 0
+def apply_rotary_emb_real(hidden_states, freqs_cos, freqs_sin):
+    """Rotate the interleaved (real, imag) pairs of ``hidden_states`` [B, H, S, D] in float32.
 
-    num_sampled_rows = 32
-    attention_masks = None
-    block_mask = None
+    Same result as ``view_as_complex(hidden_states.double()) * freqs`` up to float32 rounding, without
+    the float64 complex upcast.
+    """
+    x_real, x_imag = hidden_states.float().unflatten(-1, (-1, 2)).unbind(-1)
+    x_out = torch.stack([x_real * freqs_cos - x_imag * freqs_sin, x_real * freqs_sin + x_imag * freqs_cos], dim=-1)
+    return x_out.flatten(-2).type_as(hidden_states)
+
+
+class WanAttn_SparseAttn_Processor2_0(SparseAttentionProcessor):
+    version = None
     
     def __init__(self, layer_idx):
         self.layer_idx = layer_idx
@@ -57,14 +81,12 @@ class WanAttn_SparseAttn_Processor2_0:
     def get_rotary_emb(self, query, key, rotary_emb):
 
         if rotary_emb is not None:
+            if not isinstance(rotary_emb, tuple):
+                # Complex freqs of WanRotaryPosEmbed, when called outside of the sparse forward
+                rotary_emb = (rotary_emb.real.float(), rotary_emb.imag.float())
 
-            def apply_rotary_emb(hidden_states: torch.Tensor, freqs: torch.Tensor):
-                x_rotated = torch.view_as_complex(hidden_states.to(torch.float64).unflatten(3, (-1, 2)))
-                x_out = torch.view_as_real(x_rotated * freqs).flatten(3, 4)
-                return x_out.type_as(hidden_states)
-
-            query = apply_rotary_emb(query, rotary_emb)
-            key = apply_rotary_emb(key, rotary_emb)
+            query = apply_rotary_emb_real(query, *rotary_emb)
+            key = apply_rotary_emb_real(key, *rotary_emb)
         
         return query, key
             
@@ -134,58 +156,6 @@ class WanAttn_SparseAttn_Processor2_0:
 
         return hidden_states
     
-    def sample_mse(self, query, key, value):
-        assert len(self.attention_masks) == 2
-
-        cfg, num_heads, seq_len, dim = query.size()
-        num_sampled_rows = min(self.num_sampled_rows, seq_len)
-        sampled_rows = torch.randint(low=0, high=self.sample_mse_max_row, size=(num_sampled_rows,))
-        sampled_q = query[:, :, sampled_rows, :]
-        sampled_qk_scores = torch.matmul(sampled_q, key.transpose(-2, -1)) / (dim**0.5)
-    
-        sampled_attn_weights = F.softmax(sampled_qk_scores, dim=-1)
-        sampled_golden_hidden_states = torch.matmul(sampled_attn_weights, value)  # (1, seq_len, dim)
-
-        sampled_mses = torch.zeros(len(self.attention_masks), cfg, num_heads, device=query.device, dtype=query.dtype)
-
-        # Only have Tri-diagonal and Striped
-        for mask_idx, attn_mask in enumerate(self.attention_masks):
-            sampled_attention_mask = attn_mask[sampled_rows, :]
-            sampled_attention_scores = sampled_qk_scores.masked_fill(sampled_attention_mask == 0, float('-inf'))
-            sampled_attn_weights = F.softmax(sampled_attention_scores, dim=-1)
-            sampled_hidden_states = torch.matmul(sampled_attn_weights, value)
-            mse = torch.mean((sampled_hidden_states - sampled_golden_hidden_states) ** 2, dim=(2, 3))
-            sampled_mses[mask_idx] = mse
-
-        return sampled_mses
-
-    def sparse_flex_attention(self, query, key, value, block_mask):
-        return flex_attention(query, key, value, block_mask=block_mask)
-
-    def sparse_head_placement(self, query, key, value, query_out, key_out, value_out, best_mask_idx, context_length, num_frame, frame_size):
-        
-        query_out, key_out, value_out = ref_wan_sparse_head_placement(query, key, value, best_mask_idx, context_length, num_frame, frame_size)
-
-        return query_out, key_out, value_out
-
-    def fast_sparse_head_placement(self, query, key, value, query_out, key_out, value_out, best_mask_idx, context_length, num_frame, frame_size):
-
-        wan_sparse_head_placement(query, key, value, query_out, key_out, value_out, best_mask_idx, context_length, num_frame, frame_size)
-
-        return query_out, key_out, value_out
-
-    def hidden_states_placement(self, \
-        hidden_states, output_hidden_states, \
-        best_mask_idx, context_length, num_frame, frame_size
-    ):
-        ref_wan_hidden_states_placement(hidden_states, output_hidden_states, best_mask_idx, context_length, num_frame, frame_size)
-
-    def fast_hidden_states_placement(self, \
-        hidden_states, output_hidden_states, \
-        best_mask_idx, context_length, num_frame, frame_size
-    ):
-        wan_hidden_states_placement(hidden_states, output_hidden_states, best_mask_idx, context_length, num_frame, frame_size)
-
     def flash_attention(self, query, key, value):
         output_hidden_states = F.scaled_dot_product_attention(
                 query, key, value, dropout_p=0.0, is_causal=False
@@ -200,50 +170,21 @@ class WanAttn_SparseAttn_Processor2_0:
         timestep,
     ):
         cfg, num_heads, seq_len, dim = query.size()
-        
-        context_length, num_frame, frame_size = self.context_length, self.num_frame, self.frame_size
-
-        assert seq_len == context_length + num_frame * frame_size, \
-            f"Query Shape: {seq_len} is not equivalent to {context_length} + {num_frame} * {frame_size}"
 
         # Determine if we use Full Attention to calculate
-        full_attention_flag = False
-
-        if self.layer_idx < self.num_layers * self.first_layers_fp:
-            full_attention_flag = True
-        if timestep[0] > 1000 * (1 - self.first_times_fp):
-            full_attention_flag = True
-            
-        if full_attention_flag:    
+        if self.use_full_attention(self.layer_idx, timestep[0], self.num_layers):
+            self.count_flops(self.layer_idx, query)
             output_hidden_states = self.flash_attention(query, key, value)
             return output_hidden_states.reshape(cfg, num_heads, seq_len, dim)
-        else:
-            sampled_mses = self.sample_mse(query, key, value)
-            best_mask_idx = torch.argmin(sampled_mses, dim=0)
-
-            output_hidden_states = torch.zeros_like(query)
-            query_out, key_out, value_out = torch.zeros_like(query), torch.zeros_like(key), torch.zeros_like(value)
-
-            query_out, key_out, value_out = self.fast_sparse_head_placement(query, key, value, query_out, key_out, value_out, best_mask_idx, context_length, num_frame, frame_size)
 
-            hidden_states = self.sparse_flex_attention(query_out, key_out, value_out, block_mask=self.block_mask)
-
-            self.fast_hidden_states_placement(hidden_states, output_hidden_states, best_mask_idx, context_length, num_frame, frame_size)
-
-            return output_hidden_states.reshape(cfg, num_heads, seq_len, dim)
+        return self.sparse_attention(query, key, value, timestep[0], self.layer_idx)
 
 
 def prepare_flexattention(cfg_size, num_head, head_dim, dtype, device, context_length, prompt_length, num_frame, frame_size, \
     diag_width=1, multiplier=2
 ):
     assert diag_width == multiplier, f"{diag_width} is not equivalent to {multiplier}"
-    
-    seq_len = context_length + num_frame * frame_size
-    query, key, value = [torch.zeros((cfg_size, num_head, seq_len, head_dim), dtype=dtype, device=device) for _ in range(3)]
 
+    geometry = SparseAttentionGeometry("wan", context_length, prompt_length, num_frame, frame_size, multiplier, first_frame_sink=True)
     mask_mod = generate_temporal_head_mask_mod(context_length, prompt_length, num_frame, frame_size, mul=multiplier)
-    block_mask = create_block_mask_cached(mask_mod, None, None, seq_len, seq_len, device=device, _compile=True)
-
-    hidden_states = flex_attention(query, key, value, block_mask=block_mask)
-
-    return block_mask
\ No newline at end of file
+    return backends.prepare_flexattention(geometry, mask_mod, cfg_size, num_head, head_dim, dtype, device)
\ No newline at end of file
@@ -7,6 +7,8 @@ from diffusers.models.transformers.transformer_wan import WanTransformerBlock, W
 from diffusers.models.modeling_outputs import Transformer2DModelOutput
 from diffusers.utils import USE_PEFT_BACKEND, logging, scale_lora_layers, unscale_lora_layers
 
+from .attention import get_rope_tables
+
 class WanTransformerBlock_Sparse(WanTransformerBlock):
     def forward(
         self,
@@ -70,7 +72,8 @@ class WanTransformer3DModel_Sparse(WanTransformer3DModel):
         post_patch_height = height // p_h
         post_patch_width = width // p_w
 
-        rotary_emb = self.rope(hidden_states)
+        # Real cos / sin tables, built once per geometry
+        rotary_emb = get_rope_tables(self.rope, hidden_states)
 
         hidden_states = self.patch_embedding(hidden_states)
         hidden_states = hidden_states.flatten(2).transpose(1, 2)
@@ -84,7 +87,18 @@ class WanTransformer3DModel_Sparse(WanTransformer3DModel):
             encoder_hidden_states = torch.concat([encoder_hidden_states_image, encoder_hidden_states], dim=1)
 
         # 4. Transformer blocks
-        if torch.is_grad_enabled() and self.gradient_checkpointing:
+        teacache = getattr(self, "teacache", None)
+        should_calc = True
+        if teacache is not None:
+            # Modulated input of the first block's self-attention
+            shift_msa, scale_msa = (self.blocks[0].scale_shift_table + timestep_proj.float()).chunk(6, dim=1)[:2]
+            modulated_inp = self.blocks[0].norm1(hidden_states.float()) * (1 + scale_msa) + shift_msa
+            should_calc = teacache.should_compute(modulated_inp)
+            ori_hidden_states = hidden_states
+
+        if not should_calc:
+            hidden_states = teacache.apply_residuals(hidden_states)
+        elif torch.is_grad_enabled() and self.gradient_checkpointing:
             for block in self.blocks:
                 hidden_states = self._gradient_checkpointing_func(
                     block, hidden_states, encoder_hidden_states, timestep_proj, rotary_emb
@@ -98,6 +112,8 @@ class WanTransformer3DModel_Sparse(WanTransformer3DModel):
                     rotary_emb,
                     timestep=timestep
                 )
+        if teacache is not None and should_calc:
+            teacache.store_residuals(ori_hidden_states, hidden_states)
 
         # 5. Output norm, projection & unpatchify
         shift, scale = (self.scale_shift_table + temb.unsqueeze(1)).chunk(2, dim=1)
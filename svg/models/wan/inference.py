@@ -3,7 +3,8 @@ import torch
 from diffusers.models.attention_processor import Attention
 
 from .attention import WanAttn_SparseAttn_Processor2_0, prepare_flexattention
-from .utils import sparsity_to_width, get_attention_mask
+from .utils import sparsity_to_width
+from svg.sparse import get_profiling_masks, AttentionFlopCounter, HeadWidthTable, PatternDecisionCache, PatternTable, SparseAttentionGeometry
 from .custom_models import replace_sparse_forward
 
 
@@ -13,14 +14,17 @@ def replace_wan_attention(
     width,
     num_frames,
     num_sampled_rows,
-    sample_mse_max_row,
     sparsity,
     first_layers_fp,
-    first_times_fp
+    first_times_fp,
+    reprofile_interval=1,
+    drift_threshold=None,
+    pattern_table=None,
+    sparse_backend="flex",
+    head_width_table=None,
+    flop_report=False
 ):
 
-    masks = ["spatial", "temporal"]
-
     context_length = 0
     num_frame = 1 + num_frames // (pipe.vae_scale_factor_temporal * pipe.transformer.config.patch_size[0])
     mod_value = pipe.vae_scale_factor_spatial * pipe.transformer.config.patch_size[1]
@@ -30,21 +34,29 @@ def replace_wan_attention(
 
     AttnModule = WanAttn_SparseAttn_Processor2_0
     AttnModule.num_sampled_rows = num_sampled_rows
-    AttnModule.sample_mse_max_row = sample_mse_max_row
-    AttnModule.attention_masks = [get_attention_mask(mask_name, sample_mse_max_row, context_length, num_frame, frame_size) for mask_name in masks]
+    AttnModule.attention_masks = get_profiling_masks("wan", context_length, num_frame, frame_size, device="cuda")
     AttnModule.first_layers_fp = first_layers_fp
     AttnModule.first_times_fp = first_times_fp
+    if pattern_table is not None:
+        # Static mode: the spatial / temporal decisions are looked up, sample_mse is never run
+        AttnModule.pattern_cache = PatternTable.load(pattern_table)
+    elif reprofile_interval > 1 or drift_threshold is not None:
+        AttnModule.pattern_cache = PatternDecisionCache(reprofile_interval, drift_threshold, num_sampled_rows)
 
     multiplier = diag_width = sparsity_to_width(sparsity, context_length, num_frame, frame_size)
 
-    AttnModule.context_length = context_length
-    AttnModule.num_frame = num_frame
-    AttnModule.frame_size = frame_size
+    AttnModule.geometry = SparseAttentionGeometry.wan(num_frame, frame_size, multiplier)
     
     # NOTE: ??? Prepare placement will strongly decrease PSNR
     # prepare_placement(2, 48, 64, dtype, "cuda", context_length, num_frame, frame_size)
     block_mask = prepare_flexattention(1, 40, 128, dtype, "cuda", context_length, context_length, num_frame, frame_size, diag_width, multiplier)
     AttnModule.block_mask = block_mask
+    AttnModule.backend = sparse_backend
+    if head_width_table is not None:
+        # Calibrated band width per (layer, head) instead of the uniform --sparsity width
+        AttnModule.head_widths = HeadWidthTable.load(head_width_table)
+    if flop_report:
+        AttnModule.flop_counter = AttentionFlopCounter()
     
     print(block_mask)
     
@@ -60,4 +72,6 @@ def replace_wan_attention(
             if hasattr(m.processor, "layer_idx"): # Only Attn 1, No Attn 2
                 layer_idx = m.processor.layer_idx
                 m.set_processor(AttnModule(layer_idx))
-                m.processor.num_layers = num_layers
\ No newline at end of file
+                m.processor.num_layers = num_layers
+
+    return AttnModule.pattern_cache
\ No newline at end of file
@@ -0,0 +1,9 @@
+from .masks import AttentionMaskRows, get_profiling_masks, get_attention_mask, PROFILING_MASK_MODS
+from .pattern_cache import PatternDecisionCache
+from .pattern_table import PatternRecorder, PatternTable, calibrate_pattern_table
+from .placement import placement_index, ref_sparse_head_placement, ref_hidden_states_placement, ref_index_mapped_attention
+from .geometry import SparseAttentionGeometry
+from .backends import SPARSE_ATTENTION_BACKENDS, register_backend, get_backend
+from .core import SparseAttentionProcessor
+from .head_widths import HeadWidthRecorder, HeadWidthTable, calibrate_head_widths
+from .flops import AttentionFlopCounter
@@ -0,0 +1,109 @@
+"""Pluggable block-sparse attention backends, shared by HunyuanVideo, Wan and CogVideoX.
+
+A backend is called as ``backend(query, key, value, best_mask_idx, block_mask, geometry)`` on the
+[cfg, num_heads, seq_len, head_dim] frame-major Q / K / V and returns the frame-major output. It owns the
+sparse head placement, so e.g. ``index_mapped`` can fuse it into the attention kernel. Triton and
+FlexAttention are only imported when a backend that needs them is called.
+"""
+
+import torch
+
+
+SPARSE_ATTENTION_BACKENDS = {}
+
+
+def register_backend(name):
+    """Register ``fn`` as the sparse attention backend ``name``."""
+    def decorator(fn):
+        SPARSE_ATTENTION_BACKENDS[name] = fn
+        return fn
+    return decorator
+
+
+def get_backend(name):
+    if name not in SPARSE_ATTENTION_BACKENDS:
+        raise ValueError(f"Unknown sparse attention backend {name}, choose from {sorted(SPARSE_ATTENTION_BACKENDS)}")
+    return SPARSE_ATTENTION_BACKENDS[name]
+
+
+_compiled_flex_attention = None
+
+
+def compiled_flex_attention():
+    """The compiled ``flex_attention`` used by every model, so they all share one dynamo cache."""
+    global _compiled_flex_attention
+    if _compiled_flex_attention is None:
+        from torch.nn.attention.flex_attention import flex_attention
+
+        torch._dynamo.config.cache_size_limit = 192 * 3
+        torch._dynamo.config.accumulated_cache_size_limit = 192 * 3
+        _compiled_flex_attention = torch.compile(flex_attention, dynamic=False, mode="max-autotune-no-cudagraphs")
+    return _compiled_flex_attention
+
+
+@register_backend("flex")
+def flex_backend(query, key, value, best_mask_idx, block_mask, geometry):
+    """Triton sparse head placement, FlexAttention on the placed Q / K / V and the inverse placement."""
+    from .placement_kernels import sparse_head_placement, hidden_states_placement
+
+    # The placement is a permutation of every head, so the buffers are fully overwritten
+    query_out, key_out, value_out = torch.empty_like(query), torch.empty_like(key), torch.empty_like(value)
+    sparse_head_placement(
+        query, key, value, query_out, key_out, value_out, best_mask_idx,
+        geometry.context_length, geometry.num_frame, geometry.frame_size, geometry.text_first
+    )
+    hidden_states = compiled_flex_attention()(query_out, key_out, value_out, block_mask=block_mask)
+    return hidden_states_placement(
+        hidden_states, torch.empty_like(hidden_states), best_mask_idx,
+        geometry.context_length, geometry.num_frame, geometry.frame_size, geometry.text_first
+    )
+
+
+@register_backend("index_mapped")
+def index_mapped_backend(query, key, value, best_mask_idx, block_mask, geometry):
+    """The placement applied as a gather inside the attention kernel, see ``svg.sparse.index_mapped_attention``."""
+    from .index_mapped_attention import index_mapped_attention
+
+    return index_mapped_attention(query, key, value, best_mask_idx, block_mask, geometry)
+
+
+@register_backend("sdpa")
+def sdpa_backend(query, key, value, best_mask_idx, block_mask, geometry):
+    """PyTorch reference: the mask of ``block_mask`` is materialized and applied with SDPA. For validation only."""
+    from .placement import ref_index_mapped_attention
+
+    return ref_index_mapped_attention(query, key, value, best_mask_idx, block_mask.mask_mod, geometry)
+
+
+@register_backend("cpu")
+def cpu_backend(query, key, value, best_mask_idx, block_mask, geometry):
+    """Device agnostic: PyTorch placement and an attention that only visits the non-empty blocks of ``block_mask``."""
+    from .cpu_attention import block_sparse_attention
+    from .placement import ref_sparse_head_placement, ref_hidden_states_placement
+
+    query_out, key_out, value_out = ref_sparse_head_placement(
+        query, key, value, best_mask_idx, geometry.context_length, geometry.num_frame, geometry.frame_size, geometry.text_first
+    )
+    hidden_states = block_sparse_attention(query_out, key_out, value_out, block_mask)
+    return ref_hidden_states_placement(
+        hidden_states, torch.empty_like(hidden_states), best_mask_idx,
+        geometry.context_length, geometry.num_frame, geometry.frame_size, geometry.text_first
+    )
+
+
+def prepare_flexattention(geometry, mask_mod, cfg_size, num_head, head_dim, dtype, device, B=None, H=None):
+    """Build (or load) the BlockMask of the temporal heads and warm up the compiled FlexAttention on it.
+
+    Args:
+        geometry (SparseAttentionGeometry): Token layout, also the geometry part of the BlockMask cache key.
+        mask_mod (Callable): The temporal head mask of the model, on the placed sequence.
+        B, H (int): Batch and head dimensions of the BlockMask, None to share it across heads.
+    """
+    from .block_mask_cache import create_block_mask_persistent
+
+    seq_len = geometry.seq_len
+    block_mask = create_block_mask_persistent(mask_mod, geometry.cache_key(), B, H, seq_len, seq_len, device=device, _compile=True)
+
+    query, key, value = [torch.zeros((cfg_size, num_head, seq_len, head_dim), dtype=dtype, device=device) for _ in range(3)]
+    compiled_flex_attention()(query, key, value, block_mask=block_mask)
+    return block_mask
@@ -0,0 +1,145 @@
+"""On-disk cache of FlexAttention BlockMasks, keyed by the attention geometry and the mask_mod.
+
+Building a BlockMask for a 720p video takes a while and the result only depends on the geometry and the
+mask_mod, so the ``kv_num_blocks`` / ``kv_indices`` / ``full_kv_*`` tensors are stored in a content-addressed
+directory and read back (a few MB of block indices, copied to the device) by every worker that starts with the
+same geometry. The key includes the source and closure values of the mask_mod, so a change of the mask logic
+or of a mask option (e.g. the ``attn_sink`` of CogVideoX) gets its own entry.
+"""
+
+import dataclasses
+import hashlib
+import inspect
+import json
+import os
+import types
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import save_file
+from torch.nn.attention.flex_attention import BlockMask, create_block_mask
+
+
+BLOCK_MASK_CACHE_DIR = os.environ.get(
+    "SVG_BLOCK_MASK_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "svg", "block_masks")
+)
+
+# Bumped when the stored format or the way the key is built changes
+BLOCK_MASK_CACHE_VERSION = 3
+
+KV_BLOCK_FIELDS = ("kv_num_blocks", "kv_indices", "full_kv_num_blocks", "full_kv_indices")
+
+# torch>=2.6 records the unpadded sequence lengths in the BlockMask
+FROM_KV_BLOCKS_HAS_SEQ_LENGTHS = "seq_lengths" in inspect.signature(BlockMask.from_kv_blocks).parameters
+
+
+def code_fingerprint(code):
+    """Bytecode and constants of a function without source, the nested code objects by content rather than by repr."""
+    consts = [code_fingerprint(const) if isinstance(const, types.CodeType) else repr(const) for const in code.co_consts]
+    return {"code": code.co_code.hex(), "consts": consts}
+
+
+def mask_mod_fingerprint(value):
+    """The source of a mask_mod and the values it closes over, recursively for the functions among them.
+
+    Only values with a content that is the same in every process are accepted: primitives, tensors (by content),
+    dataclasses (by fields), functions (by source and closure) and the lists / tuples / dicts of those. Anything
+    else raises a TypeError rather than falling back to a repr, which may hold a memory address.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if torch.is_tensor(value):
+        return {"tensor": value.tolist(), "dtype": str(value.dtype)}
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        fields = {field.name: mask_mod_fingerprint(getattr(value, field.name)) for field in dataclasses.fields(value)}
+        return {"dataclass": type(value).__qualname__, "fields": fields}
+    if isinstance(value, (list, tuple)):
+        return [mask_mod_fingerprint(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): mask_mod_fingerprint(item) for key, item in value.items()}
+    if not isinstance(value, types.FunctionType):
+        raise TypeError(f"Cannot fingerprint a mask_mod closing over a {type(value).__qualname__}")
+
+    try:
+        source = inspect.getsource(value)
+    except (OSError, TypeError):
+        source = code_fingerprint(value.__code__)
+    closure = []
+    for cell in value.__closure__ or ():
+        try:
+            contents = cell.cell_contents
+        except ValueError:
+            # Empty cell
+            closure.append(None)
+            continue
+        closure.append(mask_mod_fingerprint(contents))
+    return {"source": source, "closure": closure}
+
+
+def block_mask_cache_key(geometry, B, H, M, N, mask_mod=None):
+    key = dict(
+        geometry, B=B, H=H, M=M, N=N, torch=torch.__version__.split("+")[0], version=BLOCK_MASK_CACHE_VERSION,
+        mask_mod=mask_mod_fingerprint(mask_mod) if mask_mod is not None else None,
+    )
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def save_block_mask(block_mask, path, geometry=None):
+    tensors = {
+        name: getattr(block_mask, name).contiguous().cpu()
+        for name in KV_BLOCK_FIELDS if getattr(block_mask, name) is not None
+    }
+    seq_lengths = getattr(block_mask, "seq_lengths", None)
+    metadata = {
+        "BLOCK_SIZE": json.dumps(list(block_mask.BLOCK_SIZE)),
+        "seq_lengths": json.dumps(list(seq_lengths) if seq_lengths is not None else None),
+        "geometry": json.dumps(geometry, sort_keys=True),
+    }
+    # Write to a private file first so that concurrent workers never read a partial mask
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    save_file(tensors, tmp_path, metadata=metadata)
+    os.replace(tmp_path, path)
+
+
+def load_block_mask(path, mask_mod, device="cuda"):
+    with safe_open(path, framework="pt", device="cpu") as f:
+        metadata = f.metadata()
+        tensors = {name: f.get_tensor(name).to(device) for name in f.keys()}
+
+    kwargs = {}
+    seq_lengths = json.loads(metadata["seq_lengths"])
+    if FROM_KV_BLOCKS_HAS_SEQ_LENGTHS and seq_lengths is not None:
+        kwargs["seq_lengths"] = tuple(seq_lengths)
+
+    return BlockMask.from_kv_blocks(
+        tensors["kv_num_blocks"],
+        tensors["kv_indices"],
+        tensors.get("full_kv_num_blocks"),
+        tensors.get("full_kv_indices"),
+        BLOCK_SIZE=tuple(json.loads(metadata["BLOCK_SIZE"])),
+        mask_mod=mask_mod,
+        **kwargs,
+    )
+
+
+def create_block_mask_persistent(mask_mod, geometry, B, H, M, N, device="cuda", _compile=False, cache_dir=None):
+    """``create_block_mask`` backed by the on-disk cache.
+
+    Args:
+        mask_mod: The mask_mod the BlockMask is built from. It is re-attached to a cached mask, since it
+            is still evaluated inside the partial blocks.
+        geometry (dict): The token layout ``mask_mod`` is built for, e.g. model, context_length, prompt_length,
+            num_frame, frame_size, multiplier and block_size. With the fingerprint of ``mask_mod``, it is the
+            cache key.
+        cache_dir (str): Cache directory, defaults to ``$SVG_BLOCK_MASK_CACHE`` or ``~/.cache/svg/block_masks``.
+    """
+    cache_dir = BLOCK_MASK_CACHE_DIR if cache_dir is None else cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{block_mask_cache_key(geometry, B, H, M, N, mask_mod)}.safetensors")
+
+    if os.path.exists(path):
+        return load_block_mask(path, mask_mod, device=device)
+
+    block_mask = create_block_mask(mask_mod, B, H, M, N, device=device, _compile=_compile)
+    save_block_mask(block_mask, path, geometry)
+    return block_mask
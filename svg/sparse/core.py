@@ -0,0 +1,93 @@
+"""Model independent part of the sparse attention processors of HunyuanVideo, Wan and CogVideoX."""
+
+import torch
+import torch.nn.functional as F
+
+from .backends import get_backend
+
+
+class SparseAttentionProcessor:
+    """Online spatial / temporal head selection followed by the block-sparse attention of a backend.
+
+    The model processors subclass it and only add the projections around ``sparse_attention``. The
+    settings are class attributes, set once on the model processor class at setup.
+    """
+
+    geometry = None # SparseAttentionGeometry of the video
+    block_mask = None
+    backend = "flex" # Name of a backend in svg.sparse.backends.SPARSE_ATTENTION_BACKENDS
+
+    num_sampled_rows = 32
+    attention_masks = None
+    pattern_cache = None
+    head_widths = None # HeadWidthTable (or HeadWidthRecorder while calibrating), None for the --sparsity width
+    flop_counter = None # AttentionFlopCounter of the run, if any
+
+    first_layers_fp = 0
+    first_times_fp = 0
+
+    def use_full_attention(self, layer_idx, timestep, num_layers):
+        """Whether the layer runs dense attention: the first ``first_layers_fp`` of the layers or ``first_times_fp`` of the timesteps."""
+        return layer_idx < num_layers * self.first_layers_fp or timestep > 1000 * (1 - self.first_times_fp)
+
+    def count_flops(self, layer_idx, query, block_mask=None):
+        """Account the attention of the [cfg, num_heads, seq_len, head_dim] query, dense when ``block_mask`` is None."""
+        if self.flop_counter is not None:
+            self.flop_counter.add(layer_idx, *query.shape, block_mask=block_mask)
+
+    def sample_rows(self, seq_len):
+        return torch.randint(low=0, high=seq_len, size=(min(self.num_sampled_rows, seq_len),))
+
+    def sample_mse(self, query, key, value, sampled_rows=None):
+        assert len(self.attention_masks) == 2
+
+        cfg, num_heads, seq_len, dim = query.size()
+        if sampled_rows is None:
+            sampled_rows = self.sample_rows(seq_len)
+        sampled_q = query[:, :, sampled_rows, :]
+        sampled_qk_scores = torch.matmul(sampled_q, key.transpose(-2, -1)) / (dim**0.5)
+
+        sampled_attn_weights = F.softmax(sampled_qk_scores, dim=-1)
+        sampled_golden_hidden_states = torch.matmul(sampled_attn_weights, value)  # (1, seq_len, dim)
+
+        sampled_mses = torch.zeros(len(self.attention_masks), cfg, num_heads, device=query.device, dtype=query.dtype)
+
+        # Only have Tri-diagonal and Striped
+        for mask_idx, attn_mask in enumerate(self.attention_masks):
+            sampled_attention_mask = attn_mask[sampled_rows, :]
+            sampled_attention_scores = sampled_qk_scores.masked_fill(sampled_attention_mask == 0, float('-inf'))
+            sampled_attn_weights = F.softmax(sampled_attention_scores, dim=-1)
+            sampled_hidden_states = torch.matmul(sampled_attn_weights, value)
+            mse = torch.mean((sampled_hidden_states - sampled_golden_hidden_states) ** 2, dim=(2, 3))
+            sampled_mses[mask_idx] = mse
+
+        return sampled_mses
+
+    def get_best_mask_idx(self, query, key, value, timestep, layer_idx):
+        def profile():
+            # The rows are kept on profile for the pattern cache, which checks the drift of the query on the same rows
+            profile.sampled_rows = self.sample_rows(query.shape[2])
+            sampled_mses = self.sample_mse(query, key, value, profile.sampled_rows)
+            return torch.argmin(sampled_mses, dim=0)
+
+        if self.pattern_cache is None:
+            return profile()
+        return self.pattern_cache(layer_idx, timestep, query, profile)
+
+    def sparse_attention(self, query, key, value, timestep, layer_idx):
+        """Sparse attention of the [cfg, num_heads, seq_len, head_dim] frame-major Q / K / V."""
+        cfg, num_heads, seq_len, dim = query.size()
+        geometry = self.geometry
+
+        assert seq_len == geometry.seq_len, \
+            f"Query Shape: {seq_len} is not equivalent to {geometry.context_length} + {geometry.num_frame} * {geometry.frame_size}"
+
+        best_mask_idx = self.get_best_mask_idx(query, key, value, timestep, layer_idx)
+        block_mask = None
+        if self.head_widths is not None:
+            block_mask = self.head_widths(layer_idx, timestep, query, key, best_mask_idx, geometry)
+        block_mask = self.block_mask if block_mask is None else block_mask
+
+        self.count_flops(layer_idx, query, block_mask)
+        output_hidden_states = get_backend(self.backend)(query, key, value, best_mask_idx, block_mask, geometry)
+        return output_hidden_states.reshape(cfg, num_heads, seq_len, dim)
@@ -0,0 +1,138 @@
+"""Device agnostic block-sparse attention over a FlexAttention BlockMask, for the CPU backend, tests and benchmarks.
+
+Only the non-empty blocks of the BlockMask are visited: the partial blocks (``kv_indices``) evaluate the
+``mask_mod`` and the full blocks (``full_kv_indices``) are not masked, like FlexAttention does. Each
+(head group, query block) is a task of a thread pool that runs a tiled online softmax over its active key
+blocks, so the memory of a task is one query block times one span of key blocks instead of seq_len^2.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+
+def block_mask_rows(block_mask, batch, num_heads):
+    """[mask_heads, num_q_blocks(, num_kv_blocks)] views of the BlockMask, with mask_heads 1, ``num_heads`` or ``batch * num_heads``."""
+    kv_num_blocks = block_mask.kv_num_blocks.flatten(0, 1)
+    kv_indices = block_mask.kv_indices.flatten(0, 1)
+    if block_mask.full_kv_num_blocks is not None:
+        full_kv_num_blocks = block_mask.full_kv_num_blocks.flatten(0, 1)
+        full_kv_indices = block_mask.full_kv_indices.flatten(0, 1)
+    else:
+        full_kv_num_blocks, full_kv_indices = torch.zeros_like(kv_num_blocks), kv_indices[..., :0]
+
+    mask_heads = kv_num_blocks.shape[0]
+    assert mask_heads in (1, num_heads, batch * num_heads), f"BlockMask with {mask_heads} heads does not match {batch} x {num_heads}"
+    return kv_num_blocks, kv_indices, full_kv_num_blocks, full_kv_indices
+
+
+def block_spans(blocks, max_span_blocks):
+    """Merge the sorted block indices into [start, end) runs of consecutive blocks, at most ``max_span_blocks`` long."""
+    spans = []
+    for block in sorted(blocks):
+        if spans and spans[-1][1] == block and spans[-1][1] - spans[-1][0] < max_span_blocks:
+            spans[-1][1] = block + 1
+        else:
+            spans.append([block, block + 1])
+    return spans
+
+
+def csr_block_lists(block_mask, batch, num_heads, max_span_blocks=4):
+    """CSR-like block list of the BlockMask: ``lists[mask_head][q_block]`` is the list of (kv_start_block, kv_end_block, is_partial).
+
+    Consecutive active blocks of the same kind are merged so that the tiles are larger than one block.
+    """
+    kv_num_blocks, kv_indices, full_kv_num_blocks, full_kv_indices = [
+        tensor.cpu() for tensor in block_mask_rows(block_mask, batch, num_heads)
+    ]
+    lists = []
+    for mask_head in range(kv_num_blocks.shape[0]):
+        rows = []
+        for q_block in range(kv_num_blocks.shape[1]):
+            partial = kv_indices[mask_head, q_block, :kv_num_blocks[mask_head, q_block]].tolist()
+            full = full_kv_indices[mask_head, q_block, :full_kv_num_blocks[mask_head, q_block]].tolist()
+            rows.append(
+                [(start, end, True) for start, end in block_spans(partial, max_span_blocks)] +
+                [(start, end, False) for start, end in block_spans(full, max_span_blocks)]
+            )
+        lists.append(rows)
+    return lists
+
+
+def attend_q_block(out, query, key, value, heads, q_start, q_end, spans, mask_mod, b, h, BLOCK_N, scale):
+    # Online softmax of query[heads, q_start:q_end] over the key spans, written to out[heads, q_start:q_end]
+    seq_len = key.shape[1]
+    q = query[heads, q_start:q_end].float() * scale
+    q_idx = torch.arange(q_start, q_end, device=q.device)[:, None]
+
+    m_i = torch.full(q.shape[:-1], float("-inf"), device=q.device)
+    l_i = torch.zeros(q.shape[:-1], device=q.device)
+    acc = torch.zeros_like(q)
+    for start_block, end_block, is_partial in spans:
+        kv_start, kv_end = start_block * BLOCK_N, min(end_block * BLOCK_N, seq_len)
+        if kv_start >= kv_end:
+            continue
+        scores = torch.matmul(q, key[heads, kv_start:kv_end].float().transpose(-2, -1))
+        if is_partial:
+            mask = mask_mod(b, h, q_idx, torch.arange(kv_start, kv_end, device=q.device)[None, :])
+            scores.masked_fill_(~mask, float("-inf"))
+
+        m_new = torch.maximum(m_i, scores.amax(dim=-1))
+        m_safe = torch.where(m_new == float("-inf"), 0.0, m_new)
+        p = torch.exp(scores - m_safe[..., None])
+        alpha = torch.exp(m_i - m_safe)
+        l_i = l_i * alpha + p.sum(dim=-1)
+        acc = acc * alpha[..., None] + torch.matmul(p, value[heads, kv_start:kv_end].float())
+        m_i = m_new
+
+    # Rows without any active key are zero, like FlexAttention
+    out[heads, q_start:q_end] = (acc / torch.where(l_i == 0, 1.0, l_i)[..., None]).to(out.dtype)
+
+
+def block_sparse_attention(query, key, value, block_mask, scale=None, num_threads=None, max_span_blocks=4):
+    """Attention of the [batch, num_heads, seq_len, head_dim] Q / K / V restricted to ``block_mask``.
+
+    The BlockMask is either shared by all heads, has one row per head (B = 1, H = num_heads, e.g. the adaptive
+    widths of ``svg.sparse.head_widths``) or one row per (batch, head), like the BlockMask of CogVideoX
+    (B = 1, H = cfg * num_heads). The scores are computed in float32.
+
+    Args:
+        num_threads (int): Size of the thread pool over (head group, query block), defaults to the number of CPUs.
+        max_span_blocks (int): Maximum number of consecutive key blocks attended in one tile.
+    """
+    batch, num_heads, seq_len, head_dim = query.shape
+    BLOCK_M, BLOCK_N = block_mask.BLOCK_SIZE
+    scale = head_dim ** -0.5 if scale is None else scale
+
+    lists = csr_block_lists(block_mask, batch, num_heads, max_span_blocks)
+    mask_num_heads = block_mask.kv_num_blocks.shape[1]
+
+    query, key, value = [tensor.flatten(0, 1) for tensor in (query, key, value)]
+    out = torch.empty_like(query)
+
+    tasks = []
+    for mask_head, rows in enumerate(lists):
+        # A BlockMask row is applied to all the (batch, head) rows it covers at once
+        if len(lists) == 1:
+            heads = slice(None)
+        elif len(lists) == num_heads:
+            heads = slice(mask_head, None, num_heads)
+        else:
+            heads = slice(mask_head, mask_head + 1)
+        b, h = [torch.tensor(i, device=query.device) for i in divmod(mask_head, mask_num_heads)]
+        for q_block in range(-(-seq_len // BLOCK_M)):
+            q_start, q_end = q_block * BLOCK_M, min((q_block + 1) * BLOCK_M, seq_len)
+            tasks.append((out, query, key, value, heads, q_start, q_end, rows[q_block], block_mask.mask_mod, b, h, BLOCK_N, scale))
+
+    num_threads = num_threads or os.cpu_count()
+    if num_threads == 1:
+        for task in tasks:
+            attend_q_block(*task)
+    else:
+        # The tasks write disjoint rows of out, and the PyTorch kernels release the GIL
+        with ThreadPoolExecutor(num_threads) as executor:
+            for future in [executor.submit(attend_q_block, *task) for task in tasks]:
+                future.result()
+
+    return out.unflatten(0, (batch, num_heads))
@@ -0,0 +1,59 @@
+"""FLOP accounting of the attention of a run, dense and block-sparse layers alike."""
+
+from collections import defaultdict
+
+
+class AttentionFlopCounter:
+    """Counts the QK^T and PV FLOPs of every attention call, 4 * rows * cols * head_dim per head.
+
+    A sparse call only counts the active blocks of its BlockMask (partial blocks as full blocks), which
+    is what the kernels compute. The per-head block counts are cached per BlockMask.
+    """
+
+    def __init__(self):
+        self.dense_flops = defaultdict(float)
+        self.sparse_flops = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.block_counts = {}
+
+    def active_blocks(self, block_mask):
+        key = id(block_mask)
+        if key not in self.block_counts:
+            from .head_widths import active_blocks_per_head
+
+            # The BlockMask is kept alive with its count, so that its id is not reused
+            self.block_counts[key] = (block_mask, active_blocks_per_head(block_mask))
+        return self.block_counts[key][1]
+
+    def add(self, layer_idx, cfg, num_heads, seq_len, head_dim, block_mask=None):
+        dense = 4.0 * cfg * num_heads * seq_len * seq_len * head_dim
+        self.dense_flops[layer_idx] += dense
+        self.calls[layer_idx] += 1
+        if block_mask is None:
+            self.sparse_flops[layer_idx] += dense
+            return
+
+        BLOCK_M, BLOCK_N = block_mask.BLOCK_SIZE
+        blocks = self.active_blocks(block_mask)
+        # A BlockMask shared by the heads, or one row per head (or per (cfg, head))
+        blocks = blocks.sum().item() * cfg * num_heads / blocks.numel()
+        self.sparse_flops[layer_idx] += 4.0 * blocks * BLOCK_M * BLOCK_N * head_dim
+
+    def summary(self):
+        dense, sparse = sum(self.dense_flops.values()), sum(self.sparse_flops.values())
+        return dict(
+            dense_tflops=dense / 1e12, attention_tflops=sparse / 1e12,
+            density=sparse / dense if dense else 1.0, calls=sum(self.calls.values()),
+        )
+
+    def report(self):
+        lines = ["layer  calls  attention TFLOPs  density"]
+        for layer_idx in sorted(self.calls):
+            dense, sparse = self.dense_flops[layer_idx], self.sparse_flops[layer_idx]
+            lines.append(f"{layer_idx:5d}  {self.calls[layer_idx]:5d}  {sparse / 1e12:16.3f}  {sparse / dense:7.3f}")
+        summary = self.summary()
+        lines.append(
+            f"total  {summary['calls']:5d}  {summary['attention_tflops']:16.3f}  {summary['density']:7.3f}"
+            f"  (dense {summary['dense_tflops']:.3f} TFLOPs)"
+        )
+        return "\n".join(lines)
@@ -0,0 +1,62 @@
+"""Token layout of the joint text / video sequence seen by the sparse attention."""
+
+from dataclasses import dataclass, asdict
+
+
+@dataclass(frozen=True)
+class SparseAttentionGeometry:
+    """Everything the placement, the masks and the BlockMask depend on.
+
+    Args:
+        model (str): "hunyuan", "wan" or "cog", selects the model specific temporal head mask.
+        context_length (int): Number of text tokens in the sequence (padded).
+        prompt_length (int): Number of valid text tokens, the rest of the context is padding.
+        num_frame (int): Number of latent frames.
+        frame_size (int): Number of tokens per latent frame.
+        multiplier (float): Width of the temporal head band, in frames.
+        text_first (bool): Whether the text tokens come before (CogVideoX) or after (HunyuanVideo, Wan) the video tokens.
+        first_frame_sink (bool): Whether the first frame is attended by every token (Wan).
+        attn_sink (bool): Whether the temporal heads attend to the first frame as well as the text (the ``attn_sink`` of CogVideoX).
+        block_size (int): Block size of the BlockMask.
+    """
+
+    model: str
+    context_length: int
+    prompt_length: int
+    num_frame: int
+    frame_size: int
+    multiplier: float = 2
+    text_first: bool = False
+    first_frame_sink: bool = False
+    attn_sink: bool = False
+    block_size: int = 128
+
+    @property
+    def pixel_length(self):
+        return self.num_frame * self.frame_size
+
+    @property
+    def seq_len(self):
+        return self.context_length + self.pixel_length
+
+    def cache_key(self):
+        """The geometry part of the BlockMask cache key."""
+        return dict(
+            model=self.model, context_length=self.context_length, prompt_length=self.prompt_length,
+            num_frame=self.num_frame, frame_size=self.frame_size, multiplier=self.multiplier, attn_sink=self.attn_sink, block_size=self.block_size,
+        )
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def hunyuan(cls, context_length, prompt_length, num_frame, frame_size, multiplier):
+        return cls("hunyuan", context_length, prompt_length, num_frame, frame_size, multiplier)
+
+    @classmethod
+    def wan(cls, num_frame, frame_size, multiplier):
+        return cls("wan", 0, 0, num_frame, frame_size, multiplier, first_frame_sink=True)
+
+    @classmethod
+    def cog(cls, context_length, num_frame, frame_size, multiplier, attn_sink=False):
+        return cls("cog", context_length, context_length, num_frame, frame_size, multiplier, text_first=True, attn_sink=attn_sink)
@@ -0,0 +1,271 @@
+"""Adaptive temporal band width per (layer call, head) under a global attention FLOP budget.
+
+``--sparsity`` gives one band width to every head of every layer. During calibration, ``HeadWidthRecorder``
+measures, for a ladder of widths around that uniform width, the attention mass of sampled query rows that
+each head keeps inside the band. ``allocate_head_widths`` then greedily widens the heads that gain the most
+mass per extra attention block until the block budget of the uniform width (times ``budget``) is spent.
+The resulting ``HeadWidthTable`` returns a per-head BlockMask (H = num_heads) for every layer call.
+
+Both are installed as ``AttnModule.head_widths`` and called as ``(layer_idx, timestep, query, key, best_mask_idx, geometry)``.
+"""
+
+import heapq
+import os
+
+import numpy as np
+import torch
+
+from .pattern_cache import LayerCallCounter, timestep_to_float
+from .placement import placement_index, temporal_head_band_width
+
+
+WIDTH_FACTORS = (0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0)
+
+
+def band_mask_mod(geometry, band_widths):
+    """``generate_temporal_head_mask_mod`` of ``geometry.model`` with the band half width ``band_widths[h]`` (in tokens) for head h."""
+    pixel_length, prompt_length, frame_size = geometry.pixel_length, geometry.prompt_length, geometry.frame_size
+    real_length = pixel_length + prompt_length
+
+    def mask_mod(b, h, q_idx, kv_idx):
+        band_width = band_widths[h]
+        distance = torch.abs(q_idx - kv_idx)
+        if geometry.model == "wan":
+            return (kv_idx < frame_size) | (distance <= band_width)
+        if geometry.model == "cog":
+            return (q_idx < prompt_length) | (kv_idx < prompt_length) | (distance < band_width)
+        real_mask = (kv_idx < real_length) & (q_idx < real_length)
+        fake_mask = (kv_idx >= real_length) & (q_idx >= real_length)
+        text_column_mask = (pixel_length <= kv_idx) & (kv_idx < real_length)
+        text_row_mask = (pixel_length <= q_idx) & (q_idx < real_length)
+        return (real_mask & ((distance < band_width) | text_column_mask | text_row_mask)) | fake_mask
+
+    # Read by the index-mapped kernel, which evaluates the band in Triton
+    mask_mod.band_widths = band_widths
+    return mask_mod
+
+
+def band_widths_in_tokens(geometry, multipliers, device="cpu"):
+    return torch.tensor(
+        [temporal_head_band_width(geometry.model, multiplier, geometry.frame_size, geometry.block_size) for multiplier in multipliers],
+        dtype=torch.int32, device=device
+    )
+
+
+def create_head_width_block_mask(geometry, multipliers, device="cuda"):
+    """Per-head BlockMask (B = 1, H = len(multipliers)) with the band of ``multipliers[h]`` frames for head h."""
+    from .block_mask_cache import create_block_mask_persistent
+
+    band_widths = band_widths_in_tokens(geometry, multipliers, device)
+    mask_mod = band_mask_mod(geometry, band_widths)
+    cache_key = dict(geometry.cache_key(), band_widths=band_widths.tolist())
+    seq_len = geometry.seq_len
+    return create_block_mask_persistent(mask_mod, cache_key, 1, len(multipliers), seq_len, seq_len, device=device, _compile=True)
+
+
+def active_blocks_per_head(block_mask):
+    """[B * H] number of non-empty blocks of every BlockMask row."""
+    counts = block_mask.kv_num_blocks.sum(-1)
+    if block_mask.full_kv_num_blocks is not None:
+        counts = counts + block_mask.full_kv_num_blocks.sum(-1)
+    return counts.flatten().cpu()
+
+
+def sampled_band_mass(query, key, best_mask_idx, geometry, band_widths, num_sampled_rows=32):
+    """[num_widths, cfg, num_heads] fraction of the attention of sampled rows inside the band of each width.
+
+    The rows and the band are taken in the placed order of every head: frame major for spatial heads,
+    token major for temporal heads.
+    """
+    cfg, num_heads, seq_len, dim = query.size()
+    device = query.device
+    index = placement_index(geometry.context_length, geometry.num_frame, geometry.frame_size, geometry.text_first, device=device)
+    inverse = torch.empty_like(index)
+    inverse[index] = torch.arange(seq_len, device=device)
+
+    rows = torch.randint(low=0, high=seq_len, size=(min(num_sampled_rows, seq_len),), device=device)
+    temporal = (best_mask_idx == 1)[..., None, None]
+    sampled_q = torch.where(temporal, query[:, :, index[rows]], query[:, :, rows])
+    sampled_qk_scores = torch.matmul(sampled_q, key.transpose(-2, -1)) / (dim**0.5)
+    sampled_attn_weights = torch.softmax(sampled_qk_scores.float(), dim=-1)
+
+    # Placed position of every frame-major key
+    kv_spatial = torch.arange(seq_len, device=device)[None, :]
+    kv_temporal = inverse[None, :]
+    mass = []
+    for band_width in band_widths:
+        mask_mod = band_mask_mod(geometry, band_width[None])
+        spatial_mass = torch.einsum("chrs,rs->chr", sampled_attn_weights, mask_mod(None, 0, rows[:, None], kv_spatial).float())
+        temporal_mass = torch.einsum("chrs,rs->chr", sampled_attn_weights, mask_mod(None, 0, rows[:, None], kv_temporal).float())
+        mass.append(torch.where(temporal[..., 0], temporal_mass, spatial_mass).mean(dim=-1))
+    return torch.stack(mass)
+
+
+def allocate_head_widths(mass, costs, budget):
+    """Greedy width per (layer call, head) that maximizes the kept attention mass within ``budget`` blocks.
+
+    Args:
+        mass (np.ndarray): [num_calls, num_widths, num_heads] kept attention mass, non decreasing in the width.
+        costs (np.ndarray): [num_widths] active blocks of one head with each width, increasing.
+        budget (float): Total number of active blocks over all layer calls and heads.
+
+    Returns:
+        np.ndarray: [num_calls, num_heads] index of the width of every head.
+    """
+    num_calls, num_widths, num_heads = mass.shape
+    levels = np.zeros((num_calls, num_heads), dtype=np.int64)
+    total = costs[0] * num_calls * num_heads
+
+    def push(heap, call, head, level):
+        if level + 1 < num_widths:
+            gain = (mass[call, level + 1, head] - mass[call, level, head]) / (costs[level + 1] - costs[level])
+            heapq.heappush(heap, (-gain, call, head, level + 1))
+
+    heap = []
+    for call in range(num_calls):
+        for head in range(num_heads):
+            push(heap, call, head, 0)
+    while heap:
+        _, call, head, level = heapq.heappop(heap)
+        extra = costs[level] - costs[level - 1]
+        if total + extra > budget:
+            continue
+        total += extra
+        levels[call, head] = level
+        push(heap, call, head, level)
+    return levels
+
+
+class HeadWidthRecorder(LayerCallCounter):
+    """Accumulates ``sampled_band_mass`` per layer call for the widths ``WIDTH_FACTORS`` x the uniform width.
+
+    The mass is averaged over the cfg / batch rows of the query, so the widths are per (layer call, head) and
+    hold for any batch size.
+    """
+
+    def __init__(self, width_factors=WIDTH_FACTORS, num_sampled_rows=32):
+        super().__init__()
+        self.width_factors = width_factors
+        self.num_sampled_rows = num_sampled_rows
+        self.mass = {}
+        self.counts = {}
+        self.geometry = None
+        self.device = None
+
+    def multipliers(self, geometry):
+        return [geometry.multiplier * factor for factor in self.width_factors]
+
+    def __call__(self, layer_idx, timestep, query, key, best_mask_idx, geometry):
+        key_ = self.get_key(layer_idx, timestep_to_float(timestep))
+        self.geometry, self.device = geometry, query.device
+
+        band_widths = band_widths_in_tokens(geometry, self.multipliers(geometry), query.device)
+        mass = sampled_band_mass(query, key, best_mask_idx, geometry, band_widths, self.num_sampled_rows)
+        if key_ not in self.mass:
+            self.mass[key_] = np.zeros((len(self.width_factors), query.shape[1]))
+            self.counts[key_] = 0
+        self.mass[key_] += mass.sum(dim=1).cpu().numpy()
+        self.counts[key_] += query.shape[0]
+        # The calibration run itself uses the uniform width
+        return None
+
+    def block_costs(self):
+        """[num_widths] active blocks of one head with each width."""
+        block_mask = create_head_width_block_mask(self.geometry, self.multipliers(self.geometry), device=self.device)
+        return active_blocks_per_head(block_mask).numpy().astype(np.float64)
+
+    def to_table(self, budget=1.0):
+        """Allocate the widths within ``budget`` x the blocks of the uniform width."""
+        keys = sorted(self.mass)
+        mass = np.stack([self.mass[key] / self.counts[key] for key in keys])
+        costs = self.block_costs()
+        num_calls, _, num_heads = mass.shape
+        uniform_level = self.width_factors.index(1.0)
+        levels = allocate_head_widths(mass, costs, budget * costs[uniform_level] * num_calls * num_heads)
+        return HeadWidthTable(
+            np.array(keys, dtype=np.int64).reshape(-1, 2), levels, np.array(self.multipliers(self.geometry)), costs, uniform_level
+        )
+
+
+class HeadWidthTable(LayerCallCounter):
+    """Calibrated width per (layer call, head), one BlockMask (B = 1) broadcast over the cfg / batch rows.
+
+    Calls that were not calibrated, or with another number of heads, use the uniform BlockMask.
+
+    Args:
+        keys (np.ndarray): [N, 2] ``(layer_idx, call index within the timestep)`` of every row.
+        levels (np.ndarray): [N, num_heads] index into ``multipliers`` of every head.
+        multipliers (np.ndarray): [num_widths] band widths, in frames.
+        costs (np.ndarray): [num_widths] active blocks of one head with each width, for the FLOP report.
+        uniform_level (int): Index of the ``--sparsity`` width the budget is relative to.
+    """
+
+    def __init__(self, keys, levels, multipliers, costs, uniform_level):
+        super().__init__()
+        if levels.ndim != 2 or len(levels) != len(keys):
+            raise ValueError(f"Head width levels must be [num_calls, num_heads] with {len(keys)} calls, got {levels.shape}")
+        if levels.size and not 0 <= levels.min() <= levels.max() < len(multipliers):
+            raise ValueError(f"Head width levels must index the {len(multipliers)} widths")
+        self.keys = keys
+        self.levels = levels
+        self.num_heads = levels.shape[1]
+        self.multipliers = multipliers
+        self.costs = costs
+        self.uniform_level = int(uniform_level)
+        self.rows = {tuple(int(i) for i in key): row for row, key in enumerate(keys)}
+        self.block_masks = {}
+        self.fallbacks = 0
+
+    def get_block_mask(self, geometry, levels, device):
+        # Layer calls with the same widths share one BlockMask
+        cache_key = (tuple(levels.tolist()), torch.device(device))
+        if cache_key not in self.block_masks:
+            self.block_masks[cache_key] = create_head_width_block_mask(geometry, self.multipliers[levels].tolist(), device=device)
+        return self.block_masks[cache_key]
+
+    def __call__(self, layer_idx, timestep, query, key, best_mask_idx, geometry):
+        row = self.rows.get(self.get_key(layer_idx, timestep_to_float(timestep)))
+        if row is None:
+            return None
+        if query.shape[1] != self.num_heads:
+            self.fallbacks += 1
+            return None
+        return self.get_block_mask(geometry, self.levels[row], query.device)
+
+    def relative_flops(self):
+        """Attention blocks of the table relative to the uniform width."""
+        return self.costs[self.levels].sum() / (self.costs[self.uniform_level] * self.levels.size)
+
+    def summary(self):
+        widths = self.multipliers[self.levels]
+        return (
+            f"Head widths: {len(self.keys)} layer calls, {len(self.block_masks)} BlockMasks, "
+            f"widths {widths.min():.2f} - {widths.max():.2f} frames (mean {widths.mean():.2f}), "
+            f"{self.relative_flops():.3f}x the attention blocks of the uniform width, "
+            f"{self.fallbacks} calls with another number of heads"
+        )
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez_compressed(path, keys=self.keys, levels=self.levels, multipliers=self.multipliers, costs=self.costs, uniform_level=self.uniform_level)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["keys"], data["levels"], data["multipliers"], data["costs"], data["uniform_level"])
+
+
+def calibrate_head_widths(attn_module, run_prompt, prompts, budget=1.0, path=None, num_sampled_rows=32):
+    """Record the band mass of ``attn_module`` while ``run_prompt(prompt)`` generates every prompt, then allocate the widths."""
+    recorder = HeadWidthRecorder(num_sampled_rows=num_sampled_rows)
+    head_widths, attn_module.head_widths = attn_module.head_widths, recorder
+    try:
+        for prompt in prompts:
+            run_prompt(prompt)
+    finally:
+        attn_module.head_widths = head_widths
+
+    table = recorder.to_table(budget)
+    if path is not None:
+        table.save(path)
+    return table
@@ -0,0 +1,255 @@
+"""Block-sparse attention that applies the sparse head placement as a gather.
+
+``attention_core_logic`` used to copy Q / K / V of the temporal heads into token-major order, run
+FlexAttention on the copies and copy the output back. This kernel walks the same BlockMask but loads
+the rows of the frame-major Q / K / V through ``placement_index`` and stores the output rows the same
+way, so the only full-sequence tensor it allocates is the output.
+
+The mask of the partial blocks is the ``generate_temporal_head_mask_mod`` of each model, re-implemented
+below since a Python ``mask_mod`` cannot be called from Triton. Which mask and which options it applies
+only come from the ``SparseAttentionGeometry``, so the mask_mod has to be built from the same geometry.
+``ref_index_mapped_attention`` in ``svg.sparse.placement`` is the PyTorch reference.
+"""
+
+import torch
+import triton
+import triton.language as tl
+
+from .placement import temporal_head_band_width
+from .placement_kernels import placed_token_index
+
+
+MASK_KINDS = {
+    "hunyuan": 0,
+    "wan": 1,
+    "cog": 2,
+}
+
+
+@triton.jit
+def temporal_head_mask(q_idx, kv_idx, band_width, pixel_length, prompt_length, frame_size, MASK_KIND: tl.constexpr, ATTN_SINK: tl.constexpr):
+    # generate_temporal_head_mask_mod of svg/models/{hyvideo/modules,wan,cog}/utils.py, on the placed indices
+    q_idx = q_idx[:, None]
+    kv_idx = kv_idx[None, :]
+    distance = tl.abs(q_idx - kv_idx)
+    if MASK_KIND == 0:
+        real_length = pixel_length + prompt_length
+        real_mask = (kv_idx < real_length) & (q_idx < real_length)
+        fake_mask = (kv_idx >= real_length) & (q_idx >= real_length)
+        text_column_mask = (pixel_length <= kv_idx) & (kv_idx < real_length)
+        text_row_mask = (pixel_length <= q_idx) & (q_idx < real_length)
+        video_mask = (distance < band_width) | text_column_mask | text_row_mask
+        mask = (real_mask & video_mask) | fake_mask
+    elif MASK_KIND == 1:
+        mask = (kv_idx < frame_size) | (distance <= band_width)
+    else:
+        sink_length = prompt_length + frame_size if ATTN_SINK else prompt_length
+        mask = (q_idx < prompt_length) | (kv_idx < sink_length) | (distance < band_width)
+    return mask
+
+
+@triton.jit
+def index_mapped_attention_tile(
+    acc, l_i, m_i, query,
+    key_ptr, value_ptr,
+    key_stride_s, key_stride_d, value_stride_s, value_stride_d,
+    offset_m, start_n, is_temporal, qk_scale,
+    seq_len, context_length, num_frame, frame_size,
+    band_width, prompt_length,
+    APPLY_MASK: tl.constexpr,
+    MASK_KIND: tl.constexpr,
+    ATTN_SINK: tl.constexpr,
+    TEXT_FIRST: tl.constexpr,
+    HEAD_DIM: tl.constexpr,
+    BLOCK_N: tl.constexpr,
+):
+    offset_n = start_n + tl.arange(0, BLOCK_N)
+    offset_d = tl.arange(0, HEAD_DIM)
+    kv_valid = offset_n < seq_len
+
+    kv_token = offset_n
+    if is_temporal:
+        kv_token = placed_token_index(offset_n, seq_len, context_length, num_frame, frame_size, TEXT_FIRST)
+
+    key = tl.load(key_ptr + kv_token[:, None] * key_stride_s + offset_d[None, :] * key_stride_d, mask=kv_valid[:, None], other=0.0)
+    value = tl.load(value_ptr + kv_token[:, None] * value_stride_s + offset_d[None, :] * value_stride_d, mask=kv_valid[:, None], other=0.0)
+
+    qk = tl.dot(query, tl.trans(key)) * qk_scale
+    valid = kv_valid[None, :]
+    if APPLY_MASK:
+        valid = valid & temporal_head_mask(offset_m, offset_n, band_width, num_frame * frame_size, prompt_length, frame_size, MASK_KIND, ATTN_SINK)
+    qk = tl.where(valid, qk, float("-inf"))
+
+    # Online softmax, in base 2
+    m_new = tl.maximum(m_i, tl.max(qk, 1))
+    m_safe = tl.where(m_new == float("-inf"), 0.0, m_new)
+    p = tl.math.exp2(qk - m_safe[:, None])
+    alpha = tl.math.exp2(m_i - m_safe)
+    l_i = l_i * alpha + tl.sum(p, 1)
+    acc = acc * alpha[:, None] + tl.dot(p.to(value.dtype), value)
+    return acc, l_i, m_new
+
+
+@triton.jit
+def index_mapped_attention_kernel(
+    query_ptr, key_ptr, value_ptr, # [cfg, num_heads, seq_len, head_dim] in frame-major order
+    out_ptr, # [cfg, num_heads, seq_len, head_dim]
+    best_mask_idx_ptr, # [cfg, num_heads]
+    kv_num_blocks_ptr, kv_indices_ptr, full_kv_num_blocks_ptr, full_kv_indices_ptr, # BlockMask, [mask_heads, num_q_blocks(, num_kv_blocks)]
+    query_stride_b, query_stride_h, query_stride_s, query_stride_d,
+    key_stride_b, key_stride_h, key_stride_s, key_stride_d,
+    value_stride_b, value_stride_h, value_stride_s, value_stride_d,
+    out_stride_b, out_stride_h, out_stride_s, out_stride_d,
+    mask_idx_stride_b, mask_idx_stride_h,
+    kv_num_stride_h, kv_num_stride_q, kv_indices_stride_h, kv_indices_stride_q,
+    full_kv_num_stride_h, full_kv_num_stride_q, full_kv_indices_stride_h, full_kv_indices_stride_q,
+    qk_scale,
+    num_heads, seq_len, context_length, num_frame, frame_size,
+    band_width, band_widths_ptr, prompt_length, # band_widths_ptr: [num_heads] per-head band widths, if PER_HEAD_BAND
+    mask_heads, # 1, num_heads or cfg * num_heads rows of the BlockMask
+    PER_HEAD_BAND: tl.constexpr,
+    HAS_FULL_BLOCKS: tl.constexpr,
+    MASK_KIND: tl.constexpr,
+    ATTN_SINK: tl.constexpr,
+    TEXT_FIRST: tl.constexpr,
+    HEAD_DIM: tl.constexpr,
+    BLOCK_M: tl.constexpr, # = BlockMask Q block size
+    BLOCK_N: tl.constexpr,
+    SPARSE_BLOCK_N: tl.constexpr, # = BlockMask KV block size
+):
+    q_block = tl.program_id(0)
+    batch_head = tl.program_id(1)
+    cfg = batch_head // num_heads
+    head = batch_head - cfg * num_heads
+    mask_head = batch_head % mask_heads
+    if PER_HEAD_BAND:
+        band_width = tl.load(band_widths_ptr + head)
+
+    # Load best mask idx (0 is spatial, 1 is temporal)
+    is_temporal = tl.load(best_mask_idx_ptr + cfg * mask_idx_stride_b + head * mask_idx_stride_h)
+
+    offset_m = q_block * BLOCK_M + tl.arange(0, BLOCK_M)
+    offset_d = tl.arange(0, HEAD_DIM)
+    q_valid = offset_m < seq_len
+
+    q_token = offset_m
+    if is_temporal:
+        q_token = placed_token_index(offset_m, seq_len, context_length, num_frame, frame_size, TEXT_FIRST)
+
+    query = tl.load(
+        query_ptr + cfg * query_stride_b + head * query_stride_h + q_token[:, None] * query_stride_s + offset_d[None, :] * query_stride_d,
+        mask=q_valid[:, None], other=0.0
+    )
+    key_ptr += cfg * key_stride_b + head * key_stride_h
+    value_ptr += cfg * value_stride_b + head * value_stride_h
+
+    m_i = tl.full([BLOCK_M], float("-inf"), dtype=tl.float32)
+    l_i = tl.zeros([BLOCK_M], dtype=tl.float32)
+    acc = tl.zeros([BLOCK_M, HEAD_DIM], dtype=tl.float32)
+
+    # Partial blocks, the mask is evaluated
+    num_blocks = tl.load(kv_num_blocks_ptr + mask_head * kv_num_stride_h + q_block * kv_num_stride_q)
+    for i in range(num_blocks):
+        kv_block = tl.load(kv_indices_ptr + mask_head * kv_indices_stride_h + q_block * kv_indices_stride_q + i)
+        for sub_block in tl.static_range(SPARSE_BLOCK_N // BLOCK_N):
+            acc, l_i, m_i = index_mapped_attention_tile(
+                acc, l_i, m_i, query, key_ptr, value_ptr,
+                key_stride_s, key_stride_d, value_stride_s, value_stride_d,
+                offset_m, kv_block * SPARSE_BLOCK_N + sub_block * BLOCK_N, is_temporal, qk_scale,
+                seq_len, context_length, num_frame, frame_size, band_width, prompt_length,
+                True, MASK_KIND, ATTN_SINK, TEXT_FIRST, HEAD_DIM, BLOCK_N,
+            )
+
+    # Full blocks, no mask
+    if HAS_FULL_BLOCKS:
+        num_blocks = tl.load(full_kv_num_blocks_ptr + mask_head * full_kv_num_stride_h + q_block * full_kv_num_stride_q)
+        for i in range(num_blocks):
+            kv_block = tl.load(full_kv_indices_ptr + mask_head * full_kv_indices_stride_h + q_block * full_kv_indices_stride_q + i)
+            for sub_block in tl.static_range(SPARSE_BLOCK_N // BLOCK_N):
+                acc, l_i, m_i = index_mapped_attention_tile(
+                    acc, l_i, m_i, query, key_ptr, value_ptr,
+                    key_stride_s, key_stride_d, value_stride_s, value_stride_d,
+                    offset_m, kv_block * SPARSE_BLOCK_N + sub_block * BLOCK_N, is_temporal, qk_scale,
+                    seq_len, context_length, num_frame, frame_size, band_width, prompt_length,
+                    False, MASK_KIND, ATTN_SINK, TEXT_FIRST, HEAD_DIM, BLOCK_N,
+                )
+
+    acc = acc / l_i[:, None]
+    tl.store(
+        out_ptr + cfg * out_stride_b + head * out_stride_h + q_token[:, None] * out_stride_s + offset_d[None, :] * out_stride_d,
+        acc.to(out_ptr.dtype.element_ty), mask=q_valid[:, None]
+    )
+
+
+def index_mapped_attention(query, key, value, best_mask_idx, block_mask, geometry, out=None, BLOCK_N=64):
+    """Sparse head placement, FlexAttention with ``block_mask`` and hidden states placement in one kernel.
+
+    Args:
+        query, key, value (torch.Tensor): [cfg, num_heads, seq_len, head_dim], in frame-major order. Any strides.
+        best_mask_idx (torch.Tensor): [cfg, num_heads], 0 for spatial and 1 for temporal heads.
+        block_mask (BlockMask): The BlockMask of ``prepare_flexattention``.
+        geometry (SparseAttentionGeometry): The geometry the mask_mod of the BlockMask was built from.
+        out (torch.Tensor): Optional output buffer, in frame-major order.
+    """
+    cfg, num_heads, seq_len, head_dim = query.shape
+    context_length, num_frame, frame_size = geometry.context_length, geometry.num_frame, geometry.frame_size
+    assert seq_len == geometry.seq_len
+    assert geometry.model == "cog" or not geometry.attn_sink, f"No attn_sink in the {geometry.model} temporal head mask"
+
+    BLOCK_M, SPARSE_BLOCK_N = block_mask.BLOCK_SIZE
+    assert SPARSE_BLOCK_N % BLOCK_N == 0
+
+    if out is None:
+        out = torch.empty_like(query)
+
+    # [B, H, num_q_blocks(, num_kv_blocks)] with B * H = 1, num_heads (per-head widths) or cfg * num_heads
+    num_q_blocks = triton.cdiv(seq_len, BLOCK_M)
+    kv_num_blocks = block_mask.kv_num_blocks.flatten(0, 1)[:, :num_q_blocks]
+    kv_indices = block_mask.kv_indices.flatten(0, 1)[:, :num_q_blocks].contiguous()
+    mask_heads = kv_num_blocks.shape[0]
+    assert mask_heads in (1, num_heads, cfg * num_heads), f"BlockMask with {mask_heads} heads does not match {cfg} x {num_heads}"
+
+    # Adaptive widths (svg.sparse.head_widths) attach the band width of every head to the mask_mod
+    band_widths = getattr(block_mask.mask_mod, "band_widths", None)
+    if band_widths is not None:
+        assert band_widths.numel() == num_heads, f"{band_widths.numel()} band widths for {num_heads} heads"
+
+    has_full_blocks = block_mask.full_kv_num_blocks is not None
+    if has_full_blocks:
+        full_kv_num_blocks = block_mask.full_kv_num_blocks.flatten(0, 1)[:, :num_q_blocks]
+        full_kv_indices = block_mask.full_kv_indices.flatten(0, 1)[:, :num_q_blocks].contiguous()
+    else:
+        full_kv_num_blocks, full_kv_indices = kv_num_blocks, kv_indices
+
+    sm_scale = head_dim ** -0.5
+    grid = (num_q_blocks, cfg * num_heads)
+
+    index_mapped_attention_kernel[grid](
+        query, key, value, out,
+        best_mask_idx,
+        kv_num_blocks, kv_indices, full_kv_num_blocks, full_kv_indices,
+        query.stride(0), query.stride(1), query.stride(2), query.stride(3),
+        key.stride(0), key.stride(1), key.stride(2), key.stride(3),
+        value.stride(0), value.stride(1), value.stride(2), value.stride(3),
+        out.stride(0), out.stride(1), out.stride(2), out.stride(3),
+        best_mask_idx.stride(0), best_mask_idx.stride(1),
+        kv_num_blocks.stride(0), kv_num_blocks.stride(1), kv_indices.stride(0), kv_indices.stride(1),
+        full_kv_num_blocks.stride(0), full_kv_num_blocks.stride(1), full_kv_indices.stride(0), full_kv_indices.stride(1),
+        sm_scale * 1.44269504, # log2(e)
+        num_heads, seq_len, context_length, num_frame, frame_size,
+        temporal_head_band_width(geometry.model, geometry.multiplier, frame_size, geometry.block_size),
+        kv_num_blocks if band_widths is None else band_widths, geometry.prompt_length,
+        mask_heads,
+        PER_HEAD_BAND=band_widths is not None,
+        HAS_FULL_BLOCKS=has_full_blocks,
+        MASK_KIND=MASK_KINDS[geometry.model],
+        ATTN_SINK=geometry.attn_sink,
+        TEXT_FIRST=geometry.text_first,
+        HEAD_DIM=head_dim,
+        BLOCK_M=BLOCK_M,
+        BLOCK_N=BLOCK_N,
+        SPARSE_BLOCK_N=SPARSE_BLOCK_N,
+        num_warps=8,
+        num_stages=2,
+    )
+    return out
@@ -0,0 +1,187 @@
+"""Analytic spatial / temporal masks used by the online profiling (sample_mse)."""
+
+import math
+
+import torch
+
+
+def token_major_index(idx, num_frame, frame_size):
+    """Map a frame-major pixel index to its token-major position."""
+    return (idx % frame_size) * num_frame + idx // frame_size
+
+
+def block_band(q_idx, kv_idx, block_thres, block_size=128):
+    """Blocks (i, j) with |i - j| < block_thres // block_size, like the dense mask builders."""
+    num_diag = int(block_thres // block_size)
+    return torch.abs(q_idx // block_size - kv_idx // block_size) < num_diag
+
+
+def block_band_mask(num_tokens, block_thres, block_size=128, device="cpu"):
+    """Dense [num_tokens, num_tokens] version of ``block_band``, compared at block granularity and then expanded."""
+    num_block = math.ceil(num_tokens / block_size)
+    block_idx = torch.arange(num_block, device=device)
+    block_mask = torch.abs(block_idx[:, None] - block_idx[None, :]) < int(block_thres // block_size)
+    block_mask = block_mask.repeat_interleave(block_size, dim=0).repeat_interleave(block_size, dim=1)
+    return block_mask[:num_tokens, :num_tokens].contiguous()
+
+
+def token_major_to_frame_major_mask(mask, num_frame, frame_size):
+    """Permute a pixel mask laid out in token-major order into frame-major order."""
+    pixel_length = num_frame * frame_size
+    return mask.reshape(frame_size, num_frame, frame_size, num_frame).permute(1, 0, 3, 2).reshape(pixel_length, pixel_length)
+
+
+def generate_hunyuan_profiling_mask_mod(mask_name, context_length, num_frame, frame_size, block_size=128):
+    """HunyuanVideo: text is placed after the video tokens and attends / is attended everywhere."""
+    pixel_length = num_frame * frame_size
+    block_thres = frame_size * 1.5
+
+    def spatial_mask_mod(b, h, q_idx, kv_idx):
+        text_mask = (q_idx >= pixel_length) | (kv_idx >= pixel_length)
+        return text_mask | block_band(q_idx, kv_idx, block_thres, block_size)
+
+    def temporal_mask_mod(b, h, q_idx, kv_idx):
+        text_mask = (q_idx >= pixel_length) | (kv_idx >= pixel_length)
+        q_token = token_major_index(q_idx, num_frame, frame_size)
+        kv_token = token_major_index(kv_idx, num_frame, frame_size)
+        return text_mask | block_band(q_token, kv_token, block_thres, block_size)
+
+    return spatial_mask_mod if mask_name == "spatial" else temporal_mask_mod
+
+
+def generate_wan_profiling_mask_mod(mask_name, context_length, num_frame, frame_size, block_size=128):
+    """Wan 2.1: no text tokens in self attention, the first frame is an attention sink."""
+    assert context_length == 0, f"Wan self attention has no context tokens, got {context_length}"
+    block_thres = frame_size * 2
+
+    def spatial_mask_mod(b, h, q_idx, kv_idx):
+        first_frame_mask = kv_idx < frame_size
+        return first_frame_mask | block_band(q_idx, kv_idx, block_thres, block_size)
+
+    def temporal_mask_mod(b, h, q_idx, kv_idx):
+        q_token = token_major_index(q_idx, num_frame, frame_size)
+        kv_token = token_major_index(kv_idx, num_frame, frame_size)
+        first_frame_mask = kv_token < frame_size
+        return first_frame_mask | block_band(q_token, kv_token, block_thres, block_size)
+
+    return spatial_mask_mod if mask_name == "spatial" else temporal_mask_mod
+
+
+def generate_cog_profiling_mask_mod(mask_name, context_length, num_frame, frame_size, block_size=128):
+    """CogVideoX: text is placed before the video tokens."""
+    pixel_length = num_frame * frame_size
+    block_thres = frame_size * 1.5
+    # The spatial band is laid out on absolute indices, covering whole blocks of the pixel length
+    band_length = -(-pixel_length // block_size) * block_size
+
+    def spatial_mask_mod(b, h, q_idx, kv_idx):
+        text_mask = (q_idx < context_length) | (kv_idx < context_length)
+        band_mask = (q_idx < band_length) & (kv_idx < band_length) & block_band(q_idx, kv_idx, block_thres, block_size)
+        return text_mask | band_mask
+
+    def temporal_mask_mod(b, h, q_idx, kv_idx):
+        pixel_mask = (q_idx >= context_length) & (kv_idx >= context_length)
+        q_token = token_major_index(q_idx - context_length, num_frame, frame_size)
+        kv_token = token_major_index(kv_idx - context_length, num_frame, frame_size)
+        return pixel_mask & block_band(q_token, kv_token, block_thres, block_size)
+
+    return spatial_mask_mod if mask_name == "spatial" else temporal_mask_mod
+
+
+PROFILING_MASK_MODS = {
+    "hunyuan": generate_hunyuan_profiling_mask_mod,
+    "wan": generate_wan_profiling_mask_mod,
+    "cog": generate_cog_profiling_mask_mod,
+}
+
+
+def get_hunyuan_attention_mask(mask_name, context_length, num_frame, frame_size, block_size=128, device="cpu"):
+    pixel_length = num_frame * frame_size
+    seq_len = context_length + pixel_length
+
+    pixel_attn_mask = block_band_mask(pixel_length, frame_size * 1.5, block_size, device=device)
+    if mask_name == "temporal":
+        pixel_attn_mask = token_major_to_frame_major_mask(pixel_attn_mask, num_frame, frame_size)
+
+    attention_mask = torch.ones((seq_len, seq_len), dtype=torch.bool, device=device)
+    attention_mask[:pixel_length, :pixel_length] = pixel_attn_mask
+    return attention_mask
+
+
+def get_wan_attention_mask(mask_name, context_length, num_frame, frame_size, block_size=128, device="cpu"):
+    assert context_length == 0, f"Wan self attention has no context tokens, got {context_length}"
+    pixel_length = num_frame * frame_size
+
+    pixel_attn_mask = block_band_mask(pixel_length, frame_size * 2, block_size, device=device)
+    pixel_attn_mask[:, :frame_size] = 1 # First Frame Sink
+    if mask_name == "temporal":
+        pixel_attn_mask = token_major_to_frame_major_mask(pixel_attn_mask, num_frame, frame_size)
+    return pixel_attn_mask
+
+
+def get_cog_attention_mask(mask_name, context_length, num_frame, frame_size, block_size=128, device="cpu"):
+    pixel_length = num_frame * frame_size
+    seq_len = context_length + pixel_length
+
+    attention_mask = torch.zeros((seq_len, seq_len), dtype=torch.bool, device=device)
+    if mask_name == "spatial":
+        band_length = min(math.ceil(pixel_length / block_size) * block_size, seq_len)
+        attention_mask[:band_length, :band_length] = block_band_mask(band_length, frame_size * 1.5, block_size, device=device)
+        attention_mask[:context_length, :] = 1
+        attention_mask[:, :context_length] = 1
+    else:
+        pixel_attn_mask = block_band_mask(pixel_length, frame_size * 1.5, block_size, device=device)
+        attention_mask[context_length:, context_length:] = token_major_to_frame_major_mask(pixel_attn_mask, num_frame, frame_size)
+    return attention_mask
+
+
+ATTENTION_MASK_BUILDERS = {
+    "hunyuan": get_hunyuan_attention_mask,
+    "wan": get_wan_attention_mask,
+    "cog": get_cog_attention_mask,
+}
+
+
+def get_attention_mask(model, mask_name, context_length, num_frame, frame_size, device="cpu"):
+    """Dense boolean spatial / temporal mask of ``model``, equal row by row to ``get_profiling_masks``."""
+    return ATTENTION_MASK_BUILDERS[model](mask_name, context_length, num_frame, frame_size, device=device)
+
+
+class AttentionMaskRows:
+    """A [seq_len, seq_len] boolean attention mask that is evaluated row by row and never stored.
+
+    Indexing with ``mask[rows, :]`` (as ``sample_mse`` does) evaluates ``mask_mod`` only for the
+    requested query rows, so memory is ``len(rows) * seq_len`` instead of ``seq_len ** 2``.
+    """
+
+    def __init__(self, mask_mod, seq_len, device="cuda"):
+        self.mask_mod = mask_mod
+        self.seq_len = seq_len
+        self.device = device
+        self.kv_idx = torch.arange(seq_len, device=device)[None, :]
+
+    @property
+    def shape(self):
+        return (self.seq_len, self.seq_len)
+
+    def __len__(self):
+        return self.seq_len
+
+    def __getitem__(self, index):
+        if isinstance(index, tuple):
+            rows, cols = index
+            assert cols == slice(None), "Only full rows can be evaluated"
+        else:
+            rows = index
+        q_idx = torch.as_tensor(rows, device=self.device).reshape(-1, 1)
+        return self.mask_mod(None, None, q_idx, self.kv_idx)
+
+
+def get_profiling_masks(model, context_length, num_frame, frame_size, device="cuda", mask_names=("spatial", "temporal")):
+    """Row-evaluated spatial and temporal masks for ``sample_mse`` of ``model`` ("hunyuan", "wan" or "cog")."""
+    seq_len = context_length + num_frame * frame_size
+    generate_mask_mod = PROFILING_MASK_MODS[model]
+    return [
+        AttentionMaskRows(generate_mask_mod(mask_name, context_length, num_frame, frame_size), seq_len, device=device)
+        for mask_name in mask_names
+    ]
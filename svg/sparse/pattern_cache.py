@@ -0,0 +1,138 @@
+"""Reuse of the online spatial / temporal decision (best_mask_idx) across timesteps."""
+
+import torch
+
+
+class LayerCallCounter:
+    """Keys calls by ``(layer_idx, call index within the timestep)``.
+
+    Layers that are called several times per timestep (e.g. the separate cond / uncond passes of Wan,
+    or HunyuanVideo's double and single blocks sharing layer indices) get one key per call.
+    """
+
+    def __init__(self):
+        self.timestep_calls = {}
+
+    def reset(self):
+        self.timestep_calls.clear()
+
+    def new_generation(self, layer_idx):
+        pass
+
+    def get_key(self, layer_idx, timestep):
+        last = self.timestep_calls.get(layer_idx)
+        if last is not None and timestep > last[0]:
+            # Timesteps decrease while denoising, a larger one means that a new video has started
+            self.new_generation(layer_idx)
+            last = None
+
+        if last is None or last[0] != timestep:
+            last = self.timestep_calls[layer_idx] = [timestep, 0]
+        else:
+            last[1] += 1
+        return (layer_idx, last[1])
+
+
+def timestep_to_float(timestep):
+    if torch.is_tensor(timestep):
+        timestep = timestep.reshape(-1)[0].item()
+    return float(timestep)
+
+
+class PatternDecisionCache(LayerCallCounter):
+    """Caches ``best_mask_idx`` per layer and re-profiles only every ``reprofile_interval`` steps.
+
+    A cached decision is also dropped when the mean query norm of the rows sampled at profiling time
+    drifts by more than ``drift_threshold`` (relative) on any head. The drift of every layer is kept on
+    the device and read at the first call of the next step, so the check costs one host sync per step
+    and a drifted decision is re-profiled one step later. It is off when ``drift_threshold`` is None.
+    """
+
+    def __init__(self, reprofile_interval=5, drift_threshold=None, num_sampled_rows=32):
+        super().__init__()
+        self.reprofile_interval = reprofile_interval
+        self.drift_threshold = drift_threshold
+        self.num_sampled_rows = num_sampled_rows
+
+        self.entries = {}
+        self.step_timestep = None
+        self.pending_drifts = [] # (key, drift) of the cached decisions used during the current step
+
+        self.hits = 0
+        self.misses = 0
+        self.drift_misses = 0
+        self.drift_syncs = 0
+
+    def reset(self):
+        super().reset()
+        self.entries.clear()
+        self.step_timestep = None
+        self.pending_drifts = []
+
+    def new_generation(self, layer_idx):
+        self.entries = {key: entry for key, entry in self.entries.items() if key[0] != layer_idx}
+
+    def row_norm(self, query, sampled_rows):
+        return query[:, :, sampled_rows, :].float().norm(dim=-1).mean(dim=-1)
+
+    def queue_drift(self, key, entry, query):
+        row_norm = self.row_norm(query, entry["sampled_rows"])
+        drift = ((row_norm - entry["row_norm"]).abs() / entry["row_norm"].clamp_min(1e-6)).max()
+        self.pending_drifts.append((key, drift))
+
+    def read_drifts(self):
+        """Flag the decisions whose query drifted during the last step, with one host sync for all the layers."""
+        if not self.pending_drifts:
+            return
+        keys, drifts = zip(*self.pending_drifts)
+        self.pending_drifts = []
+        self.drift_syncs += 1
+        for key, drift in zip(keys, torch.stack(drifts).tolist()):
+            if drift > self.drift_threshold and key in self.entries:
+                self.entries[key]["drifted"] = True
+
+    def __call__(self, layer_idx, timestep, query, profile):
+        """Return the cached ``best_mask_idx`` of this call, or ``profile()`` when it is stale."""
+        timestep = timestep_to_float(timestep)
+        if timestep != self.step_timestep:
+            self.read_drifts()
+            self.step_timestep = timestep
+
+        # A decision is [cfg * batch, num_head], batches of other sizes through the same layer do not share it
+        key = (*self.get_key(layer_idx, timestep), query.shape[0])
+
+        entry = self.entries.get(key)
+        if entry is not None and entry["age"] < self.reprofile_interval:
+            if not entry["drifted"]:
+                entry["age"] += 1
+                self.hits += 1
+                if self.drift_threshold is not None:
+                    self.queue_drift(key, entry, query)
+                return entry["best_mask_idx"]
+            self.drift_misses += 1
+
+        best_mask_idx = profile()
+        self.misses += 1
+
+        entry = {"best_mask_idx": best_mask_idx, "age": 1, "drifted": False}
+        if self.drift_threshold is not None:
+            # The rows sample_mse profiled, if profile() exposes them
+            sampled_rows = getattr(profile, "sampled_rows", None)
+            if sampled_rows is None:
+                seq_len = query.shape[2]
+                sampled_rows = torch.randint(low=0, high=seq_len, size=(min(self.num_sampled_rows, seq_len),))
+            entry["sampled_rows"] = sampled_rows
+            entry["row_norm"] = self.row_norm(query, sampled_rows)
+        self.entries[key] = entry
+        return best_mask_idx
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def summary(self):
+        return (
+            f"Pattern cache: {self.hits} hits, {self.misses} misses ({self.drift_misses} from drift), "
+            f"hit rate {self.hit_rate * 100:.1f}%"
+        )
@@ -0,0 +1,183 @@
+"""Offline calibration of the spatial / temporal decision into a static per-layer / per-head table."""
+
+import os
+
+import numpy as np
+import torch
+
+from .pattern_cache import LayerCallCounter, timestep_to_float
+
+
+NUM_TRAIN_TIMESTEPS = 1000
+
+
+def timestep_bucket(timestep, num_timestep_buckets):
+    bucket = int(timestep / NUM_TRAIN_TIMESTEPS * num_timestep_buckets)
+    return min(max(bucket, 0), num_timestep_buckets - 1)
+
+
+class PatternRecorder(LayerCallCounter):
+    """Runs the online profiling on every call and counts the temporal decisions per (layer call, timestep bucket, head).
+
+    The cfg / batch rows of a call are votes of the same heads, so a table calibrated with one prompt at a time
+    serves batched generation.
+
+    It is installed in place of the pattern cache (``AttnModule.pattern_cache = PatternRecorder()``) while a
+    small prompt set is generated, then ``to_table()`` turns the counts into a ``PatternTable``.
+    """
+
+    def __init__(self, num_timestep_buckets=10):
+        super().__init__()
+        self.num_timestep_buckets = num_timestep_buckets
+        self.temporal_counts = {}
+        self.total_counts = {}
+
+    def __call__(self, layer_idx, timestep, query, profile):
+        timestep = timestep_to_float(timestep)
+        key = self.get_key(layer_idx, timestep)
+        bucket = timestep_bucket(timestep, self.num_timestep_buckets)
+
+        best_mask_idx = profile()
+        votes = best_mask_idx.reshape(-1, best_mask_idx.shape[-1])
+        if key not in self.temporal_counts:
+            self.temporal_counts[key] = np.zeros((self.num_timestep_buckets, votes.shape[1]), dtype=np.int64)
+            self.total_counts[key] = np.zeros((self.num_timestep_buckets,), dtype=np.int64)
+        self.temporal_counts[key][bucket] += votes.sum(dim=0).cpu().numpy().astype(np.int64)
+        self.total_counts[key][bucket] += votes.shape[0]
+        return best_mask_idx
+
+    def to_table(self):
+        keys = sorted(self.temporal_counts)
+        return PatternTable(
+            np.array(keys, dtype=np.int64).reshape(-1, 2),
+            np.stack([self.temporal_counts[key] for key in keys]),
+            np.stack([self.total_counts[key] for key in keys]),
+        )
+
+
+class PatternTable(LayerCallCounter):
+    """Static ``best_mask_idx`` per (layer call, timestep bucket, head), looked up instead of running ``sample_mse``.
+
+    A head is temporal in a bucket when the majority of the calibration decisions chose the temporal mask. The
+    decision of a head is broadcast over the cfg / batch rows of the query, whatever the batch size of the
+    calibration. Calls that were not seen during calibration (e.g. a bucket that was never reached), or with
+    another number of heads, fall back to ``profile()``.
+
+    Args:
+        keys (np.ndarray): [N, 2] ``(layer_idx, call index within the timestep)`` of every row.
+        temporal_counts (np.ndarray): [N, num_timestep_buckets, num_head] number of temporal decisions.
+        total_counts (np.ndarray): [N, num_timestep_buckets] number of calibration decisions per head.
+    """
+
+    def __init__(self, keys, temporal_counts, total_counts):
+        super().__init__()
+        self.keys = keys
+        self.temporal_counts = temporal_counts
+        self.total_counts = total_counts
+        self.num_timestep_buckets = temporal_counts.shape[1]
+        self.num_heads = temporal_counts.shape[2]
+
+        self.rows = {tuple(int(i) for i in key): row for row, key in enumerate(keys)}
+        self.best_mask_idx = torch.from_numpy(2 * temporal_counts > total_counts[:, :, None]).long()
+        self.device_tables = {}
+        self.fallbacks = 0
+
+    def get_best_mask_idx(self, device):
+        device = torch.device(device)
+        if device not in self.device_tables:
+            self.device_tables[device] = self.best_mask_idx.to(device)
+        return self.device_tables[device]
+
+    def __call__(self, layer_idx, timestep, query, profile):
+        timestep = timestep_to_float(timestep)
+        row = self.rows.get(self.get_key(layer_idx, timestep))
+        bucket = timestep_bucket(timestep, self.num_timestep_buckets)
+        if row is None or self.total_counts[row, bucket] == 0 or query.shape[1] != self.num_heads:
+            self.fallbacks += 1
+            return profile()
+        # [cfg * batch, num_head] like the online decision
+        return self.get_best_mask_idx(query.device)[row, bucket].expand(query.shape[0], -1)
+
+    def temporal_fraction(self):
+        """Fraction of temporal heads per timestep bucket, over the calibrated calls."""
+        seen = self.total_counts > 0
+        temporal = (self.best_mask_idx.numpy() * seen[:, :, None]).sum(axis=(0, 2))
+        total = seen.sum(axis=0) * self.num_heads
+        return temporal / np.maximum(total, 1)
+
+    def summary(self):
+        return f"Pattern table: {len(self.keys)} layer calls, {self.fallbacks} fallbacks to online profiling"
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez_compressed(path, keys=self.keys, temporal_counts=self.temporal_counts, total_counts=self.total_counts)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["keys"], data["temporal_counts"], data["total_counts"])
+
+    def merge(self, other):
+        """Add the counts of another calibration run (e.g. on more prompts) with the same bucketing."""
+        assert self.num_timestep_buckets == other.num_timestep_buckets, "Timestep buckets do not match"
+        keys = sorted(set(self.rows) | set(other.rows))
+        assert self.num_heads == other.num_heads, "Number of heads does not match"
+        temporal_counts = np.zeros((len(keys), self.num_timestep_buckets, self.num_heads), dtype=np.int64)
+        total_counts = np.zeros((len(keys), self.num_timestep_buckets), dtype=np.int64)
+        for i, key in enumerate(keys):
+            for table in (self, other):
+                if key in table.rows:
+                    temporal_counts[i] += table.temporal_counts[table.rows[key]]
+                    total_counts[i] += table.total_counts[table.rows[key]]
+        return PatternTable(np.array(keys, dtype=np.int64).reshape(-1, 2), temporal_counts, total_counts)
+
+
+def calibrate_pattern_table(attn_module, run_prompt, prompts, num_timestep_buckets=10, path=None):
+    """Record the online decisions of ``attn_module`` while ``run_prompt(prompt)`` generates every prompt.
+
+    Args:
+        attn_module: The SparseAttn processor class whose ``pattern_cache`` is used during calibration.
+        path (str): If given, the table is saved there, merged with the counts already in the file.
+    """
+    recorder = PatternRecorder(num_timestep_buckets)
+    pattern_cache, attn_module.pattern_cache = attn_module.pattern_cache, recorder
+    try:
+        for prompt in prompts:
+            run_prompt(prompt)
+    finally:
+        attn_module.pattern_cache = pattern_cache
+
+    table = recorder.to_table()
+    if path is not None:
+        if os.path.exists(path):
+            table = PatternTable.load(path).merge(table)
+        table.save(path)
+    return table
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or merge static pattern tables")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    show_parser = subparsers.add_parser("show", help="Print the fraction of temporal heads per timestep bucket")
+    show_parser.add_argument("path", type=str)
+    merge_parser = subparsers.add_parser("merge", help="Merge the counts of several calibration runs (e.g. one per rank)")
+    merge_parser.add_argument("output", type=str)
+    merge_parser.add_argument("inputs", type=str, nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "show":
+        table = PatternTable.load(args.path)
+        print(f"{len(table.keys)} layer calls, {table.num_timestep_buckets} timestep buckets, {table.num_heads} heads")
+        for bucket, fraction in enumerate(table.temporal_fraction()):
+            print(f"Bucket {bucket}: {fraction * 100:.1f}% temporal heads")
+    else:
+        table = PatternTable.load(args.inputs[0])
+        for path in args.inputs[1:]:
+            table = table.merge(PatternTable.load(path))
+        table.save(args.output)
+
+
+if __name__ == "__main__":
+    main()
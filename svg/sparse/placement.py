@@ -0,0 +1,104 @@
+"""Sparse head placement: temporal heads attend over their tokens in token-major order.
+
+``ref_sparse_head_placement`` / ``ref_hidden_states_placement`` copy Q / K / V into that order and the
+output back, like the Triton kernels in ``svg.sparse.placement_kernels``. The placement can also be
+expressed as a gather index: the attention reads row ``placement_index[i]`` of the frame-major tensors
+wherever it would have read row ``i`` of the placed ones, and writes its output the same way.
+"""
+
+import math
+
+import torch
+
+
+def pixel_slice(context_length, num_frame, frame_size, text_first=False):
+    if text_first:
+        return slice(context_length, context_length + num_frame * frame_size)
+    return slice(0, num_frame * frame_size)
+
+
+def token_reorder_to_token_major(tensor, context_length, num_frame, frame_size, text_first=False):
+    """Reorder the video tokens of [..., seq_len, head_dim] from frame major to token major, in place."""
+    pixels = pixel_slice(context_length, num_frame, frame_size, text_first)
+    tensor[..., pixels, :] = tensor[..., pixels, :].unflatten(-2, (num_frame, frame_size)).transpose(-3, -2).flatten(-3, -2)
+    return tensor
+
+
+def token_reorder_to_frame_major(tensor, context_length, num_frame, frame_size, text_first=False):
+    """Reorder the video tokens of [..., seq_len, head_dim] from token major to frame major, in place."""
+    pixels = pixel_slice(context_length, num_frame, frame_size, text_first)
+    tensor[..., pixels, :] = tensor[..., pixels, :].unflatten(-2, (frame_size, num_frame)).transpose(-3, -2).flatten(-3, -2)
+    return tensor
+
+
+def ref_sparse_head_placement(query, key, value, best_mask_idx, context_length, num_frame, frame_size, text_first=False):
+    cfg, num_heads, seq_len, head_dim = query.shape
+    assert seq_len == context_length + num_frame * frame_size
+
+    query_out, key_out, value_out = query.clone(), key.clone(), value.clone()
+
+    # Spatial heads are copied as is, temporal heads are reordered
+    temporal = best_mask_idx == 1
+    for tensor, tensor_out in ((query, query_out), (key, key_out), (value, value_out)):
+        tensor_out[temporal] = token_reorder_to_token_major(tensor[temporal], context_length, num_frame, frame_size, text_first)
+
+    return query_out, key_out, value_out
+
+
+def ref_hidden_states_placement(hidden_states, output_hidden_states, best_mask_idx, context_length, num_frame, frame_size, text_first=False):
+    cfg, num_heads, seq_len, head_dim = hidden_states.shape
+    assert seq_len == context_length + num_frame * frame_size
+
+    temporal = best_mask_idx == 1
+    output_hidden_states[~temporal] = hidden_states[~temporal]
+    output_hidden_states[temporal] = token_reorder_to_frame_major(hidden_states[temporal], context_length, num_frame, frame_size, text_first)
+    return output_hidden_states
+
+
+def placement_index(context_length, num_frame, frame_size, text_first=False, device="cpu"):
+    """[seq_len] frame-major index of every token of a temporal head, in token-major order."""
+    pixel_length = num_frame * frame_size
+    token_idx = torch.arange(pixel_length, device=device)
+    pixel_idx = (token_idx % num_frame) * frame_size + token_idx // num_frame
+
+    text_idx = torch.arange(context_length, device=device)
+    if text_first:
+        return torch.cat([text_idx, context_length + pixel_idx])
+    return torch.cat([pixel_idx, pixel_length + text_idx])
+
+
+def head_placement_index(best_mask_idx, context_length, num_frame, frame_size, text_first=False):
+    """[cfg, num_heads, seq_len] gather index: identity for spatial heads, ``placement_index`` for temporal heads."""
+    index = placement_index(context_length, num_frame, frame_size, text_first, device=best_mask_idx.device)
+    identity = torch.arange(index.shape[0], device=best_mask_idx.device)
+    return torch.where(best_mask_idx[..., None] == 1, index, identity)
+
+
+def temporal_head_band_width(model, multiplier, frame_size, block_size=128):
+    """Half width of the diagonal band of ``generate_temporal_head_mask_mod``, rounded like each model does."""
+    if model == "wan":
+        return math.ceil(multiplier * frame_size / block_size) * block_size
+    return math.floor(multiplier * frame_size / block_size) * block_size
+
+
+def ref_index_mapped_attention(query, key, value, best_mask_idx, mask_mod, geometry):
+    """Pure PyTorch reference of the index-mapped sparse attention.
+
+    Equivalent to ``sparse_head_placement`` -> masked attention -> ``hidden_states_placement``, where
+    ``mask_mod`` is the mask of the placed sequence (the ``mask_mod`` of the BlockMask). The mask is
+    materialized, so this is meant for validation on small shapes.
+    """
+    cfg, num_heads, seq_len, head_dim = query.shape
+    assert seq_len == geometry.seq_len
+
+    index = head_placement_index(best_mask_idx, geometry.context_length, geometry.num_frame, geometry.frame_size, geometry.text_first)
+    index = index[..., None].expand(-1, -1, -1, head_dim)
+    query_out, key_out, value_out = [tensor.gather(2, index) for tensor in (query, key, value)]
+
+    # Per-head masks (e.g. adaptive band widths) give [num_heads, seq_len, seq_len], shared ones [seq_len, seq_len]
+    idx = torch.arange(seq_len, device=query.device)
+    head = torch.arange(num_heads, device=query.device)[:, None, None]
+    attn_mask = mask_mod(None, head, idx[:, None], idx[None, :])
+    hidden_states = torch.nn.functional.scaled_dot_product_attention(query_out, key_out, value_out, attn_mask=attn_mask)
+
+    return torch.empty_like(hidden_states).scatter_(2, index, hidden_states)
@@ -0,0 +1,245 @@
+"""Triton kernels of the sparse head placement, shared by HunyuanVideo, Wan and CogVideoX.
+
+The models only differ in where the text tokens are (``text_first``), which is a constexpr of the kernels.
+"""
+
+import torch
+import triton
+import triton.language as tl
+
+from .placement import ref_sparse_head_placement, ref_hidden_states_placement
+
+
+@triton.jit
+def token_major_token_index(idx, seq_len, context_length, num_frame, frame_size, TEXT_FIRST: tl.constexpr):
+    # Token-major position of the frame-major token idx
+    if TEXT_FIRST:
+        pixel_idx = tl.where(idx < context_length, 0, idx - context_length)
+        frame_id = pixel_idx // frame_size
+        patch_id = pixel_idx - frame_id * frame_size
+        return tl.where(idx < context_length, idx, context_length + patch_id * num_frame + frame_id)
+    else:
+        frame_id = idx // frame_size
+        patch_id = idx - frame_id * frame_size
+        return tl.where(idx >= seq_len - context_length, idx, patch_id * num_frame + frame_id)
+
+
+@triton.jit
+def placed_token_index(idx, seq_len, context_length, num_frame, frame_size, TEXT_FIRST: tl.constexpr):
+    # Frame-major index of the token-major token idx, the inverse of token_major_token_index
+    if TEXT_FIRST:
+        pixel_idx = tl.where(idx < context_length, 0, idx - context_length)
+        patch_id = pixel_idx // num_frame
+        frame_id = pixel_idx - patch_id * num_frame
+        return tl.where(idx < context_length, idx, context_length + frame_id * frame_size + patch_id)
+    else:
+        patch_id = idx // num_frame
+        frame_id = idx - patch_id * num_frame
+        return tl.where(idx >= seq_len - context_length, idx, frame_id * frame_size + patch_id)
+
+
+@triton.jit
+def sparse_head_placement_kernel(
+    query_ptr, key_ptr, value_ptr, # [cfg, num_heads, seq_len, head_dim] seq_len = context_length + num_frame * frame_size
+    query_out_ptr, key_out_ptr, value_out_ptr, # [cfg, num_heads, seq_len, head_dim]
+    best_mask_idx_ptr, # [cfg, num_heads]
+    query_stride_b, query_stride_h, query_stride_s, query_stride_d,
+    mask_idx_stride_b, mask_idx_stride_h,
+    seq_len: tl.constexpr,
+    head_dim: tl.constexpr,
+    context_length: tl.constexpr,
+    num_frame: tl.constexpr,
+    frame_size: tl.constexpr,
+    TEXT_FIRST: tl.constexpr,
+    BLOCK_SIZE: tl.constexpr
+):
+    # Copy query, key, value to output
+    # range: [b, h, block_id * block_size: block_id * block_size + block_size, :]
+    cfg = tl.program_id(0)
+    head = tl.program_id(1)
+    block_id = tl.program_id(2)
+
+    start_id = block_id * BLOCK_SIZE
+
+    # Load best mask idx (0 is spatial, 1 is temporal)
+    is_temporal = tl.load(best_mask_idx_ptr + cfg * mask_idx_stride_b + head * mask_idx_stride_h)
+
+    offset_token = tl.arange(0, BLOCK_SIZE) + start_id
+    offset_mask = offset_token < seq_len
+    offset_d = tl.arange(0, head_dim)
+
+    offset_store_token = offset_token
+    if is_temporal:
+        offset_store_token = token_major_token_index(offset_token, seq_len, context_length, num_frame, frame_size, TEXT_FIRST)
+
+    offset_load = (cfg * query_stride_b + head * query_stride_h + offset_token[:,None] * query_stride_s) + offset_d[None,:] * query_stride_d
+    offset_store = (cfg * query_stride_b + head * query_stride_h + offset_store_token[:,None] * query_stride_s) + offset_d[None,:] * query_stride_d
+
+    # Maybe tune the pipeline here
+    query = tl.load(query_ptr + offset_load, mask=offset_mask[:,None])
+    tl.store(query_out_ptr + offset_store, query, mask=offset_mask[:,None])
+    key = tl.load(key_ptr + offset_load, mask=offset_mask[:,None])
+    tl.store(key_out_ptr + offset_store, key, mask=offset_mask[:,None])
+    value = tl.load(value_ptr + offset_load, mask=offset_mask[:,None])
+    tl.store(value_out_ptr + offset_store, value, mask=offset_mask[:,None])
+
+
+def sparse_head_placement(query, key, value, query_out, key_out, value_out, best_mask_idx, context_length, num_frame, frame_size, text_first=False):
+    cfg, num_heads, seq_len, head_dim = query.shape
+    BLOCK_SIZE = 128
+    assert seq_len == context_length + num_frame * frame_size
+
+    grid = (cfg, num_heads, (seq_len + BLOCK_SIZE - 1) // BLOCK_SIZE)
+
+    sparse_head_placement_kernel[grid](
+        query, key, value,
+        query_out, key_out, value_out,
+        best_mask_idx,
+        query.stride(0), query.stride(1), query.stride(2), query.stride(3),
+        best_mask_idx.stride(0), best_mask_idx.stride(1),
+        seq_len, head_dim, context_length, num_frame, frame_size, text_first,
+        BLOCK_SIZE
+    )
+    return query_out, key_out, value_out
+
+
+@triton.jit
+def hidden_states_placement_kernel(
+    hidden_states_ptr, # [cfg, num_heads, seq_len, head_dim] seq_len = context_length + num_frame * frame_size
+    hidden_states_out_ptr, # [cfg, num_heads, seq_len, head_dim]
+    best_mask_idx_ptr, # [cfg, num_heads]
+    hidden_states_stride_b, hidden_states_stride_h, hidden_states_stride_s, hidden_states_stride_d,
+    mask_idx_stride_b, mask_idx_stride_h,
+    seq_len: tl.constexpr,
+    head_dim: tl.constexpr,
+    context_length: tl.constexpr,
+    num_frame: tl.constexpr,
+    frame_size: tl.constexpr,
+    TEXT_FIRST: tl.constexpr,
+    BLOCK_SIZE: tl.constexpr
+):
+    # Copy hidden_states to output
+    # range: [b, h, block_id * block_size: block_id * block_size + block_size, :]
+    cfg = tl.program_id(0)
+    head = tl.program_id(1)
+    block_id = tl.program_id(2)
+
+    start_id = block_id * BLOCK_SIZE
+
+    # Load best mask idx (0 is spatial, 1 is temporal)
+    is_temporal = tl.load(best_mask_idx_ptr + cfg * mask_idx_stride_b + head * mask_idx_stride_h)
+
+    offset_token = tl.arange(0, BLOCK_SIZE) + start_id
+    offset_mask = offset_token < seq_len
+    offset_d = tl.arange(0, head_dim)
+
+    offset_store_token = offset_token
+    if is_temporal:
+        offset_store_token = placed_token_index(offset_token, seq_len, context_length, num_frame, frame_size, TEXT_FIRST)
+
+    offset_load = (cfg * hidden_states_stride_b + head * hidden_states_stride_h + offset_token[:,None] * hidden_states_stride_s) + offset_d[None,:] * hidden_states_stride_d
+    offset_store = (cfg * hidden_states_stride_b + head * hidden_states_stride_h + offset_store_token[:,None] * hidden_states_stride_s) + offset_d[None,:] * hidden_states_stride_d
+
+    # Maybe tune the pipeline here
+    hidden_states = tl.load(hidden_states_ptr + offset_load, mask=offset_mask[:,None])
+    tl.store(hidden_states_out_ptr + offset_store, hidden_states, mask=offset_mask[:,None])
+
+
+def hidden_states_placement(hidden_states, hidden_states_out, best_mask_idx, context_length, num_frame, frame_size, text_first=False):
+    cfg, num_heads, seq_len, head_dim = hidden_states.shape
+    BLOCK_SIZE = 128
+    assert seq_len == context_length + num_frame * frame_size
+
+    grid = (cfg, num_heads, (seq_len + BLOCK_SIZE - 1) // BLOCK_SIZE)
+
+    hidden_states_placement_kernel[grid](
+        hidden_states,
+        hidden_states_out,
+        best_mask_idx,
+        hidden_states.stride(0), hidden_states.stride(1), hidden_states.stride(2), hidden_states.stride(3),
+        best_mask_idx.stride(0), best_mask_idx.stride(1),
+        seq_len, head_dim, context_length, num_frame, frame_size, text_first,
+        BLOCK_SIZE
+    )
+    return hidden_states_out
+
+
+def test_sparse_head_placement(context_length=226, num_frame=11, frame_size=4080, text_first=True):
+    cfg, num_heads, head_dim = 2, 48, 64
+    seq_len = context_length + num_frame * frame_size
+    dtype, device = torch.bfloat16, torch.device("cuda")
+
+    query, key, value = [torch.randn(cfg, num_heads, seq_len, head_dim, dtype=dtype, device=device) for _ in range(3)]
+    best_mask_idx = torch.randint(0, 2, (cfg, num_heads), device=device)
+    query_out, key_out, value_out = [torch.empty_like(query) for _ in range(3)]
+
+    sparse_head_placement(query, key, value, query_out, key_out, value_out, best_mask_idx, context_length, num_frame, frame_size, text_first)
+    ref_query_out, ref_key_out, ref_value_out = ref_sparse_head_placement(query, key, value, best_mask_idx, context_length, num_frame, frame_size, text_first)
+
+    torch.testing.assert_close(query_out, ref_query_out)
+    torch.testing.assert_close(key_out, ref_key_out)
+    torch.testing.assert_close(value_out, ref_value_out)
+
+
+def test_hidden_states_placement(context_length=226, num_frame=11, frame_size=4080, text_first=True):
+    cfg, num_heads, head_dim = 2, 48, 64
+    seq_len = context_length + num_frame * frame_size
+    dtype, device = torch.bfloat16, torch.device("cuda")
+
+    hidden_states = torch.randn(cfg, num_heads, seq_len, head_dim, dtype=dtype, device=device)
+    best_mask_idx = torch.randint(0, 2, (cfg, num_heads), device=device)
+
+    hidden_states_out1 = torch.empty_like(hidden_states)
+    hidden_states_out2 = torch.empty_like(hidden_states)
+    hidden_states_placement(hidden_states, hidden_states_out1, best_mask_idx, context_length, num_frame, frame_size, text_first)
+    ref_hidden_states_placement(hidden_states, hidden_states_out2, best_mask_idx, context_length, num_frame, frame_size, text_first)
+
+    torch.testing.assert_close(hidden_states_out1, hidden_states_out2)
+
+
+def benchmark_placement(context_length=226, num_frame=11, frame_size=4080, text_first=True):
+    import time
+
+    cfg, num_heads, head_dim = 2, 48, 64
+    seq_len = context_length + num_frame * frame_size
+    dtype, device = torch.bfloat16, torch.device("cuda")
+
+    query, key, value = [torch.randn(cfg, num_heads, seq_len, head_dim, dtype=dtype, device=device) for _ in range(3)]
+    best_mask_idx = torch.randint(0, 2, (cfg, num_heads), device=device)
+    query_out, key_out, value_out = [torch.empty_like(query) for _ in range(3)]
+
+    warmup = 10
+    all_iter = 1000
+
+    def bench(name, fn, num_bytes):
+        for _ in range(warmup):
+            fn()
+        torch.cuda.synchronize()
+        start = time.time()
+        for _ in range(all_iter):
+            fn()
+        torch.cuda.synchronize()
+        end = time.time()
+        print(f"{name} Elapsed Time: {(end - start) / all_iter * 1e3:.2f} ms")
+        print(f"{name} Total Bandwidth: {num_bytes * all_iter / (end - start) / 1e9:.2f} GB/s")
+
+    num_bytes = query.nelement() * query.element_size() * 2
+    bench("Triton Sparse Head Placement", lambda: sparse_head_placement(
+        query, key, value, query_out, key_out, value_out, best_mask_idx, context_length, num_frame, frame_size, text_first
+    ), num_bytes * 3)
+    bench("Reference Sparse Head Placement", lambda: ref_sparse_head_placement(
+        query, key, value, best_mask_idx, context_length, num_frame, frame_size, text_first
+    ), num_bytes * 3)
+    bench("Triton Hidden States Placement", lambda: hidden_states_placement(
+        query, query_out, best_mask_idx, context_length, num_frame, frame_size, text_first
+    ), num_bytes)
+    bench("Reference Hidden States Placement", lambda: ref_hidden_states_placement(
+        query, query_out, best_mask_idx, context_length, num_frame, frame_size, text_first
+    ), num_bytes)
+
+
+if __name__ == "__main__":
+    for text_first in (True, False):
+        test_sparse_head_placement(text_first=text_first)
+        test_hidden_states_placement(text_first=text_first)
+        benchmark_placement(text_first=text_first)
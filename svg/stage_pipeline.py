@@ -0,0 +1,190 @@
+"""Pipelined execution of generation jobs through stages (text encoding, denoising, VAE decode, video writing).
+
+Every stage runs on its own thread and hands its jobs to the next one through a bounded queue, so that e.g.
+the video of job ``i`` is encoded while job ``i + 1`` is denoised. A stage whose output queue is full blocks
+(backpressure), so that at most ``queue_size`` finished jobs wait between two stages, whatever their size.
+
+Stages that share a ``StageLock`` never run at the same time, e.g. the GPU stages of a pipeline whose models are
+swapped in and out of the device by an offloader. The lock goes to the waiting stage furthest down the pipeline,
+so that a denoised job is decoded and handed to the writer before the next one is denoised. The jobs go through
+every stage in order.
+
+Per stage, ``StagePipeline.stats`` accumulates the time spent running, waiting for input (starved), waiting
+for the lock and waiting for room downstream (backpressure).
+"""
+
+import queue
+import threading
+import time
+
+
+class Stage:
+    """One step of the jobs.
+
+    Args:
+        name (str): Name in the stats.
+        func (callable): Takes the output of the previous stage (the input job for the first one) and returns its own.
+        queue_size (int): Outputs waiting for the next stage before this stage blocks.
+        lock (StageLock): Held while ``func`` runs, shared by the stages that must not overlap.
+    """
+
+    def __init__(self, name, func, queue_size=1, lock=None):
+        self.name = name
+        self.func = func
+        self.queue_size = queue_size
+        self.lock = lock
+
+
+class StageLock:
+    """A lock granted to the waiting stage with the highest priority (its index in the pipeline).
+
+    A stage reserves the lock of the next one before handing it a job, so that the next stage already counts as
+    waiting while its thread picks the job up.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.held = False
+        self.waiting = []
+
+    def reserve(self, priority):
+        with self.condition:
+            self.waiting.append(priority)
+
+    def cancel(self, priority):
+        with self.condition:
+            self.waiting.remove(priority)
+            self.condition.notify_all()
+
+    def acquire(self, priority=0, reserved=False):
+        with self.condition:
+            if not reserved:
+                self.waiting.append(priority)
+            while self.held or max(self.waiting) != priority:
+                self.condition.wait()
+            self.waiting.remove(priority)
+            self.held = True
+
+    def release(self):
+        with self.condition:
+            self.held = False
+            self.condition.notify_all()
+
+
+class StageStats:
+    def __init__(self):
+        self.jobs = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.locked = 0.0
+        self.blocked = 0.0
+
+    def __repr__(self):
+        return (
+            f"{self.jobs} jobs, busy {self.busy:.2f}s, starved {self.starved:.2f}s, "
+            f"waiting for the lock {self.locked:.2f}s, blocked downstream {self.blocked:.2f}s"
+        )
+
+
+# End of the jobs, passed down the stages
+_DONE = object()
+
+
+class StagePipeline:
+    """Runs jobs through ``stages``, one thread per stage.
+
+    Args:
+        stages (list of Stage): In order, the output of a stage is the input of the next one.
+        log (callable): Called with every (stage name, job index, "start" or "end", time) event, e.g. by tests
+            checking the overlap of the stages.
+    """
+
+    def __init__(self, stages, log=None):
+        self.stages = stages
+        self.log = log
+        self.stats = {stage.name: StageStats() for stage in stages}
+
+    def record(self, stage, job_idx, event):
+        if self.log is not None:
+            self.log(stage.name, job_idx, event, time.perf_counter())
+
+    def run_stage(self, stage_idx, stage, inputs, outputs, errors):
+        stats = self.stats[stage.name]
+        # The jobs of the stages after the first one come reserved
+        reserved = stage_idx > 0
+        next_lock = self.stages[stage_idx + 1].lock if stage_idx + 1 < len(self.stages) else None
+        while True:
+            start = time.perf_counter()
+            item = inputs.get()
+            stats.starved += time.perf_counter() - start
+            if item is _DONE:
+                break
+            job_idx, job = item
+            if errors:
+                # Drain the jobs after a failure, without running them
+                if stage.lock is not None and reserved:
+                    stage.lock.cancel(stage_idx)
+                continue
+            try:
+                start = time.perf_counter()
+                if stage.lock is not None:
+                    stage.lock.acquire(stage_idx, reserved=reserved)
+                    stats.locked += time.perf_counter() - start
+                try:
+                    self.record(stage, job_idx, "start")
+                    start = time.perf_counter()
+                    job = stage.func(job)
+                    stats.busy += time.perf_counter() - start
+                    stats.jobs += 1
+                    self.record(stage, job_idx, "end")
+                    if next_lock is not None:
+                        next_lock.reserve(stage_idx + 1)
+                finally:
+                    if stage.lock is not None:
+                        stage.lock.release()
+            except BaseException as error:
+                errors.append(error)
+                continue
+            start = time.perf_counter()
+            outputs.put((job_idx, job))
+            stats.blocked += time.perf_counter() - start
+        outputs.put(_DONE)
+
+    def run(self, jobs):
+        """Run ``jobs`` through the stages and return the outputs of the last stage, in order.
+
+        The first error raised by a stage is re-raised once the threads are done, the jobs after it are dropped.
+        """
+        queues = [queue.Queue(maxsize=1)] + [queue.Queue(maxsize=stage.queue_size) for stage in self.stages[:-1]]
+        results = queue.Queue()
+        errors = []
+        threads = [
+            threading.Thread(
+                target=self.run_stage,
+                args=(i, stage, queues[i], queues[i + 1] if i + 1 < len(self.stages) else results, errors),
+                name=f"stage-{stage.name}",
+                daemon=True,
+            )
+            for i, stage in enumerate(self.stages)
+        ]
+        for thread in threads:
+            thread.start()
+        for job_idx, job in enumerate(jobs):
+            if errors:
+                break
+            queues[0].put((job_idx, job))
+        queues[0].put(_DONE)
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+        outputs = []
+        while True:
+            item = results.get()
+            if item is _DONE:
+                return outputs
+            outputs.append(item[1])
+
+    def summary(self):
+        return "Stages: " + "; ".join(f"{name}: {stats}" for name, stats in self.stats.items())
@@ -0,0 +1,260 @@
+"""TeaCache: skip the transformer blocks of a denoising step whose input barely changed since the last computed step.
+
+Every step, the relative L1 change of the first block's modulated input is rescaled by a per-model polynomial
+into an estimate of the relative change of the blocks' output, and accumulated. While the accumulated estimate
+stays under ``threshold`` the step reuses the residual (output - input) of the last computed step instead of
+running the blocks.
+
+The distances stay on the device. The host reads them once every ``sync_interval`` steps and decides the steps
+in between from the last distance it read, so that the denoising loop only syncs with the device once per
+``sync_interval`` steps. ``sync_interval=1`` takes the decisions of the original TeaCache.
+
+The rescale polynomial is fitted with ``TeaCacheRecorder`` / ``fit_teacache_coefficients`` from the
+(input change, output change) pairs of a few full generations.
+"""
+
+import os
+
+import numpy as np
+import torch
+
+
+# Rescale polynomials, highest degree first
+TEACACHE_COEFFICIENTS = {
+    "hunyuan": [7.33226126e+02, -4.01131952e+02, 6.75869174e+01, -3.14987800e+00, 9.61237896e-02],
+}
+
+
+def relative_l1(current, previous):
+    """Relative L1 change, as a 0-d float32 tensor on the device."""
+    return ((current - previous).abs().mean() / previous.abs().mean()).float()
+
+
+def polyval(coefficients, x):
+    """``np.polyval`` on a tensor, without leaving the device."""
+    y = torch.zeros_like(x)
+    for coefficient in coefficients:
+        y = y * x + coefficient
+    return y
+
+
+class TeaCacheBranch:
+    """State of one call of the transformer per step, e.g. the cond or uncond pass of a CFG pipeline."""
+
+    def __init__(self):
+        self.previous_input = None
+        self.previous_output = None
+        self.residuals = None
+        # Exact accumulated distance at the last sync, and the estimate the decisions since then were made with
+        self.accumulated = 0.0
+        self.estimate = 0.0
+        self.last_distance = None
+        # Distance tensors of the steps since the last sync, and whether they were computed
+        self.pending = []
+        self.decisions = []
+
+
+class TeaCache:
+    """Step-level residual cache attached to a transformer as ``transformer.teacache``.
+
+    The transformer forward calls ``should_compute(modulated_input)`` once per call. When it returns False,
+    the forward returns ``apply_residuals(*hidden_states)`` instead of running its blocks, otherwise it runs
+    them and calls ``store_residuals(inputs, outputs)``.
+
+    Args:
+        threshold (float): Accumulated rescaled distance under which steps are skipped. 0 never skips.
+        coefficients (list of float): Rescale polynomial, highest degree first.
+        num_steps (int): Denoising steps per generation. The first and last ones are always computed.
+        calls_per_step (int): Transformer calls per step, e.g. 2 for the separate cond / uncond passes of Wan.
+        sync_interval (int): The host reads the distances once every ``sync_interval`` steps.
+    """
+
+    def __init__(self, threshold, coefficients, num_steps, calls_per_step=1, sync_interval=1):
+        self.threshold = threshold
+        self.coefficients = [float(coefficient) for coefficient in coefficients]
+        self.num_steps = num_steps
+        self.calls_per_step = calls_per_step
+        self.sync_interval = max(int(sync_interval), 1)
+
+        self.computed = 0
+        self.skipped = 0
+        self.syncs = 0
+        # Skipped calls of every finished generation
+        self.skipped_per_generation = []
+        self.generation_skipped = 0
+        self.reset()
+
+    def reset(self):
+        """Forget the state of the current generation. Done automatically when a call follows the last step."""
+        self.num_calls = 0
+        self.branches = [TeaCacheBranch() for _ in range(self.calls_per_step)]
+        self.branch = self.branches[0]
+
+    def sync(self, branch):
+        """Read the pending distances, replay the decisions taken since the last sync and return the undecided distances."""
+        distances = torch.stack(branch.pending).tolist()
+        self.syncs += 1
+        for distance, computed in zip(distances, branch.decisions):
+            branch.accumulated = 0.0 if computed else branch.accumulated + distance
+        branch.last_distance = distances[-1]
+        undecided = distances[len(branch.decisions):]
+        branch.pending, branch.decisions = [], []
+        return undecided
+
+    def decide(self, branch, distance):
+        branch.pending.append(distance)
+        synced = len(branch.pending) >= self.sync_interval
+        if synced:
+            estimate = branch.accumulated + self.sync(branch)[0]
+        elif branch.last_distance is not None:
+            # Extrapolated from the last distance that was read
+            estimate = branch.estimate + branch.last_distance
+        else:
+            estimate = None
+
+        computed = estimate is None or estimate >= self.threshold
+        branch.estimate = 0.0 if computed else estimate
+        if synced:
+            branch.accumulated = branch.estimate
+        else:
+            branch.decisions.append(computed)
+        return computed
+
+    def decide_step(self, branch, step, modulated_input):
+        if step == 0 or step == self.num_steps - 1 or branch.residuals is None:
+            # A computed step resets the accumulator, the pending distances are not needed
+            branch.pending, branch.decisions = [], []
+            branch.accumulated = branch.estimate = 0.0
+            computed = True
+        else:
+            distance = polyval(self.coefficients, relative_l1(modulated_input, branch.previous_input))
+            computed = self.decide(branch, distance)
+        branch.previous_input = modulated_input
+        return computed
+
+    def should_compute(self, modulated_input):
+        """Whether the blocks must run for this call. ``modulated_input`` is the first block's modulated input."""
+        if self.num_calls == self.num_steps * self.calls_per_step:
+            self.reset()
+        step, branch_idx = divmod(self.num_calls, self.calls_per_step)
+        branch = self.branch = self.branches[branch_idx]
+        computed = self.decide_step(branch, step, modulated_input)
+
+        self.num_calls += 1
+        if computed:
+            self.computed += 1
+        else:
+            self.skipped += 1
+            self.generation_skipped += 1
+        if self.num_calls == self.num_steps * self.calls_per_step:
+            self.skipped_per_generation.append(self.generation_skipped)
+            self.generation_skipped = 0
+        return computed
+
+    def apply_residuals(self, *hidden_states):
+        outputs = tuple(hidden + residual for hidden, residual in zip(hidden_states, self.branch.residuals))
+        return outputs if len(outputs) > 1 else outputs[0]
+
+    def store_residuals(self, inputs, outputs):
+        """Keep ``outputs - inputs`` of the blocks, for tuples of tensors or single tensors."""
+        if torch.is_tensor(inputs):
+            inputs, outputs = (inputs,), (outputs,)
+        self.branch.residuals = tuple(output - input for input, output in zip(inputs, outputs))
+
+    def skip_rate(self):
+        total = self.computed + self.skipped
+        return self.skipped / total if total > 0 else 0.0
+
+    def summary(self):
+        return (
+            f"TeaCache: {self.skipped} / {self.computed + self.skipped} calls skipped ({self.skip_rate() * 100:.1f}%), "
+            f"{self.syncs} host syncs, skipped calls per generation: {self.skipped_per_generation}"
+        )
+
+
+class TeaCacheRecorder(TeaCache):
+    """Computes every step and records the (input change, output change) pairs the rescale polynomial is fitted on.
+
+    The output change is the relative L1 change of the blocks' output between consecutive steps. The pairs
+    stay on the device until ``to_numpy`` or ``save``.
+    """
+
+    def __init__(self, num_steps, calls_per_step=1):
+        super().__init__(0.0, [1.0, 0.0], num_steps, calls_per_step)
+        self.input_distances = []
+        self.output_distances = []
+        self.input_distance = None
+
+    def should_compute(self, modulated_input):
+        if self.num_calls == self.num_steps * self.calls_per_step:
+            self.reset()
+        branch = self.branch = self.branches[self.num_calls % self.calls_per_step]
+        self.input_distance = None if branch.previous_input is None else relative_l1(modulated_input, branch.previous_input)
+        branch.previous_input = modulated_input
+
+        self.num_calls += 1
+        self.computed += 1
+        return True
+
+    def store_residuals(self, inputs, outputs):
+        output = outputs if torch.is_tensor(outputs) else outputs[0]
+        if self.input_distance is not None and self.branch.previous_output is not None:
+            self.input_distances.append(self.input_distance)
+            self.output_distances.append(relative_l1(output, self.branch.previous_output))
+        self.branch.previous_output = output
+
+    def to_numpy(self):
+        if not self.input_distances:
+            return np.zeros(0), np.zeros(0)
+        return torch.stack(self.input_distances).detach().cpu().numpy(), torch.stack(self.output_distances).detach().cpu().numpy()
+
+    def save(self, path):
+        """Save the pairs to an .npz file, added to the pairs already in it."""
+        input_distances, output_distances = self.to_numpy()
+        if os.path.exists(path):
+            with np.load(path) as data:
+                input_distances = np.concatenate([data["input_distances"], input_distances])
+                output_distances = np.concatenate([data["output_distances"], output_distances])
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez_compressed(path, input_distances=input_distances, output_distances=output_distances)
+
+
+def fit_teacache_coefficients(input_distances, output_distances, degree=4):
+    """Least-squares rescale polynomial mapping the input changes to the output changes, highest degree first."""
+    return np.polyfit(np.asarray(input_distances, dtype=np.float64), np.asarray(output_distances, dtype=np.float64), degree).tolist()
+
+
+def load_teacache_coefficients(name_or_path, degree=4):
+    """Coefficients of a model in ``TEACACHE_COEFFICIENTS``, or fitted on the pairs of a ``TeaCacheRecorder`` .npz file."""
+    if name_or_path in TEACACHE_COEFFICIENTS:
+        return TEACACHE_COEFFICIENTS[name_or_path]
+    if not os.path.exists(name_or_path):
+        raise ValueError(
+            f"Unknown TeaCache coefficients {name_or_path}: expected one of {sorted(TEACACHE_COEFFICIENTS)} or a calibration .npz file"
+        )
+    with np.load(name_or_path) as data:
+        return fit_teacache_coefficients(data["input_distances"], data["output_distances"], degree)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fit the TeaCache rescale polynomial on recorded calibration pairs")
+    parser.add_argument("inputs", type=str, nargs="+", help="TeaCacheRecorder .npz files, e.g. one per rank")
+    parser.add_argument("--degree", type=int, default=4)
+    args = parser.parse_args()
+
+    input_distances, output_distances = [], []
+    for path in args.inputs:
+        with np.load(path) as data:
+            input_distances.append(data["input_distances"])
+            output_distances.append(data["output_distances"])
+    input_distances, output_distances = np.concatenate(input_distances), np.concatenate(output_distances)
+    coefficients = fit_teacache_coefficients(input_distances, output_distances, args.degree)
+    residual = np.polyval(coefficients, input_distances) - output_distances
+    print(f"{len(input_distances)} pairs, RMS error {np.sqrt(np.mean(residual ** 2)):.4g}")
+    print(coefficients)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# Startup cost of the profiling masks: the former double Python loop, the vectorized dense builder, and the
+# row-evaluated masks (get_profiling_masks) the models build at startup since the dense masks are gone.
+# Run from the repository root: PYTHONPATH=. python tests/bench_attention_mask.py [--small]
+# The loop references build float32 masks like the original code, so expect ~10 GB of host memory, ~2 GB with --small.
+import argparse
+import time
+
+import torch
+
+from svg.sparse import get_attention_mask, get_profiling_masks
+from reference_masks import REF_ATTENTION_MASK
+
+
+def bench_attention_mask(parameters, mask_func, iter_total: int = 1):
+    time_list = []
+    for model, context_length, num_frame, frame_size in parameters:
+        local_time_list = []
+        for _ in range(iter_total):
+            start = time.perf_counter()
+            for mask_name in ["spatial", "temporal"]:
+                mask = mask_func(model, mask_name, context_length, num_frame, frame_size)
+                del mask
+            local_time_list.append(time.perf_counter() - start)
+        time_list.append(sum(local_time_list) / len(local_time_list))
+    return time_list
+
+
+def ref_loop_impl(model, mask_name, context_length, num_frame, frame_size):
+    return REF_ATTENTION_MASK[model](mask_name, context_length, num_frame, frame_size)
+
+
+def vectorized_impl(model, mask_name, context_length, num_frame, frame_size):
+    return get_attention_mask(model, mask_name, context_length, num_frame, frame_size, device="cpu")
+
+
+def rows_impl(model, mask_name, context_length, num_frame, frame_size):
+    return get_profiling_masks(model, context_length, num_frame, frame_size, device="cpu", mask_names=(mask_name,))
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--small", action="store_true", help="Fewer frames of the same size, for hosts with less memory")
+args = parser.parse_args()
+
+# (model, context_length, num_frame, frame_size)
+if args.small:
+    parameters = {
+        "Wan 480p, 33 frames": ("wan", 0, 9, 1560),
+        "HunyuanVideo 720p, 13 frames": ("hunyuan", 256, 4, 3600),
+        "CogVideoX 1.5, 25 frames": ("cog", 226, 4, 4080),
+    }
+else:
+    parameters = {
+        "Wan 480p": ("wan", 0, 21, 1560),
+        "HunyuanVideo 720p, 49 frames": ("hunyuan", 256, 13, 3600),
+        "CogVideoX 1.5": ("cog", 226, 11, 4080),
+    }
+loop_time = bench_attention_mask(parameters.values(), ref_loop_impl)
+vectorized_time = bench_attention_mask(parameters.values(), vectorized_impl)
+rows_time = bench_attention_mask(parameters.values(), rows_impl)
+
+for name, t_loop, t_vec, t_rows in zip(parameters, loop_time, vectorized_time, rows_time):
+    print(
+        f"{name}: Python loop {t_loop:.2f} s, vectorized {t_vec:.2f} s ({t_loop / t_vec:.1f}x), "
+        f"row masks {t_rows * 1e3:.2f} ms ({t_loop / t_rows:.0f}x)"
+    )
@@ -0,0 +1,69 @@
+# Startup time of a DiT-shaped checkpoint: torch.load of the .pt pickle vs the memory-mapped .safetensors conversion.
+# Run from the repository root: PYTHONPATH=. python tests/bench_checkpoint_loading.py [num_blocks] [hidden_size]
+import os
+import sys
+import tempfile
+import time
+
+import torch
+from torch import nn
+
+from svg.models.hyvideo.utils.checkpoint import convert_to_safetensors, load_model_checkpoint
+
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS"):
+                return int(line.split()[1]) / 1024
+
+
+def make_blocks(num_blocks, hidden_size, device=None):
+    # The linears of a double stream block: qkv, proj and a 4x MLP for img and txt
+    return nn.ModuleList(
+        nn.ModuleDict({
+            f"{stream}_{name}": nn.Linear(hidden_size, hidden_size * ratio, dtype=torch.bfloat16, device=device)
+            for stream in ("img", "txt")
+            for name, ratio in (("attn_qkv", 3), ("attn_proj", 1), ("mlp_fc1", 4))
+        })
+        for _ in range(num_blocks)
+    )
+
+
+num_blocks = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+hidden_size = int(sys.argv[2]) if len(sys.argv) > 2 else 3072
+
+with tempfile.TemporaryDirectory() as checkpoint_dir:
+    path = os.path.join(checkpoint_dir, "mp_rank_00_model_states.pt")
+    blocks = make_blocks(num_blocks, hidden_size)
+    torch.save({"module": blocks.state_dict()}, path)
+    size_gb = os.path.getsize(path) / 1024 ** 3
+    del blocks
+
+    start, rss = time.perf_counter(), rss_mb()
+    state_dict = torch.load(path, map_location="cpu")["module"]
+    pt_time, pt_rss = time.perf_counter() - start, rss_mb() - rss
+    del state_dict
+
+    start = time.perf_counter()
+    convert_to_safetensors(path, load_key="module")
+    convert_time = time.perf_counter() - start
+    # load_model_checkpoint(path) picks up the conversion next to the .pt
+    os.remove(path)
+
+    start, rss = time.perf_counter(), rss_mb()
+    model = make_blocks(num_blocks, hidden_size, device="meta")
+    load_model_checkpoint(model, path)
+    mapped_time, mapped_rss = time.perf_counter() - start, rss_mb() - rss
+
+    # Touching the weights of the first block only pages in that block
+    start = time.perf_counter()
+    with torch.no_grad():
+        first_block = sum(float(linear.weight.sum()) for linear in model[0].values())
+    first_block_time, first_block_rss = time.perf_counter() - start, rss_mb() - rss
+
+    print(f"{num_blocks} blocks, hidden {hidden_size}: {size_gb:.2f} GB (page cache warm)")
+    print(f"torch.load .pt:              {pt_time * 1000:8.1f} ms, +{pt_rss:7.0f} MB RSS")
+    print(f"mmap .safetensors into meta: {mapped_time * 1000:8.1f} ms, +{mapped_rss:7.0f} MB RSS")
+    print(f"  + first block touched:     {first_block_time * 1000:8.1f} ms, +{first_block_rss:7.0f} MB RSS")
+    print(f"one-time conversion:         {convert_time * 1000:8.1f} ms")
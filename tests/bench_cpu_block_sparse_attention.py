@@ -0,0 +1,56 @@
+# CPU block-sparse attention driven by the BlockMask vs dense SDPA, at the sparsity of the README examples.
+# Run from the repository root: PYTHONPATH=. python tests/bench_cpu_block_sparse_attention.py
+import time
+
+import torch
+from torch.nn.attention.flex_attention import create_block_mask
+
+from svg.models.hyvideo.modules.utils import generate_temporal_head_mask_mod as hunyuan_temporal_head_mask_mod
+from svg.models.wan.utils import generate_temporal_head_mask_mod as wan_temporal_head_mask_mod
+from svg.models.wan.utils import sparsity_to_width
+from svg.sparse.cpu_attention import block_sparse_attention
+
+
+def bench(fn, iter_total=3):
+    fn()
+    start = time.perf_counter()
+    for _ in range(iter_total):
+        fn()
+    return (time.perf_counter() - start) / iter_total
+
+
+def bench_cpu_attention(model, context_length, prompt_length, num_frame, frame_size, sparsity, num_heads=4, head_dim=64):
+    seq_len = context_length + num_frame * frame_size
+    multiplier = sparsity_to_width(sparsity, context_length, num_frame, frame_size)
+    if model == "hunyuan":
+        mask_mod = hunyuan_temporal_head_mask_mod(context_length, prompt_length, num_frame, frame_size, mul=multiplier)
+    else:
+        mask_mod = wan_temporal_head_mask_mod(context_length, prompt_length, num_frame, frame_size, mul=multiplier)
+
+    query, key, value = [torch.randn(1, num_heads, seq_len, head_dim) for _ in range(3)]
+    block_mask = create_block_mask(mask_mod, None, None, seq_len, seq_len, device="cpu")
+    idx = torch.arange(seq_len)
+    dense_mask = mask_mod(None, None, idx[:, None], idx[None, :])
+
+    t_masked = bench(lambda: torch.nn.functional.scaled_dot_product_attention(query, key, value, attn_mask=dense_mask))
+    t_dense = bench(lambda: torch.nn.functional.scaled_dot_product_attention(query, key, value))
+    t_sparse = bench(lambda: block_sparse_attention(query, key, value, block_mask))
+
+    # Memory of the scores: seq_len^2 for SDPA, the active blocks of one task per thread for the block-sparse engine
+    density = dense_mask.float().mean().item()
+    print(
+        f"{model} seq_len {seq_len}, sparsity {sparsity} (mask density {density:.3f}, {block_mask.sparsity():.1f}% blocks skipped): "
+        f"SDPA + mask {t_masked * 1e3:.0f} ms, SDPA {t_dense * 1e3:.0f} ms, block-sparse {t_sparse * 1e3:.0f} ms, "
+        f"speedup {t_masked / t_sparse:.2f}x vs masked SDPA, {t_dense / t_sparse:.2f}x vs SDPA"
+    )
+
+
+# (model, context_length, prompt_length, num_frame, frame_size), reduced resolutions
+parameters = {
+    "Wan 240p": ("wan", 0, 0, 21, 390),
+    "HunyuanVideo 360p, 33 frames": ("hunyuan", 256, 255, 9, 880),
+}
+for sparsity in (0.2, 0.25):
+    for name, parameter in parameters.items():
+        print(name, end=": ")
+        bench_cpu_attention(*parameter, sparsity)
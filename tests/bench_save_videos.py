@@ -0,0 +1,60 @@
+# Peak RSS and wall time of saving one video: the former frame list + mimsave vs the streaming save_videos_grid.
+# Each variant runs in its own process, so that ru_maxrss is its own peak.
+# Run from the repository root: PYTHONPATH=. python tests/bench_save_videos.py [frames] [height] [width]
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import imageio
+import numpy as np
+import torch
+import torchvision
+from einops import rearrange
+
+from svg.models.hyvideo.utils.file_utils import save_videos_grid
+
+
+def ref_save_videos_grid(videos, path, rescale=False, n_rows=1, fps=24):
+    """The former save_videos_grid: every float grid frame converted, then the whole list encoded."""
+    videos = rearrange(videos, "b c t h w -> t b c h w")
+    outputs = []
+    for x in videos:
+        x = torchvision.utils.make_grid(x, nrow=n_rows)
+        x = x.transpose(0, 1).transpose(1, 2).squeeze(-1)
+        if rescale:
+            x = (x + 1.0) / 2.0
+        x = torch.clamp(x, 0, 1)
+        x = (x * 255).numpy().astype(np.uint8)
+        outputs.append(x)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    imageio.mimsave(path, outputs, fps=fps)
+
+
+def run(save, shape, path, results):
+    # The float32 [0, 1] video the pipeline returns
+    videos = torch.rand(*shape)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    save(videos, path, fps=24)
+    results.put((time.perf_counter() - start, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024))
+
+
+if __name__ == "__main__":
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 65
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 480
+    width = int(sys.argv[3]) if len(sys.argv) > 3 else 848
+    shape = (1, 3, frames, height, width)
+    context = multiprocessing.get_context("spawn")
+
+    print(f"{frames} frames {height}x{width}, {np.prod(shape) * 4 / 1024 ** 3:.2f} GB float32 video")
+    with tempfile.TemporaryDirectory() as output_dir:
+        for name, save in (("list + mimsave", ref_save_videos_grid), ("streaming", save_videos_grid)):
+            results = context.Queue()
+            process = context.Process(target=run, args=(save, shape, os.path.join(output_dir, f"{name}.mp4"), results))
+            process.start()
+            wall_time, peak_mb = results.get()
+            process.join()
+            print(f"{name:>15}: {wall_time:6.2f} s, peak RSS +{peak_mb:7.0f} MB over the video tensor")
@@ -0,0 +1,78 @@
+# Resume time with 10k completed tasks: the former per-task full JSON checkpoints vs the append-only journals.
+# Run from the repository root: PYTHONPATH=. python tests/bench_task_journal.py
+import glob
+import json
+import os
+import tempfile
+import time
+
+from svg.models.hyvideo.utils.task_journal import TaskJournal, compact_journals, load_completed_tasks
+
+
+def ref_load_task_list_checkpoint(checkpoint_dir, task_list, max_world_size=16):
+    """The former ``InferenceTask.load_task_list_checkpoint``: the newest full dump of every rank."""
+    for rank in range(max_world_size):
+        files = glob.glob(checkpoint_dir + f"/task_list_*_{rank}.json")
+        if len(files) == 0:
+            continue
+        with open(max(files, key=os.path.getctime), "r") as f:
+            current_task_list = json.load(f)
+        for prompt in current_task_list:
+            for loop_idx in current_task_list[prompt]:
+                if current_task_list[prompt][loop_idx] == True:
+                    task_list[prompt][int(loop_idx)] = True
+
+
+def write_checkpoints(checkpoint_dir, prompts, loop_num, world_size):
+    """One full task list dump per completed task, like ``save_task_list_checkpoint``."""
+    task_list = {prompt: {i: False for i in range(loop_num)} for prompt in prompts}
+    for rank in range(world_size):
+        for task_idx, prompt in enumerate(prompts[rank::world_size]):
+            for loop_idx in range(loop_num):
+                task_list[prompt][loop_idx] = True
+                with open(checkpoint_dir + f"/task_list_{task_idx:08d}_{loop_idx:06d}_{rank}.json", "w") as f:
+                    json.dump(task_list, f)
+
+
+def write_journals(checkpoint_dir, prompts, loop_num, world_size):
+    for rank in range(world_size):
+        journal = TaskJournal(checkpoint_dir, rank)
+        for prompt in prompts[rank::world_size]:
+            for loop_idx in range(loop_num):
+                journal.append(prompt, loop_idx)
+        journal.close()
+
+
+num_tasks, loop_num, world_size = 10000, 5, 8
+prompts = [f"A cinematic shot of scene number {i}, with a long vbench style description" for i in range(num_tasks // loop_num)]
+
+with tempfile.TemporaryDirectory() as checkpoint_dir:
+    start = time.perf_counter()
+    write_checkpoints(checkpoint_dir, prompts, loop_num, world_size)
+    write_time = time.perf_counter() - start
+    num_files, size = len(os.listdir(checkpoint_dir)), sum(e.stat().st_size for e in os.scandir(checkpoint_dir))
+
+    start = time.perf_counter()
+    ref_load_task_list_checkpoint(checkpoint_dir, {prompt: {i: False for i in range(loop_num)} for prompt in prompts})
+    ref_time = time.perf_counter() - start
+print(f"JSON checkpoints: {num_files} files, {size / 2**20:.1f} MB, write {write_time:.2f} s, resume {ref_time:.3f} s")
+
+with tempfile.TemporaryDirectory() as checkpoint_dir:
+    start = time.perf_counter()
+    write_journals(checkpoint_dir, prompts, loop_num, world_size)
+    write_time = time.perf_counter() - start
+    num_files, size = len(os.listdir(checkpoint_dir)), sum(e.stat().st_size for e in os.scandir(checkpoint_dir))
+
+    start = time.perf_counter()
+    completed = load_completed_tasks(checkpoint_dir)
+    journal_time = time.perf_counter() - start
+    assert len(completed) == num_tasks
+
+    compact_journals(checkpoint_dir)
+    start = time.perf_counter()
+    load_completed_tasks(checkpoint_dir)
+    compacted_time = time.perf_counter() - start
+print(
+    f"Journals: {num_files} files, {size / 2**20:.1f} MB, write {write_time:.2f} s, resume {journal_time:.3f} s "
+    f"({compacted_time:.3f} s compacted), speedup {ref_time / journal_time:.1f}x"
+)
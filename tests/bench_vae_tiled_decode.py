@@ -0,0 +1,120 @@
+# Peak RSS and wall time of the tiled VAE decode of a small random AutoencoderKLCausal3D: the former loops (every
+# tile decoded, then blended) vs the TiledDecoder with a few tile batch sizes and workers.
+# Each variant runs in its own process, so that ru_maxrss is its own peak. The VAE is thin so that, like the
+# Hunyuan VAE on long 720p videos, the decoded tiles and the video outweigh the activations of one tile.
+# MALLOC_MMAP_THRESHOLD_=65536 keeps glibc from holding on to the freed tiles, so that the peaks are the live memory.
+# Run from the repository root: PYTHONPATH=. python tests/bench_vae_tiled_decode.py [frames] [height] [width]
+import multiprocessing
+import resource
+import sys
+import time
+
+import torch
+
+from svg.models.hyvideo.vae.autoencoder_kl_causal_3d import AutoencoderKLCausal3D
+
+
+def ref_blend(a, b, blend_extent, dim):
+    blend_extent = min(a.shape[dim], b.shape[dim], blend_extent)
+    for y in range(blend_extent):
+        b.select(dim, y).copy_(a.select(dim, y - blend_extent) * (1 - y / blend_extent) + b.select(dim, y) * (y / blend_extent))
+    return b
+
+
+def ref_spatial_tiled_decode(vae, z):
+    """The former spatial_tiled_decode."""
+    overlap_size = int(vae.tile_latent_min_size * (1 - vae.tile_overlap_factor))
+    blend_extent = int(vae.tile_sample_min_size * vae.tile_overlap_factor)
+    row_limit = vae.tile_sample_min_size - blend_extent
+    rows = []
+    for i in range(0, z.shape[-2], overlap_size):
+        row = []
+        for j in range(0, z.shape[-1], overlap_size):
+            tile = z[:, :, :, i: i + vae.tile_latent_min_size, j: j + vae.tile_latent_min_size]
+            row.append(vae.decoder(vae.post_quant_conv(tile)))
+        rows.append(row)
+    result_rows = []
+    for i, row in enumerate(rows):
+        result_row = []
+        for j, tile in enumerate(row):
+            if i > 0:
+                tile = ref_blend(rows[i - 1][j], tile, blend_extent, -2)
+            if j > 0:
+                tile = ref_blend(row[j - 1], tile, blend_extent, -1)
+            result_row.append(tile[:, :, :, :row_limit, :row_limit])
+        result_rows.append(torch.cat(result_row, dim=-1))
+    return torch.cat(result_rows, dim=-2)
+
+
+def ref_temporal_tiled_decode(vae, z):
+    """The former temporal_tiled_decode."""
+    overlap_size = int(vae.tile_latent_min_tsize * (1 - vae.tile_overlap_factor))
+    blend_extent = int(vae.tile_sample_min_tsize * vae.tile_overlap_factor)
+    t_limit = vae.tile_sample_min_tsize - blend_extent
+    row = []
+    for i in range(0, z.shape[2], overlap_size):
+        tile = z[:, :, i: i + vae.tile_latent_min_tsize + 1, :, :]
+        decoded = ref_spatial_tiled_decode(vae, tile)
+        if i > 0:
+            decoded = decoded[:, :, 1:, :, :]
+        row.append(decoded)
+    result_row = []
+    for i, tile in enumerate(row):
+        if i > 0:
+            tile = ref_blend(row[i - 1], tile, blend_extent, 2)
+            result_row.append(tile[:, :, :t_limit, :, :])
+        else:
+            result_row.append(tile[:, :, :t_limit + 1, :, :])
+    return torch.cat(result_row, dim=2)
+
+
+def make_vae():
+    torch.manual_seed(0)
+    vae = AutoencoderKLCausal3D(
+        down_block_types=("DownEncoderBlockCausal3D",) * 4,
+        up_block_types=("UpDecoderBlockCausal3D",) * 4,
+        block_out_channels=(4, 8, 8, 8),
+        norm_num_groups=4,
+        latent_channels=16,
+        sample_size=64,
+        sample_tsize=16,
+    ).eval()
+    vae.enable_tiling()
+    return vae
+
+
+def run(variant, shape, results):
+    vae = make_vae()
+    z = torch.randn(*shape)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    with torch.no_grad():
+        if variant is None:
+            dec = ref_temporal_tiled_decode(vae, z)
+        else:
+            vae.tile_batch_size, vae.tile_num_workers = variant
+            dec = vae.decode(z).sample
+    results.put((time.perf_counter() - start, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024, tuple(dec.shape)))
+
+
+if __name__ == "__main__":
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 17
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    width = int(sys.argv[3]) if len(sys.argv) > 3 else 64
+    shape = (1, 16, frames, height, width)
+    context = multiprocessing.get_context("spawn")
+
+    print(f"latents {shape}, {torch.get_num_threads()} intra-op threads")
+    for name, variant in (
+        ("former loops", None),
+        ("batch 1, 1 worker", (1, 1)),
+        ("batch 4, 1 worker", (4, 1)),
+        ("batch 1, 4 workers", (1, 4)),
+        ("batch 2, 4 workers", (2, 4)),
+    ):
+        results = context.Queue()
+        process = context.Process(target=run, args=(variant, shape, results))
+        process.start()
+        wall_time, peak_mb, dec_shape = results.get()
+        process.join()
+        print(f"{name:>20}: {wall_time:6.2f} s, peak RSS +{peak_mb:7.0f} MB, video {dec_shape}")
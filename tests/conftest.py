@@ -0,0 +1,76 @@
+import types
+
+import pytest
+import torch
+from torch import nn
+
+
+def split_linear(module, name, names, sizes):
+    # The checkpoint loader splits the fused projections of the blocks
+    linear = getattr(module, name)
+    start = 0
+    for sub_name, size in zip(names, sizes):
+        sub_linear = nn.Linear(linear.in_features, size, bias=linear.bias is not None, dtype=linear.weight.dtype)
+        sub_linear.weight.data.copy_(linear.weight.data[start:start + size])
+        sub_linear.bias.data.copy_(linear.bias.data[start:start + size])
+        setattr(module, sub_name, sub_linear)
+        start += size
+
+
+@pytest.fixture
+def hunyuan():
+    models = pytest.importorskip("svg.models.hyvideo.modules.models")
+    posemb_layers = pytest.importorskip("svg.models.hyvideo.modules.posemb_layers")
+    torch.manual_seed(0)
+    hidden_size = 64
+    transformer = models.HYVideoDiffusionTransformer(
+        types.SimpleNamespace(text_states_dim=32, text_states_dim_2=16),
+        in_channels=4,
+        hidden_size=hidden_size,
+        heads_num=2,
+        mm_double_blocks_depth=2,
+        mm_single_blocks_depth=4,
+        rope_dim_list=[8, 12, 12],
+        dtype=torch.bfloat16,
+    ).eval()
+    for parameter in transformer.parameters():
+        nn.init.normal_(parameter, std=0.1)
+    for block in transformer.double_blocks:
+        split_linear(block, "img_attn_qkv", ["img_attn_q", "img_attn_k", "img_attn_v"], [hidden_size] * 3)
+    for block in transformer.single_blocks:
+        split_linear(
+            block, "linear1", ["linear1_attn_q", "linear1_attn_k", "linear1_attn_v", "linear1_mlp"], [hidden_size] * 3 + [4 * hidden_size]
+        )
+    freqs_cos, freqs_sin = posemb_layers.get_nd_rotary_pos_embed([8, 12, 12], [3, 4, 4], theta=256, use_real=True)
+
+    @torch.no_grad()
+    def denoise_hunyuan(steps=8):
+        generator = torch.Generator().manual_seed(0)
+        x = torch.randn(1, 4, 3, 8, 8, generator=generator).bfloat16()
+        text_states = torch.randn(1, 10, 32, generator=generator).bfloat16()
+        text_states_2 = torch.randn(1, 16, generator=generator).bfloat16()
+        text_mask = torch.ones(1, 10, dtype=torch.long)
+        text_mask[:, 7:] = 0
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            for t in torch.linspace(900, 100, steps):
+                output = transformer(x, t[None], text_states, text_mask, text_states_2, freqs_cos, freqs_sin)["x"]
+                x = x - 0.05 * output
+        return x
+
+    return transformer, denoise_hunyuan
+
+
+@pytest.fixture
+def tiny_vae():
+    # The 884 layout of the Hunyuan VAE (4x in time, 8x in space) with a few channels: 8x8 latent tiles, 4 latent frames
+    autoencoder = pytest.importorskip("svg.models.hyvideo.vae.autoencoder_kl_causal_3d")
+    torch.manual_seed(0)
+    return autoencoder.AutoencoderKLCausal3D(
+        down_block_types=("DownEncoderBlockCausal3D",) * 4,
+        up_block_types=("UpDecoderBlockCausal3D",) * 4,
+        block_out_channels=(8, 8, 16, 16),
+        norm_num_groups=4,
+        latent_channels=4,
+        sample_size=64,
+        sample_tsize=16,
+    ).eval()
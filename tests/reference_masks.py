@@ -0,0 +1,70 @@
+"""Dense spatial / temporal masks built with the former double Python loop, shared by the mask tests and bench."""
+
+import math
+
+import torch
+
+
+def ref_hunyuan_attention_mask(mask_name, context_length, num_frame, frame_size):
+    # Ref: the dense masks previously built in hyvideo_inference.py
+    attention_mask = torch.zeros((context_length + num_frame * frame_size, context_length + num_frame * frame_size))
+    pixel_attn_mask = torch.zeros_like(attention_mask[:-context_length, :-context_length], dtype=torch.bool)
+    block_size, block_thres = 128, frame_size * 1.5
+    num_block = math.ceil(num_frame * frame_size / block_size)
+    for i in range(num_block):
+        for j in range(num_block):
+            if abs(i - j) < block_thres // block_size:
+                pixel_attn_mask[i * block_size : (i + 1) * block_size, j * block_size : (j + 1) * block_size] = 1
+    if mask_name == "temporal":
+        pixel_attn_mask = pixel_attn_mask.reshape(frame_size, num_frame, frame_size, num_frame).permute(1, 0, 3, 2).reshape(frame_size * num_frame, frame_size * num_frame)
+    attention_mask[:-context_length, :-context_length] = pixel_attn_mask
+    attention_mask[-context_length:, :] = 1
+    attention_mask[:, -context_length:] = 1
+    return attention_mask
+
+
+def ref_wan_attention_mask(mask_name, context_length, num_frame, frame_size):
+    # Ref: the former get_attention_mask of svg/models/wan/utils.py
+    attention_mask = torch.zeros((context_length + num_frame * frame_size, context_length + num_frame * frame_size))
+    pixel_attn_mask = torch.zeros_like(attention_mask, dtype=torch.bool)
+    pixel_attn_mask[:, :frame_size] = 1
+    block_size, block_thres = 128, frame_size * 2
+    num_block = math.ceil(num_frame * frame_size / block_size)
+    for i in range(num_block):
+        for j in range(num_block):
+            if abs(i - j) < block_thres // block_size:
+                pixel_attn_mask[i * block_size : (i + 1) * block_size, j * block_size : (j + 1) * block_size] = 1
+    if mask_name == "temporal":
+        pixel_attn_mask = pixel_attn_mask.reshape(frame_size, num_frame, frame_size, num_frame).permute(1, 0, 3, 2).reshape(frame_size * num_frame, frame_size * num_frame)
+    return pixel_attn_mask
+
+
+def ref_cog_attention_mask(mask_name, context_length, num_frame, frame_size):
+    # Ref: the former get_attention_mask of svg/models/cog/utils.py
+    attention_mask = torch.zeros((context_length + num_frame * frame_size, context_length + num_frame * frame_size))
+    block_size, block_thres = 128, frame_size * 1.5
+    num_block = math.ceil(num_frame * frame_size / block_size)
+    if mask_name == "spatial":
+        attention_mask[:context_length, :] = 1
+        attention_mask[:, :context_length] = 1
+        for i in range(num_block):
+            for j in range(num_block):
+                if abs(i - j) < block_thres // block_size:
+                    attention_mask[i * block_size : (i + 1) * block_size, j * block_size : (j + 1) * block_size] = 1
+    else:
+        pixel_attn_mask = torch.zeros_like(attention_mask[context_length:, context_length:])
+        for i in range(num_block):
+            for j in range(num_block):
+                if abs(i - j) < block_thres // block_size:
+                    pixel_attn_mask[i * block_size : (i + 1) * block_size, j * block_size : (j + 1) * block_size] = 1
+        pixel_attn_mask = pixel_attn_mask.reshape(frame_size, num_frame, frame_size, num_frame)\
+            .permute(1, 0, 3, 2).reshape(frame_size * num_frame, frame_size * num_frame)
+        attention_mask[context_length:, context_length:] = pixel_attn_mask
+    return attention_mask
+
+
+REF_ATTENTION_MASK = {
+    "hunyuan": ref_hunyuan_attention_mask,
+    "wan": ref_wan_attention_mask,
+    "cog": ref_cog_attention_mask,
+}
@@ -0,0 +1,137 @@
+import pytest
+import torch
+from torch import nn
+
+from svg.block_cache import BlockResidualCache
+from svg.teacache import TeaCache
+
+
+class TinyStack(nn.Module):
+    """Stack of residual blocks with the block cache hooks of HYVideoDiffusionTransformer.forward."""
+
+    def __init__(self, dim=32, num_blocks=6):
+        super().__init__()
+        self.blocks = nn.ModuleList(nn.Linear(dim, dim) for _ in range(num_blocks))
+        self.teacache = None
+        self.block_cache = None
+        self.block_runs = [0] * num_blocks
+
+    def forward(self, x, t):
+        if self.teacache is not None and not self.teacache.should_compute(x):
+            return self.teacache.apply_residuals(x)
+        ori_x = x
+        group_size = len(self.blocks) if self.block_cache is None else self.block_cache.group_size
+        for group_idx, group_start in enumerate(range(0, len(self.blocks), group_size)):
+            if self.block_cache is not None and not self.block_cache.should_compute(group_idx, x):
+                x = self.block_cache.apply_residuals(x)
+                continue
+            group_input = x
+            for block_idx in range(group_start, min(group_start + group_size, len(self.blocks))):
+                x = x + torch.tanh(self.blocks[block_idx](x) * t)
+                self.block_runs[block_idx] += 1
+            if self.block_cache is not None:
+                self.block_cache.store_residuals(group_input, x)
+        if self.teacache is not None:
+            self.teacache.store_residuals(ori_x, x)
+        return x
+
+
+num_steps = 30
+
+
+@torch.no_grad()
+def denoise(model, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    x = torch.randn(2, 64, 32, generator=generator)
+    for t in torch.linspace(1, 0.1, num_steps):
+        x = x - 0.05 * model(x, t)
+    return x
+
+
+@pytest.fixture
+def model():
+    torch.manual_seed(0)
+    return TinyStack()
+
+
+def test_threshold_zero_never_skips(model):
+    reference = denoise(model)
+    model.block_cache = BlockResidualCache(0.0, len(model.blocks), num_steps, group_size=2)
+    assert torch.equal(denoise(model), reference)
+    assert model.block_cache.skipped == 0
+    assert model.block_cache.computed == num_steps * 3
+
+
+@pytest.mark.parametrize("group_size", [1, 2, 6])
+def test_skips_groups(model, group_size):
+    reference = denoise(model)
+    block_cache = model.block_cache = BlockResidualCache(0.1, len(model.blocks), num_steps, group_size=group_size)
+    output = denoise(model)
+    assert block_cache.skipped > 0
+    assert block_cache.skipped_per_generation == [block_cache.skipped]
+    # A group runs all its blocks or none
+    for group_idx in range(block_cache.num_groups):
+        runs = {model.block_runs[block_idx] for block_idx in block_cache.group_blocks(group_idx)}
+        assert runs == {2 * num_steps - block_cache.group_skipped[group_idx]}
+    assert (output - reference).abs().mean() < 0.1 * reference.abs().mean()
+
+
+def test_one_group_is_teacache(model):
+    model.teacache = TeaCache(0.1, [1.0, 0.0], num_steps)
+    reference = denoise(model)
+    reference_skipped = model.teacache.skipped
+    assert reference_skipped > 0
+
+    model.teacache = None
+    model.block_cache = BlockResidualCache(0.1, len(model.blocks), num_steps, group_size=len(model.blocks), input_stride=1)
+    torch.testing.assert_close(denoise(model), reference)
+    assert model.block_cache.skipped == reference_skipped
+
+
+def test_memory_budget(model):
+    unbounded = model.block_cache = BlockResidualCache(0.1, len(model.blocks), num_steps, group_size=1)
+    reference = denoise(model)
+    residual_bytes = 2 * 64 * 32 * 4
+    assert unbounded.peak_cached_bytes == len(model.blocks) * residual_bytes
+
+    bounded = model.block_cache = BlockResidualCache(0.1, len(model.blocks), num_steps, group_size=1, max_cached_bytes=2 * residual_bytes)
+    output = denoise(model)
+    assert bounded.peak_cached_bytes <= 2 * residual_bytes
+    assert bounded.evictions > 0
+    # An evicted group runs at its next step, so it skips less but still skips
+    assert 0 < bounded.skipped < unbounded.skipped
+    assert (output - reference).abs().mean() < 0.1 * reference.abs().mean()
+
+
+def test_generations_and_branches(model):
+    block_cache = model.block_cache = BlockResidualCache(0.1, len(model.blocks), num_steps, group_size=3, calls_per_step=2)
+
+    @torch.no_grad()
+    def denoise_cfg(seed):
+        generator = torch.Generator().manual_seed(seed)
+        x = torch.randn(1, 64, 32, generator=generator)
+        for t in torch.linspace(1, 0.1, num_steps):
+            cond, uncond = model(x, t), model(0.5 * x, t)
+            x = x - 0.05 * (uncond + 2.0 * (cond - uncond))
+        return x
+
+    first = denoise_cfg(0)
+    assert torch.equal(denoise_cfg(0), first)
+    assert len(block_cache.skipped_per_generation) == 2
+    assert block_cache.skipped_per_generation[0] == block_cache.skipped_per_generation[1] > 0
+
+
+def test_hunyuan_block_cache(hunyuan):
+    transformer, denoise_hunyuan = hunyuan
+    reference = denoise_hunyuan()
+    num_blocks = len(transformer.double_blocks) + len(transformer.single_blocks)
+
+    # Groups across the double / single stream boundary
+    transformer.block_cache = BlockResidualCache(0.0, num_blocks, 8, group_size=4)
+    assert torch.equal(denoise_hunyuan(), reference)
+    assert transformer.block_cache.computed == 8 * 2
+
+    block_cache = transformer.block_cache = BlockResidualCache(1.0, num_blocks, 8, group_size=1)
+    output = denoise_hunyuan()
+    assert block_cache.skipped > 0
+    assert output.shape == reference.shape and torch.isfinite(output).all()
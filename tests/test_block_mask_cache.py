@@ -0,0 +1,110 @@
+import os
+
+import torch
+import pytest
+from torch.nn.attention.flex_attention import create_block_mask
+
+from svg.sparse import block_mask_cache
+from svg.sparse.block_mask_cache import create_block_mask_persistent
+from svg.models.wan.utils import generate_temporal_head_mask_mod as wan_mask_mod
+from svg.models.cog.utils import generate_temporal_head_mask_mod as cog_mask_mod
+
+
+BLOCK_MASK_FIELDS = [
+    "kv_num_blocks", "kv_indices", "full_kv_num_blocks", "full_kv_indices",
+    "q_num_blocks", "q_indices", "full_q_num_blocks", "full_q_indices",
+]
+
+def assert_block_mask_equal(a, b):
+    assert a.BLOCK_SIZE == b.BLOCK_SIZE
+    for name in BLOCK_MASK_FIELDS:
+        x, y = getattr(a, name), getattr(b, name)
+        assert x.dtype == y.dtype, name
+        assert torch.equal(x, y), name
+
+
+parameters = [
+    ("wan", 0, 5, 300, 1.3),
+    ("wan", 0, 7, 256, 2.0),
+    ("cog", 64, 5, 300, 1.3),
+    ("cog", 100, 4, 520, 0.8),
+]
+@pytest.mark.parametrize("model, context_length, num_frame, frame_size, multiplier", parameters)
+def test_block_mask_cache(tmp_path, monkeypatch, model, context_length, num_frame, frame_size, multiplier):
+    seq_len = context_length + num_frame * frame_size
+    if model == "wan":
+        mask_mod = wan_mask_mod(context_length, context_length, num_frame, frame_size, mul=multiplier)
+    else:
+        mask_mod = cog_mask_mod(context_length, num_frame, frame_size, mul=multiplier)
+    geometry = dict(model=model, context_length=context_length, prompt_length=context_length, num_frame=num_frame,
+                    frame_size=frame_size, multiplier=multiplier, block_size=128)
+
+    fresh = create_block_mask(mask_mod, None, None, seq_len, seq_len, device="cpu")
+
+    built = create_block_mask_persistent(mask_mod, geometry, None, None, seq_len, seq_len, device="cpu", cache_dir=tmp_path)
+    assert len(os.listdir(tmp_path)) == 1
+    assert_block_mask_equal(built, fresh)
+
+    # The second worker must load the mask instead of rebuilding it
+    def fail(*args, **kwargs):
+        raise AssertionError("BlockMask was rebuilt instead of loaded from the cache")
+    monkeypatch.setattr(block_mask_cache, "create_block_mask", fail)
+
+    reloaded = create_block_mask_persistent(mask_mod, geometry, None, None, seq_len, seq_len, device="cpu", cache_dir=tmp_path)
+    assert_block_mask_equal(reloaded, fresh)
+    assert reloaded.mask_mod is mask_mod
+
+    # A different geometry gets its own entry
+    other_geometry = dict(geometry, multiplier=multiplier + 1)
+    monkeypatch.undo()
+    create_block_mask_persistent(mask_mod, other_geometry, None, None, seq_len, seq_len, device="cpu", cache_dir=tmp_path)
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_block_mask_cache_key_follows_mask_mod(tmp_path):
+    context_length, num_frame, frame_size = 64, 5, 300
+    seq_len = context_length + num_frame * frame_size
+    geometry = dict(model="cog", context_length=context_length, prompt_length=context_length, num_frame=num_frame,
+                    frame_size=frame_size, multiplier=1.3, block_size=128)
+
+    # Same geometry, the first frame sink of CogVideoX on or off
+    for attn_sink in (False, True, False):
+        mask_mod = cog_mask_mod(context_length, num_frame, frame_size, mul=1.3, attn_sink=attn_sink)
+        cached = create_block_mask_persistent(mask_mod, geometry, None, None, seq_len, seq_len, device="cpu", cache_dir=tmp_path)
+        assert_block_mask_equal(cached, create_block_mask(mask_mod, None, None, seq_len, seq_len, device="cpu"))
+    assert len(os.listdir(tmp_path)) == 2
+
+    # A change of the mask logic with the same closure values
+    def mask_mod(b, h, q_idx, kv_idx):
+        return q_idx >= kv_idx
+    key = block_mask_cache.block_mask_cache_key(geometry, None, None, seq_len, seq_len, mask_mod)
+    def mask_mod(b, h, q_idx, kv_idx):
+        return q_idx <= kv_idx
+    assert block_mask_cache.block_mask_cache_key(geometry, None, None, seq_len, seq_len, mask_mod) != key
+
+
+def test_mask_mod_fingerprint_is_stable():
+    from svg.sparse import SparseAttentionGeometry
+    from svg.sparse.block_mask_cache import mask_mod_fingerprint
+    from svg.sparse.head_widths import band_mask_mod
+
+    # Closes over a SparseAttentionGeometry and a tensor, hashed by content
+    geometry = SparseAttentionGeometry.hunyuan(64, 60, 4, 96, 1.5)
+    fingerprint = mask_mod_fingerprint(band_mask_mod(geometry, torch.tensor([128, 256])))
+    assert mask_mod_fingerprint(band_mask_mod(SparseAttentionGeometry.hunyuan(64, 60, 4, 96, 1.5), torch.tensor([128, 256]))) == fingerprint
+    assert mask_mod_fingerprint(band_mask_mod(geometry, torch.tensor([128, 384]))) != fingerprint
+    assert mask_mod_fingerprint(band_mask_mod(SparseAttentionGeometry.hunyuan(64, 41, 4, 96, 1.5), torch.tensor([128, 256]))) != fingerprint
+
+    # Without source, e.g. built by exec: two compilations have nested code objects at other addresses
+    def compile_mask_mod():
+        namespace = {}
+        exec("def mask_mod(b, h, q_idx, kv_idx):\n    return (lambda d: d < 4)(q_idx - kv_idx)", namespace)
+        return namespace["mask_mod"]
+    assert mask_mod_fingerprint(compile_mask_mod()) == mask_mod_fingerprint(compile_mask_mod())
+
+    # An object whose repr holds its address has no stable fingerprint
+    marker = object()
+    def mask_mod(b, h, q_idx, kv_idx):
+        return q_idx >= kv_idx if marker else q_idx <= kv_idx
+    with pytest.raises(TypeError, match="object"):
+        mask_mod_fingerprint(mask_mod)
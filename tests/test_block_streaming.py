@@ -0,0 +1,98 @@
+import pytest
+import torch
+from torch import nn
+
+from svg.block_cache import BlockResidualCache
+from svg.block_streaming import BlockStreamer, stream_transformer_blocks
+from svg.teacache import TeaCache
+
+
+def make_blocks(num_blocks=5, dim=16):
+    torch.manual_seed(0)
+    return nn.Sequential(*(nn.Sequential(nn.Linear(dim, dim), nn.LayerNorm(dim)) for _ in range(num_blocks)))
+
+
+def test_schedule_overlaps_copies():
+    blocks = make_blocks()
+    x = torch.randn(4, 16)
+    with torch.no_grad():
+        reference = blocks(x)
+    streamer = BlockStreamer(blocks, "cpu", prefetch_depth=2, simulate=True)
+    with torch.no_grad():
+        assert torch.equal(blocks(x), reference)
+        assert torch.equal(blocks(x), reference)
+
+    schedule = streamer.schedule
+    for block_idx in range(5):
+        # Block i + 1 and i + 2 are on their way before block i computes
+        compute = schedule.index(("compute", block_idx))
+        for next_idx in (block_idx + 1, block_idx + 2):
+            if next_idx < 5:
+                assert schedule.index(("copy", next_idx)) < compute
+    # Only the very first block waits for its copy, the next step's first blocks are prefetched by the last ones
+    assert streamer.stalls == 1
+    second_copy = [i for i, entry in enumerate(schedule) if entry == ("copy", 0)][1]
+    assert second_copy < schedule.index(("compute", 4))
+    assert streamer.peak_resident_bytes == 3 * streamer.nbytes[0]
+
+
+def test_memory_budget():
+    blocks = make_blocks()
+    block_bytes = BlockStreamer(make_blocks(), "cpu").nbytes[0]
+    streamer = BlockStreamer(blocks, "cpu", prefetch_depth=4, max_resident_bytes=2 * block_bytes, simulate=True)
+    with torch.no_grad():
+        blocks(torch.randn(4, 16))
+    assert streamer.peak_resident_bytes == 2 * block_bytes
+    assert streamer.stalls == 1
+
+    # Less than one block: the computing block is still loaded, nothing is prefetched
+    streamer.remove()
+    streamer = BlockStreamer(blocks, "cpu", prefetch_depth=4, max_resident_bytes=block_bytes // 2, simulate=True)
+    with torch.no_grad():
+        blocks(torch.randn(4, 16))
+    assert streamer.stalls == 5
+    assert streamer.peak_resident_bytes == block_bytes
+
+
+def test_weights_live_on_the_host():
+    blocks = make_blocks()
+    weight = blocks[0][0].weight
+    streamer = BlockStreamer(blocks, "cpu", simulate=True)
+    assert weight.untyped_storage().data_ptr() == streamer.host_buffers[0].untyped_storage().data_ptr()
+    with torch.no_grad():
+        blocks(torch.randn(4, 16))
+    streamer.remove()
+    assert not streamer.resident
+    assert weight.untyped_storage().data_ptr() == streamer.host_buffers[0].untyped_storage().data_ptr()
+
+
+def test_hunyuan_streaming(hunyuan):
+    transformer, denoise_hunyuan = hunyuan
+    reference = denoise_hunyuan(steps=3)
+    num_blocks = len(transformer.double_blocks) + len(transformer.single_blocks)
+    streamer = stream_transformer_blocks(transformer, "cpu", prefetch_depth=2, simulate=True)
+    assert torch.equal(denoise_hunyuan(steps=3), reference)
+    assert streamer.stalls == 1
+    assert [entry for entry in streamer.schedule if entry[0] == "compute"] == [("compute", i) for i in range(num_blocks)] * 3
+
+    # TeaCache calls the first modulation of block 0 outside of its forward, block cache skips blocks
+    transformer.teacache = TeaCache(0.0, [1.0, 0.0], 3)
+    transformer.block_cache = BlockResidualCache(1.0, num_blocks, 3, group_size=2)
+    output = denoise_hunyuan(steps=3)
+    assert transformer.block_cache.skipped > 0
+    assert torch.isfinite(output).all()
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="CUDA is not available")
+def test_cuda_streaming():
+    blocks = make_blocks(num_blocks=8, dim=256)
+    x = torch.randn(64, 256, device="cuda")
+    with torch.no_grad():
+        reference = blocks.to("cuda")(x)
+    blocks.to("cpu")
+    streamer = BlockStreamer(blocks, "cuda", prefetch_depth=2)
+    assert streamer.host_buffers[0].is_pinned()
+    with torch.no_grad():
+        for _ in range(3):
+            torch.testing.assert_close(blocks(x), reference)
+    assert streamer.stalls == 1
@@ -0,0 +1,77 @@
+import argparse
+
+import torch
+from torch import nn
+
+from svg.models.hyvideo.utils.checkpoint import (
+    MappedSafetensors,
+    checkpoint_variant,
+    convert_to_safetensors,
+    load_checkpoint,
+    load_model_checkpoint,
+    resolve_checkpoint,
+)
+
+
+def make_model(device=None, dtype=torch.bfloat16):
+    torch.manual_seed(0)
+    return nn.Sequential(nn.Linear(7, 5), nn.LayerNorm(5), nn.Linear(5, 3, bias=False)).to(device=device, dtype=dtype)
+
+
+def test_convert_deepspeed_checkpoint(tmp_path):
+    model = make_model()
+    path = str(tmp_path / "mp_rank_00_model_states.pt")
+    # Deepspeed checkpoints also pickle the training args
+    torch.save({"module": model.state_dict(), "args": argparse.Namespace(lr=1e-4)}, path)
+
+    converted = convert_to_safetensors(path, load_key="module")
+    assert converted == str(tmp_path / "mp_rank_00_model_states.safetensors")
+    assert resolve_checkpoint(path) == converted
+
+    state_dict = load_checkpoint(path)
+    assert isinstance(state_dict, MappedSafetensors)
+    assert sorted(state_dict) == sorted(model.state_dict())
+    for key, tensor in model.state_dict().items():
+        assert torch.equal(state_dict[key], tensor)
+        assert state_dict[key].dtype == torch.bfloat16
+    assert sorted(state_dict.prefix("0.")) == ["bias", "weight"]
+
+
+def test_tensors_are_views_of_the_mapping(tmp_path):
+    path = str(tmp_path / "weights.pt")
+    # An odd-sized bfloat16 tensor misaligns the float32 one after it
+    torch.save({"a": torch.randn(3, dtype=torch.bfloat16), "b": torch.randn(4, 4), "c": torch.arange(5)}, path)
+    state_dict = load_checkpoint(convert_to_safetensors(path))
+    base = state_dict.buffer.data_ptr()
+    for key in state_dict:
+        tensor = state_dict[key]
+        offset = state_dict.data_offset + state_dict.entries[key]["data_offsets"][0]
+        if offset % tensor.element_size() == 0:
+            assert tensor.data_ptr() == base + offset
+        assert torch.equal(tensor, torch.load(path)[key])
+
+
+def test_load_meta_model(tmp_path):
+    model = make_model()
+    path = str(tmp_path / "model.pt")
+    torch.save(model.state_dict(), path)
+    convert_to_safetensors(path)
+
+    # Built on the meta device like HYVideoDiffusionTransformer, in float32 this time
+    meta_model = make_model(device="meta", dtype=torch.float32)
+    load_model_checkpoint(meta_model, path)
+    for key, tensor in meta_model.state_dict().items():
+        assert tensor.device.type == "cpu" and tensor.dtype == torch.float32
+        assert torch.equal(tensor, model.state_dict()[key].float())
+    x = torch.randn(2, 7)
+    torch.testing.assert_close(meta_model(x), model(x.bfloat16()).float(), atol=5e-2, rtol=5e-2)
+
+    # The .pt checkpoint without conversion
+    bf16_model = make_model(device="meta")
+    load_model_checkpoint(bf16_model, tmp_path / "model.pt", strict=True)
+    torch.testing.assert_close(bf16_model(x.bfloat16()), model(x.bfloat16()))
+
+
+def test_checkpoint_variants():
+    assert checkpoint_variant("ckpts/mp_rank_00_model_states.pt", "_fp8") == "ckpts/mp_rank_00_model_states_fp8.pt"
+    assert checkpoint_variant(checkpoint_variant("w.safetensors", "_fp8"), "_map") == "w_fp8_map.safetensors"
@@ -0,0 +1,119 @@
+import importlib
+
+import torch
+import pytest
+
+from svg.sparse import SparseAttentionGeometry, SparseAttentionProcessor, get_backend, get_profiling_masks, placement_index
+from svg.sparse.cpu_attention import block_sparse_attention
+
+flex_attention = pytest.importorskip("torch.nn.attention.flex_attention")
+
+
+def get_mask_mod(model, context_length, prompt_length, num_frame, frame_size, multiplier):
+    if model == "hunyuan":
+        utils = importlib.import_module("svg.models.hyvideo.modules.utils")
+        return utils.generate_temporal_head_mask_mod(context_length, prompt_length, num_frame, frame_size, mul=multiplier)
+    if model == "wan":
+        utils = importlib.import_module("svg.models.wan.utils")
+        return utils.generate_temporal_head_mask_mod(context_length, prompt_length, num_frame, frame_size, mul=multiplier)
+    utils = importlib.import_module("svg.models.cog.utils")
+    return utils.generate_temporal_head_mask_mod(context_length, num_frame, frame_size, mul=multiplier, attn_sink=False)
+
+
+# Reduced sizes of the three models, with partial last blocks
+geometries = [
+    SparseAttentionGeometry.hunyuan(64, 60, 4, 96, 1.5),
+    SparseAttentionGeometry.wan(5, 80, 2),
+    SparseAttentionGeometry.cog(50, 4, 96, 1.5),
+]
+
+
+def dense_reference(query, key, value, best_mask_idx, mask_mod, geometry):
+    # Explicit [cfg, num_heads, seq_len, seq_len] frame-major masks: a temporal head attends in token-major order,
+    # so frame-major token i sits at position inverse[i] of the placed sequence
+    seq_len = geometry.seq_len
+    inverse = torch.empty(seq_len, dtype=torch.long)
+    inverse[placement_index(geometry.context_length, geometry.num_frame, geometry.frame_size, geometry.text_first)] = torch.arange(seq_len)
+    idx = torch.arange(seq_len)
+    spatial_mask = mask_mod(None, None, idx[:, None], idx[None, :])
+    temporal_mask = mask_mod(None, None, inverse[:, None], inverse[None, :])
+    attn_mask = torch.where(best_mask_idx[..., None, None] == 1, temporal_mask, spatial_mask)
+    return torch.nn.functional.scaled_dot_product_attention(query, key, value, attn_mask=attn_mask)
+
+
+@pytest.mark.parametrize("geometry", geometries, ids=lambda geometry: geometry.model)
+@pytest.mark.parametrize("per_head_mask", [False, True])
+def test_block_sparse_attention(geometry, per_head_mask):
+    mask_mod = get_mask_mod(geometry.model, geometry.context_length, geometry.prompt_length, geometry.num_frame, geometry.frame_size, geometry.multiplier)
+    cfg, num_heads, head_dim, seq_len = 2, 3, 32, geometry.seq_len
+    query, key, value = [torch.randn(cfg, num_heads, seq_len, head_dim) for _ in range(3)]
+
+    # Like CogVideoX, one BlockMask row per (cfg, head)
+    B, H = (1, cfg * num_heads) if per_head_mask else (None, None)
+    block_mask = flex_attention.create_block_mask(mask_mod, B, H, seq_len, seq_len, device="cpu")
+
+    idx = torch.arange(seq_len)
+    attn_mask = mask_mod(None, None, idx[:, None], idx[None, :])
+    ref_output = torch.nn.functional.scaled_dot_product_attention(query, key, value, attn_mask=attn_mask)
+
+    output = block_sparse_attention(query, key, value, block_mask)
+    torch.testing.assert_close(output, ref_output, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("geometry", geometries, ids=lambda geometry: geometry.model)
+def test_cpu_backend(geometry):
+    mask_mod = get_mask_mod(geometry.model, geometry.context_length, geometry.prompt_length, geometry.num_frame, geometry.frame_size, geometry.multiplier)
+    cfg, num_heads, head_dim, seq_len = 2, 4, 32, geometry.seq_len
+    query, key, value = [torch.randn(cfg, num_heads, seq_len, head_dim) for _ in range(3)]
+    best_mask_idx = torch.tensor([[0, 1, 1, 0], [1, 0, 1, 1]])
+    block_mask = flex_attention.create_block_mask(mask_mod, None, None, seq_len, seq_len, device="cpu")
+
+    output = get_backend("cpu")(query, key, value, best_mask_idx, block_mask, geometry)
+    ref_output = dense_reference(query, key, value, best_mask_idx, mask_mod, geometry)
+    torch.testing.assert_close(output, ref_output, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("geometry", geometries, ids=lambda geometry: geometry.model)
+def test_cpu_sparse_attention_processor(geometry):
+    # The whole sparse path of the processors: profiling, placement, block-sparse attention and placement back
+    mask_mod = get_mask_mod(geometry.model, geometry.context_length, geometry.prompt_length, geometry.num_frame, geometry.frame_size, geometry.multiplier)
+    cfg, num_heads, head_dim, seq_len = 2, 4, 32, geometry.seq_len
+
+    class Processor(SparseAttentionProcessor):
+        pass
+
+    Processor.geometry = geometry
+    Processor.backend = "cpu"
+    Processor.block_mask = flex_attention.create_block_mask(mask_mod, None, None, seq_len, seq_len, device="cpu")
+    Processor.attention_masks = get_profiling_masks(geometry.model, geometry.context_length, geometry.num_frame, geometry.frame_size, device="cpu")
+
+    decisions = []
+    def record_profile(layer_idx, timestep, query, profile):
+        decisions.append(profile())
+        record_profile.profile = profile
+        return decisions[-1]
+    processor = Processor()
+    processor.pattern_cache = record_profile
+
+    query, key, value = [torch.randn(cfg, num_heads, seq_len, head_dim) for _ in range(3)]
+    output = processor.sparse_attention(query, key, value, timestep=500, layer_idx=0)
+
+    assert decisions[0].shape == (cfg, num_heads)
+    # The rows sample_mse ran on, for the drift check of the pattern cache
+    assert processor.pattern_cache.profile.sampled_rows.shape == (Processor.num_sampled_rows,)
+    ref_output = dense_reference(query, key, value, decisions[0], mask_mod, geometry)
+    torch.testing.assert_close(output, ref_output, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("num_threads, max_span_blocks", [(1, 1), (1, 8), (4, 2)])
+def test_block_sparse_attention_tiling(num_threads, max_span_blocks):
+    geometry = geometries[0]
+    mask_mod = get_mask_mod(geometry.model, geometry.context_length, geometry.prompt_length, geometry.num_frame, geometry.frame_size, geometry.multiplier)
+    seq_len = geometry.seq_len
+    query, key, value = [torch.randn(1, 2, seq_len, 32) for _ in range(3)]
+    block_mask = flex_attention.create_block_mask(mask_mod, None, None, seq_len, seq_len, device="cpu")
+
+    idx = torch.arange(seq_len)
+    ref_output = torch.nn.functional.scaled_dot_product_attention(query, key, value, attn_mask=mask_mod(None, None, idx[:, None], idx[None, :]))
+    output = block_sparse_attention(query, key, value, block_mask, num_threads=num_threads, max_span_blocks=max_span_blocks)
+    torch.testing.assert_close(output, ref_output, rtol=1e-4, atol=1e-4)
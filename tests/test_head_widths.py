@@ -0,0 +1,132 @@
+import importlib
+
+import numpy as np
+import torch
+import pytest
+
+from svg.sparse import AttentionFlopCounter, HeadWidthTable, SparseAttentionGeometry, get_backend
+from svg.sparse.head_widths import allocate_head_widths, band_mask_mod, band_widths_in_tokens, sampled_band_mass
+
+flex_attention = pytest.importorskip("torch.nn.attention.flex_attention")
+
+
+def get_mask_mod(model, context_length, prompt_length, num_frame, frame_size, multiplier):
+    utils = importlib.import_module({
+        "hunyuan": "svg.models.hyvideo.modules.utils", "wan": "svg.models.wan.utils", "cog": "svg.models.cog.utils"
+    }[model])
+    if model == "cog":
+        return utils.generate_temporal_head_mask_mod(context_length, num_frame, frame_size, mul=multiplier)
+    return utils.generate_temporal_head_mask_mod(context_length, prompt_length, num_frame, frame_size, mul=multiplier)
+
+
+# Reduced sizes of the three models, with partial last blocks
+geometries = [
+    SparseAttentionGeometry.hunyuan(64, 60, 4, 96, 1.5),
+    SparseAttentionGeometry.wan(5, 80, 2),
+    SparseAttentionGeometry.cog(50, 4, 96, 1.5),
+]
+
+
+@pytest.mark.parametrize("geometry", geometries, ids=lambda geometry: geometry.model)
+def test_band_mask_mod(geometry):
+    # At the --sparsity width, the band of every head is the temporal head mask of the model
+    mask_mod = get_mask_mod(geometry.model, geometry.context_length, geometry.prompt_length, geometry.num_frame, geometry.frame_size, geometry.multiplier)
+    band_widths = band_widths_in_tokens(geometry, [geometry.multiplier] * 3)
+
+    idx = torch.arange(geometry.seq_len)
+    head = torch.arange(3)[:, None, None]
+    ref_mask = mask_mod(None, None, idx[:, None], idx[None, :])
+    mask = band_mask_mod(geometry, band_widths)(None, head, idx[:, None], idx[None, :])
+    assert torch.equal(mask, ref_mask.expand_as(mask))
+
+
+def test_allocate_head_widths():
+    rng = np.random.default_rng(0)
+    num_calls, num_widths, num_heads = 4, 5, 6
+    mass = np.sort(rng.uniform(size=(num_calls, num_widths, num_heads)), axis=1)
+    costs = np.array([2.0, 4.0, 6.0, 10.0, 16.0])
+
+    budget = costs[2] * num_calls * num_heads
+    levels = allocate_head_widths(mass, costs, budget)
+    assert levels.shape == (num_calls, num_heads)
+    assert costs[levels].sum() <= budget
+    # The heads that gain nothing from a wider band stay narrow
+    mass[0, :, 0] = mass[0, 0, 0]
+    assert allocate_head_widths(mass, costs, budget)[0, 0] == 0
+    # No budget above the narrowest width, or enough for the widest
+    assert (allocate_head_widths(mass, costs, costs[0] * num_calls * num_heads) == 0).all()
+    assert (allocate_head_widths(mass, costs, costs[-1] * num_calls * num_heads)[mass[:, -1] > mass[:, 0]] == num_widths - 1).all()
+
+
+@pytest.mark.parametrize("geometry", geometries, ids=lambda geometry: geometry.model)
+def test_sampled_band_mass(geometry):
+    cfg, num_heads, head_dim = 2, 4, 32
+    query, key = [torch.randn(cfg, num_heads, geometry.seq_len, head_dim) for _ in range(2)]
+    best_mask_idx = torch.tensor([[0, 1, 1, 0], [1, 0, 1, 1]])
+    band_widths = band_widths_in_tokens(geometry, [0.5, 1, 2, 100])
+
+    mass = sampled_band_mass(query, key, best_mask_idx, geometry, band_widths, num_sampled_rows=16)
+    assert mass.shape == (4, cfg, num_heads)
+    assert (mass[1:] >= mass[:-1] - 1e-6).all()
+    assert (mass <= 1 + 1e-5).all()
+    if geometry.model != "hunyuan":
+        # A band wider than the video keeps all the attention (HunyuanVideo always masks the text padding)
+        torch.testing.assert_close(mass[-1], torch.ones(cfg, num_heads))
+
+
+@pytest.mark.parametrize("geometry", geometries, ids=lambda geometry: geometry.model)
+def test_cpu_backend_per_head_widths(geometry):
+    cfg, num_heads, head_dim, seq_len = 2, 4, 32, geometry.seq_len
+    query, key, value = [torch.randn(cfg, num_heads, seq_len, head_dim) for _ in range(3)]
+    best_mask_idx = torch.tensor([[0, 1, 1, 0], [1, 0, 1, 1]])
+
+    band_widths = band_widths_in_tokens(geometry, [0.5, 1, 1.5, 3])
+    mask_mod = band_mask_mod(geometry, band_widths)
+    block_mask = flex_attention.create_block_mask(mask_mod, 1, num_heads, seq_len, seq_len, device="cpu")
+
+    output = get_backend("cpu")(query, key, value, best_mask_idx, block_mask, geometry)
+    ref_output = get_backend("sdpa")(query, key, value, best_mask_idx, block_mask, geometry)
+    torch.testing.assert_close(output, ref_output, rtol=1e-4, atol=1e-4)
+
+
+def test_head_width_table(tmp_path):
+    keys = np.array([[0, 0], [0, 1], [1, 0]])
+    levels = np.array([[0, 2], [1, 1], [2, 0]])
+    table = HeadWidthTable(keys, levels, np.array([1.0, 2.0, 3.0]), np.array([4.0, 6.0, 8.0]), uniform_level=1)
+    assert table.relative_flops() == pytest.approx(36 / 36)
+
+    table.save(tmp_path / "head_widths.npz")
+    loaded = HeadWidthTable.load(tmp_path / "head_widths.npz")
+    assert np.array_equal(loaded.levels, levels) and loaded.uniform_level == 1
+    # Calls that were not calibrated fall back to the uniform BlockMask
+    assert loaded(2, 900.0, torch.zeros(1, 2, 1, 1), None, None, geometries[0]) is None
+    # So do queries with another number of heads
+    loaded.reset()
+    assert loaded(0, 900.0, torch.zeros(4, 3, 1, 1), None, None, geometries[0]) is None
+    assert loaded.fallbacks == 1
+
+    with pytest.raises(ValueError, match="num_calls, num_heads"):
+        HeadWidthTable(keys, levels[:2], np.array([1.0, 2.0, 3.0]), np.array([4.0, 6.0, 8.0]), uniform_level=1)
+    with pytest.raises(ValueError, match="index the 2 widths"):
+        HeadWidthTable(keys, levels, np.array([1.0, 2.0]), np.array([4.0, 6.0]), uniform_level=1)
+
+
+def test_attention_flop_counter():
+    geometry = geometries[1]
+    seq_len, head_dim = geometry.seq_len, 32
+    mask_mod = get_mask_mod(geometry.model, geometry.context_length, geometry.prompt_length, geometry.num_frame, geometry.frame_size, geometry.multiplier)
+    block_mask = flex_attention.create_block_mask(mask_mod, None, None, seq_len, seq_len, device="cpu")
+    num_blocks = (block_mask.kv_num_blocks.sum() + block_mask.full_kv_num_blocks.sum()).item()
+
+    counter = AttentionFlopCounter()
+    counter.add(0, 2, 4, seq_len, head_dim)
+    counter.add(1, 2, 4, seq_len, head_dim, block_mask=block_mask)
+    counter.add(1, 2, 4, seq_len, head_dim, block_mask=block_mask)
+
+    dense = 4 * 2 * 4 * seq_len * seq_len * head_dim
+    sparse = 4 * 2 * 4 * num_blocks * 128 * 128 * head_dim
+    summary = counter.summary()
+    assert summary["calls"] == 3
+    assert summary["dense_tflops"] * 1e12 == pytest.approx(3 * dense)
+    assert summary["attention_tflops"] * 1e12 == pytest.approx(dense + 2 * sparse)
+    assert len(counter.report().splitlines()) == 4
@@ -0,0 +1,187 @@
+import types
+
+import torch
+import pytest
+
+from svg.models.hyvideo.modules import attenion
+from svg.models.hyvideo.modules.attenion import Hunyuan_SparseAttn, attention, get_cu_seqlens
+from svg.models.hyvideo.modules.utils import generate_temporal_head_mask_mod
+from svg.sparse import SparseAttentionGeometry, get_profiling_masks
+
+flex_attention = pytest.importorskip("torch.nn.attention.flex_attention")
+
+
+# Reduced HunyuanVideo: 4 latent frames of 96 tokens, then 64 text tokens
+geometry = SparseAttentionGeometry.hunyuan(64, 60, 4, 96, 1.5)
+img_len = geometry.num_frame * geometry.frame_size
+text_mask = (torch.arange(geometry.context_length)[None, :] < torch.tensor([[60], [41]])).long()
+best_mask_idx = torch.tensor([[0, 1, 1, 0], [1, 0, 1, 1]])
+
+
+def test_get_cu_seqlens():
+    cu_seqlens = get_cu_seqlens(text_mask, img_len)
+    max_len = img_len + geometry.context_length
+    assert cu_seqlens.tolist() == [0, img_len + 60, max_len, max_len + img_len + 41, 2 * max_len]
+    assert cu_seqlens.dtype == torch.int32
+
+
+def ref_get_cu_seqlens(text_mask, img_len):
+    # The former per-sample loop, one host sync per sample
+    batch_size = text_mask.shape[0]
+    text_len = text_mask.sum(dim=1)
+    max_len = text_mask.shape[1] + img_len
+    cu_seqlens = torch.zeros([2 * batch_size + 1], dtype=torch.int32, device=text_mask.device)
+    for i in range(batch_size):
+        s = text_len[i] + img_len
+        cu_seqlens[2 * i + 1] = i * max_len + s
+        cu_seqlens[2 * i + 2] = (i + 1) * max_len
+    return cu_seqlens
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 5])
+@pytest.mark.parametrize("dtype", [torch.long, torch.bool, torch.int32])
+def test_get_cu_seqlens_matches_loop(batch_size, dtype):
+    generator = torch.Generator().manual_seed(batch_size)
+    text_len = torch.randint(0, 257, (batch_size,), generator=generator)
+    text_len[0] = 256
+    text_mask = (torch.arange(256)[None, :] < text_len[:, None]).to(dtype)
+
+    cu_seqlens = get_cu_seqlens(text_mask, 1000)
+    assert cu_seqlens.dtype == torch.int32 and cu_seqlens.device == text_mask.device
+    assert torch.equal(cu_seqlens, ref_get_cu_seqlens(text_mask, 1000))
+
+
+def test_get_cu_seqlens_memoized():
+    mask = text_mask.clone()
+    cu_seqlens = get_cu_seqlens(mask, img_len)
+    assert get_cu_seqlens(mask, img_len) is cu_seqlens
+    assert get_cu_seqlens(mask, img_len + 1) is not cu_seqlens
+    # Equal content in another tensor, or the same tensor modified in place, is recomputed
+    assert torch.equal(get_cu_seqlens(mask.clone(), img_len), cu_seqlens)
+    mask[1, 41] = 1
+    assert torch.equal(get_cu_seqlens(mask, img_len), ref_get_cu_seqlens(mask, img_len))
+
+
+@pytest.fixture
+def sparse_attn(monkeypatch):
+    # flash-attn is CUDA only, the full attention layers fall back to SDPA
+    monkeypatch.setattr(attenion, "flash_attn_varlen_func", None)
+    mask_mod = generate_temporal_head_mask_mod(
+        geometry.context_length, geometry.prompt_length, geometry.num_frame, geometry.frame_size, mul=geometry.multiplier
+    )
+    seq_len = geometry.seq_len
+    monkeypatch.setattr(Hunyuan_SparseAttn, "geometry", geometry)
+    monkeypatch.setattr(Hunyuan_SparseAttn, "cu_seqlens", None)
+    monkeypatch.setattr(Hunyuan_SparseAttn, "backend", "cpu")
+    monkeypatch.setattr(Hunyuan_SparseAttn, "block_mask", flex_attention.create_block_mask(mask_mod, None, None, seq_len, seq_len, device="cpu"))
+    monkeypatch.setattr(Hunyuan_SparseAttn, "attention_masks", get_profiling_masks("hunyuan", geometry.context_length, geometry.num_frame, geometry.frame_size, device="cpu"))
+    # Fixed per-sample decisions, so that the batch and the samples alone profile the same
+    samples = []
+    monkeypatch.setattr(attenion.hunyuan_sparse_attn, "pattern_cache", lambda layer_idx, timestep, query, profile: best_mask_idx[samples])
+    return samples
+
+
+@pytest.mark.parametrize("first_times_fp", [0.0, 1.0], ids=["sparse", "full"])
+def test_batched_attention(sparse_attn, monkeypatch, first_times_fp):
+    monkeypatch.setattr(Hunyuan_SparseAttn, "first_times_fp", first_times_fp)
+    batch_size, num_heads, head_dim, seq_len = 2, 4, 32, geometry.seq_len
+    q, k, v = [torch.randn(batch_size, seq_len, num_heads, head_dim) for _ in range(3)]
+    timestep = torch.full((batch_size,), 500.0)
+    # The sparse layers share one BlockMask over the batch, which needs prompts of the same length
+    batch_text_mask = text_mask if first_times_fp == 1.0 else text_mask[[0, 0]]
+
+    def run(samples):
+        sparse_attn[:] = samples
+        cu_seqlens = get_cu_seqlens(batch_text_mask[samples], img_len)
+        return attention(
+            q[samples], k[samples], v[samples], mode="sparse", cu_seqlens_q=cu_seqlens, cu_seqlens_kv=cu_seqlens,
+            max_seqlen_q=seq_len, max_seqlen_kv=seq_len, batch_size=len(samples), timestep=timestep[samples], layer_idx=0,
+        )
+
+    output = run([0, 1])
+    assert output.shape == (batch_size, seq_len, num_heads * head_dim)
+    for i in range(batch_size):
+        torch.testing.assert_close(output[i], run([i])[0], rtol=1e-4, atol=1e-4)
+
+
+def test_sparse_prompt_length_from_text_mask(sparse_attn, monkeypatch):
+    built = []
+    monkeypatch.setattr(attenion, "prepare_flexattention", lambda *args, **kwargs: built.append(args[6]) or "block_mask")
+    query = torch.zeros(1, 4, geometry.seq_len, 32)
+
+    # Rebuilt once for the 41 text tokens of the prompt, whatever the number of steps
+    cu_seqlens = get_cu_seqlens(text_mask[[1]], img_len)
+    for _ in range(2):
+        attenion.hunyuan_sparse_attn.update_prompt_length(query, cu_seqlens)
+    assert built == [41] and Hunyuan_SparseAttn.block_mask == "block_mask"
+    assert Hunyuan_SparseAttn.geometry == SparseAttentionGeometry.hunyuan(64, 41, 4, 96, 1.5)
+
+    with pytest.raises(ValueError, match="same number of text tokens"):
+        attenion.hunyuan_sparse_attn.update_prompt_length(query, get_cu_seqlens(text_mask, img_len))
+
+
+class FakeTextEncoder:
+    """Per-text random embeddings, the text mask as long as the text (up to max_length)."""
+
+    dtype = torch.bfloat16
+
+    def __init__(self, dim, max_length=None):
+        self.dim = dim
+        self.max_length = max_length
+
+    def text2tokens(self, texts, data_type="image"):
+        return [texts] if isinstance(texts, str) else texts
+
+    def encode(self, texts, data_type="image", device=None):
+        def embedding(text, *shape):
+            return torch.randn(*shape, generator=torch.Generator().manual_seed(sum(text.encode()))).to(device, self.dtype)
+
+        if self.max_length is None:
+            # CLIP: one pooled vector per text
+            return types.SimpleNamespace(hidden_state=torch.stack([embedding(text, self.dim) for text in texts]), attention_mask=None)
+        hidden_state = torch.stack([embedding(text, self.max_length, self.dim) for text in texts])
+        attention_mask = torch.stack([torch.arange(self.max_length) < min(len(text), self.max_length) for text in texts]).long()
+        return types.SimpleNamespace(hidden_state=hidden_state, attention_mask=attention_mask.to(device))
+
+
+@pytest.fixture
+def sampler(hunyuan, tiny_vae, monkeypatch):
+    from svg.models.hyvideo.config import parse_args
+    from svg.models.hyvideo.inference import HunyuanVideoSampler
+
+    # flash-attn is CUDA only, the full attention layers fall back to SDPA
+    monkeypatch.setattr(attenion, "flash_attn_varlen_func", None)
+    monkeypatch.setattr("sys.argv", ["hyvideo_inference.py", "--output_path", "unused", "--pattern", "dense", "--vae-precision", "fp32"])
+    transformer, _ = hunyuan
+    return HunyuanVideoSampler(
+        parse_args(), tiny_vae, {"s_ratio": 8, "t_ratio": 4}, FakeTextEncoder(32, max_length=10), transformer,
+        text_encoder_2=FakeTextEncoder(16), device="cpu", parallel_args={"ulysses_degree": 1, "ring_degree": 1},
+    )
+
+
+def test_predict_batch_matches_sequential(sampler):
+    prompts = ["A cat walks on the grass", "A dog"]
+    kwargs = dict(height=64, width=64, video_length=9, infer_steps=3, guidance_scale=2.0, flow_shift=7.0, output_type="latent")
+
+    batched = sampler.predict(prompts, seed=[11, 12], **kwargs)
+    assert batched["prompts"] == prompts and batched["seeds"] == [11, 12]
+    assert batched["samples"].shape == (2, 4, 3, 8, 8)
+    for i, prompt in enumerate(prompts):
+        # A single string prompt, as the former predict took it
+        alone = sampler.predict(prompt, seed=11 + i, **kwargs)
+        assert len(alone["samples_per_prompt"]) == 1
+        # The double and single stream blocks run in bfloat16, a batch of 2 and of 4 round differently (~0.01 on
+        # average), where a prompt mixed up with another one is ~1 away
+        torch.testing.assert_close(batched["samples_per_prompt"][i].float(), alone["samples"].float(), rtol=0, atol=0.1)
+
+
+def test_rope_tables_on_the_execution_device(sampler, monkeypatch):
+    import svg.models.hyvideo.inference as inference
+
+    devices = []
+    monkeypatch.setattr(inference, "get_cached_nd_rotary_pos_embed", lambda *args, device=None, **kwargs: devices.append(device) or (None, None))
+    # Loaded on the host (device="cpu") like hyvideo_inference.py does, run on the GPU of the rank
+    monkeypatch.setattr(torch.cuda, "is_available", lambda: True)
+    monkeypatch.setenv("LOCAL_RANK", "1")
+    sampler.get_rotary_pos_embed(9, 64, 64)
+    assert devices == [torch.device("cuda:1")]
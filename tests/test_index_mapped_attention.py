@@ -0,0 +1,132 @@
+import importlib
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import torch
+import pytest
+
+from svg.sparse import (
+    SparseAttentionGeometry, get_backend, placement_index, ref_sparse_head_placement, ref_hidden_states_placement, ref_index_mapped_attention
+)
+
+
+def assert_close(a, b):
+    rtol, atol = {
+        torch.float32: (1e-4, 1e-4),
+        torch.bfloat16: (3e-2, 2e-2),
+    }[a.dtype]
+    torch.testing.assert_close(a, b, rtol=rtol, atol=atol)
+
+
+def get_geometry(model, context_length, prompt_length, num_frame, frame_size, multiplier, attn_sink=False):
+    return SparseAttentionGeometry(
+        model, context_length, prompt_length, num_frame, frame_size, multiplier,
+        text_first=model == "cog", first_frame_sink=model == "wan", attn_sink=attn_sink,
+    )
+
+
+def get_mask_mod(model, context_length, prompt_length, num_frame, frame_size, multiplier, attn_sink=False):
+    utils = importlib.import_module({
+        "hunyuan": "svg.models.hyvideo.modules.utils", "wan": "svg.models.wan.utils", "cog": "svg.models.cog.utils"
+    }[model])
+    if model == "cog":
+        return utils.generate_temporal_head_mask_mod(context_length, num_frame, frame_size, mul=multiplier, attn_sink=attn_sink)
+    return utils.generate_temporal_head_mask_mod(context_length, prompt_length, num_frame, frame_size, mul=multiplier)
+
+
+@pytest.mark.parametrize("text_first", [False, True])
+@pytest.mark.parametrize("context_length, num_frame, frame_size", [(0, 5, 64), (30, 4, 96)])
+def test_placement_index(text_first, context_length, num_frame, frame_size):
+    index = placement_index(context_length, num_frame, frame_size, text_first)
+    seq_len = context_length + num_frame * frame_size
+    assert torch.equal(index.sort().values, torch.arange(seq_len))
+
+    # The first num_frame tokens of a temporal head are the first patch of every frame
+    pixel_start = context_length if text_first else 0
+    assert index[pixel_start:pixel_start + num_frame].tolist() == [pixel_start + f * frame_size for f in range(num_frame)]
+
+
+parameters = [
+    ("hunyuan", 64, 60, 4, 96, 1.5),
+    ("wan", 0, 0, 5, 80, 2),
+    ("cog", 50, 50, 4, 96, 1.5),
+]
+@pytest.mark.parametrize("model, context_length, prompt_length, num_frame, frame_size, multiplier", parameters)
+def test_ref_index_mapped_attention(model, context_length, prompt_length, num_frame, frame_size, multiplier):
+    geometry = get_geometry(model, context_length, prompt_length, num_frame, frame_size, multiplier)
+    mask_mod = get_mask_mod(model, context_length, prompt_length, num_frame, frame_size, multiplier)
+
+    cfg, num_heads, head_dim = 2, 4, 32
+    seq_len = context_length + num_frame * frame_size
+    query, key, value = [torch.randn(cfg, num_heads, seq_len, head_dim) for _ in range(3)]
+    best_mask_idx = torch.tensor([[0, 1, 1, 0], [1, 0, 1, 1]])
+
+    # Ref: placement -> attention on the placed tensors -> placement back
+    query_out, key_out, value_out = ref_sparse_head_placement(query, key, value, best_mask_idx, context_length, num_frame, frame_size, geometry.text_first)
+    idx = torch.arange(seq_len)
+    attn_mask = mask_mod(None, None, idx[:, None], idx[None, :])
+    hidden_states = torch.nn.functional.scaled_dot_product_attention(query_out, key_out, value_out, attn_mask=attn_mask)
+    ref_output = torch.empty_like(hidden_states)
+    ref_hidden_states_placement(hidden_states, ref_output, best_mask_idx, context_length, num_frame, frame_size, geometry.text_first)
+
+    output = ref_index_mapped_attention(query, key, value, best_mask_idx, mask_mod, geometry)
+    assert_close(output, ref_output)
+
+    # The SDPA backend only needs the mask_mod of the BlockMask
+    output = get_backend("sdpa")(query, key, value, best_mask_idx, SimpleNamespace(mask_mod=mask_mod), geometry)
+    assert_close(output, ref_output)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="Triton kernel needs CUDA")
+@pytest.mark.parametrize("model, context_length, prompt_length, num_frame, frame_size, multiplier", parameters + [("wan", 0, 0, 6, 330, 2)])
+@pytest.mark.parametrize("head_dim", [64, 128])
+def test_index_mapped_attention(model, context_length, prompt_length, num_frame, frame_size, multiplier, head_dim):
+    from torch.nn.attention.flex_attention import create_block_mask
+    from svg.sparse.index_mapped_attention import index_mapped_attention
+
+    geometry = get_geometry(model, context_length, prompt_length, num_frame, frame_size, multiplier)
+    mask_mod = get_mask_mod(model, context_length, prompt_length, num_frame, frame_size, multiplier)
+
+    cfg, num_heads, dtype, device = 2, 4, torch.bfloat16, "cuda"
+    seq_len = context_length + num_frame * frame_size
+    # Non-contiguous, like the transposed projections of the processors
+    query, key, value = [torch.randn(cfg, seq_len, num_heads, head_dim, dtype=dtype, device=device).transpose(1, 2) for _ in range(3)]
+    best_mask_idx = torch.randint(0, 2, (cfg, num_heads), device=device)
+
+    block_mask = create_block_mask(mask_mod, None, None, seq_len, seq_len, device=device)
+    output = index_mapped_attention(query, key, value, best_mask_idx, block_mask, geometry)
+
+    ref_output = ref_index_mapped_attention(
+        query.float(), key.float(), value.float(), best_mask_idx, mask_mod, geometry
+    )
+    assert_close(output, ref_output.to(dtype))
+
+
+interpreted_parameters = [p + (False,) for p in parameters] + [("cog", 50, 50, 4, 96, 1.5, True)]
+def check_index_mapped_attention(model, context_length, prompt_length, num_frame, frame_size, multiplier, attn_sink, device="cpu"):
+    # The index mapping and the Triton mask of the kernel against the reference mask_mod
+    from torch.nn.attention.flex_attention import create_block_mask
+    from svg.sparse.index_mapped_attention import index_mapped_attention
+
+    geometry = get_geometry(model, context_length, prompt_length, num_frame, frame_size, multiplier, attn_sink)
+    mask_mod = get_mask_mod(model, context_length, prompt_length, num_frame, frame_size, multiplier, attn_sink)
+
+    seq_len = context_length + num_frame * frame_size
+    query, key, value = [torch.randn(1, 2, seq_len, 32, device=device) for _ in range(3)]
+    best_mask_idx = torch.tensor([[0, 1]], device=device)
+
+    block_mask = create_block_mask(mask_mod, None, None, seq_len, seq_len, device=device)
+    output = index_mapped_attention(query, key, value, best_mask_idx, block_mask, geometry)
+    assert_close(output, ref_index_mapped_attention(query, key, value, best_mask_idx, mask_mod, geometry))
+
+
+def test_index_mapped_attention_interpreted():
+    # TRITON_INTERPRET runs the kernel on CPU tensors, but has to be set before triton is imported: run it in a child process
+    pytest.importorskip("triton")
+    tests = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, TRITON_INTERPRET="1", PYTHONPATH=os.pathsep.join([os.path.dirname(tests), tests]))
+    code = "import test_index_mapped_attention as t\nfor p in t.interpreted_parameters: t.check_index_mapped_attention(*p)"
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
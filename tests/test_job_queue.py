@@ -0,0 +1,131 @@
+import heapq
+import random
+
+import pytest
+
+from svg.models.hyvideo.utils.job_queue import DONE, LEASED, PENDING, LocalJobQueue, SQLiteJobQueue, run_worker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_queue(kind, tmp_path, lease_seconds, clock):
+    if kind == "local":
+        return LocalJobQueue(lease_seconds, clock=clock)
+    return SQLiteJobQueue(str(tmp_path / "jobs.sqlite"), lease_seconds, clock=clock)
+
+
+def static_makespan(prompts, loop_num, durations, world_size):
+    """Wall-clock time of the rank-stride sharding of ``InferenceTask.get_task``."""
+    return max(
+        sum(durations[prompt] for prompt in prompts[rank::world_size] for _ in range(loop_num)) for rank in range(world_size)
+    )
+
+
+def queue_makespan(queue, durations, world_size, clock, die_at=None, poll_interval=10.0):
+    """Event-driven simulation of ``world_size`` workers pulling from ``queue``.
+
+    ``die_at`` maps a worker to the time after which it stops without completing its current task.
+    """
+    die_at = {} if die_at is None else die_at
+    events = [(0.0, worker, None) for worker in range(world_size)]
+    makespan = 0.0
+    while events:
+        clock.now, worker, task = heapq.heappop(events)
+        if task is not None:
+            queue.complete(task, str(worker))
+            makespan = clock.now
+        if clock.now > die_at.get(worker, float("inf")):
+            continue
+        task = queue.acquire(str(worker))
+        if task is not None:
+            heapq.heappush(events, (clock.now + durations[task[0]], worker, task))
+        elif not queue.is_finished():
+            heapq.heappush(events, (clock.now + poll_interval, worker, None))
+    return makespan
+
+
+@pytest.mark.parametrize("kind", ["local", "sqlite"])
+def test_makespan_vs_static_sharding(kind, tmp_path):
+    rng = random.Random(0)
+    world_size, loop_num = 4, 2
+    prompts = [f"prompt {i}" for i in range(32)]
+    # Long prompts and low TeaCache skip rates make some tasks several times slower than others
+    durations = {prompt: rng.choice([60.0, 90.0, 300.0]) for prompt in prompts}
+    durations[prompts[0]] = durations[prompts[4]] = durations[prompts[8]] = 600.0
+
+    clock = FakeClock()
+    queue = make_queue(kind, tmp_path, 1e9, clock)
+    queue.add_tasks([(prompt, loop_idx) for prompt in prompts for loop_idx in range(loop_num)])
+    dynamic = queue_makespan(queue, durations, world_size, clock)
+
+    static = static_makespan(prompts, loop_num, durations, world_size)
+    total = sum(durations.values()) * loop_num
+    assert queue.is_finished()
+    assert dynamic < static
+    # Greedy list scheduling is within one task of the ideal balance
+    assert dynamic <= total / world_size + max(durations.values())
+
+
+@pytest.mark.parametrize("kind", ["local", "sqlite"])
+def test_dead_worker_lease_expiry(kind, tmp_path):
+    clock = FakeClock()
+    queue = make_queue(kind, tmp_path, 200.0, clock)
+    queue.add_tasks([(f"prompt {i}", 0) for i in range(6)])
+    durations = {f"prompt {i}": 100.0 for i in range(6)}
+
+    # Worker 0 dies during its first task, whose lease expires at t = 200
+    makespan = queue_makespan(queue, durations, 2, clock, die_at={0: 50.0})
+    assert queue.is_finished()
+    assert makespan >= 200.0 + 100.0
+    assert queue.counts() == {PENDING: 0, LEASED: 0, DONE: 6}
+
+
+@pytest.mark.parametrize("kind", ["local", "sqlite"])
+def test_lease_renew_and_release(kind, tmp_path):
+    clock = FakeClock()
+    queue = make_queue(kind, tmp_path, 100.0, clock)
+    queue.add_tasks([("a", 0), ("a", 1)])
+    queue.add_tasks([("a", 0)])
+
+    task = queue.acquire("w0")
+    assert task == ("a", 0)
+    clock.now = 90.0
+    assert queue.renew(task, "w0")
+    # Renewed until t = 190, so the lease is not re-issued at t = 150
+    clock.now = 150.0
+    assert queue.acquire("w1") == ("a", 1)
+    assert queue.acquire("w1") is None
+
+    clock.now = 200.0
+    assert queue.acquire("w1") == ("a", 0)
+    assert not queue.renew(task, "w0")
+    # The slow worker still finished the video, the task is done
+    assert not queue.complete(task, "w0")
+    queue.release(("a", 1), "w1")
+    assert queue.counts() == {PENDING: 1, LEASED: 0, DONE: 1}
+
+
+def test_run_worker(tmp_path):
+    queue = SQLiteJobQueue(str(tmp_path / "jobs.sqlite"))
+    queue.add_tasks([(f"prompt {i}", loop_idx) for i in range(3) for loop_idx in range(2)])
+    done = []
+    assert run_worker(queue, "w0", lambda prompts, loop_idxs: done.append(list(zip(prompts, loop_idxs))), batch_size=4) == 6
+    # A batch of 4 tasks, then the remaining 2
+    assert [len(batch) for batch in done] == [4, 2]
+    assert sorted(sum(done, [])) == sorted((f"prompt {i}", loop_idx) for i in range(3) for loop_idx in range(2))
+
+    # A failing task is released for the other workers
+    queue.add_tasks([("failing", 0)])
+
+    def fail(prompts, loop_idxs):
+        raise RuntimeError(prompts)
+
+    with pytest.raises(RuntimeError):
+        run_worker(queue, "w0", fail)
+    assert queue.counts()[PENDING] == 1
@@ -0,0 +1,125 @@
+import os
+import types
+
+import pytest
+import torch
+
+from svg.latent_store import (
+    LATENT_SUFFIX, latent_path, list_latents, load_latents, run_decode_worker, save_latents, video_paths
+)
+from svg.models.hyvideo.utils.job_queue import LocalJobQueue, SQLiteJobQueue
+
+
+def test_save_and_load(tmp_path):
+    latents = torch.randn(2, 16, 5, 8, 12)
+    metadata = {"model": "hunyuan", "vae": "884-16c-hy", "fps": 24, "prompt": "Un chat marche sur l'herbe, réaliste", "seed": None, "video_size": [720, 1280]}
+    path = latent_path(str(tmp_path / "latents"), "cat-0")
+    save_latents(path, latents, metadata)
+
+    loaded, loaded_metadata = load_latents(path)
+    assert loaded.dtype == torch.float16 and loaded.shape == latents.shape
+    torch.testing.assert_close(loaded.float(), latents, atol=2e-3, rtol=1e-3)
+    assert loaded_metadata == metadata
+    # Only the renamed file is left, and half the size of the float32 latents
+    assert os.listdir(tmp_path / "latents") == ["cat-0" + LATENT_SUFFIX]
+    assert list_latents(str(tmp_path / "latents")) == ["cat-0"]
+    assert os.path.getsize(path) < latents.numel() * 2 + 1024
+
+
+def test_save_errors(tmp_path):
+    with pytest.raises(ValueError, match="model"):
+        save_latents(latent_path(str(tmp_path), "a"), torch.zeros(1, 4), {"fps": 24})
+    with pytest.raises(ValueError, match="wider dtype"):
+        save_latents(latent_path(str(tmp_path), "b"), torch.full((1, 4), 1e6), {"model": "wan"})
+    save_latents(latent_path(str(tmp_path), "c"), torch.full((1, 4), 1e6), {"model": "wan"}, dtype=torch.float32)
+    assert list_latents(str(tmp_path)) == ["c"]
+
+
+class FakeDecoders:
+    """Decodes (1, c, t, h, w) latents into t [0, 1] frames of the first 3 channels, in chunks of 2 latent frames."""
+
+    def __init__(self):
+        self.decoded = []
+
+    def __call__(self, metadata):
+        def decode(latents, metadata):
+            self.decoded.append(metadata["prompt"])
+            for start in range(0, latents.shape[2], 2):
+                yield latents[:, :3, start:start + 2].float().sigmoid()
+
+        return decode
+
+
+def add_latents(directory, name, num_samples, model="hunyuan"):
+    latents = torch.randn(num_samples, 4, 5, 16, 16)
+    save_latents(latent_path(directory, name), latents, {"model": model, "fps": 8, "prompt": name})
+
+
+def test_decode_worker(tmp_path):
+    imageio = pytest.importorskip("imageio")
+    pytest.importorskip("imageio_ffmpeg")
+    latent_dir, output_dir = str(tmp_path / "latents"), str(tmp_path / "videos")
+    add_latents(latent_dir, "cat-0", 1)
+    add_latents(latent_dir, "dog-0", 2)
+    add_latents(latent_dir, "fox-0", 1, model="wan")
+
+    queue = SQLiteJobQueue(str(tmp_path / "videos" / "decode_queue.sqlite"))
+    decoders = FakeDecoders()
+    assert run_decode_worker(latent_dir, output_dir, decoders, queue, "worker-0") == 3
+    assert sorted(decoders.decoded) == ["cat-0", "dog-0", "dog-0", "fox-0"]
+
+    videos = sorted(entry for entry in os.listdir(output_dir) if entry.endswith(".mp4"))
+    assert videos == ["cat-0.mp4", "dog-0-0.mp4", "dog-0-1.mp4", "fox-0.mp4"]
+    assert [os.path.basename(path) for path in video_paths(output_dir, "dog-0", 2)] == videos[1:3]
+    assert len(imageio.mimread(os.path.join(output_dir, "cat-0.mp4"))) == 5
+
+    # A second worker of the same output directory finds everything decoded
+    other = FakeDecoders()
+    assert run_decode_worker(latent_dir, output_dir, other, queue, "worker-1") == 0
+    assert other.decoded == []
+    queue.close()
+
+
+def test_decode_worker_watches_for_new_latents(tmp_path, monkeypatch):
+    import svg.latent_store as latent_store
+
+    written = []
+    monkeypatch.setattr(latent_store, "decode_latent_file", lambda path, output_dir, decoder_for: written.append(os.path.basename(path)) or [])
+    latent_dir = str(tmp_path / "latents")
+    add_latents(latent_dir, "cat-0", 1)
+
+    now = [0.0]
+
+    def sleep(seconds):
+        # The denoising writes a second file while the worker waits
+        now[0] += seconds
+        if now[0] == 10:
+            add_latents(latent_dir, "dog-0", 1)
+
+    num_done = run_decode_worker(
+        latent_dir, str(tmp_path / "videos"), None, LocalJobQueue(), "worker-0", watch=25, poll_interval=10,
+        sleep=sleep, clock=lambda: now[0]
+    )
+    assert num_done == 2
+    assert written == ["cat-0" + LATENT_SUFFIX, "dog-0" + LATENT_SUFFIX]
+    # Stopped once no new file came for 25 seconds
+    assert now[0] == 40
+
+
+def test_hunyuan_decoder_loads_the_recorded_vae(monkeypatch):
+    import decode_latents
+    import svg.models.hyvideo.vae as hyvideo_vae
+
+    loaded = []
+
+    def load_vae(vae_type, vae_precision=None, vae_path=None, device=None):
+        loaded.append((vae_type, vae_path))
+        return types.SimpleNamespace(), vae_path, 8, 4
+
+    monkeypatch.setattr(hyvideo_vae, "load_vae", load_vae)
+    args = types.SimpleNamespace(tile_batch_size=1, tiling=False, streaming=False)
+    metadata = {"model": "hunyuan", "vae": "884-16c-hy", "vae_path": "/models/hunyuan/vae", "vae_dtype": "fp16"}
+    decode_latents.hunyuan_decoder(args, metadata, "cpu")
+    # Latent files written before the path was recorded use the default path of the type
+    decode_latents.hunyuan_decoder(args, {key: value for key, value in metadata.items() if key != "vae_path"}, "cpu")
+    assert loaded == [("884-16c-hy", "/models/hunyuan/vae"), ("884-16c-hy", None)]
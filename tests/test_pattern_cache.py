@@ -0,0 +1,104 @@
+import torch
+import pytest
+
+from svg.sparse import PatternDecisionCache
+
+
+class CountingProfile:
+    def __init__(self, num_head=4):
+        self.num_head = num_head
+        self.num_calls = 0
+
+    def __call__(self):
+        self.num_calls += 1
+        return torch.full((self.num_head,), self.num_calls % 2, dtype=torch.long)
+
+
+def run_steps(cache, profile, timesteps, num_layers=2, calls_per_layer=1, query=None):
+    query = torch.randn(1, 4, 256, 64) if query is None else query
+    decisions = []
+    for t in timesteps:
+        for layer_idx in range(num_layers):
+            for _ in range(calls_per_layer):
+                decisions.append(cache(layer_idx, t, query, profile))
+    return decisions
+
+
+@pytest.mark.parametrize("reprofile_interval", [1, 3, 5])
+def test_reprofile_interval(reprofile_interval):
+    cache, profile = PatternDecisionCache(reprofile_interval), CountingProfile()
+    timesteps = torch.linspace(1000, 0, 10)
+    run_steps(cache, profile, timesteps, num_layers=2)
+
+    expected = 2 * -(-len(timesteps) // reprofile_interval)
+    assert profile.num_calls == expected
+    assert cache.misses == expected
+    assert cache.hits == 2 * len(timesteps) - expected
+
+
+def test_cond_uncond_calls_are_separate():
+    # e.g. Wan runs the conditional and unconditional passes through the same layer
+    cache, profile = PatternDecisionCache(reprofile_interval=4), CountingProfile()
+    decisions = run_steps(cache, profile, [999.0, 980.0, 960.0], num_layers=1, calls_per_layer=2)
+
+    assert profile.num_calls == 2
+    cond, uncond = decisions[0::2], decisions[1::2]
+    for d in cond:
+        torch.testing.assert_close(d, cond[0])
+    for d in uncond:
+        torch.testing.assert_close(d, uncond[0])
+    assert not torch.equal(cond[0], uncond[0])
+
+
+def test_new_generation_reprofiles():
+    cache, profile = PatternDecisionCache(reprofile_interval=100), CountingProfile()
+    run_steps(cache, profile, [999.0, 500.0, 1.0], num_layers=2)
+    assert profile.num_calls == 2
+    # Timestep goes up again: a new video has started
+    run_steps(cache, profile, [999.0, 500.0], num_layers=2)
+    assert profile.num_calls == 4
+
+
+def test_drift_triggers_reprofile():
+    cache, profile = PatternDecisionCache(reprofile_interval=100, drift_threshold=0.1), CountingProfile()
+    query = torch.randn(1, 4, 256, 64)
+    run_steps(cache, profile, [999.0, 990.0], num_layers=1, query=query)
+    assert profile.num_calls == 1 and cache.drift_misses == 0
+
+    run_steps(cache, profile, [980.0], num_layers=1, query=query * 1.05)
+    assert profile.num_calls == 1
+
+    query_drifted = query.clone()
+    query_drifted[:, 2] *= 2
+    # The drift of a step is read on the host at the next step
+    run_steps(cache, profile, [970.0], num_layers=1, query=query_drifted)
+    assert profile.num_calls == 1
+    run_steps(cache, profile, [960.0], num_layers=1, query=query_drifted)
+    assert profile.num_calls == 2 and cache.drift_misses == 1
+    assert cache.hit_rate == pytest.approx(3 / 5)
+
+
+def test_drift_on_the_profiled_rows():
+    cache, profile = PatternDecisionCache(reprofile_interval=100, drift_threshold=0.1), CountingProfile()
+    # Like SparseAttentionProcessor.get_best_mask_idx, the rows sample_mse ran on
+    profile.sampled_rows = torch.arange(8)
+    query = torch.randn(1, 4, 256, 64)
+    run_steps(cache, profile, [999.0], num_layers=3, query=query)
+    assert all(torch.equal(entry["sampled_rows"], profile.sampled_rows) for entry in cache.entries.values())
+
+    # Only the rows that were not profiled change
+    query_moved = query.clone()
+    query_moved[:, :, 8:] *= 2
+    run_steps(cache, profile, [990.0, 980.0, 970.0], num_layers=3, query=query_moved)
+    assert profile.num_calls == 3 and cache.drift_misses == 0
+    # One host read of the drifts of the 3 layers per step
+    assert cache.drift_syncs == 2
+
+
+def test_batch_sizes_are_separate():
+    cache = PatternDecisionCache(reprofile_interval=100)
+    single, batched = CountingProfile(), CountingProfile()
+    run_steps(cache, single, [999.0, 980.0], num_layers=1, query=torch.randn(2, 4, 256, 64))
+    # Same layer call, cfg 2 x batch 2: the [2, num_head] decision does not fit
+    run_steps(cache, batched, [960.0, 940.0], num_layers=1, query=torch.randn(4, 4, 256, 64))
+    assert single.num_calls == 1 and batched.num_calls == 1
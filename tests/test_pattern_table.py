@@ -0,0 +1,127 @@
+import torch
+import pytest
+
+from svg.models.wan.utils import generate_temporal_head_mask_mod
+from svg.sparse import SparseAttentionGeometry, SparseAttentionProcessor, get_profiling_masks, PatternRecorder, PatternTable, calibrate_pattern_table
+
+
+flex_attention = pytest.importorskip("torch.nn.attention.flex_attention")
+
+
+class TinySparseAttn(SparseAttentionProcessor):
+    """The real processor on the CPU backend, recording its decisions and counting the sample_mse runs."""
+
+    backend = "cpu"
+
+    def __init__(self, layer_idx):
+        self.layer_idx = layer_idx
+        self.num_profiles = 0
+        self.decisions = []
+
+    def sample_mse(self, query, key, value, sampled_rows=None):
+        self.num_profiles += 1
+        return super().sample_mse(query, key, value, sampled_rows)
+
+    def get_best_mask_idx(self, query, key, value, timestep, layer_idx):
+        self.decisions.append(super().get_best_mask_idx(query, key, value, timestep, layer_idx))
+        return self.decisions[-1]
+
+
+class TinyTransformer:
+    def __init__(self, num_layers=3, num_heads=4, head_dim=16, num_frame=8, frame_size=64, seed=0):
+        generator = torch.Generator().manual_seed(seed)
+        self.seq_len = num_frame * frame_size
+        # Half of the heads look at the tokens of the same frame (spatial), the other half at the same token of other frames (temporal)
+        self.embedding = torch.randn(self.seq_len, num_heads, head_dim, generator=generator)
+        frame_embedding = torch.randn(frame_size, num_heads, head_dim, generator=generator)
+        token_embedding = frame_embedding.repeat(num_frame, 1, 1)
+        same_frame_embedding = torch.randn(num_frame, num_heads, head_dim, generator=generator).repeat_interleave(frame_size, dim=0)
+        self.embedding[:, :num_heads // 2] += 4 * same_frame_embedding[:, :num_heads // 2]
+        self.embedding[:, num_heads // 2:] += 4 * token_embedding[:, num_heads // 2:]
+        self.value = torch.randn(num_heads, self.seq_len, head_dim, generator=generator)
+        self.layers = [TinySparseAttn(layer_idx) for layer_idx in range(num_layers)]
+
+        geometry = SparseAttentionGeometry.wan(num_frame, frame_size, 2)
+        mask_mod = generate_temporal_head_mask_mod(0, 0, num_frame, frame_size, mul=geometry.multiplier)
+        TinySparseAttn.geometry = geometry
+        TinySparseAttn.block_mask = flex_attention.create_block_mask(mask_mod, None, None, self.seq_len, self.seq_len, device="cpu")
+        TinySparseAttn.attention_masks = get_profiling_masks("wan", 0, num_frame, frame_size, device="cpu")
+
+    def __call__(self, timesteps, cfg=2):
+        decisions = []
+        torch.manual_seed(0)
+        for t in timesteps:
+            for layer in self.layers:
+                x = self.embedding.transpose(0, 1)[None].expand(cfg, -1, -1, -1)
+                layer.sparse_attention(x, x, self.value[None].expand(cfg, -1, -1, -1), t, layer.layer_idx)
+                decisions.append(layer.decisions[-1])
+        return decisions
+
+
+@pytest.fixture(autouse=True)
+def reset_pattern_cache():
+    yield
+    TinySparseAttn.pattern_cache = None
+
+
+def test_static_table_matches_online_decisions(tmp_path):
+    model = TinyTransformer()
+    timesteps = torch.linspace(999, 0, 8).tolist()
+    online = model(timesteps)
+
+    path = str(tmp_path / "table.npz")
+    calibrate_pattern_table(TinySparseAttn, lambda prompt: model(timesteps), ["a", "b"], num_timestep_buckets=4, path=path)
+    assert TinySparseAttn.pattern_cache is None
+
+    TinySparseAttn.pattern_cache = PatternTable.load(path)
+    num_profiles = sum(layer.num_profiles for layer in model.layers)
+    static = model(timesteps)
+
+    assert sum(layer.num_profiles for layer in model.layers) == num_profiles
+    assert TinySparseAttn.pattern_cache.fallbacks == 0
+    for online_idx, static_idx in zip(online, static):
+        assert static_idx.shape == online_idx.shape
+        torch.testing.assert_close(static_idx, online_idx)
+
+
+def test_static_table_serves_other_batch_sizes(tmp_path):
+    model = TinyTransformer()
+    timesteps = torch.linspace(999, 0, 8).tolist()
+    # Calibrated with one prompt (cfg 2), generating two prompts at a time (cfg 2 x batch 2)
+    table = calibrate_pattern_table(TinySparseAttn, lambda prompt: model(timesteps), ["a"], num_timestep_buckets=4)
+    online = model(timesteps, cfg=4)
+
+    TinySparseAttn.pattern_cache = table
+    static = model(timesteps, cfg=4)
+    assert table.fallbacks == 0
+    for online_idx, static_idx in zip(online, static):
+        assert static_idx.shape == (4, 4)
+        torch.testing.assert_close(static_idx, online_idx)
+
+    # Another number of heads is profiled online
+    query = torch.zeros(2, 8, 4, 16)
+    assert table(0, 999.0, query, lambda: torch.ones(2, 8, dtype=torch.long)).shape == (2, 8)
+    assert table.fallbacks == 1
+
+
+def test_majority_vote_and_merge(tmp_path):
+    table = PatternRecorder(num_timestep_buckets=2)
+    query = torch.zeros(1, 3, 4, 8)
+    votes = [torch.tensor([[1, 0, 1]]), torch.tensor([[1, 0, 0]]), torch.tensor([[0, 0, 1]])]
+    for timestep, vote in zip([900.0, 800.0, 700.0], votes):
+        table(0, timestep, query, lambda: vote)
+    table = table.to_table()
+    torch.testing.assert_close(table.best_mask_idx[0, 1], torch.tensor([1, 0, 1]))
+    assert table.total_counts[0].tolist() == [0, 3]
+    assert table(0, 900.0, torch.zeros(3, 3, 4, 8), None).tolist() == [[1, 0, 1]] * 3
+
+    # Bucket 0 was never calibrated and falls back to online profiling
+    assert table(0, 100.0, query, lambda: torch.tensor([[1, 1, 1]])).tolist() == [[1, 1, 1]]
+    assert table.fallbacks == 1
+
+    path = str(tmp_path / "table.npz")
+    table.save(path)
+    merged = PatternTable.load(path).merge(table)
+    assert merged.total_counts[0].tolist() == [0, 6]
+    torch.testing.assert_close(merged.best_mask_idx, table.best_mask_idx)
+
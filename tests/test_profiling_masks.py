@@ -0,0 +1,37 @@
+import torch
+import pytest
+
+from svg.sparse import get_profiling_masks, get_attention_mask
+from reference_masks import REF_ATTENTION_MASK
+
+
+parameters = [
+    ("hunyuan", 64, 5, 200),
+    ("hunyuan", 100, 9, 144),
+    ("wan", 0, 5, 200),
+    ("wan", 0, 6, 330),
+    ("cog", 64, 5, 200),
+    ("cog", 100, 9, 144),
+]
+@pytest.mark.parametrize("model, context_length, num_frame, frame_size", parameters)
+@pytest.mark.parametrize("mask_name", ["spatial", "temporal"])
+def test_profiling_mask_rows(model, context_length, num_frame, frame_size, mask_name):
+    ref_mask = REF_ATTENTION_MASK[model](mask_name, context_length, num_frame, frame_size) != 0
+    spatial, temporal = get_profiling_masks(model, context_length, num_frame, frame_size, device="cpu")
+    mask = spatial if mask_name == "spatial" else temporal
+
+    assert mask.shape == ref_mask.shape
+    # All rows at once, and a random subset the way sample_mse indexes it
+    torch.testing.assert_close(mask[torch.arange(ref_mask.shape[0]), :], ref_mask)
+    sampled_rows = torch.randint(low=0, high=ref_mask.shape[0], size=(32,))
+    torch.testing.assert_close(mask[sampled_rows, :], ref_mask[sampled_rows, :])
+
+
+@pytest.mark.parametrize("model, context_length, num_frame, frame_size", parameters)
+@pytest.mark.parametrize("mask_name", ["spatial", "temporal"])
+def test_attention_mask_builder(model, context_length, num_frame, frame_size, mask_name):
+    ref_mask = REF_ATTENTION_MASK[model](mask_name, context_length, num_frame, frame_size) != 0
+    mask = get_attention_mask(model, mask_name, context_length, num_frame, frame_size, device="cpu")
+
+    assert mask.dtype == torch.bool
+    torch.testing.assert_close(mask, ref_mask)
@@ -0,0 +1,70 @@
+import torch
+
+from svg.models.hyvideo.text_encoder.embedding_cache import PromptEmbeddingCache
+
+
+class FakeTextEncoder:
+    """Deterministic per-text embeddings, counts the texts that are actually encoded."""
+
+    text_encoder_type = "llm"
+    model_path = "fake"
+    precision = "fp16"
+    prompt_template = {"template": "<image>{}", "crop_start": 3}
+    prompt_template_video = {"template": "<video>{}", "crop_start": 5}
+    max_length = 8
+    hidden_state_skip_layer = 2
+    apply_final_norm = False
+    output_key = "last_hidden_state"
+    use_attention_mask = True
+
+    def __init__(self):
+        self.num_encoded = 0
+
+    def text2tokens(self, texts, data_type="image"):
+        return texts
+
+    def encode(self, texts, data_type="image", device=None):
+        self.num_encoded += len(texts)
+        hidden_state = torch.stack([torch.full((self.max_length, 4), float(len(text))) for text in texts])
+        attention_mask = torch.stack([torch.arange(self.max_length) < len(text) for text in texts]).long()
+        return type("Output", (), dict(hidden_state=hidden_state, attention_mask=attention_mask))
+
+
+def test_lru_and_partial_hits():
+    text_encoder, cache = FakeTextEncoder(), PromptEmbeddingCache(max_entries=2)
+    hidden_state, attention_mask = cache.encode(text_encoder, ["a", "bb"], data_type="video")
+    assert hidden_state.shape == (2, 8, 4) and attention_mask.shape == (2, 8)
+    assert text_encoder.num_encoded == 2
+
+    # Only the new text is encoded, and the rows keep their order
+    hidden_state, attention_mask = cache.encode(text_encoder, ["ccc", "a"], data_type="video")
+    assert text_encoder.num_encoded == 3
+    assert hidden_state[:, 0, 0].tolist() == [3.0, 1.0]
+    assert attention_mask.sum(-1).tolist() == [3, 1]
+
+    # The template (image vs video) is part of the key, and "bb" was evicted from the LRU
+    cache.encode(text_encoder, ["a"], data_type="image")
+    cache.encode(text_encoder, ["bb"], data_type="video")
+    assert text_encoder.num_encoded == 5
+    assert (cache.hits, cache.misses) == (1, 5)
+
+
+def test_disk_tier(tmp_path):
+    text_encoder = FakeTextEncoder()
+    hidden_state, attention_mask = PromptEmbeddingCache(cache_dir=str(tmp_path)).encode(text_encoder, ["a", "bb"])
+
+    # A rerun never runs the text encoder
+    text_encoder = FakeTextEncoder()
+    cache = PromptEmbeddingCache(cache_dir=str(tmp_path))
+    cached_hidden_state, cached_attention_mask = cache.encode(text_encoder, ["a", "bb"])
+    assert text_encoder.num_encoded == 0
+    assert torch.equal(cached_hidden_state, hidden_state)
+    assert torch.equal(cached_attention_mask, attention_mask)
+
+
+def test_repeated_texts():
+    # The negative prompt of batched prompts is encoded once
+    text_encoder, cache = FakeTextEncoder(), PromptEmbeddingCache()
+    hidden_state, _ = cache.encode(text_encoder, ["neg", "a", "neg"])
+    assert text_encoder.num_encoded == 2
+    assert hidden_state[:, 0, 0].tolist() == [3.0, 1.0, 3.0]
@@ -0,0 +1,92 @@
+import torch
+import pytest
+
+from svg.models.hyvideo.modules import posemb_layers
+from svg.models.hyvideo.modules.posemb_layers import apply_rotary_emb, get_cached_nd_rotary_pos_embed, get_nd_rotary_pos_embed
+
+
+# HunyuanVideo head_dim = 128 split over (t, h, w)
+rope_dim_list = [16, 56, 56]
+
+
+def test_hunyuan_tables_match_and_are_cached():
+    freqs_cos, freqs_sin = get_cached_nd_rotary_pos_embed(rope_dim_list, [3, 6, 10], theta=256)
+    ref_cos, ref_sin = get_nd_rotary_pos_embed(rope_dim_list, [3, 6, 10], theta=256, use_real=True)
+    assert torch.equal(freqs_cos, ref_cos)
+    assert torch.equal(freqs_sin, ref_sin)
+
+    # Same geometry: the same resident tensors, another geometry or dtype: new tables
+    assert get_cached_nd_rotary_pos_embed(rope_dim_list, [3, 6, 10], theta=256)[0] is freqs_cos
+    assert get_cached_nd_rotary_pos_embed(rope_dim_list, [5, 6, 10], theta=256)[0].shape == (5 * 6 * 10, 128)
+    assert get_cached_nd_rotary_pos_embed(rope_dim_list, [3, 6, 10], theta=256, dtype=torch.float64)[0].dtype == torch.float64
+
+
+def test_hunyuan_cache_is_bounded():
+    for t in range(posemb_layers.ROPE_TABLE_CACHE_SIZE + 3):
+        get_cached_nd_rotary_pos_embed(rope_dim_list, [t + 1, 2, 2], theta=256)
+    assert len(posemb_layers._rope_table_cache) == posemb_layers.ROPE_TABLE_CACHE_SIZE
+
+
+def test_hunyuan_apply_rotary_emb_with_cached_tables():
+    freqs_cis = get_cached_nd_rotary_pos_embed(rope_dim_list, [2, 4, 4], theta=256)
+    xq, xk = torch.randn(2, 2, 32, 4, 128, dtype=torch.bfloat16).unbind(0)
+    out_q, out_k = apply_rotary_emb(xq, xk, freqs_cis, head_first=False)
+
+    # Complex reference of the same rotation
+    ref_cis = get_nd_rotary_pos_embed(rope_dim_list, [2, 4, 4], theta=256, use_real=False)
+    ref_q, ref_k = apply_rotary_emb(xq, xk, ref_cis, head_first=False)
+    torch.testing.assert_close(out_q, ref_q)
+    torch.testing.assert_close(out_k, ref_k)
+
+
+def wan_freqs(seq_len, head_dim, theta=10000.0):
+    # Complex128 freqs as returned by WanRotaryPosEmbed, [1, 1, S, D / 2]
+    freqs = 1.0 / theta ** (torch.arange(0, head_dim, 2, dtype=torch.float64) / head_dim)
+    freqs = torch.outer(torch.arange(seq_len, dtype=torch.float64), freqs)
+    return torch.polar(torch.ones_like(freqs), freqs)[None, None]
+
+
+def ref_wan_rotary_emb(hidden_states, freqs):
+    # The former float64 complex path
+    x_rotated = torch.view_as_complex(hidden_states.to(torch.float64).unflatten(3, (-1, 2)))
+    x_out = torch.view_as_real(x_rotated * freqs).flatten(3, 4)
+    return x_out.type_as(hidden_states)
+
+
+@pytest.mark.parametrize("dtype", [torch.float32, torch.bfloat16])
+def test_wan_real_rotary_emb_parity(dtype):
+    wan_attention = pytest.importorskip("svg.models.wan.attention")
+    freqs = wan_freqs(300, 128)
+    hidden_states = torch.randn(2, 4, 300, 128).to(dtype)
+
+    out = wan_attention.apply_rotary_emb_real(hidden_states, freqs.real.float(), freqs.imag.float())
+    ref = ref_wan_rotary_emb(hidden_states, freqs)
+    assert out.dtype == dtype
+    if dtype == torch.float32:
+        torch.testing.assert_close(out, ref, atol=1e-5, rtol=1e-5)
+    else:
+        # At most one bfloat16 rounding step apart
+        torch.testing.assert_close(out.float(), ref.float(), atol=1e-2, rtol=1e-2)
+
+
+def test_wan_rope_tables_are_cached():
+    wan_attention = pytest.importorskip("svg.models.wan.attention")
+    calls = []
+
+    def rope(hidden_states):
+        calls.append(hidden_states.shape)
+        return wan_freqs(hidden_states.shape[2] * hidden_states.shape[3] * hidden_states.shape[4] // 4, 128)
+
+    hidden_states = torch.zeros(1, 16, 3, 8, 8)
+    freqs_cos, freqs_sin = wan_attention.get_rope_tables(rope, hidden_states)
+    assert freqs_cos.dtype == torch.float32 and freqs_cos.shape == (1, 1, 48, 64)
+    assert wan_attention.get_rope_tables(rope, hidden_states.clone())[1] is freqs_sin
+    wan_attention.get_rope_tables(rope, torch.zeros(1, 16, 5, 8, 8))
+    assert len(calls) == 2
+
+    # Another rope (e.g. of another model, possibly at the address of a freed one) builds its own tables
+    def other_rope(hidden_states):
+        return 2 * rope(hidden_states)
+
+    torch.testing.assert_close(wan_attention.get_rope_tables(other_rope, hidden_states)[1], 2 * freqs_sin)
+    assert len(calls) == 3
@@ -0,0 +1,82 @@
+import threading
+
+import numpy as np
+import pytest
+import torch
+import torchvision
+from einops import rearrange
+
+file_utils = pytest.importorskip("svg.models.hyvideo.utils.file_utils")
+
+
+def ref_video_grid_frames(videos, rescale=False, n_rows=1):
+    """The frames the former save_videos_grid built in memory before mimsave."""
+    outputs = []
+    for x in rearrange(videos, "b c t h w -> t b c h w"):
+        x = torchvision.utils.make_grid(x, nrow=n_rows)
+        x = x.transpose(0, 1).transpose(1, 2).squeeze(-1)
+        if rescale:
+            x = (x + 1.0) / 2.0
+        x = torch.clamp(x, 0, 1)
+        outputs.append((x * 255).numpy().astype(np.uint8))
+    return outputs
+
+
+@pytest.mark.parametrize("batch_size, rescale, chunk_size", [(1, False, 4), (3, True, 5), (2, False, 100)])
+def test_frames_match_former_conversion(batch_size, rescale, chunk_size):
+    videos = torch.rand(batch_size, 3, 11, 16, 24) * (2 if rescale else 1.2) - (1 if rescale else 0.1)
+    frames = list(file_utils.video_grid_frames(videos, rescale=rescale, n_rows=2, chunk_size=chunk_size))
+    reference = ref_video_grid_frames(videos, rescale=rescale, n_rows=2)
+    assert len(frames) == len(reference)
+    for frame, ref_frame in zip(frames, reference):
+        assert frame.dtype == np.uint8 and frame.flags["C_CONTIGUOUS"]
+        np.testing.assert_array_equal(frame, ref_frame)
+
+
+def test_save_and_background_writer(tmp_path, monkeypatch):
+    imageio = pytest.importorskip("imageio")
+    pytest.importorskip("imageio_ffmpeg")
+    videos = torch.rand(1, 3, 9, 32, 48)
+
+    path = str(tmp_path / "out" / "video.mp4")
+    file_utils.save_videos_grid(videos, path, fps=8, chunk_size=4)
+    assert len(imageio.mimread(path)) == 9
+
+    threads = []
+    save_videos_grid = file_utils.save_videos_grid
+
+    def save(*args, **kwargs):
+        threads.append(threading.get_ident())
+        return save_videos_grid(*args, **kwargs)
+
+    monkeypatch.setattr(file_utils, "save_videos_grid", save)
+    writer = file_utils.BackgroundVideoWriter(max_pending=1)
+    futures = [writer.submit(videos, str(tmp_path / f"video_{i}.mp4"), fps=8) for i in range(3)]
+    writer.close()
+    for future in futures:
+        future.result()
+    assert len(threads) == 3 and threading.get_ident() not in threads
+    assert all(len(imageio.mimread(str(tmp_path / f"video_{i}.mp4"))) == 9 for i in range(3))
+
+
+def test_background_writer_errors(tmp_path):
+    writer = file_utils.BackgroundVideoWriter()
+    # A 4d tensor is not a video
+    future = writer.submit(torch.rand(3, 9, 32, 48), str(tmp_path / "video.mp4"))
+    writer.close()
+    with pytest.raises(Exception):
+        future.result()
+
+
+def test_save_video_stream(tmp_path):
+    imageio = pytest.importorskip("imageio")
+    pytest.importorskip("imageio_ffmpeg")
+    videos = torch.rand(2, 3, 13, 32, 48)
+
+    file_utils.save_videos_grid(videos, str(tmp_path / "whole.mp4"), fps=8, n_rows=2)
+    file_utils.save_video_stream(videos.split([1, 8, 4], dim=2), str(tmp_path / "stream.mp4"), fps=8, n_rows=2)
+    whole = imageio.mimread(str(tmp_path / "whole.mp4"))
+    stream = imageio.mimread(str(tmp_path / "stream.mp4"))
+    assert len(stream) == 13
+    for frame, ref_frame in zip(stream, whole):
+        np.testing.assert_array_equal(frame, ref_frame)
@@ -0,0 +1,101 @@
+import threading
+import time
+
+import pytest
+
+from svg.stage_pipeline import Stage, StageLock, StagePipeline
+
+
+def sleeping(seconds, name=None, calls=None):
+    def func(job):
+        if calls is not None:
+            calls.append((name, job))
+        time.sleep(seconds)
+        return job
+
+    return func
+
+
+def intervals(events):
+    """{(stage, job): (start, end)} of the logged events."""
+    starts = {}
+    spans = {}
+    for stage, job_idx, event, now in events:
+        if event == "start":
+            starts[stage, job_idx] = now
+        else:
+            spans[stage, job_idx] = (starts[stage, job_idx], now)
+    return spans
+
+
+def overlap(a, b):
+    return min(a[1], b[1]) - max(a[0], b[0])
+
+
+def test_write_overlaps_next_denoise():
+    events = []
+    gpu_lock = StageLock()
+    pipeline = StagePipeline(
+        [
+            Stage("text", sleeping(0.01), lock=gpu_lock),
+            Stage("denoise", sleeping(0.1), lock=gpu_lock),
+            Stage("decode", sleeping(0.02), lock=gpu_lock),
+            Stage("write", sleeping(0.1)),
+        ],
+        log=lambda *event: events.append(event),
+    )
+    start = time.perf_counter()
+    assert pipeline.run(range(4)) == [0, 1, 2, 3]
+    wall_time = time.perf_counter() - start
+
+    spans = intervals(events)
+    for job_idx in range(3):
+        assert overlap(spans["write", job_idx], spans["denoise", job_idx + 1]) > 0.05
+    # Serially 4 * 0.23 s, the writes hide behind the denoising
+    assert wall_time < 0.8
+    assert pipeline.stats["write"].jobs == 4
+    assert "denoise: 4 jobs" in pipeline.summary()
+
+
+def test_shared_lock_is_exclusive():
+    events = []
+    gpu_lock = StageLock()
+    stages = [Stage(name, sleeping(0.02), lock=gpu_lock) for name in ("text", "denoise", "decode")]
+    StagePipeline(stages, log=lambda *event: events.append(event)).run(range(5))
+
+    spans = sorted(intervals(events).values())
+    assert len(spans) == 15
+    for previous, span in zip(spans, spans[1:]):
+        assert previous[1] <= span[0]
+
+
+def test_backpressure():
+    calls = []
+    pipeline = StagePipeline(
+        [Stage("decode", sleeping(0.0, "decode", calls), queue_size=1), Stage("write", sleeping(0.05, "write", calls))]
+    )
+    pipeline.run(range(6))
+
+    # At most one decoded job waits for the writer, besides the one being written and the one blocked on the queue
+    for i, (name, job) in enumerate(calls):
+        if name == "decode":
+            written = sum(1 for other, _ in calls[:i] if other == "write")
+            assert job - written <= 2
+    assert pipeline.stats["decode"].blocked > 0.1
+    assert pipeline.stats["write"].starved < pipeline.stats["decode"].blocked
+
+
+def test_errors_are_raised_and_stop_the_jobs():
+    done = []
+
+    def fail(job):
+        if job == 2:
+            raise RuntimeError("decode failed")
+        return job
+
+    pipeline = StagePipeline([Stage("decode", fail), Stage("write", done.append)])
+    with pytest.raises(RuntimeError, match="decode failed"):
+        pipeline.run(range(10))
+    # The jobs still in flight are dropped, none after the failure is written
+    assert done in ([0], [0, 1])
+    assert not [thread for thread in threading.enumerate() if thread.name.startswith("stage-")]
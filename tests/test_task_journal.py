@@ -0,0 +1,42 @@
+import json
+import os
+
+from svg.models.hyvideo.utils.task_journal import TaskJournal, compact_journals, journal_paths, load_completed_tasks
+
+
+def test_journal_resume_any_world_size(tmp_path):
+    checkpoint_dir = str(tmp_path)
+    # A previous run with 3 ranks
+    for rank in range(3):
+        journal = TaskJournal(checkpoint_dir, rank, fsync_every=2)
+        for i in range(rank, 10, 3):
+            journal.append(f"prompt {i}", 0)
+        journal.close()
+    # A rank that died while writing its last line
+    with open(os.path.join(checkpoint_dir, "journal_7.jsonl"), "a") as f:
+        f.write(json.dumps({"prompt": "prompt 11", "loop_idx": 1}) + "\n" + '{"prompt": "prom')
+
+    expected = {(f"prompt {i}", 0) for i in range(10)} | {("prompt 11", 1)}
+    assert load_completed_tasks(checkpoint_dir) == expected
+
+    assert compact_journals(checkpoint_dir) == len(expected)
+    assert [os.path.basename(path) for path in journal_paths(checkpoint_dir)] == ["journal_base.jsonl"]
+    assert load_completed_tasks(checkpoint_dir) == expected
+
+    # The next run appends next to the base journal
+    journal = TaskJournal(checkpoint_dir, 0)
+    journal.append("prompt 0", 1)
+    journal.close()
+    assert load_completed_tasks(checkpoint_dir) == expected | {("prompt 0", 1)}
+
+
+def test_legacy_checkpoints(tmp_path):
+    checkpoint_dir = str(tmp_path)
+    with open(os.path.join(checkpoint_dir, "task_list_20250101_000000_0.json"), "w") as f:
+        json.dump({"a": {"0": True, "1": False}}, f)
+    with open(os.path.join(checkpoint_dir, "task_list_20250102_000000_0.json"), "w") as f:
+        json.dump({"a": {"0": True, "1": True}}, f)
+    with open(os.path.join(checkpoint_dir, "task_list_20250101_000000_12.json"), "w") as f:
+        json.dump({"b": {"0": True}}, f)
+
+    assert load_completed_tasks(checkpoint_dir) == {("a", 0), ("a", 1), ("b", 0)}
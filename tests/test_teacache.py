@@ -0,0 +1,179 @@
+import numpy as np
+import pytest
+import torch
+from torch import nn
+
+from svg.teacache import TeaCache, TeaCacheRecorder, fit_teacache_coefficients, load_teacache_coefficients
+
+
+class TinyTransformer(nn.Module):
+    """Stack of residual blocks with the TeaCache hooks of the model forwards."""
+
+    def __init__(self, dim=32, num_blocks=4):
+        super().__init__()
+        self.time_in = nn.Linear(1, dim)
+        self.blocks = nn.ModuleList(nn.Linear(dim, dim) for _ in range(num_blocks))
+        self.teacache = None
+        self.num_block_runs = 0
+
+    def forward(self, x, t):
+        vec = self.time_in(t.reshape(1, 1))
+        should_calc = True
+        if self.teacache is not None:
+            should_calc = self.teacache.should_compute(x * (1 + vec))
+        if not should_calc:
+            return self.teacache.apply_residuals(x)
+
+        ori_x = x
+        for block in self.blocks:
+            x = x + torch.tanh(block(x + vec))
+        self.num_block_runs += 1
+        if self.teacache is not None:
+            self.teacache.store_residuals(ori_x, x)
+        return x
+
+
+class ReferenceTeaCache:
+    """The former inline TeaCache of HYVideoDiffusionTransformer.forward, one .cpu().item() per step."""
+
+    def __init__(self, threshold, coefficients, num_steps):
+        self.threshold, self.rescale_func, self.num_steps = threshold, np.poly1d(coefficients), num_steps
+        self.cnt = 0
+        self.decisions = []
+
+    def should_compute(self, modulated_inp):
+        if self.cnt == 0 or self.cnt == self.num_steps - 1:
+            should_calc = True
+            self.accumulated_rel_l1_distance = 0
+        else:
+            self.accumulated_rel_l1_distance += self.rescale_func(
+                ((modulated_inp - self.previous_modulated_input).abs().mean() / self.previous_modulated_input.abs().mean()).cpu().item()
+            )
+            if self.accumulated_rel_l1_distance < self.threshold:
+                should_calc = False
+            else:
+                should_calc = True
+                self.accumulated_rel_l1_distance = 0
+        self.previous_modulated_input = modulated_inp
+        self.cnt = (self.cnt + 1) % self.num_steps
+        self.decisions.append(should_calc)
+        return should_calc
+
+    def apply_residuals(self, x):
+        return x + self.previous_residual
+
+    def store_residuals(self, inputs, outputs):
+        self.previous_residual = outputs - inputs
+
+
+num_steps = 30
+coefficients = [2.0, 1.0, 0.0]
+
+
+@torch.no_grad()
+def denoise(model, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    x = torch.randn(2, 64, 32, generator=generator)
+    for t in torch.linspace(1, 0, num_steps):
+        x = x - 0.05 * model(x, t)
+    return x
+
+
+@pytest.fixture
+def model():
+    torch.manual_seed(0)
+    return TinyTransformer()
+
+
+def test_threshold_zero_never_skips(model):
+    reference = denoise(model)
+    model.teacache = TeaCache(0.0, coefficients, num_steps)
+    assert torch.equal(denoise(model), reference)
+    assert model.teacache.skipped == 0
+
+
+def test_matches_reference_teacache(model):
+    model.teacache = ReferenceTeaCache(0.1, coefficients, num_steps)
+    reference = denoise(model)
+    reference_decisions = model.teacache.decisions
+    assert 0 < reference_decisions.count(False) < num_steps - 2
+
+    model.teacache = TeaCache(0.1, coefficients, num_steps, sync_interval=1)
+    model.num_block_runs = 0
+    torch.testing.assert_close(denoise(model), reference)
+    assert model.num_block_runs == reference_decisions.count(True)
+    assert model.teacache.skipped_per_generation == [reference_decisions.count(False)]
+    assert model.teacache.syncs == num_steps - 2
+
+
+@pytest.mark.parametrize("sync_interval", [2, 4, 8])
+def test_sync_interval(model, sync_interval):
+    model.teacache = ReferenceTeaCache(0.1, coefficients, num_steps)
+    reference = denoise(model)
+    num_skipped = model.teacache.decisions.count(False)
+
+    teacache = model.teacache = TeaCache(0.1, coefficients, num_steps, sync_interval=sync_interval)
+    output = denoise(model)
+    # One host read per sync_interval decided steps at most
+    assert teacache.syncs <= (num_steps - 2) // sync_interval + 1
+    # The steps between two reads are decided from the last distance read, within a few steps of the exact decisions
+    assert 0 < teacache.skipped and abs(teacache.skipped - num_skipped) <= sync_interval
+    assert (output - reference).abs().mean() < 0.05 * reference.abs().mean()
+
+
+def test_generations_and_branches(model):
+    teacache = model.teacache = TeaCache(0.1, coefficients, num_steps, calls_per_step=2)
+
+    @torch.no_grad()
+    def denoise_cfg(seed):
+        # Separate cond / uncond calls per step, like the Wan pipeline
+        generator = torch.Generator().manual_seed(seed)
+        x = torch.randn(1, 64, 32, generator=generator)
+        for t in torch.linspace(1, 0, num_steps):
+            cond, uncond = model(x, t), model(0.5 * x, t)
+            x = x - 0.05 * (uncond + 2.0 * (cond - uncond))
+        return x
+
+    first = denoise_cfg(0)
+    # The state of the first generation is dropped after its last step
+    assert torch.equal(denoise_cfg(0), first)
+    assert len(teacache.skipped_per_generation) == 2
+    assert teacache.skipped_per_generation[0] == teacache.skipped_per_generation[1] > 0
+
+
+def test_tuple_residuals():
+    teacache = TeaCache(1e9, coefficients, num_steps)
+    hidden_states, encoder_hidden_states = torch.randn(2, 8), torch.randn(2, 4)
+    assert teacache.should_compute(hidden_states)
+    teacache.store_residuals((hidden_states, encoder_hidden_states), (hidden_states + 1, encoder_hidden_states - 1))
+    assert not teacache.should_compute(hidden_states * 1.01)
+    outputs = teacache.apply_residuals(hidden_states, encoder_hidden_states)
+    torch.testing.assert_close(outputs[0], hidden_states + 1)
+    torch.testing.assert_close(outputs[1], encoder_hidden_states - 1)
+
+
+def test_calibration(model, tmp_path):
+    recorder = model.teacache = TeaCacheRecorder(num_steps)
+    denoise(model, seed=0)
+    denoise(model, seed=1)
+    input_distances, output_distances = recorder.to_numpy()
+    assert len(input_distances) == len(output_distances) == 2 * (num_steps - 1)
+    assert (input_distances > 0).all() and (output_distances > 0).all()
+
+    path = str(tmp_path / "teacache.npz")
+    recorder.save(path)
+    recorder.save(path)
+    with np.load(path) as data:
+        assert len(data["input_distances"]) == 4 * (num_steps - 1)
+    fitted = load_teacache_coefficients(path)
+    assert len(fitted) == 5
+    # The fitted rescale tracks the output change better than the raw input change
+    assert np.abs(np.polyval(fitted, input_distances) - output_distances).mean() < np.abs(input_distances - output_distances).mean()
+
+
+def test_fit_and_load_coefficients():
+    x = np.linspace(0.01, 0.3, 50)
+    np.testing.assert_allclose(fit_teacache_coefficients(x, 3 * x ** 2 - x + 0.1, degree=2), [3.0, -1.0, 0.1], atol=1e-8)
+    assert load_teacache_coefficients("hunyuan")[0] == pytest.approx(7.33226126e+02)
+    with pytest.raises(ValueError):
+        load_teacache_coefficients("unknown-model")
@@ -0,0 +1,81 @@
+import pytest
+import torch
+from torch import nn
+
+streaming_decode = pytest.importorskip("svg.models.hyvideo.vae.streaming_decode")
+
+
+def full_decode(vae, z):
+    """The non-tiled decode, with the statistics of every GroupNorm of the decoder."""
+    stats = {}
+
+    def record(norm, inputs, output):
+        groups = inputs[0].reshape(inputs[0].shape[0], norm.num_groups, -1).double()
+        var, mean = torch.var_mean(groups, dim=-1, unbiased=False)
+        stats[norm] = (mean, var)
+
+    hooks = [module.register_forward_hook(record) for module in vae.decoder.modules() if isinstance(module, nn.GroupNorm)]
+    try:
+        dec = vae.decoder(vae.post_quant_conv(z))
+    finally:
+        for hook in hooks:
+            hook.remove()
+    return dec, stats
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3])
+def test_stream_matches_full_decode(tiny_vae, chunk_size):
+    torch.manual_seed(0)
+    z = torch.randn(2, 4, 6, 5, 6)
+    with torch.no_grad():
+        ref, stats = full_decode(tiny_vae, z)
+        decoder = streaming_decode.StreamingDecoder(tiny_vae, chunk_size=chunk_size, norm_stats=stats)
+        chunks = list(decoder.frames(z))
+    # 1 + 4 * (n - 1) frames for the first chunk, 4 * n for the next ones
+    assert [chunk.shape[2] for chunk in chunks] == [
+        4 * min(chunk_size, 6 - start) - (start == 0) * 3 for start in range(0, 6, chunk_size)
+    ]
+    torch.testing.assert_close(torch.cat(chunks, dim=2), ref, atol=1e-4, rtol=1e-4)
+    # The decoder is back to its own forwards
+    assert not any("forward" in vars(module) for module in tiny_vae.decoder.modules())
+
+
+def test_running_statistics(tiny_vae):
+    torch.manual_seed(1)
+    z = torch.randn(1, 4, 5, 4, 4)
+    with torch.no_grad():
+        ref, _ = full_decode(tiny_vae, z)
+        first, _ = full_decode(tiny_vae, z[:, :, :2])
+        dec = streaming_decode.StreamingDecoder(tiny_vae, chunk_size=2).decode(z)
+        # The statistics of the whole video in one chunk are those of the full decode
+        whole = streaming_decode.StreamingDecoder(tiny_vae, chunk_size=5).decode(z)
+    assert dec.shape == ref.shape == (1, 3, 17, 32, 32)
+    # The first chunk only saw its own frames, like a full decode of them
+    torch.testing.assert_close(dec[:, :, :5], first, atol=1e-4, rtol=1e-4)
+    torch.testing.assert_close(whole, ref, atol=1e-4, rtol=1e-4)
+
+
+def test_stream_with_spatial_tiles(tiny_vae):
+    torch.manual_seed(2)
+    # 2 x 2 tiles of 8 latent pixels, every tile streams with its own state
+    z = torch.randn(1, 4, 4, 10, 12)
+    tiny_vae.enable_spatial_tiling()
+    with torch.no_grad():
+        tiled = tiny_vae.spatial_tiled_decode(z).sample
+        stream = streaming_decode.StreamingDecoder(tiny_vae, chunk_size=4).decode(z)
+        chunks = list(streaming_decode.StreamingDecoder(tiny_vae, chunk_size=2).frames(z))
+    # A single chunk is the spatially tiled decode
+    torch.testing.assert_close(stream, tiled, atol=1e-4, rtol=1e-4)
+    assert torch.cat(chunks, dim=2).shape == tiled.shape
+
+
+def test_vae_streaming_decode(tiny_vae):
+    torch.manual_seed(3)
+    z = torch.randn(1, 4, 7, 4, 4)
+    with torch.no_grad():
+        ref = streaming_decode.StreamingDecoder(tiny_vae, chunk_size=3).decode(z)
+        tiny_vae.enable_tiling()
+        tiny_vae.enable_streaming_decode(chunk_size=3)
+        dec = tiny_vae.decode(z).sample
+    assert dec.shape == (1, 3, 25, 32, 32)
+    torch.testing.assert_close(dec, ref)
@@ -0,0 +1,100 @@
+import pytest
+import torch
+
+
+def ref_blend(a, b, blend_extent, dim):
+    """The former per-line blends of AutoencoderKLCausal3D."""
+    blend_extent = min(a.shape[dim], b.shape[dim], blend_extent)
+    for y in range(blend_extent):
+        b.select(dim, y).copy_(a.select(dim, y - blend_extent) * (1 - y / blend_extent) + b.select(dim, y) * (y / blend_extent))
+    return b
+
+
+def ref_spatial_tiled_decode(vae, z):
+    """The former spatial_tiled_decode: every tile decoded, then blended."""
+    overlap_size = int(vae.tile_latent_min_size * (1 - vae.tile_overlap_factor))
+    blend_extent = int(vae.tile_sample_min_size * vae.tile_overlap_factor)
+    row_limit = vae.tile_sample_min_size - blend_extent
+    rows = []
+    for i in range(0, z.shape[-2], overlap_size):
+        row = []
+        for j in range(0, z.shape[-1], overlap_size):
+            tile = z[:, :, :, i: i + vae.tile_latent_min_size, j: j + vae.tile_latent_min_size]
+            row.append(vae.decoder(vae.post_quant_conv(tile)))
+        rows.append(row)
+    result_rows = []
+    for i, row in enumerate(rows):
+        result_row = []
+        for j, tile in enumerate(row):
+            if i > 0:
+                tile = ref_blend(rows[i - 1][j], tile, blend_extent, -2)
+            if j > 0:
+                tile = ref_blend(row[j - 1], tile, blend_extent, -1)
+            result_row.append(tile[:, :, :, :row_limit, :row_limit])
+        result_rows.append(torch.cat(result_row, dim=-1))
+    return torch.cat(result_rows, dim=-2)
+
+
+def ref_temporal_tiled_decode(vae, z):
+    """The former temporal_tiled_decode."""
+    overlap_size = int(vae.tile_latent_min_tsize * (1 - vae.tile_overlap_factor))
+    blend_extent = int(vae.tile_sample_min_tsize * vae.tile_overlap_factor)
+    t_limit = vae.tile_sample_min_tsize - blend_extent
+    row = []
+    for i in range(0, z.shape[2], overlap_size):
+        tile = z[:, :, i: i + vae.tile_latent_min_tsize + 1, :, :]
+        if tile.shape[-1] > vae.tile_latent_min_size or tile.shape[-2] > vae.tile_latent_min_size:
+            decoded = ref_spatial_tiled_decode(vae, tile)
+        else:
+            decoded = vae.decoder(vae.post_quant_conv(tile))
+        if i > 0:
+            decoded = decoded[:, :, 1:, :, :]
+        row.append(decoded)
+    result_row = []
+    for i, tile in enumerate(row):
+        if i > 0:
+            tile = ref_blend(row[i - 1], tile, blend_extent, 2)
+            result_row.append(tile[:, :, :t_limit, :, :])
+        else:
+            result_row.append(tile[:, :, :t_limit + 1, :, :])
+    return torch.cat(result_row, dim=2)
+
+
+@pytest.mark.parametrize("dim", [2, 3, 4])
+def test_blends_match_former_loops(tiny_vae, dim):
+    a, b = torch.randn(2, 3, 9, 10, 11), torch.randn(2, 3, 9, 10, 11)
+    blend = {2: tiny_vae.blend_t, 3: tiny_vae.blend_v, 4: tiny_vae.blend_h}[dim]
+    torch.testing.assert_close(blend(a, b.clone(), 6), ref_blend(a, b.clone(), 6, dim), atol=1e-6, rtol=1e-6)
+
+
+@pytest.mark.parametrize("tile_batch_size, num_workers", [(1, 1), (3, 1), (2, 3)])
+@pytest.mark.parametrize("shape", [(1, 4, 2, 14, 13), (2, 4, 1, 9, 16)])
+def test_spatial_tiled_decode(tiny_vae, tile_batch_size, num_workers, shape):
+    torch.manual_seed(1)
+    z = torch.randn(*shape)
+    tiny_vae.tile_batch_size, tiny_vae.tile_num_workers = tile_batch_size, num_workers
+    with torch.no_grad():
+        dec = tiny_vae.spatial_tiled_decode(z).sample
+        ref = ref_spatial_tiled_decode(tiny_vae, z)
+    assert dec.shape == ref.shape
+    torch.testing.assert_close(dec, ref, atol=1e-4, rtol=1e-4)
+
+
+def test_temporal_tiled_decode(tiny_vae):
+    torch.manual_seed(2)
+    # 7 latent frames are 3 temporal chunks (the last one a single frame) of 2 x 2 spatial tiles
+    z = torch.randn(1, 4, 7, 10, 12)
+    tiny_vae.enable_tiling()
+    tiny_vae.tile_batch_size = 4
+    with torch.no_grad():
+        dec = tiny_vae.decode(z).sample
+        ref = ref_temporal_tiled_decode(tiny_vae, z)
+    assert dec.shape == ref.shape == (1, 3, 25, 80, 96)
+    torch.testing.assert_close(dec, ref, atol=1e-4, rtol=1e-4)
+
+
+def test_workers_keep_the_grad_mode(tiny_vae):
+    tiny_vae.tile_batch_size, tiny_vae.tile_num_workers = 1, 2
+    with torch.no_grad():
+        dec = tiny_vae.spatial_tiled_decode(torch.randn(1, 4, 1, 8, 14)).sample
+    assert not dec.requires_grad
@@ -10,6 +10,8 @@ import argparse
 
 from svg.utils import seed_everything
 from svg.models.wan.inference import replace_wan_attention
+from svg.teacache import TeaCache, TeaCacheRecorder, load_teacache_coefficients
+from svg.latent_store import LATENT_SUFFIX, save_latents
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate video from text prompt using Wan-Diffuser")
@@ -27,9 +29,28 @@ if __name__ == "__main__":
     parser.add_argument("--first_layers_fp", type=float, default=0.025, help="Only works for best config. Leave the 0, 1, 2, 40, 41 layers in FP")
     parser.add_argument("--first_times_fp", type=float, default=0.075, help="Only works for best config. Leave the first 10% timestep in FP")
     parser.add_argument("--num_sampled_rows", type=int, default=64, help="The number of sampled rows")
-    parser.add_argument("--sample_mse_max_row", type=int, default=10000, help="The maximum number of rows in attention mask. Prevent OOM.")
     parser.add_argument("--sparsity", type=float, default=0.25, help="The sparsity of the striped attention pattern. Accepts one or two float values.")
+    parser.add_argument("--pattern_reprofile_interval", type=int, default=1, help="Re-run sample_mse every N timesteps and reuse the decision in between. 1 profiles every step")
+    parser.add_argument("--pattern_drift_threshold", type=float, default=None, help="Re-profile early when the sampled query norms drift by more than this relative amount")
+    parser.add_argument("--pattern_table", type=str, default=None, help="Static mode: load the spatial / temporal decisions from a calibrated .npz table instead of profiling online")
+    parser.add_argument("--sparse_backend", type=str, default="flex", choices=["flex", "index_mapped", "sdpa", "cpu"], help="Block-sparse attention backend, index_mapped gathers the token-major rows of the temporal heads inside the attention kernel")
+    parser.add_argument("--calibrate_pattern_table", type=str, default=None, help="Record the online decisions on the calibration prompts into this .npz table")
+    parser.add_argument("--calibration_prompts", type=str, default=None, help="Text file with one calibration prompt per line. Defaults to --prompt")
+    parser.add_argument("--num_timestep_buckets", type=int, default=10, help="Number of timestep buckets of the calibrated table")
+    parser.add_argument("--head_width_table", type=str, default=None, help="Load the calibrated temporal band width of every (layer, head) from this .npz table instead of one --sparsity width")
+    parser.add_argument("--calibrate_head_widths", type=str, default=None, help="Allocate a band width per (layer, head) on the calibration prompts and save the .npz table")
+    parser.add_argument("--head_width_budget", type=float, default=1.0, help="Attention blocks of the calibrated widths relative to the uniform --sparsity width")
+    parser.add_argument("--flop_report", action="store_true", help="Print the attention FLOPs of every layer and the density relative to dense attention")
+    parser.add_argument("--teacache_thresh", type=float, default=None, help="Enable TeaCache: skip the steps whose accumulated rescaled input change stays under this threshold. Requires --pattern SVG")
+    parser.add_argument("--teacache_coefficients", type=str, default=None, help="TeaCache rescale polynomial: a model name of svg.teacache.TEACACHE_COEFFICIENTS or a --calibrate_teacache .npz file")
+    parser.add_argument("--teacache_sync_interval", type=int, default=1, help="Read the TeaCache distances on the host once every N steps and extrapolate the decisions in between. 1 is exact")
+    parser.add_argument("--calibrate_teacache", type=str, default=None, help="Run every step and add the TeaCache (input change, output change) pairs of this run to this .npz file. Requires --pattern SVG")
+    parser.add_argument("--output_type", type=str, default="video", choices=["video", "latent"], help="latent skips the VAE and saves the float16 latents next to --output_file, to be decoded by decode_latents.py workers")
     args = parser.parse_args()
+    if (args.teacache_thresh is not None or args.calibrate_teacache is not None) and args.pattern != "SVG":
+        parser.error("TeaCache hooks into the sparse forward, use --pattern SVG")
+    if args.teacache_thresh is not None and args.calibrate_teacache is None and args.teacache_coefficients is None:
+        parser.error("--teacache_thresh needs --teacache_coefficients, fitted on a --calibrate_teacache run")
     
     seed_everything(args.seed)
     
@@ -52,19 +73,77 @@ if __name__ == "__main__":
     print("=" * 20 + " Prompts " + "=" * 20)
     print(f"Prompt: {args.prompt}\n\n" + f"Negative Prompt: {args.negative_prompt}")
 
+    pattern_cache = None
     if args.pattern == "SVG":
-        replace_wan_attention(
+        pattern_cache = replace_wan_attention(
             pipe,
             args.height,
             args.width,
             args.num_frames,
             args.num_sampled_rows,
-            args.sample_mse_max_row,
             args.sparsity,
             args.first_layers_fp,
-            args.first_times_fp
+            args.first_times_fp,
+            args.pattern_reprofile_interval,
+            args.pattern_drift_threshold,
+            args.pattern_table,
+            args.sparse_backend,
+            args.head_width_table,
+            args.flop_report
         )
-        
+
+    calibrate = args.calibrate_pattern_table is not None or args.calibrate_head_widths is not None
+    if args.pattern == "SVG" and calibrate:
+        from svg.models.wan.attention import WanAttn_SparseAttn_Processor2_0
+        from svg.sparse import calibrate_head_widths, calibrate_pattern_table
+
+        if args.calibration_prompts is None:
+            calibration_prompts = [args.prompt]
+        else:
+            with open(args.calibration_prompts) as f:
+                calibration_prompts = [line.strip() for line in f if line.strip()]
+
+        def run_prompt(prompt):
+            pipe(
+                prompt=prompt,
+                negative_prompt=args.negative_prompt,
+                height=args.height,
+                width=args.width,
+                num_frames=args.num_frames,
+                guidance_scale=5.0,
+                num_inference_steps=args.num_inference_steps,
+                output_type="latent"
+            )
+
+        if args.calibrate_pattern_table is not None:
+            pattern_cache = calibrate_pattern_table(
+                WanAttn_SparseAttn_Processor2_0, run_prompt, calibration_prompts, args.num_timestep_buckets, args.calibrate_pattern_table
+            )
+            print(f"Pattern table saved to {args.calibrate_pattern_table}")
+            # The video below is generated in static mode with the table just calibrated
+            WanAttn_SparseAttn_Processor2_0.pattern_cache = pattern_cache
+
+        if args.calibrate_head_widths is not None:
+            flop_counter, WanAttn_SparseAttn_Processor2_0.flop_counter = WanAttn_SparseAttn_Processor2_0.flop_counter, None
+            head_widths = calibrate_head_widths(
+                WanAttn_SparseAttn_Processor2_0, run_prompt, calibration_prompts, args.head_width_budget, args.calibrate_head_widths
+            )
+            WanAttn_SparseAttn_Processor2_0.flop_counter = flop_counter
+            print(f"Head width table saved to {args.calibrate_head_widths}")
+            print(head_widths.summary())
+            # The video below is generated with the widths just calibrated
+            WanAttn_SparseAttn_Processor2_0.head_widths = head_widths
+
+    teacache = None
+    if args.calibrate_teacache is not None:
+        teacache = TeaCacheRecorder(args.num_inference_steps, calls_per_step=2)
+    elif args.teacache_thresh is not None:
+        teacache = TeaCache(
+            args.teacache_thresh, load_teacache_coefficients(args.teacache_coefficients), args.num_inference_steps,
+            calls_per_step=2, sync_interval=args.teacache_sync_interval
+        )
+    pipe.transformer.teacache = teacache
+
     output = pipe(
         prompt=args.prompt,
         negative_prompt=args.negative_prompt,
@@ -72,12 +151,33 @@ if __name__ == "__main__":
         width=args.width,
         num_frames=args.num_frames,
         guidance_scale=5.0,
-        num_inference_steps=args.num_inference_steps
-    ).frames[0]
+        num_inference_steps=args.num_inference_steps,
+        output_type="latent" if args.output_type == "latent" else "np"
+    ).frames
+
+    if pattern_cache is not None:
+        print(pattern_cache.summary())
+    if args.calibrate_teacache is not None:
+        teacache.save(args.calibrate_teacache)
+        print(f"TeaCache calibration pairs saved to {args.calibrate_teacache}")
+    elif teacache is not None:
+        print(teacache.summary())
+    if args.pattern == "SVG" and args.flop_report:
+        from svg.models.wan.attention import WanAttn_SparseAttn_Processor2_0
+        print(WanAttn_SparseAttn_Processor2_0.flop_counter.report())
     
     # Create parent directory for output file if it doesn't exist
     output_dir = os.path.dirname(args.output_file)
     if output_dir and not os.path.exists(output_dir):
         os.makedirs(output_dir, exist_ok=True)
         
-    export_to_video(output, args.output_file, fps=16)
+    if args.output_type == "latent":
+        latent_file = os.path.splitext(args.output_file)[0] + LATENT_SUFFIX
+        metadata = {
+            "model": "wan", "vae": model_id, "vae_dtype": "fp32", "fps": 16, "prompt": args.prompt, "seed": args.seed,
+            "height": args.height, "width": args.width, "num_frames": args.num_frames
+        }
+        save_latents(latent_file, output, metadata)
+        print(f"Latents saved to {latent_file}")
+    else:
+        export_to_video(output[0], args.output_file, fps=16)